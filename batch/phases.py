@@ -0,0 +1,173 @@
+import threading
+import time
+import traceback
+
+
+class Phase:
+    """One step of a migration, and which steps have to be finished before it can start"""
+
+    def __init__(self, name, run, requires=()):
+        """
+        :param name: What to call it in the report
+        :param run: A function taking no arguments that does the work.  exit() from it fails the phase with that status.
+        :param requires: The names of the phases it has to wait for
+        """
+        self.name = name
+        self.run = run
+        self.requires = list(requires)
+        self.exitcode = None
+        self.started = None
+        self.finished = None
+
+    def seconds(self):
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+
+def check(phases):
+    """
+    Makes sure every phase's requirements exist and that nothing waits, however indirectly, on itself.
+
+    :raises ValueError: If not
+    """
+    by_name = {phase.name: phase for phase in phases}
+    if len(by_name) != len(phases):
+        raise ValueError('two phases have the same name')
+
+    visiting = set()
+    visited = set()
+
+    def visit(phase, path):
+        if phase.name in visited:
+            return
+        if phase.name in visiting:
+            raise ValueError('phases wait on each other: {0}'.format(' -> '.join(path + [phase.name])))
+        visiting.add(phase.name)
+        for name in phase.requires:
+            if name not in by_name:
+                raise ValueError('{0} requires {1}, which is not a phase'.format(phase.name, name))
+            visit(by_name[name], path + [phase.name])
+        visiting.remove(phase.name)
+        visited.add(phase.name)
+
+    for phase in phases:
+        visit(phase, [])
+
+
+def run_phases(phases, workers=None, verbose=False):
+    """
+    Runs each phase on its own thread as soon as everything it requires has finished, so phases that don't depend on
+    each other (say, the database and file copies) go on at the same time.  Phases start in the order given when
+    several are ready at once.  Once one fails, nothing new starts, but the ones already going are left to finish.
+
+    :param phases: A list of Phases
+    :param workers: How many phases may run at once, or None for no limit
+    :param verbose: Say when each phase starts and ends
+    :return: 0 if every phase finished, otherwise the first failing exit status
+    """
+    check(phases)
+
+    pending = list(phases)
+    running = []
+    done = set()
+    failures = []
+    condition = threading.Condition()
+
+    def attempt(phase):
+        try:
+            phase.run()
+            exitcode = 0
+        except SystemExit as e:
+            exitcode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            exitcode = 1
+        phase.finished = time.monotonic()
+
+        with condition:
+            phase.exitcode = exitcode
+            running.remove(phase)
+            if exitcode == 0:
+                done.add(phase.name)
+                if verbose:
+                    print('Phase {0} finished in {1:.1f}s'.format(phase.name, phase.seconds()))
+            else:
+                failures.append(phase)
+                if running:
+                    print('Phase {0} failed with {1}, waiting for {2} to finish'.format(
+                        phase.name, exitcode, ', '.join(other.name for other in running)))
+            condition.notify_all()
+
+    with condition:
+        while running or (pending and not failures):
+            ready = None
+            if not failures and (workers is None or len(running) < workers):
+                for phase in pending:
+                    if all(name in done for name in phase.requires):
+                        ready = phase
+                        break
+
+            if ready is None:
+                condition.wait()
+                continue
+
+            pending.remove(ready)
+            running.append(ready)
+            if verbose:
+                print('Phase {0} starting'.format(ready.name))
+            ready.started = time.monotonic()
+            # Daemon threads, so an interrupt doesn't have to wait for them
+            threading.Thread(target=attempt, args=(ready,), daemon=True).start()
+
+    if failures:
+        return failures[0].exitcode
+    return 0
+
+
+def critical_path(phases):
+    """
+    Works back from the phase that finished last, at each step to whichever of its requirements finished last, since
+    that's the one it was waiting on.  Making anything off this path faster wouldn't have finished the run any sooner.
+
+    :param phases: Phases that have been run
+    :return: A list of Phases, first to last
+    """
+    by_name = {phase.name: phase for phase in phases}
+    finished = [phase for phase in phases if phase.finished is not None]
+    if not finished:
+        return []
+
+    path = [max(finished, key=lambda phase: phase.finished)]
+    while True:
+        requires = [by_name[name] for name in path[-1].requires if by_name[name].finished is not None]
+        if not requires:
+            break
+        path.append(max(requires, key=lambda phase: phase.finished))
+    path.reverse()
+    return path
+
+
+def report(phases):
+    """:return: A printable timeline of the run, with the critical path marked"""
+    started = [phase.started for phase in phases if phase.started is not None]
+    if not started:
+        return 'Nothing ran'
+    origin = min(started)
+    end = max(phase.finished for phase in phases if phase.finished is not None)
+    on_path = set(phase.name for phase in critical_path(phases))
+
+    lines = ['{0:<20} {1:>8} {2:>8} {3:>8}'.format('phase', 'start', 'seconds', 'status')]
+    for phase in sorted(phases, key=lambda phase: (phase.started is None, phase.started)):
+        if phase.started is None:
+            lines.append('{0:<20} {1:>8} {2:>8} {3:>8}'.format(phase.name, '-', '-', 'skipped'))
+            continue
+        lines.append('{0:<20} {1:>8.1f} {2:>8.1f} {3:>8}{4}'.format(
+            phase.name, phase.started - origin, phase.seconds(), phase.exitcode,
+            '  *' if phase.name in on_path else ''))
+
+    total = end - origin
+    serial = sum(phase.seconds() for phase in phases)
+    lines.append('Critical path (*): {0}'.format(' -> '.join(phase.name for phase in critical_path(phases))))
+    lines.append('{0:.1f}s in all, {1:.1f}s if the phases had run one at a time'.format(total, serial))
+    return '\n'.join(lines)
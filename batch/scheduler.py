@@ -0,0 +1,255 @@
+import json
+import os
+import subprocess
+import threading
+import time
+
+# Exit statuses that no amount of retrying will fix: bad arguments, or something only a person can answer
+NO_RETRY = {2, 130}
+
+
+class Job:
+    """One site to migrate, and how it has gone so far"""
+
+    def __init__(self, name, argv, hosts):
+        """
+        :param name: What to call it in the logs, usually the site
+        :param argv: The arguments for migrate_o_matic.py
+        :param hosts: A set of (kind, host) it keeps busy while it runs, e.g. ('destination', 'aws-web1')
+        """
+        self.name = name
+        self.argv = argv
+        self.hosts = hosts
+        self.attempts = 0
+        self.exitcode = None
+        self.seconds = 0.0
+        self.not_before = 0.0
+        self.log_path = None
+        self.progress_path = None
+
+
+class Limits:
+    """How many jobs may keep each host busy at once, by kind of host"""
+
+    def __init__(self, limits):
+        """
+        :param limits: A dict of host kind to how many jobs may use any one host of that kind at once
+        """
+        self.limits = limits
+        self.busy = {}
+
+    def fits(self, job):
+        return all(self.busy.get(host, 0) < self.limits.get(host[0], 1) for host in job.hosts)
+
+    def take(self, job):
+        for host in job.hosts:
+            self.busy[host] = self.busy.get(host, 0) + 1
+
+    def give_back(self, job):
+        for host in job.hosts:
+            self.busy[host] -= 1
+
+
+def argv_for(site):
+    """
+    Turns a site's entry in a batch file into migrate_o_matic.py arguments.  Keys are the long options with dashes or
+    underscores; true makes a flag, false or null leaves the option out, and lists repeat it.
+
+    :param site: A dict with at least site and destination
+    :return: A list of arguments
+    """
+    argv = [site['site'], site['destination']]
+    for key, value in sorted(site.items()):
+        if key in ('site', 'destination') or value is None or value is False:
+            continue
+        option = '--' + key.replace('_', '-')
+        if value is True:
+            argv.append(option)
+        elif isinstance(value, list):
+            for item in value:
+                argv.extend([option, str(item)])
+        else:
+            argv.extend([option, str(value)])
+    return argv
+
+
+def read_progress(path):
+    """
+    :return: What a migration noted in its --progress-file, or an empty dict if it noted nothing we can read.  'reached'
+        lists how far it got: 'customer' once the destination customer exists (and 'customer' has its login), 'site'
+        once the site does, and 'db_refs' once the source's database settings have started changing to the
+        destination's.
+    """
+    try:
+        with open(path) as progress_fh:
+            progress = json.load(progress_fh)
+    except (OSError, ValueError):
+        return {}
+    return progress if isinstance(progress, dict) else {}
+
+
+def retry_argv(argv, progress):
+    """
+    Works out how to try a failed migration again, given how far it got.  Doing exactly the same again would try to make
+    the customer and site a second time, so once they exist it's the existing customer, and --freshen into the site.
+
+    :param argv: The arguments it failed with
+    :param progress: What it noted, from read_progress()
+    :return: The arguments to try it with, or None if it can't safely be tried again: once the source's database
+        settings have changed, looking for them would find the destination's
+    """
+    reached = progress.get('reached', [])
+    if 'db_refs' in reached:
+        return None
+    if 'customer' not in reached or not progress.get('customer'):
+        return list(argv)
+
+    retry = []
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in ('--new-customer', '--existing-customer'):
+            next(arguments, None)
+        elif not argument.startswith(('--new-customer=', '--existing-customer=')):
+            retry.append(argument)
+    retry.extend(['--existing-customer', progress['customer']])
+    if 'site' in reached and '--freshen' not in retry:
+        retry.append('--freshen')
+    return retry
+
+
+def load_jobs(path, parser):
+    """
+    Reads a batch file: JSON with a list of sites, and optionally defaults that every site starts from, e.g.
+
+        {"defaults": {"dest_sftp_pass": "...", "db_engine": "native"},
+         "sites": [{"site": "example.com", "destination": "aws-web1.example.net", "new_customer": "Example",
+                    "dest_sftp_user": "example"}]}
+
+    Every site's arguments are checked up front with the migration's own parser, which also says which hosts it will
+    keep busy.  A source database server only counts when the site's line gives it with source_db_host; one the
+    migration finds for itself in wp-config.php, env.php or local.xml isn't known until it runs.
+
+    :param path: The batch file
+    :param parser: migrate_o_matic's argument parser
+    :return: A list of Jobs, in the order given
+    :raises ValueError: If a site's arguments don't parse
+    """
+    with open(path) as batch_fh:
+        batch = json.load(batch_fh)
+
+    jobs = []
+    for entry in batch['sites']:
+        site = dict(batch.get('defaults', {}))
+        site.update(entry)
+        argv = argv_for(site)
+        try:
+            args = parser.parse_args(argv)
+        except SystemExit:
+            raise ValueError('bad arguments for {0}: {1}'.format(site.get('site'), ' '.join(argv)))
+
+        hosts = {('source', args.source_plesk_host), ('destination', args.destination)}
+        if not args.no_db:
+            hosts.add(('db', args.dest_db_host))
+            # Autodetected ones aren't known yet, so only those given count
+            if args.source_db_host:
+                hosts.add(('db', args.source_db_host))
+        jobs.append(Job(args.site, argv + ['--unattended'], hosts))
+
+    return jobs
+
+
+def run_jobs(jobs, limits, workers, command, log_dir, retries=1, retry_delay=60):
+    """
+    Runs the migrations, each as its own migrate_o_matic.py with its output in its own log, as many at once as the
+    limits allow.  Jobs start in the order given, except that one waiting on a busy host lets those behind it by.  A
+    failed job goes to the back of the queue to be tried again after retry_delay, up to retries more times, picking up
+    from how far it got (see retry_argv()), and the rest keep going regardless.
+
+    :param jobs: A list of Jobs
+    :param limits: Limits on how busy each host may get
+    :param workers: How many jobs may run at once in all
+    :param command: The command to run migrate_o_matic.py with, as a list
+    :param log_dir: Where each job's log goes
+    :param retries: How many more times to try a job that fails
+    :param retry_delay: How many seconds to wait before trying a failed job again
+    :return: The jobs, with their exit statuses
+    """
+    os.makedirs(log_dir, exist_ok=True)
+    pending = list(jobs)
+    running = []
+    condition = threading.Condition()
+
+    def attempt(job):
+        job.attempts += 1
+        job.log_path = os.path.join(log_dir, '{0}.{1}.log'.format(job.name, job.attempts))
+        job.progress_path = os.path.join(log_dir, '{0}.progress.json'.format(job.name))
+        start = time.monotonic()
+        exitcode = 1
+        try:
+            # What an earlier batch noted is nothing to do with this one
+            if job.attempts == 1 and os.path.exists(job.progress_path):
+                os.remove(job.progress_path)
+            with open(job.log_path, 'w') as log_fh:
+                exitcode = subprocess.call(command + job.argv + ['--progress-file', job.progress_path],
+                                           stdin=subprocess.DEVNULL, stdout=log_fh, stderr=subprocess.STDOUT)
+        except (OSError, ValueError) as e:
+            print('{0}: could not start: {1}'.format(job.name, e))
+        finally:
+            job.seconds += time.monotonic() - start
+
+            # Whatever happened, the job gives its hosts back, or the rest would wait on it forever
+            with condition:
+                running.remove(job)
+                limits.give_back(job)
+                job.exitcode = exitcode
+                if exitcode == 0:
+                    print('{0}: done in {1:.0f}s'.format(job.name, job.seconds))
+                elif exitcode not in NO_RETRY and job.attempts <= retries:
+                    argv = retry_argv(job.argv, read_progress(job.progress_path))
+                    if argv is None:
+                        print("{0}: failed with {1}, see {2}.  The source's database settings have already been "
+                              'changed, so it needs a person.'.format(job.name, exitcode, job.log_path))
+                    else:
+                        print('{0}: failed with {1}, see {2}.  Trying again in {3}s.'.format(
+                            job.name, exitcode, job.log_path, retry_delay))
+                        job.argv = argv
+                        job.not_before = time.monotonic() + retry_delay
+                        pending.append(job)
+                else:
+                    print('{0}: failed with {1}, see {2}.  Giving up.'.format(job.name, exitcode, job.log_path))
+                condition.notify_all()
+
+    with condition:
+        while pending or running:
+            now = time.monotonic()
+            ready = None
+            if len(running) < workers:
+                for job in pending:
+                    if job.not_before <= now and limits.fits(job):
+                        ready = job
+                        break
+
+            if ready is None:
+                # Wait for something to finish, or for the next retry to come due
+                waits = [job.not_before - now for job in pending if job.not_before > now]
+                condition.wait(min(waits) if waits else None)
+                continue
+
+            pending.remove(ready)
+            running.append(ready)
+            limits.take(ready)
+            print('{0}: starting{1}'.format(ready.name, ' (attempt {0})'.format(ready.attempts + 1)
+                                            if ready.attempts else ''))
+            threading.Thread(target=attempt, args=(ready,)).start()
+
+    return jobs
+
+
+def report(jobs):
+    """:return: A printable summary of how the batch went"""
+    lines = ['{0:<40} {1:>6} {2:>8} {3:>10}'.format('site', 'status', 'attempts', 'seconds')]
+    for job in jobs:
+        lines.append('{0:<40} {1:>6} {2:>8} {3:>10.0f}'.format(job.name, job.exitcode, job.attempts, job.seconds))
+    failed = sum(1 for job in jobs if job.exitcode != 0)
+    lines.append('{0} of {1} sites migrated, {2} failed'.format(len(jobs) - failed, len(jobs), failed))
+    return '\n'.join(lines)
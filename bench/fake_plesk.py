@@ -0,0 +1,159 @@
+import http.server
+import socketserver
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+
+class FakePlesk:
+    """
+    A stand in for a Plesk server's agent.php, for benchmarking without a real one.  It answers the packets our client
+    sends with the same shape of XML Plesk does, one result per operation, after a configurable delay, over plain HTTP
+    with keep-alive like the real thing.  Nothing it's told is kept; every site exists and every change works.
+    """
+
+    def __init__(self, latency=0.02, per_operation=0.002, dns_records=20, certificates=2, protected_dirs=1):
+        """
+        :param latency: Seconds to wait before answering each packet, standing in for the round trip and Plesk's own
+            overhead
+        :param per_operation: Seconds more to wait for each operation in the packet
+        :param dns_records: How many records every zone (and the template) has
+        :param certificates: How many certificates every site has
+        :param protected_dirs: How many protected directories every site has, besides plesk-stat
+        """
+        self.latency = latency
+        self.per_operation = per_operation
+        self.dns_records = dns_records
+        self.certificates = certificates
+        self.protected_dirs = protected_dirs
+        self.requests = 0
+        self.operations = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """
+        Starts answering on a free port on localhost.
+
+        :return: The port
+        """
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                request = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                authorised = self.headers.get('HTTP_AUTH_LOGIN') or self.headers.get('KEY')
+                body = fake.answer(request, authorised)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        class Server(socketserver.ThreadingMixIn, http.server.HTTPServer):
+            daemon_threads = True
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.server.server_address[1]
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def answer(self, request, authorised=True):
+        """:return: The response packet, as bytes, for a request packet"""
+        packet = ET.fromstring(request)
+        with self.lock:
+            self.requests += 1
+            self.operations += len(packet)
+        time.sleep(self.latency + self.per_operation * len(packet))
+
+        response = ET.Element('packet', {'version': packet.get('version', '1.6.3.5')})
+        if not authorised:
+            system = ET.SubElement(response, 'system')
+            ET.SubElement(system, 'status').text = 'error'
+            ET.SubElement(system, 'errcode').text = '1001'
+            ET.SubElement(system, 'errtext').text = 'Authentication failed'
+            return ET.tostring(response, 'utf-8')
+
+        for operation in packet:
+            action = operation[0]
+            answer = ET.SubElement(ET.SubElement(response, operation.tag), action.tag)
+            self.__answer(operation.tag, action, answer)
+        return ET.tostring(response, 'utf-8')
+
+    def __answer(self, entity, action, answer):
+        name = action.findtext('.//name') or action.findtext('.//domain-name') or 'example.com'
+
+        if (entity, action.tag) == ('dns', 'get_rec'):
+            site_id = action.findtext('filter/site-id')
+            template = action.find('template') is not None
+            for index in range(self.dns_records):
+                result = self.__result(answer, 1000 + index)
+                data = ET.SubElement(result, 'data')
+                ET.SubElement(data, 'site-id').text = site_id or ''
+                record_type, host, value = _dns_record(index, '<domain>' if template else 'example.com.')
+                ET.SubElement(data, 'type').text = record_type
+                ET.SubElement(data, 'host').text = host
+                ET.SubElement(data, 'value').text = value
+                ET.SubElement(data, 'opt').text = '10' if record_type == 'MX' else ''
+        elif (entity, action.tag) == ('certificate', 'get-pool'):
+            result = self.__result(answer)
+            certificates = ET.SubElement(result, 'certificates')
+            for index in range(self.certificates):
+                certificate = ET.SubElement(certificates, 'certificate')
+                ET.SubElement(certificate, 'name').text = '{0} cert {1}'.format(name, index)
+        elif (entity, action.tag) == ('protected-dir', 'get'):
+            for index, directory in enumerate(['plesk-stat'] + ['private{0}'.format(i)
+                                                                 for i in range(self.protected_dirs)]):
+                result = self.__result(answer, 200 + index)
+                ET.SubElement(ET.SubElement(result, 'data'), 'name').text = directory
+        elif action.tag == 'get':
+            result = self.__result(answer, 42)
+            data = ET.SubElement(result, 'data')
+            gen_info = ET.SubElement(data, 'gen_info')
+            ET.SubElement(gen_info, 'name').text = name
+            ET.SubElement(gen_info, 'pname').text = 'Example Customer'
+            ET.SubElement(gen_info, 'login').text = action.findtext('filter/login') or 'example'
+            vrt_hst = ET.SubElement(ET.SubElement(data, 'hosting'), 'vrt_hst')
+            for key, value in [('ftp_login', 'example'), ('shell', '/bin/bash'), ('ssl', 'true'),
+                               ('php', 'true'), ('php_handler_type', 'fastcgi'), ('www_root', '/httpdocs')]:
+                prop = ET.SubElement(vrt_hst, 'property')
+                ET.SubElement(prop, 'name').text = key
+                ET.SubElement(prop, 'value').text = value
+        elif entity in ('customer', 'webspace', 'site', 'dns') and action.tag in ('add', 'set', 'add_rec', 'del_rec',
+                                                                                  'enable', 'disable'):
+            self.__result(answer, 43)
+        else:
+            result = ET.SubElement(answer, 'result')
+            ET.SubElement(result, 'status').text = 'error'
+            ET.SubElement(result, 'errcode').text = '1014'
+            ET.SubElement(result, 'errtext').text = 'Parser error: Request is invalid'
+
+    def __result(self, parent, object_id=None):
+        result = ET.SubElement(parent, 'result')
+        ET.SubElement(result, 'status').text = 'ok'
+        if object_id is not None:
+            ET.SubElement(result, 'id').text = str(object_id)
+        return result
+
+
+def _dns_record(index, domain):
+    """:return: A made up (type, host, value) for the index'th record of a zone"""
+    kinds = [('A', domain, '203.0.113.10'), ('CNAME', 'www.' + domain, domain), ('MX', domain, 'mail.' + domain),
+             ('TXT', domain, 'v=spf1 +a +mx -all'), ('A', 'mail.' + domain, '203.0.113.11'),
+             ('NS', domain, 'ns1.firstscribe.com.')]
+    record_type, host, value = kinds[index % len(kinds)]
+    if index >= len(kinds):
+        host = 'host{0}.{1}'.format(index, domain)
+    return record_type, host, value
@@ -0,0 +1,348 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import bench.fake_plesk
+import bench.sitegen
+import fs.scanner
+import plesk.aioclient
+import plesk.apiclient
+import plesk.pool
+import telemetry.metrics
+import transfer.compression
+import transfer.files
+import transfer.incremental
+import transfer.shell
+
+# The same pattern migrate_o_matic.py scans for
+DATABASE_REFS = 'wp-config.php|etc/local.xml|includes?/(config.xml|connect.php)'
+
+# What results against the same site have in common
+SITE_PARAMS = ('kind', 'files', 'average_bytes', 'site')
+
+# A "destination" that's just a shell here, so the transfer pipeline runs end to end without a network
+LOOPBACK = 'sh -c "{0}"'
+
+
+class Result:
+    """How one benchmark went: the best of its runs, and how much work each run did"""
+
+    def __init__(self, name, params, seconds, bytes_moved=0, operations=0, extra=None):
+        self.name = name
+        self.params = params
+        self.seconds = seconds
+        self.bytes = bytes_moved
+        self.operations = operations
+        self.extra = extra or {}
+
+    def key(self):
+        return '{0} {1}'.format(self.name, json.dumps(self.params, sort_keys=True))
+
+    def label(self):
+        """:return: A short name for printing, leaving out the site, which every result shares"""
+        return ' '.join([self.name] + ['{0}={1}'.format(key, value) for key, value in sorted(self.params.items())
+                                       if key not in SITE_PARAMS])
+
+    def as_dict(self):
+        record = {'name': self.name, 'params': self.params, 'seconds': round(self.seconds, 4), 'bytes': self.bytes,
+                  'operations': self.operations,
+                  'mb_per_second': round(self.bytes / self.seconds / 1e6, 3) if self.seconds and self.bytes else None,
+                  'operations_per_second': round(self.operations / self.seconds, 3) if self.seconds else None}
+        record.update(self.extra)
+        return record
+
+
+def best_of(repeats, func, setup=None):
+    """
+    Runs func repeats times, with setup before each (untimed), and keeps the quickest run, as the one least disturbed
+    by whatever else the machine was doing.
+
+    :return: (seconds, whatever that run of func returned)
+    """
+    best = None
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best[0]:
+            best = (seconds, value)
+    return best
+
+
+def bench_scanner(site, repeats):
+    results = []
+    for workers in (1, 8):
+        seconds, scan = best_of(repeats, lambda: fs.scanner.scan_site(site, DATABASE_REFS, workers=workers))
+        results.append(Result('scan', {'workers': workers}, seconds, operations=scan.file_count,
+                              extra={'files': scan.file_count, 'directories': scan.dir_count,
+                                     'site_bytes': scan.total_bytes}))
+    return results
+
+
+def bench_plesk(repeats, latency):
+    fake = bench.fake_plesk.FakePlesk(latency=latency)
+    port = fake.start()
+    results = []
+
+    def client(cls=plesk.apiclient.Client):
+        # A pool of its own, so every run pays for its own connection like a fresh migration would
+        plesk_client = cls('127.0.0.1', port=port, protocol='http', pool=plesk.pool.ConnectionPool())
+        plesk_client.set_credentials('admin', 'benchpass')
+        return plesk_client
+
+    def one_at_a_time():
+        source = client()
+        site_id = source.get_site_id('example.com')
+        source.get_ssl_certs('example.com')
+        source.get_dns_template()
+        source.get_dns_records(site_id)
+        source.get_protected_dirs(site_id)
+        source.get_customer_id('example')
+        return 6
+
+    def batched():
+        source = client()
+        lookups = source.batch()
+        lookups.get_site_id('example.com')
+        lookups.get_ssl_certs('example.com')
+        lookups.get_dns_template()
+        lookups.get_customer_id('example')
+        site_id = lookups.execute()[0]
+        lookups.get_dns_records(site_id)
+        lookups.get_protected_dirs(site_id)
+        lookups.execute()
+        return 6
+
+    def both_ends_async():
+        # The provisioning pattern: the source's lookups going on while the destination is set up
+        loop = asyncio.new_event_loop()
+        source = client(plesk.aioclient.AsyncClient)
+        destination = client(plesk.aioclient.AsyncClient)
+
+        async def lookup_source():
+            lookups = source.batch()
+            lookups.get_site_id('example.com')
+            lookups.get_ssl_certs('example.com')
+            lookups.get_dns_template()
+            site_id = (await lookups.execute())[0]
+            lookups.get_dns_records(site_id)
+            lookups.get_protected_dirs(site_id)
+            await lookups.execute()
+
+        async def set_up_destination():
+            customer_id = await destination.add_customer('Example Customer')
+            await destination.add_webspace({'name': 'example.com', 'owner-id': customer_id}, 'vrt_hst',
+                                           {'ftp_login': 'example', 'shell': '/bin/bash'}, '203.0.113.10',
+                                           'Default Domain')
+
+        async def both():
+            await asyncio.gather(lookup_source(), set_up_destination())
+
+        try:
+            loop.run_until_complete(both())
+        finally:
+            loop.close()
+        return 7
+
+    try:
+        for name, func in [('one_at_a_time', one_at_a_time), ('batched', batched),
+                           ('both_ends_async', both_ends_async)]:
+            requests_before = fake.requests
+            seconds, operations = best_of(repeats, func)
+            results.append(Result('plesk_' + name, {'latency': latency}, seconds, operations=operations,
+                                  extra={'packets': (fake.requests - requests_before) // repeats}))
+    finally:
+        fake.stop()
+    return results
+
+
+def bench_transfer(site, work_dir, repeats, streams):
+    results = []
+    dest_dir = os.path.join(work_dir, 'dest')
+    site_bytes = fs.scanner.scan_site(site).total_bytes
+
+    def clean():
+        shutil.rmtree(dest_dir, ignore_errors=True)
+        os.makedirs(dest_dir)
+
+    def single(codec):
+        meter = telemetry.metrics.Meter(echo=False)
+        stream = transfer.shell.Stream('tar cf - -C {0} .'.format(site),
+                                       LOOPBACK.format(codec.pipe_in('tar xf - -C {0}'.format(dest_dir))),
+                                       compress=codec.compress, pipeline='files')
+        if transfer.shell.run(stream, mirror=False, meter=meter) != 0:
+            raise ChildProcessError('the {0} stream failed'.format(codec))
+        return meter.summary()['pipelines'][0]
+
+    for spec in ['none', 'lz4', 'zstd:1', 'zstd:3', 'xz:1']:
+        codec = transfer.compression.get_codec(spec)
+        if codec.compress and not shutil.which(codec.compress.split()[0]):
+            continue
+        seconds, totals = best_of(repeats, lambda: single(codec), setup=clean)
+        results.append(Result('transfer_single', {'codec': spec}, seconds, bytes_moved=totals['read'],
+                              extra={'sent_bytes': totals['sent'],
+                                     'compression_ratio': totals.get('compression_ratio')}))
+
+    codec = transfer.compression.get_codec('zstd:1' if shutil.which('zstd') else 'none')
+    scan = fs.scanner.scan_site(site)
+    plan = transfer.files.plan_shards(scan, streams)
+
+    def parallel():
+        if transfer.files.copy_parallel(plan, dest_dir, LOOPBACK, codec=codec) != 0:
+            raise ChildProcessError('the parallel copy failed')
+
+    seconds, _ = best_of(repeats, parallel, setup=clean)
+    results.append(Result('transfer_parallel', {'codec': str(codec), 'streams': streams}, seconds,
+                          bytes_moved=site_bytes))
+
+    state_prefix = os.path.join(work_dir, 'manifest')
+
+    def forget():
+        clean()
+        for suffix in ('.source', '.destination'):
+            if os.path.exists(state_prefix + suffix):
+                os.remove(state_prefix + suffix)
+
+    def incremental():
+        # It says how much it's sending every time, which we don't need to hear
+        with contextlib.redirect_stdout(io.StringIO()):
+            exitcode = transfer.incremental.copy_incremental(site, dest_dir, LOOPBACK, state_prefix, codec=codec)
+        if exitcode != 0:
+            raise ChildProcessError('the incremental copy failed')
+
+    seconds, _ = best_of(repeats, incremental, setup=forget)
+    results.append(Result('transfer_incremental_first', {'codec': str(codec)}, seconds, bytes_moved=site_bytes))
+    # Everything is there now, so this is the cost of finding out there's nothing to do
+    seconds, _ = best_of(repeats, incremental)
+    results.append(Result('transfer_incremental_nothing', {'codec': str(codec)}, seconds,
+                          operations=scan.file_count))
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_results(path):
+    """:return: Earlier results from this host, by benchmark key"""
+    earlier = {}
+    if not os.path.exists(path):
+        return earlier
+    host = socket.gethostname()
+    with open(path) as results_fh:
+        for line in results_fh:
+            record = json.loads(line)
+            if record.get('host') == host:
+                key = '{0} {1}'.format(record['name'], json.dumps(record['params'], sort_keys=True))
+                earlier.setdefault(key, []).append(record)
+    return earlier
+
+
+def compare(results, earlier, threshold):
+    """
+    Prints each result against the best earlier run of the same benchmark on this host.
+
+    :return: The results more than threshold slower than that
+    """
+    regressions = []
+    print('{0:<45} {1:>10} {2:>10} {3:>8}'.format('benchmark', 'seconds', 'best', 'change'))
+    for result in results:
+        best = min((record['seconds'] for record in earlier.get(result.key(), [])), default=None)
+        if best:
+            change = (result.seconds - best) / best
+            flag = '  SLOWER' if change > threshold else ''
+            if flag:
+                regressions.append(result)
+            print('{0:<45} {1:>10.4f} {2:>10.4f} {3:>+8.0%}{4}'.format(result.label(), result.seconds, best, change,
+                                                                      flag))
+        else:
+            print('{0:<45} {1:>10.4f} {2:>10} {3:>8}'.format(result.label(), result.seconds, '-', 'new'))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the scanner, the plesk client and the transfer pipeline '
+                                                 'offline, against a fake plesk and a made up site')
+    parser.add_argument('--only', help='which benchmarks to run, defaults to all of them', action='append',
+                        choices=['scan', 'plesk', 'transfer'])
+    parser.add_argument('--kind', help='what kind of site to make up, defaults to wordpress',
+                        choices=bench.sitegen.KINDS, default='wordpress')
+    parser.add_argument('--files', help='how many files the made up site has, defaults to 5000', type=int,
+                        default=5000)
+    parser.add_argument('--average-bytes', help='how big its code files are on average, defaults to 8000', type=int,
+                        default=8000)
+    parser.add_argument('--site', help='benchmark against this directory instead of making one up')
+    parser.add_argument('--repeats', help='how many times to run each benchmark, keeping the best, defaults to 3',
+                        type=int, default=3)
+    parser.add_argument('--latency', help='how many seconds the fake plesk takes to answer, defaults to 0.02',
+                        type=float, default=0.02)
+    parser.add_argument('--streams', help='how many streams the parallel copy uses, defaults to 4', type=int,
+                        default=4)
+    parser.add_argument('--results', help='the JSON lines file results are added to and compared against, defaults '
+                                          'to ~/.migrate_o_matic/bench.jsonl',
+                        default=os.path.expanduser('~/.migrate_o_matic/bench.jsonl'))
+    parser.add_argument('--threshold', help='how much slower than the best earlier run counts as a regression, '
+                                            'defaults to 0.2', type=float, default=0.2)
+    parser.add_argument('--no-record', help="don't add this run's results to the file", action='store_true')
+    args = parser.parse_args()
+    only = args.only or ['scan', 'plesk', 'transfer']
+
+    work_dir = tempfile.mkdtemp(prefix='migrate_o_matic.bench.')
+    try:
+        site = args.site
+        site_params = {}
+        if site is None and ('scan' in only or 'transfer' in only):
+            site = os.path.join(work_dir, 'httpdocs')
+            files, site_bytes = bench.sitegen.generate(site, args.kind, args.files, args.average_bytes)
+            site_params = {'kind': args.kind, 'files': args.files, 'average_bytes': args.average_bytes}
+            print('Made up a {0} site of {1} files, {2} bytes'.format(args.kind, files, site_bytes))
+
+        results = []
+        if 'scan' in only:
+            results.extend(bench_scanner(site, args.repeats))
+        if 'plesk' in only:
+            results.extend(bench_plesk(args.repeats, args.latency))
+        if 'transfer' in only:
+            results.extend(bench_transfer(site, work_dir, args.repeats, args.streams))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    # Results are only comparable with runs against the same made up site
+    for result in results:
+        if not result.name.startswith('plesk_'):
+            result.params.update(site_params if args.site is None else {'site': args.site})
+
+    regressions = compare(results, load_results(args.results), args.threshold)
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        now = time.time()
+        with open(args.results, 'a') as results_fh:
+            for result in results:
+                record = result.as_dict()
+                record.update({'time': round(now, 3), 'commit': git_commit(), 'host': socket.gethostname(),
+                               'python': platform.python_version()})
+                results_fh.write(json.dumps(record, sort_keys=True) + '\n')
+
+    if regressions:
+        print('{0} benchmarks got slower'.format(len(regressions)))
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+import os
+import random
+
+# Something code shaped to cut text files out of, so they compress about like real PHP and JavaScript does
+_CODE_WORDS = ('function', 'return', 'array', 'if', 'else', 'foreach', 'as', '$this->', 'public', 'static', 'null',
+               'true', 'false', 'echo', 'isset', 'empty', '$post', '$query', 'get_option', 'add_action',
+               'apply_filters', 'esc_html', '__(', "'default'", 'var', 'const', 'let', '=>', '{', '}', '(', ')', ';',
+               '//', '$i++',
+               'Mage::getModel', 'getCollection', 'addAttributeToSelect', 'jQuery', 'document', 'window', '.css')
+
+KINDS = ['wordpress', 'magento']
+
+
+class _Maker:
+    def __init__(self, root, rng):
+        self.root = root
+        self.rng = rng
+        self.files = 0
+        self.bytes = 0
+        words = [rng.choice(_CODE_WORDS) for _ in range(40000)]
+        lines = []
+        while words:
+            count = rng.randint(3, 14)
+            lines.append(' ' * rng.choice((0, 4, 8, 12)) + ' '.join(words[:count]))
+            words = words[count:]
+        self.corpus = '\n'.join(lines).encode()
+
+    def text(self, path, size):
+        """A code file of about size bytes, with a header of its own so no two are the same"""
+        start = self.rng.randrange(max(1, len(self.corpus) - size))
+        body = self.corpus[start:start + size]
+        while len(body) < size:
+            body += self.corpus[:size - len(body)]
+        self.write(path, '<?php /* {0} */\n'.format(path).encode() + body)
+
+    def binary(self, path, size):
+        """An incompressible file, like an image or an archive"""
+        self.write(path, self.rng.getrandbits(size * 8).to_bytes(size, 'little') if size else b'')
+
+    def write(self, path, data):
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as file_fh:
+            file_fh.write(data)
+        self.files += 1
+        self.bytes += len(data)
+
+    def code_size(self, average):
+        # Mostly small, some big, like a real code base
+        return min(int(self.rng.expovariate(1.0 / average)), average * 20)
+
+
+def _wordpress(maker, files, average_bytes):
+    rng = maker.rng
+    maker.write('wp-config.php', b"<?php\ndefine('DB_NAME', 'bench_wp');\ndefine('DB_USER', 'bench_wp');\n"
+                                 b"define('DB_PASSWORD', 'benchpass');\ndefine('DB_HOST', 'localhost');\n"
+                                 b"$table_prefix = 'wp_';\n")
+    maker.text('index.php', 400)
+    maker.text('wp-load.php', 3000)
+
+    plugins = ['plugin-{0}'.format(i) for i in range(max(1, files // 400))]
+    themes = ['theme-{0}'.format(i) for i in range(max(1, files // 2000))]
+    while maker.files < files:
+        roll = rng.random()
+        if roll < 0.15:
+            path = 'wp-admin/{0}/{1}-{2}.php'.format(rng.choice(('includes', 'css', 'js', 'network')),
+                                                    rng.choice(('edit', 'post', 'options', 'user')), maker.files)
+        elif roll < 0.35:
+            path = 'wp-includes/{0}/{1}.{2}'.format(rng.choice(('js', 'css', 'blocks', 'rest-api', 'SimplePie')),
+                                                   maker.files, rng.choice(('php', 'js', 'css')))
+        elif roll < 0.75:
+            path = 'wp-content/plugins/{0}/{1}/{2}.{3}'.format(rng.choice(plugins), rng.choice(('includes', 'assets',
+                                                                                                 'admin', 'lib')),
+                                                              maker.files, rng.choice(('php', 'js', 'css')))
+        elif roll < 0.85:
+            path = 'wp-content/themes/{0}/{1}.php'.format(rng.choice(themes), maker.files)
+        else:
+            path = 'wp-content/uploads/{0}/{1:02d}/image-{2}.jpg'.format(rng.randint(2012, 2020), rng.randint(1, 12),
+                                                                         maker.files)
+            maker.binary(path, maker.code_size(average_bytes * 4))
+            continue
+        maker.text(path, maker.code_size(average_bytes))
+
+
+def _magento(maker, files, average_bytes):
+    rng = maker.rng
+    maker.write('app/etc/local.xml', b'<?xml version="1.0"?>\n<config><global><resources><default_setup><connection>'
+                                     b'<host><![CDATA[localhost]]></host><username><![CDATA[bench_mage]]></username>'
+                                     b'<password><![CDATA[benchpass]]></password><dbname><![CDATA[bench_mage]]>'
+                                     b'</dbname></connection></default_setup></resources></global></config>\n')
+    maker.text('index.php', 2000)
+    maker.text('app/Mage.php', 20000)
+
+    modules = ['Module{0}'.format(i) for i in range(max(1, files // 150))]
+    while maker.files < files:
+        roll = rng.random()
+        if roll < 0.55:
+            path = 'app/code/{0}/Vendor/{1}/{2}/{3}.php'.format(rng.choice(('core', 'community', 'local')),
+                                                               rng.choice(modules),
+                                                               rng.choice(('Model', 'Block', 'Helper', 'controllers')),
+                                                               maker.files)
+        elif roll < 0.7:
+            path = 'skin/frontend/default/{0}/{1}.{2}'.format(rng.choice(('css', 'js', 'images')), maker.files,
+                                                             rng.choice(('css', 'js')))
+        elif roll < 0.8:
+            path = 'js/{0}/{1}.js'.format(rng.choice(('prototype', 'varien', 'mage', 'lib')), maker.files)
+        elif roll < 0.9:
+            path = 'var/cache/mage--{0}/mage---{1}'.format(rng.randint(0, 15), maker.files)
+        else:
+            name = '{0:x}'.format(rng.getrandbits(32))
+            path = 'media/catalog/product/{0}/{1}/{2}.jpg'.format(name[0], name[1], name)
+            maker.binary(path, maker.code_size(average_bytes * 4))
+            continue
+        maker.text(path, maker.code_size(average_bytes))
+
+
+def generate(root, kind='wordpress', files=2000, average_bytes=8000, seed=1):
+    """
+    Makes a made up httpdocs tree shaped like a real install: the config file the scanner looks for, lots of small
+    code files (which compress), and uploads or product images (which don't).  The same arguments always make the
+    same tree.
+
+    :param root: Where to make it; it shouldn't already have things in it
+    :param kind: One of KINDS
+    :param files: About how many files to make
+    :param average_bytes: About how big the code files are on average.  Images run about four times that.
+    :param seed: Makes a different tree with the same shape
+    :return: (files, bytes) made
+    """
+    if kind not in KINDS:
+        raise ValueError("unknown kind of site: '{0}'".format(kind))
+
+    maker = _Maker(root, random.Random(seed))
+    if kind == 'wordpress':
+        _wordpress(maker, files, average_bytes)
+    else:
+        _magento(maker, files, average_bytes)
+    return maker.files, maker.bytes
@@ -0,0 +1,179 @@
+import fnmatch
+import os
+import re
+import xml.etree.ElementTree as ET
+import xml.sax.saxutils
+
+import cms.slim
+from cms.slim import DISPOSABLE, ESSENTIAL, REGENERABLE
+
+# Where each version keeps its database settings, relative to the install: Magento 2's first
+CONFIG_FILES = ['app/etc/env.php', 'app/etc/local.xml']
+
+# Directories, relative to the install, that Magento fills again by itself: the file caches and full page caches,
+# sessions, error reports, preprocessed view files and resized product images.  Their contents never need copying.
+SKIP_DIRS = ['var/cache', 'var/full_page_cache', 'var/page_cache', 'var/session', 'var/report',
+             'var/view_preprocessed', 'media/catalog/product/cache', 'pub/media/catalog/product/cache']
+
+# Tables, by fnmatch patterns of their name after the prefix, whose rows can all be left behind, first match wins.  The
+# tables themselves always go, empty.  Anything regenerable is rebuilt by a full reindex.
+TABLE_KINDS = [
+    # Caches and sessions, 1 and 2
+    ('core_cache', DISPOSABLE), ('core_cache_tag', DISPOSABLE), ('core_session', DISPOSABLE), ('cache', DISPOSABLE),
+    ('cache_tag', DISPOSABLE), ('session', DISPOSABLE), ('api_session', DISPOSABLE),
+    # Visitor logs, and the reports built from them
+    ('log_*', DISPOSABLE), ('customer_visitor', DISPOSABLE), ('report_event', DISPOSABLE),
+    ('report_viewed_product_index', DISPOSABLE), ('report_compared_product_index', DISPOSABLE),
+    # Leftovers of imports and exports
+    ('dataflow_batch_export', DISPOSABLE), ('dataflow_batch_import', DISPOSABLE),
+    # The indexers' scratch tables, and the indexes and flat tables they build
+    ('*_idx', DISPOSABLE), ('*_tmp', DISPOSABLE), ('*_replica', DISPOSABLE),
+    ('catalog_product_index_*', REGENERABLE), ('catalog_category_product_index*', REGENERABLE),
+    ('catalog_product_flat_*', REGENERABLE), ('catalog_category_flat_*', REGENERABLE),
+    ('catalogsearch_fulltext*', REGENERABLE), ('catalogsearch_result', REGENERABLE),
+    ('cataloginventory_stock_status', REGENERABLE),
+]
+
+# What the tables Magento's indexers make scratch copies and replicas of start with.  The TABLE_KINDS patterns that
+# start with a * only match these, so they can't take another application's tables in the same database.
+INDEXED_TABLES = ('catalog_', 'cataloginventory_', 'catalogrule_', 'catalogsearch_', 'customer_', 'downloadable_',
+                  'eav_', 'inventory_', 'sales_', 'salesrule_', 'tax_', 'weee_')
+
+
+def config_path(base_path):
+    """:return: The file holding an install's database settings, or None if it doesn't look like Magento after all"""
+    for config_file in CONFIG_FILES:
+        path = os.path.join(base_path, config_file)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+# A PHP string literal, in either quotes
+_PHP_STRING = r"""(['"])((?:(?!\1)[^\\]|\\.)*)\1"""
+
+
+def _php_setting(name, config, start=0):
+    """:return: The match for "'name' => 'value'" at or after start, with the value in group 2, or None"""
+    return re.compile(r"""['"]{0}['"]\s*=>\s*{1}""".format(re.escape(name), _PHP_STRING)).search(config, start)
+
+
+def _php_unquote(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+
+def _php_quote(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+class Instance:
+    """A class to represent an installation of Magento, 1 (local.xml) or 2 (env.php)"""
+
+    # The database settings, by what each version calls them
+    SETTINGS = {'host': 'host', 'username': 'user', 'password': 'password', 'dbname': 'name'}
+
+    def __init__(self, base_path):
+        """
+        :param base_path: The install, the directory with app/ in it
+        :raises ValueError: If local.xml has no database settings we can read
+        """
+        self.base_path = base_path
+        self.config_path = config_path(base_path)
+        if self.config_path is None:
+            raise FileNotFoundError('no {0} in {1}'.format(' or '.join(CONFIG_FILES), base_path))
+        self.version = 2 if self.config_path.endswith('.php') else 1
+
+        with open(self.config_path, 'r') as conf_fh:
+            config = conf_fh.read()
+
+        if self.version == 1:
+            try:
+                resources = ET.fromstring(config).find('global/resources')
+            except ET.ParseError as e:
+                raise ValueError('{0}: {1}'.format(self.config_path, e))
+            connection = resources.find('default_setup/connection') if resources is not None else None
+            if connection is None:
+                raise ValueError('{0} has no default_setup connection'.format(self.config_path))
+            for setting, attribute in self.SETTINGS.items():
+                setattr(self, attribute, (connection.findtext(setting) or '').strip())
+            self.table_prefix = (resources.findtext('db/table_prefix') or '').strip()
+        else:
+            start = self.__connection_start(config)
+            for setting, attribute in self.SETTINGS.items():
+                match = _php_setting(setting, config, start)
+                setattr(self, attribute, _php_unquote(match.group(2)) if match else '')
+            match = _php_setting('table_prefix', config)
+            self.table_prefix = _php_unquote(match.group(2)) if match else ''
+
+    @staticmethod
+    def __connection_start(config):
+        """:return: Where env.php's default connection starts, so its settings are the first after it"""
+        connection = re.search(r"""['"]connection['"]\s*=>""", config)
+        default = re.compile(r"""['"]default['"]\s*=>""").search(config, connection.end() if connection else 0)
+        return default.end() if default else 0
+
+    def update_config(self, user=None, password=None, name=None, host=None):
+        values = {'user': user, 'password': password, 'name': name, 'host': host}
+        for attribute, value in values.items():
+            if value is None:
+                values[attribute] = getattr(self, attribute)
+
+        with open(self.config_path, 'r') as conf_fh:
+            conf_data = conf_fh.read()
+
+        if self.version == 1:
+            # ElementTree would lose the comments and layout, so only the values in default_setup are touched
+            setup = re.search(r'<default_setup>.*?</default_setup>', conf_data, re.DOTALL)
+            block = setup.group(0)
+            for setting, attribute in self.SETTINGS.items():
+                block = re.sub(r'(<{0}>\s*)(<!\[CDATA\[.*?\]\]>|[^<]*)(\s*</{0}>)'.format(setting),
+                               lambda match, value=values[attribute]: match.group(1) + (
+                                   '<![CDATA[{0}]]>'.format(value) if match.group(2).startswith('<![CDATA[')
+                                   else xml.sax.saxutils.escape(value)) + match.group(3),
+                               block, count=1, flags=re.DOTALL)
+            new_conf_data = conf_data[:setup.start()] + block + conf_data[setup.end():]
+        else:
+            start = self.__connection_start(conf_data)
+            # Last first, so the earlier positions still hold
+            matches = sorted(((_php_setting(setting, conf_data, start), attribute)
+                              for setting, attribute in self.SETTINGS.items()),
+                             key=lambda pair: pair[0].start() if pair[0] else 0, reverse=True)
+            new_conf_data = conf_data
+            for match, attribute in matches:
+                if match is not None:
+                    new_conf_data = (new_conf_data[:match.start(1)] + _php_quote(values[attribute]) +
+                                     new_conf_data[match.end():])
+
+        with open(self.config_path, 'w') as conf_fh:
+            conf_fh.write(new_conf_data)
+
+        for attribute, value in values.items():
+            setattr(self, attribute, value)
+
+    def skip_dirs(self):
+        """:return: The SKIP_DIRS this install has, as full paths"""
+        paths = [os.path.join(self.base_path, skip_dir) for skip_dir in SKIP_DIRS]
+        return [path for path in paths if os.path.isdir(path) and not os.path.islink(path)]
+
+    def classify(self, table):
+        """
+        :param table: A table in the store's database
+        :return: What kind of data the table holds, ESSENTIAL, REGENERABLE or DISPOSABLE, and an empty list, as
+            cms.slim.plan() wants it
+        """
+        if table.startswith(self.table_prefix):
+            base_name = table[len(self.table_prefix):]
+            for pattern, kind in TABLE_KINDS:
+                if pattern.startswith('*') and not base_name.startswith(INDEXED_TABLES):
+                    continue
+                if fnmatch.fnmatchcase(base_name, pattern):
+                    return kind, []
+        return ESSENTIAL, []
+
+    def slim(self, connection, tables, level=DISPOSABLE):
+        """
+        Works out what of the store's database can be left behind, as cms.slim.plan() does.
+
+        :param level: One of cms.slim.LEVELS
+        """
+        return cms.slim.plan(connection, tables, level, self.classify)
@@ -0,0 +1,93 @@
+import collections
+
+# How much a table, or some of its rows, matters to the site.  Regenerable data is rebuilt by the CMS or a plugin when
+# it's missing (caches, search indexes, file scans); disposable data is logs and leftovers nobody will miss.
+ESSENTIAL = 'essential'
+REGENERABLE = 'regenerable'
+DISPOSABLE = 'disposable'
+
+# How far plan() goes: leave it all, leave out the disposable, or leave out the regenerable too
+LEVELS = ['off', DISPOSABLE, REGENERABLE]
+
+# What plan() did with a table: the kind of data it left behind, what it did ('schema only' or 'filtered'), and how many
+# rows and (about) how many bytes that saved
+Saving = collections.namedtuple('Saving', ['table', 'kind', 'action', 'rows', 'bytes'])
+
+
+def by_install(installs, tables):
+    """
+    Shares a database's tables out between the installs using it.  Each table goes to the install with the longest
+    table prefix the table's name starts with, the first of them should two have the same, so a store with no prefix at
+    all doesn't claim the tables of a blog with one.
+
+    :param installs: cms.wordpress.Instances and cms.magento.Instances, with a table_prefix each
+    :param tables: A list of database.scheduler.TableInfo
+    :return: A list of (install, its tables), in the order of installs
+    """
+    owned = collections.OrderedDict((id(install), (install, [])) for install in installs)
+    for table in tables:
+        owners = [install for install in installs if table.name.startswith(install.table_prefix)]
+        if owners:
+            owned[id(max(owners, key=lambda install: len(install.table_prefix)))][1].append(table)
+    return list(owned.values())
+
+
+def plan(connection, tables, level, classify):
+    """
+    Works out what of a database can be left behind.  Tables holding nothing worth keeping go as schema only, and
+    tables with some rows not worth keeping are filtered.  The source is asked how many rows each filter leaves out, to
+    say what it saves.
+
+    :param connection: A pymysql connection to the database
+    :param tables: A list of database.scheduler.TableInfo for it
+    :param level: One of LEVELS
+    :param classify: Says what a table holds, given its name: its kind, and a list of (kind, condition) for rows of it
+        that matter less than the table as a whole, least important first
+    :return: A dict of table name to the condition for the rows to copy, or None for none of them, as
+        database.engine.Engine and database.pipe.copy_tables take it, and a list of Savings
+    """
+    dropped_kinds = LEVELS[1:LEVELS.index(level) + 1]
+    row_filters = {}
+    savings = []
+    for table in tables:
+        if table.is_view():
+            continue
+
+        kind, row_kinds = classify(table.name)
+        if kind in dropped_kinds:
+            row_filters[table.name] = None
+            savings.append(Saving(table.name, kind, 'schema only', table.rows, table.bytes))
+            continue
+
+        conditions = [(row_kind, condition) for row_kind, condition in row_kinds if row_kind in dropped_kinds]
+        if not conditions:
+            continue
+
+        dropped = ' OR '.join('({0})'.format(condition) for row_kind, condition in conditions)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT COUNT(*), COALESCE(SUM({0}), 0) FROM `{1}`'.format(dropped,
+                                                                                  table.name.replace('`', '``')))
+            total_rows, dropped_rows = cursor.fetchone()
+        if not dropped_rows:
+            continue
+
+        # A NULL in the condition mustn't lose the row
+        row_filters[table.name] = 'NOT COALESCE({0}, FALSE)'.format(dropped)
+        # information_schema's size is all we have to go on, so the bytes are the table's share of it
+        savings.append(Saving(table.name, conditions[-1][0], 'filtered', int(dropped_rows),
+                              int(table.bytes * int(dropped_rows) / max(total_rows, 1))))
+
+    return row_filters, savings
+
+
+def report(savings):
+    """:return: A printable table of what plan() left behind, biggest first, with the total"""
+    if not savings:
+        return 'Nothing in the database can be left behind'
+
+    lines = ['{0:<40} {1:<12} {2:<12} {3:>10} {4:>10}'.format('table', 'kind', 'action', 'rows', 'MB')]
+    for saving in sorted(savings, key=lambda saving: -saving.bytes):
+        lines.append('{0:<40} {1:<12} {2:<12} {3:>10} {4:>10.1f}'.format(saving.table[:40], saving.kind, saving.action,
+                                                                       saving.rows, saving.bytes / 1e6))
+    lines.append('Leaving behind about {0:.1f} MB'.format(sum(saving.bytes for saving in savings) / 1e6))
+    return '\n'.join(lines)
@@ -1,5 +1,46 @@
 import re
 
+import cms.slim
+from cms.slim import DISPOSABLE, ESSENTIAL, REGENERABLE
+
+# Tables, by their name after the prefix, whose rows can all be left behind.  The tables themselves always go, empty.
+TABLE_KINDS = {
+    # Wordfence's traffic and login logs, and caches it fills again
+    'wfhits': DISPOSABLE, 'wflogins': DISPOSABLE, 'wfstatus': DISPOSABLE, 'wflivetraffichuman': DISPOSABLE,
+    'wfblockediplog': DISPOSABLE, 'wftrafficrates': DISPOSABLE, 'wfcrawlers': DISPOSABLE, 'wfreversecache': DISPOSABLE,
+    'wfsnipcache': DISPOSABLE, 'wffilechanges': REGENERABLE, 'wfknownfilelist': REGENERABLE,
+    'wffilemods': REGENERABLE,
+    # Action scheduler's log of what it ran
+    'actionscheduler_logs': DISPOSABLE,
+    # Redirection's hit logs
+    'redirection_logs': DISPOSABLE, 'redirection_404': DISPOSABLE,
+    # WooCommerce's shopper sessions, which expire within days anyway
+    'woocommerce_sessions': DISPOSABLE, 'wc_sessions': DISPOSABLE,
+    # Yoast's indexables, which it rebuilds
+    'yoast_indexable': REGENERABLE, 'yoast_indexable_hierarchy': REGENERABLE, 'yoast_seo_links': REGENERABLE,
+    'yoast_seo_meta': REGENERABLE,
+}
+
+# Transients whose timeout has passed, which WordPress would only delete next time someone asked for them.  table is the
+# options table, quoted; the timeouts are looked up by their unique key, so it's one index probe a row.
+_EXPIRED_TRANSIENTS = (
+    "(option_name LIKE '\\_transient\\_timeout\\_%' OR option_name LIKE '\\_site\\_transient\\_timeout\\_%') "
+    "AND option_value < UNIX_TIMESTAMP() OR "
+    "option_name LIKE '\\_transient\\_%' AND EXISTS (SELECT 1 FROM {table} AS expiry WHERE expiry.option_name = "
+    "CONCAT('_transient_timeout_', SUBSTRING({table}.option_name, 12)) AND expiry.option_value < UNIX_TIMESTAMP()) OR "
+    "option_name LIKE '\\_site\\_transient\\_%' AND EXISTS (SELECT 1 FROM {table} AS expiry WHERE "
+    "expiry.option_name = CONCAT('_site_transient_timeout_', SUBSTRING({table}.option_name, 17)) AND "
+    "expiry.option_value < UNIX_TIMESTAMP())")
+
+# Rows of otherwise essential tables that can be left behind, by the table's name after the prefix: a list of (kind,
+# condition matching the rows), where {table} in the condition is the quoted table name
+ROW_KINDS = {
+    'options': [(DISPOSABLE, _EXPIRED_TRANSIENTS),
+                (REGENERABLE, "option_name LIKE '\\_transient\\_%' OR option_name LIKE '\\_site\\_transient\\_%'")],
+    # Scheduled actions that have already run; the pending ones have to come along
+    'actionscheduler_actions': [(DISPOSABLE, "status IN ('complete', 'failed', 'canceled')")],
+}
+
 
 class Instance:
     """A class to represent an installation of WordPress"""
@@ -9,11 +50,15 @@ class Instance:
         self.config_path = base_path + '/wp-config.php'
 
         with open(self.config_path, 'r') as conf_fh:
-            t_result = re.findall(r"""^define\(\s*['"]*(.*?)['"]*[\s,]+['"]*(.*?)['"]*\s*\)""", conf_fh.read(),
-                                  re.IGNORECASE | re.DOTALL | re.MULTILINE)
+            config = conf_fh.read()
+        t_result = re.findall(r"""^define\(\s*['"]*(.*?)['"]*[\s,]+['"]*(.*?)['"]*\s*\)""", config,
+                              re.IGNORECASE | re.DOTALL | re.MULTILINE)
 
         result = dict(t_result)
 
+        prefix_match = re.search(r"""^\s*\$table_prefix\s*=\s*['"]([^'"]*)['"]\s*;""", config, re.MULTILINE)
+        self.table_prefix = prefix_match.group(1) if prefix_match else 'wp_'
+
         self.user = result['DB_USER']
         self.password = result['DB_PASSWORD']
         self.name = result['DB_NAME']
@@ -49,3 +94,29 @@ class Instance:
         self.name = name
         self.password = password
         self.host = host
+
+    def __base_name(self, table):
+        """:return: The table's name without the prefix (or a multisite blog's prefix), or None if it isn't ours"""
+        match = re.match(re.escape(self.table_prefix) + r'(?:\d+_)?(.+)$', table)
+        return match.group(1) if match else None
+
+    def classify(self, table):
+        """
+        :param table: A table in the site's database
+        :return: What kind of data the table holds, ESSENTIAL, REGENERABLE or DISPOSABLE, and a list of (kind,
+            condition) for rows of it that matter less than the table as a whole
+        """
+        base_name = self.__base_name(table)
+        if base_name in TABLE_KINDS:
+            return TABLE_KINDS[base_name], []
+
+        quoted = '`' + table.replace('`', '``') + '`'
+        return ESSENTIAL, [(kind, condition.format(table=quoted)) for kind, condition in ROW_KINDS.get(base_name, [])]
+
+    def slim(self, connection, tables, level=DISPOSABLE):
+        """
+        Works out what of the site's database can be left behind, as cms.slim.plan() does.
+
+        :param level: One of cms.slim.LEVELS
+        """
+        return cms.slim.plan(connection, tables, level, self.classify)
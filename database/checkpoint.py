@@ -0,0 +1,76 @@
+import json
+import os
+import threading
+
+
+class Checkpoint:
+    """
+    How far a database copy has got, kept in a small JSON file that's rewritten as each step is committed on the
+    destination, so a copy that dies can pick up where it stopped.  For tables copied in primary key order, it also
+    keeps the key of the last row committed.
+    """
+
+    def __init__(self, path, source, destination, fresh=False):
+        """
+        :param path: Where to keep the checkpoint
+        :param source: Something naming the source database, e.g. host/name.  A checkpoint for another copy is ignored.
+        :param destination: Something naming the destination database
+        :param fresh: Ignore any earlier checkpoint and start over
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.state = {'source': source, 'destination': destination, 'schema': False, 'tables': {}}
+
+        if not fresh:
+            try:
+                with open(path) as checkpoint_fh:
+                    state = json.load(checkpoint_fh)
+                if state.get('source') == source and state.get('destination') == destination:
+                    self.state = state
+            except (OSError, ValueError):
+                pass
+
+        # Whether the schema was already in place when we started, so anything unfinished may be half there
+        self.resuming = self.state['schema']
+
+    def __save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', mode=0o700, exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_fh:
+            json.dump(self.state, checkpoint_fh)
+        os.replace(temp_path, self.path)
+
+    def __table(self, table):
+        return self.state['tables'].setdefault(table, {'done': False, 'last_key': None})
+
+    def schema_done(self):
+        with self.lock:
+            self.state['schema'] = True
+            self.__save()
+
+    def table_done(self, table):
+        with self.lock:
+            self.__table(table)['done'] = True
+            self.__save()
+
+    def is_table_done(self, table):
+        with self.lock:
+            return self.__table(table)['done']
+
+    def set_last_key(self, table, key):
+        """
+        :param key: The primary key of the last row committed, as a list of SQL literals
+        """
+        with self.lock:
+            self.__table(table)['last_key'] = key
+            self.__save()
+
+    def last_key(self, table):
+        with self.lock:
+            return self.__table(table)['last_key']
+
+    def finish(self):
+        """The copy is done, so there's nothing left to pick up"""
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
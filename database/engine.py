@@ -0,0 +1,433 @@
+import queue
+import re
+import threading
+import time
+
+import pymysql
+import pymysql.cursors
+
+import database.scheduler
+
+# Whoever created a view or trigger on the old server probably doesn't exist on the new one
+DEFINER = re.compile(r'\sDEFINER\s*=\s*(`[^`]*`|\S+)@(`[^`]*`|\S+)', re.IGNORECASE)
+
+
+def quote(name):
+    """Quotes a table or column name for MySQL"""
+    return '`' + name.replace('`', '``') + '`'
+
+
+class TableStats:
+    """How the copy of one table went"""
+
+    def __init__(self, name, estimated_rows=None):
+        self.name = name
+        self.estimated_rows = estimated_rows
+        self.rows = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return '{0}: {1} rows, {2} bytes in {3:.1f}s ({4:.0f} rows/s, {5:.2f} MB/s)'.format(
+            self.name, self.rows, self.bytes, self.seconds, self.rows_per_second(), self.bytes_per_second() / 1e6)
+
+
+class Engine:
+    """
+    Copies a MySQL database from one server to another in-process.  Rows are streamed off the source with an unbuffered
+    server side cursor and written to the destination as multi-row INSERTs of bounded size, so memory use stays the
+    same however big the tables are.
+    """
+
+    def __init__(self, source, destination, batch_bytes=1024 * 1024, batch_rows=5000, chunk_rows=100000,
+                 source_time_zone=None, dest_time_zone=None, progress_interval=10, meter=None, row_filters=None,
+                 verbose=False):
+        """
+        :param source: A dict of pymysql.connect arguments for the source database (host, user, password, db, ...)
+        :param destination: A dict of pymysql.connect arguments for the destination database
+        :param batch_bytes: About how big each INSERT may get
+        :param batch_rows: How many rows each INSERT may hold
+        :param chunk_rows: How many rows of a table with a primary key to copy between checkpoints
+        :param source_time_zone: If given, the time_zone to read TIMESTAMPs in on the source
+        :param dest_time_zone: If given, the time_zone to write TIMESTAMPs in on the destination
+        :param progress_interval: How often, in seconds, to report on a table that's still going
+        :param meter: A telemetry.metrics.Meter to count the bytes of the INSERTs with, if any
+        :param row_filters: A dict of table name to a condition for which of its rows to copy, or None to copy only
+            its schema, as cms.wordpress.Instance.slim() makes it.  Other tables are copied whole.
+        :param verbose: Explain what you are doing
+        """
+        self.source = source
+        self.destination = destination
+        self.batch_bytes = batch_bytes
+        self.batch_rows = batch_rows
+        self.chunk_rows = chunk_rows
+        self.source_time_zone = source_time_zone
+        self.dest_time_zone = dest_time_zone
+        self.progress_interval = progress_interval
+        self.meter = meter
+        self.row_filters = row_filters or {}
+        self.verbose = verbose
+        self.stats = []
+
+    def connect_source(self):
+        connection = pymysql.connect(charset='utf8mb4', autocommit=True, **self.source)
+        if self.source_time_zone:
+            with connection.cursor() as cursor:
+                cursor.execute('SET time_zone = %s', self.source_time_zone)
+        return connection
+
+    def connect_snapshots(self, source, count):
+        """
+        Opens connections to the source that all see the database as it was at one moment, so tables copied on
+        different ones still agree with each other, as a single mysqldump --single-transaction would.  Each starts a
+        transaction WITH CONSISTENT SNAPSHOT while a global read lock on source holds writes off, the way mydumper does
+        it.  Without the RELOAD privilege the lock needs, the snapshots are started back to back instead, which is as
+        close as we can get.
+
+        :param source: A connection to the source to take the lock on
+        :param count: How many connections to open
+        :return: A list of connections, each in its transaction
+        """
+        connections = [self.connect_source() for _ in range(count)]
+        locked = False
+        with source.cursor() as cursor:
+            try:
+                cursor.execute('FLUSH TABLES WITH READ LOCK')
+                locked = True
+            except pymysql.MySQLError as e:
+                print('Could not lock the source ({0}), the tables may not quite agree with each other'.format(e))
+        try:
+            for connection in connections:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+                    cursor.execute('START TRANSACTION WITH CONSISTENT SNAPSHOT')
+        finally:
+            if locked:
+                with source.cursor() as cursor:
+                    cursor.execute('UNLOCK TABLES')
+        return connections
+
+    def connect_destination(self):
+        # The same session settings a mysqldump file starts with
+        connection = pymysql.connect(charset='utf8mb4', autocommit=True, binary_prefix=True, **self.destination)
+        with connection.cursor() as cursor:
+            cursor.execute("SET foreign_key_checks = 0, unique_checks = 0, sql_mode = 'NO_AUTO_VALUE_ON_ZERO'")
+            if self.dest_time_zone:
+                cursor.execute('SET time_zone = %s', self.dest_time_zone)
+        return connection
+
+    def copy_schema(self, source, destination, table):
+        with source.cursor() as cursor:
+            cursor.execute('SHOW CREATE TABLE {0}'.format(quote(table)))
+            create = cursor.fetchone()[1]
+
+        with destination.cursor() as cursor:
+            cursor.execute('DROP TABLE IF EXISTS {0}'.format(quote(table)))
+            cursor.execute(create)
+
+    def copy_columns(self, source, table):
+        """
+        :return: The table's columns, leaving out generated ones, which can't be inserted into
+        """
+        with source.cursor() as cursor:
+            cursor.execute("SELECT column_name FROM information_schema.columns WHERE table_schema = DATABASE() AND "
+                           "table_name = %s AND extra NOT LIKE '%%GENERATED%%' ORDER BY ordinal_position", table)
+            return [row[0] for row in cursor.fetchall()]
+
+    def primary_key(self, source, table):
+        """
+        :return: The columns of the table's primary key, in order, or an empty list if it hasn't got one
+        """
+        with source.cursor() as cursor:
+            cursor.execute("SELECT column_name FROM information_schema.key_column_usage "
+                           "WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = 'PRIMARY' "
+                           "ORDER BY ordinal_position", table)
+            return [row[0] for row in cursor.fetchall()]
+
+    def after_key(self, key, values, condition=None):
+        """
+        :param key: The primary key's columns
+        :param values: A key, as a list of SQL literals
+        :param condition: If given, only the rows after that key it matches
+        :return: A WHERE clause for the rows after that key, spelled out so older servers can still use the index
+        """
+        terms = []
+        for index, column in enumerate(key):
+            equal = ['{0} = {1}'.format(quote(c), v) for c, v in zip(key[:index], values[:index])]
+            terms.append('(' + ' AND '.join(equal + ['{0} > {1}'.format(quote(column), values[index])]) + ')')
+        if condition:
+            return 'WHERE ({0}) AND ({1})'.format(' OR '.join(terms), condition)
+        return 'WHERE ' + ' OR '.join(terms)
+
+    def at_key(self, key, values):
+        """:return: A WHERE clause for the row with that key"""
+        return 'WHERE ' + ' AND '.join('{0} = {1}'.format(quote(c), v) for c, v in zip(key, values))
+
+    def check_boundary(self, source, destination, table, key, values):
+        """
+        Gets a half copied table ready to carry on from its checkpoint.  Rows after the checkpoint were never
+        checkpointed, so they're deleted and will be copied again, and the last checkpointed row has to match the
+        source's, or we can't trust the rest either.
+
+        :return: Whether the table can carry on from the checkpoint
+        """
+        with destination.cursor() as cursor:
+            cursor.execute('DELETE FROM {0} {1}'.format(quote(table), self.after_key(key, values)))
+
+        column_list = ', '.join(quote(column) for column in self.copy_columns(source, table))
+        rows = []
+        for connection in source, destination:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT {0} FROM {1} {2}'.format(column_list, quote(table), self.at_key(key, values)))
+                rows.append(cursor.fetchone())
+        return rows[0] is not None and rows[0] == rows[1]
+
+    def copy_table(self, source, destination, table, stats, checkpoint=None, condition=None):
+        """
+        Copies a table's rows.  With a checkpoint, a table with a primary key is copied in key order, chunk_rows at a
+        time, and the key of the last row is checkpointed after each chunk, so a rerun only has to redo one chunk.  A
+        table without one starts over.
+
+        :param condition: If given, only copy the rows it matches
+        """
+        key = self.primary_key(source, table) if checkpoint is not None else []
+        columns = self.copy_columns(source, table)
+        if not key or not set(key) <= set(columns):
+            if checkpoint is not None and checkpoint.resuming:
+                with destination.cursor() as cursor:
+                    cursor.execute('TRUNCATE TABLE {0}'.format(quote(table)))
+            self.copy_rows(source, destination, table, stats, 'WHERE ' + condition if condition else '')
+            return
+
+        last = checkpoint.last_key(table)
+        if last is not None and not self.check_boundary(source, destination, table, key, last):
+            print('{0} does not match its checkpoint, starting it over'.format(table))
+            last = None
+        if last is None and checkpoint.resuming:
+            with destination.cursor() as cursor:
+                cursor.execute('TRUNCATE TABLE {0}'.format(quote(table)))
+        elif last is not None and self.verbose:
+            print('Carrying on with {0} after {1}'.format(table, ', '.join(last)))
+
+        positions = [columns.index(column) for column in key]
+        order_by = 'ORDER BY {0} LIMIT {1}'.format(', '.join(quote(column) for column in key), self.chunk_rows)
+        while True:
+            rows_before = stats.rows
+            if last:
+                where = self.after_key(key, last, condition)
+            else:
+                where = 'WHERE ' + condition if condition else ''
+            row = self.copy_rows(source, destination, table, stats, where, order_by)
+            if row is None:
+                break
+            last = [source.escape(row[position]) for position in positions]
+            checkpoint.set_last_key(table, last)
+            if stats.rows - rows_before < self.chunk_rows:
+                break
+
+    def copy_rows(self, source, destination, table, stats, where='', order_by=''):
+        """
+        Streams a table's rows from the source into the destination.
+
+        :param where: An optional WHERE clause (with the WHERE), to copy only some of the rows
+        :param order_by: An optional ORDER BY clause (with the ORDER BY)
+        :return: The last row copied, or None if there weren't any
+        """
+        columns = self.copy_columns(source, table)
+        column_list = ', '.join(quote(column) for column in columns)
+        insert = 'INSERT INTO {0} ({1}) VALUES '.format(quote(table), column_list)
+
+        start = time.monotonic()
+        last_report = start
+        seconds_before = stats.seconds
+        last_row = None
+        values = []
+        values_bytes = len(insert)
+
+        def flush():
+            if self.meter is not None:
+                self.meter.add('database', 'read', values_bytes)
+            with destination.cursor() as cursor:
+                cursor.execute(insert + ','.join(values))
+            stats.bytes += values_bytes
+            if self.meter is not None:
+                self.meter.add('database', 'sent', values_bytes)
+                self.meter.add('database', 'written', values_bytes)
+
+        with source.cursor(pymysql.cursors.SSCursor) as cursor:
+            cursor.execute('SELECT {0} FROM {1} {2} {3}'.format(column_list, quote(table), where, order_by))
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+
+                for row in rows:
+                    value = destination.escape(row)
+                    values.append(value)
+                    values_bytes += len(value) + 1
+                    if len(values) >= self.batch_rows or values_bytes >= self.batch_bytes:
+                        flush()
+                        stats.rows += len(values)
+                        values = []
+                        values_bytes = len(insert)
+                last_row = rows[-1]
+
+                now = time.monotonic()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    stats.seconds = seconds_before + now - start
+                    self.report_progress(stats)
+
+        if values:
+            flush()
+            stats.rows += len(values)
+
+        stats.seconds = seconds_before + time.monotonic() - start
+        return last_row
+
+    def report_progress(self, stats):
+        if stats.estimated_rows and stats.rows_per_second() and stats.estimated_rows > stats.rows:
+            eta = ', about {0:.0f}s to go'.format((stats.estimated_rows - stats.rows) / stats.rows_per_second())
+        else:
+            eta = ''
+        print('  {0}{1}'.format(stats, eta))
+
+    def copy_views(self, source, destination, views):
+        """
+        Recreates the views.  Views can be built on other views, so any that fail go round again until they all work
+        or we stop getting anywhere.
+        """
+        creates = {}
+        with source.cursor() as cursor:
+            for view in views:
+                cursor.execute('SHOW CREATE VIEW {0}'.format(quote(view)))
+                creates[view] = DEFINER.sub('', cursor.fetchone()[1])
+
+        with destination.cursor() as cursor:
+            pending = list(views)
+            while pending:
+                failed = []
+                error = None
+                for view in pending:
+                    try:
+                        cursor.execute('DROP VIEW IF EXISTS {0}'.format(quote(view)))
+                        cursor.execute(creates[view])
+                    except pymysql.MySQLError as e:
+                        failed.append(view)
+                        error = e
+                if len(failed) == len(pending):
+                    raise error
+                pending = failed
+
+    def copy_triggers(self, source, destination):
+        """Recreates the triggers, after the data is in, so copying the rows doesn't set them off"""
+        with source.cursor() as cursor:
+            cursor.execute('SHOW TRIGGERS')
+            triggers = [row[0] for row in cursor.fetchall()]
+            creates = []
+            for trigger in triggers:
+                cursor.execute('SHOW CREATE TRIGGER {0}'.format(quote(trigger)))
+                creates.append(DEFINER.sub('', cursor.fetchone()[2]))
+
+        with destination.cursor() as cursor:
+            for trigger, create in zip(triggers, creates):
+                cursor.execute('DROP TRIGGER IF EXISTS {0}'.format(quote(trigger)))
+                cursor.execute(create)
+
+    def run(self, workers=1, checkpoint=None):
+        """
+        Copies the whole database.  Every table is created first, then the rows are copied on a pool of workers, each
+        with its own pair of connections, biggest tables first.  The workers' source connections share one snapshot,
+        from connect_snapshots(), so the copy is of the database at one moment.  Views and triggers go in once all the
+        data is there.
+
+        With a checkpoint, tables already copied by an earlier run are skipped, and half copied ones carry on from their
+        last chunk.  The checkpoint is finished once everything is in.
+
+        :param workers: How many tables to copy at once
+        :param checkpoint: A database.checkpoint.Checkpoint, or None to copy everything regardless
+        :return: A list of TableStats, one per table, in the order they finished
+        """
+        source = self.connect_source()
+        destination = self.connect_destination()
+        connections = [source, destination]
+        local = threading.local()
+        lock = threading.Lock()
+        snapshots = queue.Queue()
+
+        def copy(table):
+            if checkpoint is not None and checkpoint.is_table_done(table.name):
+                print('{0}: already copied.  {1}'.format(table.name, progress.table_done(table)))
+                return None
+
+            if not hasattr(local, 'source'):
+                local.source = snapshots.get_nowait()
+                local.destination = self.connect_destination()
+                with lock:
+                    connections.append(local.destination)
+
+            if self.verbose:
+                print('Copying {0}'.format(table.name))
+            stats = TableStats(table.name, table.rows)
+            if table.name in self.row_filters and self.row_filters[table.name] is None:
+                # Its schema is all it needs
+                if checkpoint is not None:
+                    checkpoint.table_done(table.name)
+                self.stats.append(stats)
+                print('{0}: schema only.  {1}'.format(table.name, progress.table_done(table)))
+                return stats
+
+            if self.meter is not None:
+                self.meter.stream_started('database', table=table.name)
+            try:
+                self.copy_table(local.source, local.destination, table.name, stats, checkpoint,
+                                self.row_filters.get(table.name))
+            except pymysql.MySQLError as e:
+                print('Failed copying {0}: {1}'.format(table.name, e))
+                if self.meter is not None:
+                    self.meter.stream_finished('database', 1, table=table.name)
+                raise
+            if self.meter is not None:
+                self.meter.stream_finished('database', 0, table=table.name, rows=stats.rows)
+            if checkpoint is not None:
+                checkpoint.table_done(table.name)
+            self.stats.append(stats)
+            print('{0}.  {1}'.format(stats, progress.table_done(table)))
+            return stats
+
+        try:
+            tables = database.scheduler.table_sizes(source)
+            base_tables = [table for table in tables if not table.is_view()]
+
+            # With every table in place up front (and foreign key checks off), the rows can go in any order
+            if checkpoint is None or not checkpoint.resuming:
+                for table in base_tables:
+                    self.copy_schema(source, destination, table.name)
+                if checkpoint is not None:
+                    checkpoint.schema_done()
+            elif self.verbose:
+                print('Picking up an unfinished copy, the tables are already there')
+
+            # One per worker run_largest_first will start
+            for connection in self.connect_snapshots(source, max(1, min(workers, len(base_tables)))):
+                connections.append(connection)
+                snapshots.put(connection)
+
+            progress = database.scheduler.Progress(base_tables)
+            database.scheduler.run_largest_first(base_tables, workers, copy)
+
+            self.copy_views(source, destination, [table.name for table in tables if table.is_view()])
+            self.copy_triggers(source, destination)
+            if checkpoint is not None:
+                checkpoint.finish()
+        finally:
+            for connection in connections:
+                connection.close()
+
+        return self.stats
@@ -0,0 +1,116 @@
+import shlex
+import time
+
+import database.scheduler
+import transfer.shell
+
+
+def copy_tables(dump_proc, restore_proc, db_name, tables, remote, codec, workers, filter_proc=None, password=None,
+                checkpoint=None, meter=None, row_filters=None, per_table=False, verbose=False):
+    """
+    Copies a database with mysqldump | mysql pipelines.  The schema (tables and views) goes first in one stream, then
+    the tables' rows, then the triggers, so they don't go off while the rows are loaded.
+
+    The rows go in one --single-transaction dump, so every table is copied as it was at the same moment.  With
+    per_table, each table gets its own dump instead, biggest first, on a pool of workers, so a few big tables don't hold
+    everything else up, but separate mysqldumps can't share a snapshot, so tables written to during the copy may not
+    quite agree with each other.  Tables with a row filter always get their own dump, as --where applies to every table
+    in one.
+
+    With a checkpoint, a rerun skips the schema and the tables an earlier run finished, and empties any it didn't
+    before copying them again.  mysqldump can't pick up part way through a dump, so that's as fine as it gets here.
+
+    :param dump_proc: mysqldump with its credentials and host, but no database
+    :param restore_proc: mysql with its credentials, host and database
+    :param db_name: The database being dumped
+    :param tables: A list of database.scheduler.TableInfo for the database
+    :param remote: A format string wrapping a command to be run on the destination, e.g. 'ssh user@host "{0}"'
+    :param codec: The transfer.compression.Codec to squeeze the streams with
+    :param workers: How many dumps to run at once
+    :param filter_proc: A command to pass every dump through, if any, e.g. a sed
+    :param password: The password to give ssh, or None if keys will do
+    :param checkpoint: A database.checkpoint.Checkpoint, or None to copy everything regardless
+    :param meter: A telemetry.metrics.Meter to count the streams' bytes with, if any
+    :param row_filters: A dict of table name to a condition for which of its rows to copy, or None to copy only its
+        schema, as cms.wordpress.Instance.slim() makes it.  Other tables are copied whole.
+    :param per_table: Dump each table on its own, trading consistency between tables for speed
+    :param verbose: Explain what you are doing
+    :return: 0 if every stream succeeded, otherwise the first failing exit status
+    """
+
+    def pipeline(dump_options, table='', before=None):
+        dump = '{0} {1} {2} {3}'.format(dump_proc, dump_options, db_name, table).rstrip()
+        if before:
+            dump = '(echo {0} && {1})'.format(shlex.quote(before), dump)
+        if filter_proc:
+            dump = '{0} | {1}'.format(dump, filter_proc)
+        return transfer.shell.Stream(dump, remote.format(codec.pipe_in(restore_proc)), compress=codec.compress,
+                                     pipeline='database', table=table or dump_options)
+
+    def run(command):
+        if verbose:
+            print(command)
+        return transfer.shell.run(command, password=password, mirror=verbose, meter=meter)
+
+    row_filters = row_filters or {}
+    base_tables = [table for table in tables if not table.is_view()]
+    progress = database.scheduler.Progress(base_tables)
+
+    def copy(dump_tables, condition=None):
+        start = time.monotonic()
+        names = [table.name for table in dump_tables]
+        # Whatever an earlier run got in of these tables has to go, or their rows would be there twice
+        before = None
+        if checkpoint is not None and checkpoint.resuming:
+            before = 'SET FOREIGN_KEY_CHECKS = 0; ' + ' '.join('TRUNCATE TABLE `{0}`;'.format(name.replace('`', '``'))
+                                                               for name in names)
+        # A snapshot rather than LOCK TABLES, which also lets a filter look at other rows of the same table
+        dump_options = '--no-create-info --skip-triggers --single-transaction'
+        if condition:
+            dump_options += ' --where={0}'.format(shlex.quote(condition))
+        exitcode = run(pipeline(dump_options, ' '.join(shlex.quote(name) for name in names), before))
+        if exitcode != 0:
+            print('Failed copying {0}'.format(', '.join(names)))
+            raise ChildProcessError(exitcode)
+        seconds = time.monotonic() - start
+        for table in dump_tables:
+            if checkpoint is not None:
+                checkpoint.table_done(table.name)
+            print('{0}: {1} bytes in {2:.1f}s.  {3}'.format(table.name, table.bytes, seconds,
+                                                            progress.table_done(table)))
+
+    if checkpoint is None or not checkpoint.resuming:
+        exitcode = run(pipeline('--no-data --skip-triggers'))
+        if exitcode != 0:
+            return exitcode
+        if checkpoint is not None:
+            checkpoint.schema_done()
+    else:
+        print('Picking up an unfinished copy, the tables are already there')
+
+    together = []
+    alone = []
+    for table in base_tables:
+        if checkpoint is not None and checkpoint.is_table_done(table.name):
+            print('{0}: already copied.  {1}'.format(table.name, progress.table_done(table)))
+        elif table.name in row_filters and row_filters[table.name] is None:
+            # The schema stream already made it
+            if checkpoint is not None:
+                checkpoint.table_done(table.name)
+            print('{0}: schema only.  {1}'.format(table.name, progress.table_done(table)))
+        elif per_table or row_filters.get(table.name):
+            alone.append(table)
+        else:
+            together.append(table)
+
+    try:
+        if together:
+            copy(together)
+        database.scheduler.run_largest_first(alone, workers, lambda table: copy([table], row_filters.get(table.name)))
+    except ChildProcessError as e:
+        return e.args[0]
+
+    exitcode = run(pipeline('--no-data --no-create-info --triggers'))
+    if exitcode == 0 and checkpoint is not None:
+        checkpoint.finish()
+    return exitcode
@@ -0,0 +1,100 @@
+import queue
+import threading
+import time
+
+
+class TableInfo:
+    """What information_schema says about a table before we start"""
+
+    def __init__(self, name, table_type, size, rows):
+        self.name = name
+        self.table_type = table_type
+        self.bytes = size or 0
+        self.rows = rows or 0
+
+    def is_view(self):
+        return self.table_type == 'VIEW'
+
+
+def table_sizes(connection):
+    """
+    Reads the size of every table in the connection's database up front.  InnoDB's numbers are estimates, but they're
+    plenty good enough to schedule by.
+
+    :param connection: A pymysql connection to the database
+    :return: A list of TableInfo, biggest first, views last
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT table_name, table_type, data_length + index_length, table_rows '
+                       'FROM information_schema.tables WHERE table_schema = DATABASE()')
+        tables = [TableInfo(*row) for row in cursor.fetchall()]
+
+    return sorted(tables, key=lambda table: (table.is_view(), -table.bytes, table.name))
+
+
+class Progress:
+    """Keeps track of a multi-table copy, so there's something sensible to say about when it'll finish"""
+
+    def __init__(self, tables):
+        self.total_bytes = sum(table.bytes for table in tables)
+        self.total_tables = len(tables)
+        self.done_bytes = 0
+        self.done_tables = 0
+        self.start = time.monotonic()
+        self.lock = threading.Lock()
+
+    def table_done(self, table):
+        """
+        :return: A line saying how far along we are
+        """
+        with self.lock:
+            self.done_bytes += table.bytes
+            self.done_tables += 1
+            elapsed = time.monotonic() - self.start
+            if self.done_bytes and self.total_bytes > self.done_bytes:
+                eta = elapsed * (self.total_bytes - self.done_bytes) / self.done_bytes
+            else:
+                eta = 0
+            return '{0} of {1} tables done, {2:.0f}% by size, about {3:.0f}s to go'.format(
+                self.done_tables, self.total_tables, 100.0 * self.done_bytes / max(self.total_bytes, 1), eta)
+
+
+def run_largest_first(tables, workers, job):
+    """
+    Runs job(table) for every table on a pool of workers, handing out the biggest tables first so the big ones don't
+    end up starting last.  After something fails, no more tables are started, and the first error is raised once the
+    ones already going have finished.
+
+    :param tables: A list of TableInfo
+    :param workers: How many tables to work on at once
+    :param job: A function taking a TableInfo
+    :return: A dict of table name to whatever job returned for it
+    """
+    pending = queue.Queue()
+    for table in sorted(tables, key=lambda table: table.bytes, reverse=True):
+        pending.put(table)
+
+    results = {}
+    errors = []
+
+    def worker():
+        while not errors:
+            try:
+                table = pending.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[table.name] = job(table)
+            except BaseException as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(max(1, min(workers, len(tables))))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return results
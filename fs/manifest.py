@@ -0,0 +1,216 @@
+import collections
+import gzip
+import hashlib
+import os
+import stat
+
+# kind is 'f' for a file, 'l' for a symlink or 'd' for a directory, the same as find -printf %y.  digest is the SHA-1 of
+# a file's contents, or None if nobody has needed it yet.
+Entry = collections.namedtuple('Entry', ['kind', 'size', 'mtime', 'mode', 'digest'])
+
+# The same record format as the listing find makes on the destination, see transfer.incremental.list_remote
+LISTING_FORMAT = '%y %s %T@ %m - %P\\0'
+
+
+class Manifest:
+    """
+    Everything under a site's root, by path relative to the root (the root itself is '.'), with enough about each to
+    tell whether it has changed.
+    """
+
+    def __init__(self, entries=None):
+        self.entries = entries if entries is not None else {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def total_bytes(self):
+        return sum(entry.size for entry in self.entries.values())
+
+    def save(self, path):
+        """Writes the manifest out compressed, replacing any old one in one go so a crash can't leave half of it"""
+        os.makedirs(os.path.dirname(path) or '.', mode=0o700, exist_ok=True)
+        temp_path = path + '.tmp'
+        with gzip.open(temp_path, 'wb', compresslevel=1) as manifest_fh:
+            for name, entry in self.entries.items():
+                manifest_fh.write('{0} {1} {2} {3:o} {4} '.format(entry.kind, entry.size, entry.mtime, entry.mode,
+                                                                  entry.digest or '-').encode())
+                manifest_fh.write(os.fsencode(name) + b'\0')
+        os.replace(temp_path, path)
+
+    def forget(self, paths):
+        """Drops the given paths, and everything under them"""
+        gone = set(paths)
+        for name in list(self.entries):
+            parent = name
+            while parent:
+                if parent in gone:
+                    del self.entries[name]
+                    break
+                parent = os.path.dirname(parent)
+
+
+class Delta:
+    """What has to happen to the destination to make it match the source"""
+
+    def __init__(self):
+        # Files and symlinks to send
+        self.send = []
+        # Paths to remove from the destination, along with everything under them
+        self.remove = []
+        # Directories to create, or whose mode or time needs putting right
+        self.directories = []
+        # Files the same size on both ends but with different times, which need hashing to tell apart
+        self.unsure = []
+        # Files put in place on the destination some other way than sending them
+        self.placed = []
+
+    def directories_to_fix(self, source):
+        """
+        :param source: The source Manifest
+        :return: The changed directories, and every directory something was sent into, placed in or removed from,
+            parents first
+        """
+        directories = set(self.directories)
+        for path in self.send + self.placed + self.remove:
+            parent = os.path.dirname(path) or '.'
+            if source.entries.get(parent, Entry('', 0, 0, 0, None)).kind == 'd':
+                directories.add(parent)
+        return sorted(directories, key=lambda p: (p != '.', p.count(os.sep), p))
+
+
+def parse(data):
+    """
+    :param data: Records as written by Manifest.save, or listed by find -printf LISTING_FORMAT
+    :return: A Manifest
+    """
+    entries = {}
+    for record in data.split(b'\0'):
+        if not record:
+            continue
+        kind, size, mtime, mode, digest, name = record.split(b' ', 5)
+        kind = kind.decode()
+        entries[os.fsdecode(name) or '.'] = Entry(kind, int(size) if kind != 'd' else 0, int(float(mtime)),
+                                                  int(mode, 8), None if digest == b'-' else digest.decode())
+    return Manifest(entries)
+
+
+def load(path):
+    """
+    :return: The Manifest saved at path, or None if there isn't one
+    """
+    try:
+        with gzip.open(path, 'rb') as manifest_fh:
+            return parse(manifest_fh.read())
+    except FileNotFoundError:
+        return None
+
+
+def file_digest(path):
+    """:return: The SHA-1 of a file's contents, in hex, the same as sha1sum gives"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file_fh:
+        for block in iter(lambda: file_fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build(root, previous=None, skip=None):
+    """
+    Lists everything under a directory.  Only the size, time and mode of each entry are read; a file's digest is carried
+    over from the previous manifest if the file doesn't look like it has changed since, and is otherwise left to be
+    worked out if it's ever needed.  Directories we can't read are skipped, and anything that isn't a file, symlink or
+    directory is ignored, as tar would only complain about it.
+
+    :param root: The directory to list, probably a site's httpdocs
+    :param previous: The last Manifest built of the same root, if any
+    :param skip: Directories, relative to the root, to list but not what's in them
+    :return: A Manifest
+    """
+    manifest = Manifest()
+    previous_entries = previous.entries if previous is not None else {}
+    skip = {os.path.join(root, path) for path in skip or []}
+
+    def add(path, st):
+        if stat.S_ISDIR(st.st_mode):
+            kind = 'd'
+        elif stat.S_ISLNK(st.st_mode):
+            kind = 'l'
+        elif stat.S_ISREG(st.st_mode):
+            kind = 'f'
+        else:
+            return None
+
+        relative = os.path.relpath(path, root)
+        # A directory's own size is down to the filesystem, not what's in it
+        entry = Entry(kind, st.st_size if kind != 'd' else 0, int(st.st_mtime), stat.S_IMODE(st.st_mode), None)
+        old = previous_entries.get(relative)
+        if old is not None and old[:4] == entry[:4]:
+            entry = old
+        manifest.entries[relative] = entry
+        return kind
+
+    add(root, os.lstat(root))
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+
+        for entry in entries:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if add(entry.path, st) == 'd' and entry.path not in skip:
+                pending.append(entry.path)
+
+    return manifest
+
+
+def compare(source, destination):
+    """
+    Works out what has to be sent, and what removed, to make the destination match the source.  An entry that's the
+    same kind, size, mode and time on both ends is taken to be the same, as is a file whose digests are known and match.
+
+    :param source: The Manifest of the source
+    :param destination: The Manifest of the destination
+    :return: A Delta
+    """
+    delta = Delta()
+    for path, entry in source.entries.items():
+        other = destination.entries.get(path)
+        if other is not None and other.kind != entry.kind:
+            delta.remove.append(path)
+            other = None
+
+        if entry.kind == 'd':
+            if other is None or other.mode != entry.mode or other.mtime != entry.mtime:
+                delta.directories.append(path)
+        elif other is None or other.size != entry.size or other.mode != entry.mode:
+            delta.send.append(path)
+        elif other.mtime == entry.mtime:
+            continue
+        elif entry.kind == 'f' and entry.digest is not None and other.digest is not None:
+            if entry.digest != other.digest:
+                delta.send.append(path)
+        elif entry.kind == 'f':
+            delta.unsure.append(path)
+        else:
+            delta.send.append(path)
+
+    # Only the top of anything that's gone needs removing
+    extra = set(path for path in destination.entries if path not in source.entries)
+    for path in sorted(extra):
+        parent = os.path.dirname(path)
+        while parent and parent not in extra:
+            parent = os.path.dirname(parent)
+        if not parent:
+            delta.remove.append(path)
+
+    delta.send.sort()
+    delta.remove.sort()
+    delta.unsure.sort()
+    return delta
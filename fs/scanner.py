@@ -0,0 +1,246 @@
+import fnmatch
+import os
+import queue
+import re
+import threading
+import time
+
+# Directories that only ever hold caches and backups, never anything that tells us about the site
+COMMON_PRUNE = ['*/wp-content/cache', '*/wp-content/updraft', '*/wp-content/ai1wm-backups',
+                '*/wp-content/backups-dup-lite', '*/wp-content/backup-db', '*/wp-content/uploads/backupbuddy_backups',
+                '*/var/cache', '*/var/session', '*/var/report', '*/media/catalog/product/cache']
+
+
+class SiteScan:
+    """What one pass over a site's document root turned up"""
+
+    def __init__(self, root):
+        self.root = root
+        self.wp_roots = []
+        self.magento_roots = []
+        self.db_refs = []
+        self.pruned = []
+        # What's in the directories scanned, so not what's in the pruned ones, which weren't looked into
+        self.total_bytes = 0
+        self.file_count = 0
+        self.dir_count = 0
+        # Top level directory name -> {'bytes', 'files', 'seconds'}, with the root's own files under '.'
+        self.top_level = {}
+        # Every directory scanned -> the bytes directly in it (its files, and its subdirectories' own entries)
+        self.dir_bytes = {}
+        # Files with more than one link, which have to stay together to stay hardlinked when copied
+        self.hardlinks = []
+
+    def merge(self, other):
+        """Folds another (partial) scan of the same root into this one"""
+        self.wp_roots.extend(other.wp_roots)
+        self.magento_roots.extend(other.magento_roots)
+        self.db_refs.extend(other.db_refs)
+        self.pruned.extend(other.pruned)
+        self.total_bytes += other.total_bytes
+        self.file_count += other.file_count
+        self.dir_count += other.dir_count
+        self.dir_bytes.update(other.dir_bytes)
+        self.hardlinks.extend(other.hardlinks)
+        for name, stats in other.top_level.items():
+            mine = self.top_level.setdefault(name, {'bytes': 0, 'files': 0, 'seconds': 0.0})
+            for k in mine:
+                mine[k] += stats[k]
+
+    def top_level_report(self):
+        """
+        :return: A printable table of the top level directories, slowest to scan first
+        """
+        lines = ['{0:>10} {1:>10} {2:>16}  {3}'.format('seconds', 'files', 'bytes', 'directory')]
+        for name, stats in sorted(self.top_level.items(), key=lambda item: item[1]['seconds'], reverse=True):
+            lines.append('{0:>10.3f} {1:>10} {2:>16}  {3}'.format(stats['seconds'], stats['files'], stats['bytes'],
+                                                                  name))
+        return '\n'.join(lines)
+
+
+class _Scanner:
+    """The per-directory work of a scan, shared by the single threaded and threaded walks"""
+
+    def __init__(self, root, db_ref_pattern, prune):
+        self.root = root
+        self.db_ref_pattern = db_ref_pattern
+        self.prune = prune or []
+
+    def is_pruned(self, path, name):
+        relative = os.path.relpath(path, self.root)
+        for rule in self.prune:
+            # Rules with a slash are matched against the path from the root, the rest against the directory name
+            if '/' in rule:
+                if fnmatch.fnmatchcase('./' + relative, rule) or fnmatch.fnmatchcase(relative, rule):
+                    return True
+            elif fnmatch.fnmatchcase(name, rule):
+                return True
+        return False
+
+    def top_level_name(self, path):
+        if path == self.root:
+            return '.'
+        return os.path.relpath(path, self.root).split(os.sep, 1)[0]
+
+    def scan_dir(self, path, scan):
+        """
+        Lists one directory, adding what's in it to scan.
+
+        :return: A list of subdirectories still to be scanned
+        """
+        start = time.monotonic()
+        top_level = scan.top_level.setdefault(self.top_level_name(path), {'bytes': 0, 'files': 0, 'seconds': 0.0})
+        scan.dir_count += 1
+
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            scan.dir_bytes[path] = 0
+            return []
+
+        subdirs = []
+        dir_names = set()
+        file_names = set()
+        dir_bytes = 0
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+
+            if is_dir:
+                dir_names.add(entry.name)
+                if entry.is_symlink():
+                    continue
+                if self.is_pruned(entry.path, entry.name):
+                    scan.pruned.append(entry.path)
+                    continue
+                try:
+                    dir_bytes += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    # Gone since the listing, as os.walk would have it
+                    continue
+                subdirs.append(entry.path)
+                continue
+
+            file_names.add(entry.name)
+            top_level['files'] += 1
+            try:
+                stat = entry.stat(follow_symlinks=False)
+            except OSError:
+                stat = None
+
+            if stat is not None:
+                dir_bytes += stat.st_size
+                if stat.st_nlink > 1:
+                    scan.hardlinks.append(entry.path)
+
+            if self.db_ref_pattern is not None and self.db_ref_pattern.search(entry.path):
+                scan.db_refs.append(entry.path)
+
+        if 'app' in dir_names:
+            scan.magento_roots.append(path)
+        if 'wp-config.php' in file_names:
+            scan.wp_roots.append(path)
+
+        scan.file_count += len(file_names)
+        scan.total_bytes += dir_bytes
+        scan.dir_bytes[path] = dir_bytes
+        top_level['bytes'] += dir_bytes
+        top_level['seconds'] += time.monotonic() - start
+
+        return subdirs
+
+
+def scan_site(root, db_ref_pattern=None, prune=None, workers=1, queue_size=1024):
+    """
+    Walks a document root once, noting WordPress and Magento installs, files that might hold database credentials, and
+    how big the whole thing is.  Directories are listed with os.scandir, so each entry's type comes for free and its
+    size costs one lstat.  Like os.walk, symlinked directories are noted but not followed, and directories we can't read
+    are skipped.
+
+    With more than one worker, directories are listed on a pool of threads fed from a bounded queue, which helps a lot
+    when every listing waits on NFS or a seeking disk.  A worker that finds the queue full walks the overflow itself.
+
+    :param root: The directory to scan, probably a site's httpdocs
+    :param db_ref_pattern: A regex (string or compiled) searched for in each file's full path to spot database refs
+    :param prune: A list of fnmatch patterns for directories to skip, against the path from the root if the pattern has
+        a slash (e.g. '*/wp-content/cache'), otherwise against the directory name.  Skipped directories are neither
+        searched nor counted, so the result's total_bytes leaves out whatever is in them, but are listed in its pruned.
+    :param workers: How many threads list directories
+    :param queue_size: How many directories may wait in the queue before workers keep them for themselves
+    :return: A SiteScan, with its lists sorted
+    """
+    if isinstance(db_ref_pattern, str):
+        db_ref_pattern = re.compile(db_ref_pattern)
+
+    scanner = _Scanner(root, db_ref_pattern, prune)
+    scan = SiteScan(root)
+    scan.total_bytes = os.lstat(root).st_size
+
+    if workers <= 1:
+        pending = [root]
+        while pending:
+            pending.extend(scanner.scan_dir(pending.pop(), scan))
+    else:
+        _scan_threaded(scanner, scan, workers, queue_size)
+
+    scan.wp_roots.sort()
+    scan.magento_roots.sort()
+    scan.db_refs.sort()
+    scan.pruned.sort()
+    scan.hardlinks.sort()
+    return scan
+
+
+def _scan_threaded(scanner, scan, workers, queue_size):
+    work = queue.Queue(maxsize=max(queue_size, workers))
+    lock = threading.Lock()
+    # Directories queued or being scanned.  When it drops to zero, everyone can go home.
+    outstanding = [1]
+    partials = []
+    errors = []
+
+    def worker():
+        partial = SiteScan(scan.root)
+        partials.append(partial)
+        while True:
+            path = work.get()
+            if path is None:
+                return
+
+            try:
+                local = [path]
+                while local:
+                    for subdir in scanner.scan_dir(local.pop(), partial):
+                        try:
+                            with lock:
+                                outstanding[0] += 1
+                            work.put_nowait(subdir)
+                        except queue.Full:
+                            with lock:
+                                outstanding[0] -= 1
+                            local.append(subdir)
+            except Exception as e:
+                errors.append(e)
+
+            with lock:
+                outstanding[0] -= 1
+                finished = outstanding[0] == 0
+
+            if finished:
+                for _ in range(workers):
+                    work.put(None)
+
+    work.put(scanner.root)
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    for partial in partials:
+        scan.merge(partial)
@@ -0,0 +1,115 @@
+import argparse
+import os
+import sys
+
+import batch.scheduler
+import migrate_o_matic
+import plesk.index
+import plesk_sync
+import zone.resolver
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='migrate a list of websites, several at a time')
+    parser.add_argument('sites', help='a JSON file of the sites to migrate, each with its migrate_o_matic options')
+    parser.add_argument('--workers', help='how many sites to migrate at once, defaults to 4', type=int, default=4)
+    parser.add_argument('--per-source', help='how many sites may be copied off any one source host at once, defaults '
+                                             'to 4', type=int, default=4)
+    parser.add_argument('--per-destination', help='how many sites may be copied to any one destination at once, '
+                                                  'defaults to 2', type=int, default=2)
+    parser.add_argument('--per-db-host', help='how many sites may use any one database server at once, defaults to 2.  '
+                                              'Source database servers only count when the site gives '
+                                              'source_db_host, not when the migration finds them itself',
+                        type=int, default=2)
+    parser.add_argument('--retries', help='how many more times to try a site that fails, defaults to 1', type=int,
+                        default=1)
+    parser.add_argument('--retry-delay', help='how many seconds to wait before trying a site again, defaults to 60',
+                        type=int, default=60)
+    parser.add_argument('--log-dir', help="where each site's log goes, defaults to ~/.migrate_o_matic/logs",
+                        default=os.path.expanduser('~/.migrate_o_matic/logs'))
+    parser.add_argument('--dns-cache', help='where to keep the DNS answers looked up for the whole batch up front, '
+                                            'for every migration to use, defaults to ~/.migrate_o_matic/dns-cache.json',
+                        default=os.path.expanduser('~/.migrate_o_matic/dns-cache.json'))
+    parser.add_argument('--dns-zone-file', help='answer DNS lookups from this zone file first; may be given more than '
+                                                'once', action='append', default=[])
+    parser.add_argument('--nameserver', help="ask this nameserver, as host, host:port or [IPv6 address]:port, instead "
+                                             "of the system's; may be given more than once", action='append',
+                        default=[])
+    parser.add_argument('--plesk-index', help='sync the source servers into this index up front, and have every '
+                                              'migration answer plesk lookups from it')
+    parser.add_argument('--dns-only', help="just say which sites' DNS we host, and stop", action='store_true')
+    return parser
+
+
+def check_nameservers(jobs, resolver):
+    """
+    Looks up every site's nameservers at once, so the migrations find them in the cache rather than each asking on its
+    own, and says whose DNS we host.
+
+    :return: A dict of site to whether we host its DNS, leaving out the sites that couldn't be looked up
+    """
+    answers, failures = resolver.lookup_many([job.name for job in jobs], 'NS')
+    ours = {site: zone.resolver.served_by(nameservers, migrate_o_matic.OUR_NAMESERVERS)
+            for site, nameservers in answers.items()}
+
+    print('We host DNS for {0} of {1} sites'.format(sum(ours.values()), len(jobs)))
+    for site, error in sorted(failures.items()):
+        print('  could not look up the nameservers for {0}: {1}'.format(site, error))
+    resolver.save()
+    return ours
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    try:
+        jobs = batch.scheduler.load_jobs(args.sites, migrate_o_matic.build_parser())
+    except (OSError, ValueError, KeyError) as e:
+        print('I cannot use that batch file: {0}'.format(e))
+        exit(2)
+
+    limits = batch.scheduler.Limits({'source': max(1, args.per_source),
+                                     'destination': max(1, args.per_destination),
+                                     'db': max(1, args.per_db_host)})
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrate_o_matic.py')]
+
+    try:
+        resolver = zone.resolver.Resolver(nameservers=args.nameserver, cache_path=args.dns_cache)
+    except ValueError as e:
+        print('I cannot use that nameserver: {0}'.format(e))
+        exit(2)
+    for zone_file in args.dns_zone_file:
+        resolver.load_zone_file(zone_file)
+    ours = check_nameservers(jobs, resolver)
+    if args.dns_only:
+        for job in jobs:
+            print('  {0}: {1}'.format(job.name, {True: 'ours', False: 'elsewhere'}.get(ours.get(job.name), 'unknown')))
+        exit(0)
+
+    # Every migration reads the answers we just looked up, and asks the same way for anything else
+    command += ['--dns-cache', args.dns_cache]
+    for nameserver in args.nameserver:
+        command += ['--nameserver', nameserver]
+
+    if args.plesk_index:
+        index = plesk.index.Index(args.plesk_index, verbose=True)
+        try:
+            plesk_sync.sync_hosts(sorted({host for job in jobs for kind, host in job.hosts if kind == 'source'}),
+                                  index)
+        finally:
+            index.close()
+        command += ['--plesk-index', args.plesk_index]
+
+    print('Migrating {0} sites, {1} at a time'.format(len(jobs), args.workers))
+    try:
+        batch.scheduler.run_jobs(jobs, limits, max(1, args.workers), command, args.log_dir, retries=args.retries,
+                                 retry_delay=args.retry_delay)
+    except KeyboardInterrupt:
+        exit(130)
+
+    print(batch.scheduler.report(jobs))
+    exit(0 if all(job.exitcode == 0 for job in jobs) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,84 +1,149 @@
 import argparse
+import asyncio
 import getpass
+import json
 import os
-import re
 import shlex
+import shutil
 import socket
-import subprocess
 import sys
+import tempfile
+import threading
+import time
 
-import dns.resolver
-import pexpect
+import pymysql
 
+import batch.phases
+import batch.scheduler
+import cms.magento
+import cms.slim
 import cms.wordpress
+import database.checkpoint
+import database.engine
+import database.pipe
+import database.scheduler
+import fs.scanner
+import plesk.aioclient
 import plesk.apiclient
+import plesk.index
+import plesk.inventory
+import telemetry.metrics
+import telemetry.tracing
+import transfer.compression
+import transfer.dedup
+import transfer.files
+import transfer.incremental
+import transfer.shell
+import transfer.ssh
+import zone.diff
+import zone.resolver
 
 DOCUMENT_ROOT = '/var/www/vhosts/'
-DATABASE_REFS = 'wp-config.php|etc/local.xml|includes?/(config.xml|connect.php)'
-
-parser = argparse.ArgumentParser(description='migrate a website from one server to another')
-parser.add_argument('site', help='the site to be migrated')
-parser.add_argument('destination', help='where to move the site')
-
-parser.add_argument('-v', '--verbose', help='explain what you are doing', action='store_true')
-parser.add_argument('--no-db', help='skip the database migration', action='store_true')
-parser.add_argument('--freshen', help='site already exists at destination, just freshen contents', action='store_true')
-parser.add_argument('-sdn', '--source-db-name', help='what the database is currently named')
-parser.add_argument('-ddn', '--dest-db-name', help='what the database should be named, defaults to source-db-name')
-parser.add_argument('-sdu', '--source-db-user',
-                    help='what user currently uses the database, defaults to source-db-name')
-parser.add_argument('-ddu', '--dest-db-user', help='what user will use the database, defaults to dest-db-name')
-parser.add_argument('-sdp', '--source-db-pass', nargs='?',
-                    help='what the password for the user currently is, defaults to prompt', const='prompt')
-parser.add_argument('-ddp', '--dest-db-pass', nargs='?',
-                    help='what the password for the user should be, defaults to source-db-pass', const='prompt')
-parser.add_argument('-sdh', '--source-db-host', help='where the database currently resides')
-parser.add_argument('-ddh', '--dest-db-host', help='where the database should go', default='aws-db1.cluster-czcqe9ojhauq.us-east-1.rds.amazonaws.com')
-parser.add_argument('-dsu', '--dest-sftp-user', help='the username for the customer SFTP account')
-parser.add_argument('-dsp', '--dest-sftp-pass', help='the password for the customer SFTP account', nargs='?', const='prompt')
-parser.add_argument('-dss', '--dest-sftp-site', help='the site name on the destination server, if different')
-
-parser.add_argument('--no-plesk', help="don't try to mess with plesk", action='store_true')
-parser.add_argument('-sph', '--source-plesk-host', help='the hostname of the source plesk instance, defaults to the current host', default=socket.gethostname())
-parser.add_argument('-spu', '--source-plesk-user', help='the username of the source plesk instance, defaults to admin', default='admin')
-parser.add_argument('-spp', '--source-plesk-pass', help='the password of the source plesk instance, defaults to prompt', nargs='?', const='prompt')
-parser.add_argument('-dph', '--dest-plesk-host', help='the hostname of the destination plesk instance')
-parser.add_argument('-dpu', '--dest-plesk-user', help='the username of the destination plesk instance, defaults to admin', default='admin')
-parser.add_argument('-dpp', '--dest-plesk-pass', help='the password of the destination plesk instance, defaults to prompt', nargs='?', const='prompt')
-parser.add_argument('-dpi', '--dest-plesk-ip', help='the ip address of the destination plesk instance')
-parser.add_argument('-ec', '--existing-customer', help='the login id of the customer to append to')
-parser.add_argument('-nc', '--new-customer', help='the name of the customer as it should appear in plesk')
-
-args = parser.parse_args()
-
-if args.dest_sftp_site is None:
-    args.dest_sftp_site = args.site
-
-# Shorthands for me
-
-site_httpdocs = DOCUMENT_ROOT + args.site + '/httpdocs'
-dest_httpdocs = DOCUMENT_ROOT + args.dest_sftp_site + '/httpdocs'
-
-# Before we get too far, let's make sure we didn't fat finger the site name...
-
-if not os.path.isdir(site_httpdocs):
-    print('I cannot find that site.  Make sure you typed it correctly.')
-    exit(1)
-
-def step_placeholder(action):
-    print('Did you {0}?'.format(action))
-    input('Press enter when done.')
-
-
-def get_folder_size(folder):
-    total_size = os.path.getsize(folder)
-    for item in os.listdir(folder):
-        itempath = os.path.join(folder, item)
-        if os.path.isfile(itempath):
-            total_size += os.path.getsize(itempath)
-        elif os.path.isdir(itempath):
-            total_size += get_folder_size(itempath)
-    return total_size
+DATABASE_REFS = '(wp-config.php|etc/local.xml|etc/env.php|includes?/(config.xml|connect.php))$'
+# Sites whose nameservers are under here have their DNS hosted by us
+OUR_NAMESERVERS = 'firstscribe.com'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='migrate a website from one server to another')
+    parser.add_argument('site', help='the site to be migrated')
+    parser.add_argument('destination', help='where to move the site')
+
+    parser.add_argument('-v', '--verbose', help='explain what you are doing', action='store_true')
+    parser.add_argument('--no-db', help='skip the database migration', action='store_true')
+    parser.add_argument('--freshen', help='site already exists at destination, just freshen contents',
+                        action='store_true')
+    parser.add_argument('--incremental', help='only send what is missing or changed on the destination, keeping '
+                                              'manifests so an interrupted copy picks up where it stopped',
+                        action='store_true')
+    parser.add_argument('--dedup-store', help='keep WordPress core, plugin and theme files in a store at this path on '
+                                              'the destination, and put any it already has in place from there '
+                                              'instead of sending them; implies --incremental')
+    parser.add_argument('--dedup-link', help='hardlink files out of the dedup store instead of copying them',
+                        action='store_true')
+    parser.add_argument('--state-dir', help='where incremental copies keep their manifests and database copies their '
+                                            'checkpoints, defaults to ~/.migrate_o_matic',
+                        default=os.path.expanduser('~/.migrate_o_matic'))
+    parser.add_argument('--streams', help='how many tar streams copy the site at once, or auto for one per two cores, '
+                                          'defaults to 1', default='1')
+    parser.add_argument('--codec', help='how to compress the database and site streams: none, lz4, zstd, xz, '
+                                        'optionally with a level (zstd:6), or auto to measure and pick; defaults to xz')
+    parser.add_argument('--codec-threads', help='how many threads zstd and xz may use, defaults to one per core',
+                        type=int, default=0)
+    parser.add_argument('--scan-workers', help='how many threads list directories while scanning the site, defaults '
+                                               'to 8', type=int, default=8)
+    parser.add_argument('--scan-prune', help='skip directories matching this pattern while scanning the site, may be '
+                                             'repeated', action='append', default=[])
+    parser.add_argument('--scan-prune-common', help='skip the usual cache and backup directories while scanning the '
+                                                    'site', action='store_true')
+    parser.add_argument('-sdn', '--source-db-name', help='what the database is currently named')
+    parser.add_argument('-ddn', '--dest-db-name', help='what the database should be named, defaults to source-db-name')
+    parser.add_argument('-sdu', '--source-db-user',
+                        help='what user currently uses the database, defaults to source-db-name')
+    parser.add_argument('-ddu', '--dest-db-user', help='what user will use the database, defaults to dest-db-name')
+    parser.add_argument('-sdp', '--source-db-pass', nargs='?',
+                        help='what the password for the user currently is, defaults to prompt', const='prompt')
+    parser.add_argument('-ddp', '--dest-db-pass', nargs='?',
+                        help='what the password for the user should be, defaults to source-db-pass', const='prompt')
+    parser.add_argument('-sdh', '--source-db-host', help='where the database currently resides')
+    parser.add_argument('-ddh', '--dest-db-host', help='where the database should go', default='aws-db1.cluster-czcqe9ojhauq.us-east-1.rds.amazonaws.com')
+    parser.add_argument('--db-engine', help='copy the database with a mysqldump pipe, or natively with pymysql, '
+                                            'defaults to pipe', choices=['pipe', 'native'], default='pipe')
+    parser.add_argument('--db-direct', help='connect the native engine straight to the destination database instead of '
+                                            'through an ssh tunnel to the destination', action='store_true')
+    parser.add_argument('--db-restart', help='start the database copy over, instead of picking up where the last one '
+                                             'stopped', action='store_true')
+    parser.add_argument('--db-workers', help='how many tables to copy at once, biggest first, defaults to 1', type=int,
+                        default=1)
+    parser.add_argument('--db-per-table', help='dump each table on its own with the pipe engine, so --db-workers can '
+                                               'copy them at once, though tables written to meanwhile may not agree '
+                                               'with each other.  Defaults to one dump of every table',
+                        action='store_true')
+    parser.add_argument('--db-slim', help="leave behind what a WordPress or Magento site's database can do without: "
+                                          "'disposable' leaves out caches, logs, sessions and expired transients, and "
+                                          "'regenerable' indexes that get rebuilt as well.  Defaults to off",
+                        choices=cms.slim.LEVELS, default='off')
+    parser.add_argument('-dsu', '--dest-sftp-user', help='the username for the customer SFTP account')
+    parser.add_argument('-dsp', '--dest-sftp-pass', help='the password for the customer SFTP account', nargs='?', const='prompt')
+    parser.add_argument('-dss', '--dest-sftp-site', help='the site name on the destination server, if different')
+
+    parser.add_argument('--no-plesk', help="don't try to mess with plesk", action='store_true')
+    parser.add_argument('-sph', '--source-plesk-host', help='the hostname of the source plesk instance, defaults to the current host', default=socket.gethostname())
+    parser.add_argument('-spu', '--source-plesk-user', help='the username of the source plesk instance, defaults to admin', default='admin')
+    parser.add_argument('-spp', '--source-plesk-pass', help='the password of the source plesk instance, defaults to prompt', nargs='?', const='prompt')
+    parser.add_argument('-dph', '--dest-plesk-host', help='the hostname of the destination plesk instance')
+    parser.add_argument('-dpu', '--dest-plesk-user', help='the username of the destination plesk instance, defaults to admin', default='admin')
+    parser.add_argument('-dpp', '--dest-plesk-pass', help='the password of the destination plesk instance, defaults to prompt', nargs='?', const='prompt')
+    parser.add_argument('-dpi', '--dest-plesk-ip', help='the ip address of the destination plesk instance')
+    parser.add_argument('-ec', '--existing-customer', help='the login id of the customer to append to')
+    parser.add_argument('-nc', '--new-customer', help='the name of the customer as it should appear in plesk')
+    parser.add_argument('--inventory-cache', help='keep looked up plesk credentials, encrypted, in this file between '
+                                                  'runs')
+    parser.add_argument('--plesk-index', help='answer plesk lookups from this index, as plesk_sync.py keeps it, '
+                                              'rather than asking the servers every time')
+    parser.add_argument('--metrics-dir', help='where to keep the progress events and summary of each run, defaults '
+                                              'to ~/.migrate_o_matic/metrics',
+                        default=os.path.expanduser('~/.migrate_o_matic/metrics'))
+    parser.add_argument('--dns-cache', help='keep DNS answers in this file between runs, for as long as their TTL '
+                                            'allows')
+    parser.add_argument('--dns-zone-file', help='answer DNS lookups from this zone file first; may be given more than '
+                                                'once', action='append', default=[])
+    parser.add_argument('--nameserver', help="ask this nameserver, as host, host:port or [IPv6 address]:port, instead "
+                                             "of the system's; may be given more than once", action='append')
+    parser.add_argument('--profile', help='rank the slowest plesk, inventory and DNS calls at the end, and write them '
+                                          'and the phases out as a trace for chrome://tracing in the metrics dir',
+                        action='store_true')
+    parser.add_argument('--no-ssh-master', help='have every step make its own ssh connection to the destination, '
+                                                'rather than sharing one for the whole run', action='store_true')
+    parser.add_argument('--serial', help='run the steps one at a time, rather than copying the database and the '
+                                         'files and setting up plesk all at once', action='store_true')
+    parser.add_argument('--unattended', help="don't stop to ask anything: steps needing a person are listed at the "
+                                             'end, questions get their default answer, and passwords have to be given',
+                        action='store_true')
+    parser.add_argument('--progress-file', help='note in this file how far the migration gets, so a batch can tell how '
+                                                'to try it again')
+
+    return parser
 
 
 def query_yes_no(question, default="yes"):  # http://code.activestate.com/recipes/577058/
@@ -118,394 +183,871 @@ def query_yes_no(question, default="yes"):  # http://code.activestate.com/recipe
                              "(or 'y' or 'n').\n")
 
 
-if not args.no_db:
-
-    possible_db_refs = []
-    wp_roots = []
-    magento_roots = []
-
-    # Let's try to find a database references...
-
-    db_ref_regexr = re.compile(DATABASE_REFS)
-
-    if args.verbose:
-        print('Looking for magento/wordpress installs...')
-
-    for root, dirs, files in os.walk(site_httpdocs):
-        if 'app' in dirs:
-            magento_roots.append(root)
-        if 'wp-config.php' in files:
-            wp_roots.append(root)
-
-        # Although inefficient, build full paths so we can search for patterns with paths
-        for name in files:
-            full_path = os.path.join(root, name)
-            if db_ref_regexr.search(full_path):
-                possible_db_refs.append(full_path)
+class Migration:
+    """
+    One site's move from this server to another, step by step.  Each step reads the arguments, and what the steps
+    before it found out, from the instance.
+    """
 
-    if any((args.source_db_name, args.source_db_pass, args.source_db_host)):
-        # They tried to define database parameters.  Let's see if they got it right
-        if not all((args.source_db_name, args.source_db_pass, args.source_db_host)):
-            print('If specifying database parameters, I need at a minimum -sdn, -sdp, and -sdh.')
+    def __init__(self, args):
+        self.args = args
+
+        if args.dest_sftp_site is None:
+            args.dest_sftp_site = args.site
+
+        # The store works file by file, which only the incremental copy does
+        if args.dedup_store:
+            args.incremental = True
+
+        # Shorthands for me
+        self.site_httpdocs = DOCUMENT_ROOT + args.site + '/httpdocs'
+        self.dest_httpdocs = DOCUMENT_ROOT + args.dest_sftp_site + '/httpdocs'
+
+        # Everything we run on the destination goes through here, and the master connection once it's up
+        self.ssh_target = '{0}@{1}'.format(args.dest_sftp_user, args.destination)
+        self.ssh = 'ssh'
+        self.remote = 'ssh {0} "{{0}}"'.format(self.ssh_target)
+        self.ssh_password = None
+        self.ssh_master = None
+        self.link_speed = None
+
+        self.site_scan = None
+        self.possible_db_refs = []
+        self.wp_roots = []
+        self.magento_roots = []
+        self.magento_installs = []
+        # The WordPress and Magento installs using the database being copied
+        self.installs = []
+        # Directories, relative to httpdocs, whose contents aren't worth copying
+        self.skip_dirs = []
+
+        self.source_plesk = None
+        self.destination_plesk = None
+        self.loop = None
+        self.customer_id = None
+        self.source_lookup = None
+        self.ns_lookup = None
+        self.dest_site_id = None
+        self.protected_dirs = []
+
+        # Bytes through every stream, for charting how fast migrations go
+        metrics_prefix = os.path.join(args.metrics_dir, '{0}-{1}'.format(args.site, args.destination))
+        self.metrics_summary = metrics_prefix + '.summary.json'
+        self.trace_path = metrics_prefix + '.trace.json'
+        self.meter = telemetry.metrics.Meter(metrics_prefix + '.jsonl', labels={
+            'site': args.site, 'source': args.source_plesk_host, 'destination': args.destination})
+
+        # A batch may well have looked our nameservers up already
+        try:
+            self.resolver = zone.resolver.Resolver(nameservers=args.nameserver, cache_path=args.dns_cache,
+                                                   verbose=args.verbose)
+        except ValueError as e:
+            print('I cannot use that nameserver: {0}'.format(e))
             exit(2)
-    else:  # Try to autodetect
-
-        if (len(possible_db_refs) > 1):
-            print('I see possible database references in:')
-            for item in possible_db_refs:
-                print(item)
-            print('This setup is too rich for my blood.  Try again manually specifying -sdn, -sdp, and -sdh.')
+        for zone_file in args.dns_zone_file:
+            self.resolver.load_zone_file(zone_file)
+
+        # What unattended runs left for a person to do
+        self.todo = []
+
+        # Phases run side by side, but only one of them gets to ask the operator anything at a time
+        self.prompt_lock = threading.RLock()
+        self.progress_lock = threading.Lock()
+
+    def step_placeholder(self, action):
+        if self.args.unattended:
+            print('To do: {0}'.format(action))
+            self.todo.append(action)
+            return
+        with self.prompt_lock:
+            print('Did you {0}?'.format(action))
+            input('Press enter when done.')
+
+    def note_progress(self, step, **facts):
+        """
+        Notes in --progress-file that the migration has got as far as step, along with anything a second try needs to
+        know about it, as batch.scheduler.retry_argv() reads them.
+        """
+        path = self.args.progress_file
+        if not path:
+            return
+        with self.progress_lock:
+            progress = batch.scheduler.read_progress(path)
+            if step not in progress.setdefault('reached', []):
+                progress['reached'].append(step)
+            progress.update(facts)
+            temp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+            with open(temp_path, 'w') as progress_fh:
+                json.dump(progress, progress_fh)
+            os.replace(temp_path, path)
+
+    def query_yes_no(self, question, default='yes'):
+        if self.args.unattended:
+            print('{0} Going with {1}, as unattended was defined.'.format(question, default))
+            return default == 'yes'
+        with self.prompt_lock:
+            return query_yes_no(question, default=default)
+
+    def getpass(self, prompt):
+        if self.args.unattended:
+            print('I need a password nobody gave me, and unattended was defined: {0}'.format(prompt))
             exit(2)
+        with self.prompt_lock:
+            return getpass.getpass(prompt=prompt)
 
-        if (len(possible_db_refs) == 1) and (len(wp_roots) == 1):
-            # Sweet!  Single wordpress install.  I can handle this.
-            wp_install = cms.wordpress.Instance(wp_roots[0])
-
-            args.source_db_host = wp_install.host
-            args.source_db_name = wp_install.name
-            args.source_db_pass = wp_install.password
-            args.source_db_user = wp_install.user
-
-        if len(possible_db_refs) == 0:
-            print('I did not see any possible database references.  Assuming --no-db, but you should probably check.')
-            args.no_db = True
-
-    # Populate the rest of the arguments
-
-    if args.dest_db_name is None:
-        args.dest_db_name = args.source_db_name
-    if args.source_db_user is None:
-        args.source_db_user = args.source_db_name
-    if args.dest_db_user is None:
-        args.dest_db_user = args.source_db_user
-    if args.source_db_pass is 'prompt':
-        args.source_db_pass = getpass.getpass(prompt='Please enter the source database password: ')
-    if args.dest_db_pass is None:
-        args.dest_db_pass = args.source_db_pass
-    elif args.dest_db_pass is 'prompt':
-        args.dest_db_pass = getpass.getpass(prompt='Please enter the destination database password: ')
-
-if args.dest_sftp_pass is 'prompt':
-    args.dest_sftp_pass = getpass.getpass(prompt='Please enter the password for the customer SFTP account: ')
-
-# Create new customer/domains on plesk
-
-if not args.no_plesk:
-    if not args.dest_plesk_host:
-        args.dest_plesk_host = args.destination
-
-    # Create the objects first
-
-    # If the source system is in trustwave, make the outgoing port 8333 because their firewalls are silly.  Assumes
-    #   iptables on the receiving end is redirecting 8333 to 8443, which should be set up on aws-web[1-3].
-    if args.source_plesk_host in ['web3.firstscribe.com', 'web4.firstscribe.com']:
-        dest_port = 8333
-    else:
-        dest_port = 8443
-
-    source_plesk = plesk.apiclient.Client(args.source_plesk_host, verbose=args.verbose)
-    destination_plesk = plesk.apiclient.Client(args.dest_plesk_host, port=dest_port, verbose=args.verbose)
-
-    # Let's autofill as much information as we can.
-
-    source_plesk.lookup_plesk_info()
-    destination_plesk.lookup_plesk_info()
-
-    if args.source_plesk_pass is 'prompt':
-        args.source_plesk_pass = getpass.getpass(
-            prompt="Please enter the password for {0}'s {1} account: ".format(args.source_plesk_host,
-                                                                              args.source_plesk_user))
-        source_plesk.set_credentials(args.source_plesk_user, args.source_plesk_pass)
-
-    if args.dest_plesk_pass is 'prompt':
-        args.dest_plesk_pass = getpass.getpass(
-            prompt="Please enter the password for {0}'s {1} account: ".format(args.dest_plesk_host,
-                                                                              args.dest_plesk_user))
-        destination_plesk.set_credentials(args.dest_plesk_user, args.dest_plesk_pass)
-
-    if args.dest_plesk_ip:
-        destination_plesk.internal_ip = args.dest_plesk_ip
+    def check_site(self):
+        # Before we get too far, let's make sure we didn't fat finger the site name...
+        if not os.path.isdir(self.site_httpdocs):
+            print('I cannot find that site.  Make sure you typed it correctly.')
+            exit(1)
 
-    if not (all((source_plesk.host, source_plesk.login, source_plesk.password, destination_plesk.host,
-                 destination_plesk.login, destination_plesk.password, destination_plesk.internal_ip)) or not any(
-            (args.new_customer, args.existing_customer))):
-        print(
-            'If I am to modify plesk, I will need the host, user, and password for both instances as well as a customer name')
-        exit(1)
+    def scan_site(self):
+        """One pass over the site tells us about any installs and database references, and how much there is to copy"""
+        args = self.args
+        if args.no_db and args.freshen:
+            return
+
+        if args.verbose:
+            print('Looking for magento/wordpress installs...')
+
+        scan_prune = list(args.scan_prune)
+        if args.scan_prune_common:
+            scan_prune.extend(fs.scanner.COMMON_PRUNE)
+
+        self.site_scan = fs.scanner.scan_site(self.site_httpdocs, DATABASE_REFS, prune=scan_prune,
+                                              workers=args.scan_workers)
+
+        if args.verbose:
+            print('Found {0} files in {1} directories, {2} bytes in all'.format(
+                self.site_scan.file_count, self.site_scan.dir_count, self.site_scan.total_bytes))
+            for pruned in self.site_scan.pruned:
+                print('Skipped {0}'.format(pruned))
+            print(self.site_scan.top_level_report())
+
+        for root in self.site_scan.magento_roots:
+            if cms.magento.config_path(root) is None:
+                continue
+            try:
+                self.magento_installs.append(cms.magento.Instance(root))
+            except ValueError as e:
+                print('I cannot read the magento configuration: {0}'.format(e))
+        for install in self.magento_installs:
+            self.skip_dirs.extend(os.path.relpath(path, self.site_httpdocs) for path in install.skip_dirs())
+        if self.skip_dirs:
+            print('Leaving out what is in {0}, magento makes it again'.format(', '.join(self.skip_dirs)))
+
+    def find_installs(self):
+        """:return: The WordPress and Magento installs whose configuration is one of the database references"""
+        installs = []
+        for root in self.wp_roots:
+            if os.path.join(root, 'wp-config.php') not in self.possible_db_refs:
+                continue
+            try:
+                installs.append(cms.wordpress.Instance(root))
+            except KeyError as e:
+                print('I cannot find {0} in {1}/wp-config.php'.format(e, root))
+        installs.extend(install for install in self.magento_installs if install.config_path in self.possible_db_refs)
+        return installs
+
+    def find_database(self):
+        args = self.args
+        if args.no_db:
+            return
+
+        # Let's try to find a database references...
+
+        self.possible_db_refs = self.site_scan.db_refs
+        self.wp_roots = self.site_scan.wp_roots
+        self.magento_roots = self.site_scan.magento_roots
+        installs = self.find_installs()
+
+        if any((args.source_db_name, args.source_db_pass, args.source_db_host)):
+            # They tried to define database parameters.  Let's see if they got it right
+            if not all((args.source_db_name, args.source_db_pass, args.source_db_host)):
+                print('If specifying database parameters, I need at a minimum -sdn, -sdp, and -sdh.')
+                exit(2)
+        else:  # Try to autodetect
+
+            # Any number of installs will do, so long as they all use the same database
+            unknown_refs = set(self.possible_db_refs) - {install.config_path for install in installs}
+            databases = {(install.host, install.name) for install in installs}
+            if len(self.possible_db_refs) > 1 and (unknown_refs or len(databases) > 1):
+                print('I see possible database references in:')
+                for item in self.possible_db_refs:
+                    print(item)
+                print('This setup is too rich for my blood.  Try again manually specifying -sdn, -sdp, and -sdh.')
+                exit(2)
+
+            if installs:
+                # Sweet!  One database, however many wordpress and magento installs use it.  I can handle this.
+                args.source_db_host = installs[0].host
+                args.source_db_name = installs[0].name
+                args.source_db_pass = installs[0].password
+                args.source_db_user = installs[0].user
+
+            if len(self.possible_db_refs) == 0:
+                print('I did not see any possible database references.  Assuming --no-db, but you should probably '
+                      'check.')
+                args.no_db = True
+
+        # Populate the rest of the arguments
+
+        if args.dest_db_name is None:
+            args.dest_db_name = args.source_db_name
+        if args.source_db_user is None:
+            args.source_db_user = args.source_db_name
+        if args.dest_db_user is None:
+            args.dest_db_user = args.source_db_user
+        if args.source_db_pass is 'prompt':
+            args.source_db_pass = self.getpass('Please enter the source database password: ')
+        if args.dest_db_pass is None:
+            args.dest_db_pass = args.source_db_pass
+        elif args.dest_db_pass is 'prompt':
+            args.dest_db_pass = self.getpass('Please enter the destination database password: ')
+
+        self.installs = [install for install in installs if install.name == args.source_db_name]
+
+    def ask_sftp_password(self):
+        if self.args.dest_sftp_pass is 'prompt':
+            self.args.dest_sftp_pass = self.getpass('Please enter the password for the customer SFTP account: ')
+        self.ssh_password = self.args.dest_sftp_pass
+
+    def connect(self):
+        """Log in to the destination once, for everything after to go through"""
+        args = self.args
+        if args.no_ssh_master:
+            return
+
+        if args.verbose:
+            print('Connecting to {0}'.format(self.ssh_target))
+        ssh_master = transfer.ssh.Master(self.ssh_target, password=self.ssh_password, verbose=args.verbose)
+        try:
+            ssh_master.open()
+        except OSError as e:
+            print('{0}, so every step will log in on its own'.format(e))
+            return
+
+        self.ssh_master = ssh_master
+        self.ssh = ssh_master.ssh()
+        self.remote = ssh_master.remote()
+        self.ssh_password = None
+
+        # The file streams and the mysqldump pipes all go through the master at once, and mustn't go past MaxSessions.
+        #   The native engine's connections are forwarded, which sshd doesn't count as sessions.
+        streams = transfer.files.stream_count(args.streams)
+        db_sessions = args.db_workers if args.db_engine == 'pipe' and not args.no_db else 0
+        shared_streams, shared_db_sessions = ssh_master.share(streams, db_sessions)
+        if (shared_streams, shared_db_sessions) != (streams, db_sessions):
+            print('{0} file streams and {1} database workers would be too many sessions for one ssh connection, using '
+                  '{2} and {3}'.format(streams, db_sessions, shared_streams, shared_db_sessions))
+            args.streams = shared_streams
+            if db_sessions:
+                args.db_workers = shared_db_sessions
+
+    def pick_codec(self, default, sample_proc):
+        """
+        Works out which codec a pipeline should use: the one asked for, or the pipeline's usual one if none was asked
+        for.  If asked to pick automatically, tries the link (once) and a sample of the data.
+
+        :param default: The codec spec to use if none was given
+        :param sample_proc: A pipeline producing the start of the stream, for sizing things up
+        :return: A transfer.compression.Codec
+        """
+        args = self.args
+
+        if args.codec is None:
+            return transfer.compression.get_codec(default, args.codec_threads)
+        if args.codec != 'auto':
+            return transfer.compression.get_codec(args.codec, args.codec_threads)
+
+        if self.link_speed is None:
+            print('Measuring the link... ', end='')
+            self.link_speed = transfer.compression.measure_link(self.remote, password=self.ssh_password) or 0
+            print('{0:.1f} MB/s'.format(self.link_speed / 1e6))
+        if not self.link_speed:
+            print('Could not measure the link, sticking with {0}'.format(default))
+            return transfer.compression.get_codec(default, args.codec_threads)
+
+        codec = transfer.compression.choose_codec(sample_proc, self.link_speed, threads=args.codec_threads,
+                                                  verbose=args.verbose)
+        print('Compressing with {0}'.format(codec))
+        return codec
+
+    def create_site(self):
+        """Create new customer/domains on plesk"""
+        args = self.args
+        if args.no_plesk:
+            self.step_placeholder('make the new customer in plesk - use bash as shell')
+            return
+
+        if not args.dest_plesk_host:
+            args.dest_plesk_host = args.destination
+
+        # Create the objects first
+
+        # If the source system is in trustwave, make the outgoing port 8333 because their firewalls are silly.  Assumes
+        #   iptables on the receiving end is redirecting 8333 to 8443, which should be set up on aws-web[1-3].
+        if args.source_plesk_host in ['web3.firstscribe.com', 'web4.firstscribe.com']:
+            dest_port = 8333
+        else:
+            dest_port = 8443
+
+        plesk_index = plesk.index.Index(args.plesk_index) if args.plesk_index else None
+        source_plesk = plesk.aioclient.AsyncClient(args.source_plesk_host, verbose=args.verbose, index=plesk_index)
+        destination_plesk = plesk.aioclient.AsyncClient(args.dest_plesk_host, port=dest_port, verbose=args.verbose,
+                                                        index=plesk_index)
+        self.source_plesk = source_plesk
+        self.destination_plesk = destination_plesk
+
+        # Both clients are asynchronous, so anything that doesn't depend on the other server can go on at the same time.
+        #   The loop gets a thread of its own, since the phases using it each run on theirs.
+        self.loop = loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        run = self.run_async
+
+        # Let's autofill as much information as we can.  Both servers come out of the inventory in one query.
+
+        plesk.inventory.default_inventory.verbose = args.verbose
+        plesk.inventory.default_inventory.cache_path = args.inventory_cache
+        plesk.inventory.default_inventory.lookup([args.source_plesk_host, args.dest_plesk_host])
+
+        async def lookup_plesk_info():
+            return await asyncio.gather(source_plesk.lookup_plesk_info(), destination_plesk.lookup_plesk_info())
+
+        run(lookup_plesk_info())
+
+        if args.source_plesk_pass is 'prompt':
+            args.source_plesk_pass = self.getpass("Please enter the password for {0}'s {1} account: ".format(
+                args.source_plesk_host, args.source_plesk_user))
+            source_plesk.set_credentials(args.source_plesk_user, args.source_plesk_pass)
+
+        if args.dest_plesk_pass is 'prompt':
+            args.dest_plesk_pass = self.getpass("Please enter the password for {0}'s {1} account: ".format(
+                args.dest_plesk_host, args.dest_plesk_user))
+            destination_plesk.set_credentials(args.dest_plesk_user, args.dest_plesk_pass)
+
+        if args.dest_plesk_ip:
+            destination_plesk.internal_ip = args.dest_plesk_ip
+
+        if not (all((source_plesk.host, source_plesk.login, source_plesk.password, destination_plesk.host,
+                     destination_plesk.login, destination_plesk.password, destination_plesk.internal_ip)) or not any(
+                (args.new_customer, args.existing_customer))):
+            print('If I am to modify plesk, I will need the host, user, and password for both instances as well as a '
+                  'customer name')
+            exit(1)
 
+        async def lookup_source():
+            # Ask the source everything read-only we'll need in two packets, the second needing the site ID from the
+            # first
+            source_lookups = source_plesk.batch()
+            source_lookups.get_site_id(args.site)
+            source_lookups.get_ssl_certs(args.site)
+            source_lookups.get_dns_template()
+            source_site_id, ssl_certs, template = await source_lookups.execute()
 
+            source_lookups.get_dns_records(source_site_id)
+            source_lookups.get_protected_dirs(source_site_id)
+            records, protected_dirs = await source_lookups.execute()
 
-    print('Creating customer... ', end='')
-    if args.existing_customer:
-        customer_id = destination_plesk.get_customer_id(args.existing_customer)[0]
-    else:
-        customer_id = destination_plesk.add_customer(args.new_customer)
-    if customer_id:
-        print('OK')
-    else:
-        print('')
-        print('Failed to create customer!')
-        exit(1)
+            return source_site_id, ssl_certs, template, records, protected_dirs
 
-    print('Creating site... ', end='')
+        async def lookup_ns():
+            return await loop.run_in_executor(None, self.resolver.lookup, args.site, 'NS')
 
-    if args.freshen:
-        get_site_result = destination_plesk.get_site_id(args.site)
-        if get_site_result:
-            dest_site_id = get_site_result
-        shell_result = destination_plesk.set_webspace({'shell': '/bin/bash'}, dest_site_id)
+        # None of this depends on the destination, so let it go on while we set the destination up
+        self.source_lookup = asyncio.run_coroutine_threadsafe(lookup_source(), loop)
+        self.ns_lookup = asyncio.run_coroutine_threadsafe(lookup_ns(), loop)
 
-        if shell_result[0] == 'ok':
-            print('OK')
+        print('Creating customer... ', end='')
+        if args.existing_customer:
+            # The site will be made for it, so it had better be the customer that's there now
+            customer_id = run(destination_plesk.get_customer_id(args.existing_customer, fresh=True))[0]
         else:
-            print('')
-            print('Failed to switch the shell back.  Take a look.')
-            print('{0}: {1}'.format(shell_result[0], shell_result[1]))
-            exit(1)
-    else:
-        webspace_result = destination_plesk.add_webspace({'name': args.site, 'owner-id': customer_id}, 'vrt_hst',
-                                                         {'ftp_login': args.dest_sftp_user,
-                                                          'ftp_password': args.dest_sftp_pass, 'shell': '/bin/bash'},
-                                                         destination_plesk.internal_ip, 'Default Domain')
-
-        if webspace_result[0] == 'ok':
+            customer_id = run(destination_plesk.add_customer(args.new_customer))
+        if customer_id:
+            self.customer_id = customer_id
+            self.note_progress('customer', customer=args.existing_customer or
+                               plesk.apiclient.customer_login(args.new_customer))
             print('OK')
-            dest_site_id = webspace_result[1]
         else:
             print('')
-            print('Failed to create site!')
-            print('{0}: {1}'.format(webspace_result[0], webspace_result[1]))
+            print('Failed to create customer!')
             exit(1)
 
-    source_site_id = source_plesk.get_site_id(args.site)
-
-    # Copy SSL certs if any
-    ssl_certs = source_plesk.get_ssl_certs(args.site)
-
-    if not ssl_certs:
-        step_placeholder('Something went wrong while getting certificates.  Please look manually.')
-    else:
-        if len(ssl_certs) > 1:
-            step_placeholder('copy the SSL certificates')
+        print('Creating site... ', end='')
+
+        if args.freshen:
+            # We're about to change it, so it had better be the site that's there now
+            get_site_result = run(destination_plesk.get_site_id(args.site, fresh=True))
+            if get_site_result:
+                self.dest_site_id = get_site_result
+            shell_result = run(destination_plesk.set_webspace({'shell': '/bin/bash'}, self.dest_site_id))
+
+            if shell_result[0] == 'ok':
+                self.note_progress('site')
+                print('OK')
+            else:
+                print('')
+                print('Failed to switch the shell back.  Take a look.')
+                print('{0}: {1}'.format(shell_result[0], shell_result[1]))
+                exit(1)
+        else:
+            webspace_result = run(destination_plesk.add_webspace({'name': args.site, 'owner-id': customer_id},
+                                                                 'vrt_hst',
+                                                                 {'ftp_login': args.dest_sftp_user,
+                                                                  'ftp_password': args.dest_sftp_pass,
+                                                                  'shell': '/bin/bash'},
+                                                                 destination_plesk.internal_ip, 'Default Domain'))
+
+            if webspace_result[0] == 'ok':
+                print('OK')
+                self.dest_site_id = webspace_result[1]
+                self.note_progress('site')
+            else:
+                print('')
+                print('Failed to create site!')
+                print('{0}: {1}'.format(webspace_result[0], webspace_result[1]))
+                exit(1)
+
+    def run_async(self, coroutine):
+        """
+        Runs a coroutine on the Plesk clients' loop, from whichever phase's thread we're on.
+
+        :return: What the coroutine returned
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def configure_plesk(self):
+        """Copy the SSL and DNS settings over to the new site"""
+        args = self.args
+        if args.no_plesk:
+            self.step_placeholder('copy the SSL certificates')
+            self.step_placeholder('update new DNS if on plesk')
+            return
+
+        source_plesk = self.source_plesk
+        destination_plesk = self.destination_plesk
+        run = self.run_async
+        customer_id = self.customer_id
+        dest_site_id = self.dest_site_id
+        source_site_id, ssl_certs, template, records, self.protected_dirs = self.source_lookup.result()
+
+        # Copy SSL certs if any
+        if not ssl_certs:
+            self.step_placeholder('Something went wrong while getting certificates.  Please look manually.')
         else:
-            print('I did not detect any certificates.  Disabling SSL.')
-            destination_plesk.set_webspace({'ssl': 'false'}, dest_site_id)
+            if len(ssl_certs) > 1:
+                self.step_placeholder('copy the SSL certificates')
+            else:
+                print('I did not detect any certificates.  Disabling SSL.')
+                run(destination_plesk.set_webspace({'ssl': 'false'}, dest_site_id))
 
-    # Let's see if we host DNS
+        # Let's see if we host DNS
 
-    answers = dns.resolver.query(args.site, 'NS')
-    our_dns = False
-    for rdata in answers:
-        if 'firstscribe.com' in str(rdata.target).lower():
-            our_dns = True
+        our_dns = zone.resolver.served_by(self.ns_lookup.result(), OUR_NAMESERVERS)
 
-    if our_dns:
-        destination_plesk.set_dns(customer_id, 'enable')
+        if our_dns:
+            run(destination_plesk.set_dns(customer_id, 'enable'))
 
-        # Plesk, to my knowledge, doesn't provide the ability to get non-default DNS records.  So, I compare them...
-        records = source_plesk.get_dns_records(source_site_id)
-        template = source_plesk.get_dns_template()
+            # Plesk, to my knowledge, doesn't provide the ability to get non-default DNS records.  So, I compare them...
+            # Make the "template" apply for the current site
+            template = zone.diff.expand_template(template, args.site, source_plesk.internal_ip)
 
-        # Make the "template" apply for the current site
-        for d in template:
-            d['host'] = d['host'].replace('<domain>', args.site).replace('<ip>', source_plesk.internal_ip)
-            d['value'] = d['value'].replace('<domain>', args.site).replace('<ip>', source_plesk.internal_ip)
-            d['site-id'] = source_site_id
+            # Find the non-default DNS entries
+            diffs = zone.diff.custom_records(records, template)
 
-        # Find the non-default DNS entries
-        diffs = [x for x in records if x not in template]
+            # Now, if there are any, let's do stuff
+            if len(diffs) > 0:
+                print('I see non-default DNS records:')
+                for record in diffs:
+                    print(record)
 
-        # Now, if there are any, let's do stuff
-        if len(diffs) > 0:
-            print('I see non-default DNS records:')
-            for record in diffs:
-                print(record)
+                dns_import = self.query_yes_no('Do you want me to try to import them?', default="no")
 
-            dns_import = query_yes_no('Do you want me to try to import them?', default="no")
+                if dns_import:
+                    # I need the new DNS zone, so I know which records to remove and which are already there
+                    new_zone = run(destination_plesk.get_dns_records(dest_site_id, get_id=True))
+                    zone_diff = zone.diff.diff_zones(records, template, new_zone, args.site)
 
-            if dns_import:
-                # I need the new DNS zone, so I know which records to remove
-                new_zone = destination_plesk.get_dns_records(dest_site_id, get_id=True)
+                    # The deletions and additions all go out in one packet, deletions first
+                    changes = destination_plesk.batch()
+                    for record_id in zone_diff.delete:
+                        changes.del_dns_record(record_id)
+                    if zone_diff.add:
+                        changes.add_dns_records(dest_site_id, zone_diff.add)
 
-                # If there are any MX records, rip out all the new ones
-                if (item for item in diffs if item['type'] == 'MX'):
-                    for record in new_zone:
-                        if record['type'] == 'MX':
-                            destination_plesk.del_dns_record(record['id'])
+                    if not all(run(changes.execute())):
+                        print('Some of the DNS changes did not take.  Please check the zone manually.')
+                    elif args.verbose:
+                        print('DNS: added {0}, deleted {1}, kept {2} records'.format(
+                            len(zone_diff.add), len(zone_diff.delete), len(zone_diff.keep)))
 
-                # If there is an SPF record, rip out the new one
-                if (item for item in diffs if 'spf' in item['value'] and item['type'] == 'TXT'):
-                    for record in new_zone:
-                        if __name__ == '__main__':
-                            if 'spf' in record['value']:
-                                destination_plesk.del_dns_record(record['id'])
+        else:
+            print('We do not host DNS.  Disabling DNS on the destination site')
+            run(destination_plesk.set_dns(customer_id, 'disable'))
+
+    def review(self):
+        args = self.args
+
+        # Copy any special hosting settings/php settings
+        self.step_placeholder('verify the PHP and hosting settings')
+
+        # Make sure there aren't protected directories
+        if not args.no_plesk:
+            if len(self.protected_dirs) > 0:
+                print('There are protected directories.  Please create them on the destination.')
+            if args.verbose:
+                print('Plesk API: {requests} requests, {reused} on reused connections, {handshakes} handshakes taking '
+                      '{handshake_time:.3f}s, {reconnects} reconnects'.format(**self.source_plesk.pool.stats))
+        else:
+            self.step_placeholder('verify any protected directories')
+
+        # Look for the existence of a vhost.conf file
+        if os.path.isfile('{0}/{1}/conf/vhost.conf'.format(DOCUMENT_ROOT, args.site)):
+            see_conf = self.query_yes_no('I see custom vhost settings.  Would you like to see them?', default='no')
+            if see_conf:
+                with open('{0}/{1}/conf/vhost.conf'.format(DOCUMENT_ROOT, args.site), 'r') as conf_file:
+                    for line in conf_file:
+                        print(line, end='')
+
+    def plan_db_slim(self):
+        """
+        Works out which tables and rows of the database --db-slim leaves behind, and says how much that saves.
+
+        :return: The row filters for database.engine.Engine and database.pipe.copy_tables, or None to copy everything
+        """
+        args = self.args
+        if args.db_slim == 'off':
+            return None
+
+        if not self.installs:
+            print('I only know how to slim WordPress and Magento databases, so I am copying all of it')
+            return None
+
+        row_filters = {}
+        savings = []
+        source_db = pymysql.connect(host=args.source_db_host, user=args.source_db_user, password=args.source_db_pass,
+                                    db=args.source_db_name)
+        try:
+            db_tables = database.scheduler.table_sizes(source_db)
+            # Each install only leaves out its own tables
+            for install, install_tables in cms.slim.by_install(self.installs, db_tables):
+                install_filters, install_savings = install.slim(source_db, install_tables, args.db_slim)
+                row_filters.update(install_filters)
+                savings.extend(install_savings)
+        finally:
+            source_db.close()
+
+        print(cms.slim.report(savings))
+        self.meter.labels['db_slim_saved_bytes'] = sum(saving.bytes for saving in savings)
+        return row_filters
+
+    def copy_database(self):
+        args = self.args
+        if args.no_db:
+            return
+
+        # Make database (through plesk, to get ref)
+        self.step_placeholder('create the database mysql://{0}/{1}?user={2}&password={3} '.format(
+            args.dest_db_host, args.dest_db_name, args.dest_db_user, args.dest_db_pass))
+
+        # Transfer the Database
+        print('OK, I am going to try to migrate the database now...')
+        self.meter.labels.update({'source_db_host': args.source_db_host, 'dest_db_host': args.dest_db_host})
+
+        try:
+            row_filters = self.plan_db_slim()
+        except pymysql.MySQLError as e:
+            print('I could not work out what to leave out of the database, so I am copying all of it: {0}'.format(e))
+            row_filters = None
+
+        # Should the copy die, running the same migration again picks it up from here
+        db_checkpoint = database.checkpoint.Checkpoint(
+            os.path.join(args.state_dir, '{0}-{1}.db.json'.format(args.site, args.destination)),
+            '{0}/{1}'.format(args.source_db_host, args.source_db_name),
+            '{0}/{1}'.format(args.dest_db_host, args.dest_db_name), fresh=args.db_restart)
+
+        if args.db_engine == 'native':
+            # mysqldump reads TIMESTAMPs in UTC, and we've always loaded them as +06:00, so the native copy does the
+            # same
+            db_engine = database.engine.Engine({'host': args.source_db_host, 'user': args.source_db_user,
+                                                'password': args.source_db_pass, 'db': args.source_db_name},
+                                               {'host': args.dest_db_host, 'user': args.dest_db_user,
+                                                'password': args.dest_db_pass, 'db': args.dest_db_name},
+                                               source_time_zone='+00:00', dest_time_zone='+06:00',
+                                               meter=self.meter, row_filters=row_filters, verbose=args.verbose)
+            db_tunnel = None
+            try:
+                if not args.db_direct:
+                    # The destination database is only reachable from the destination, same as the mysql in the pipe
+                    db_tunnel = transfer.shell.Tunnel(self.ssh_target, args.dest_db_host, password=self.ssh_password,
+                                                      master=self.ssh_master)
+                    db_engine.destination.update({'host': '127.0.0.1', 'port': db_tunnel.open()})
+                db_engine.run(workers=args.db_workers, checkpoint=db_checkpoint)
+                exitcode = 0
+            except (pymysql.MySQLError, OSError) as e:
+                print(e)
+                exitcode = 1
+            finally:
+                if db_tunnel is not None:
+                    db_tunnel.close()
+        else:
+            dump_proc = "mysqldump -u{0} -p{1} -h{2}".format(args.source_db_user, shlex.quote(args.source_db_pass),
+                                                           args.source_db_host)
+            restore_proc = 'mysql -u{0} -p{1} -h{2} {3}'.format(args.dest_db_user, shlex.quote(args.dest_db_pass),
+                                                               args.dest_db_host, args.dest_db_name)
+            time_zone_proc = 'sed "s/TIME_ZONE=\'+00:00\'/TIME_ZONE=\'+06:00\'/"'
+            db_codec = self.pick_codec('xz:4', '{0} {1}'.format(dump_proc, args.source_db_name))
+            try:
+                # Size up the tables first, so the big ones can get going straight away
+                source_db = pymysql.connect(host=args.source_db_host, user=args.source_db_user,
+                                            password=args.source_db_pass, db=args.source_db_name)
+                try:
+                    db_tables = database.scheduler.table_sizes(source_db)
+                finally:
+                    source_db.close()
+
+                exitcode = database.pipe.copy_tables(dump_proc, restore_proc, args.source_db_name, db_tables,
+                                                     self.remote, db_codec, args.db_workers,
+                                                     filter_proc=time_zone_proc, password=self.ssh_password,
+                                                     checkpoint=db_checkpoint, meter=self.meter,
+                                                     row_filters=row_filters, per_table=args.db_per_table,
+                                                     verbose=args.verbose)
+            except pymysql.MySQLError as e:
+                print(e)
+                exitcode = 1
+
+        if exitcode != 0:
+            print('DB copy failed.  Abort!')
+            exit(1)
+
+    def update_database_refs(self):
+        args = self.args
+        if args.no_db:
+            return
+
+        # Update the DB refs in local.xmls or wp-config.php.  Once they've changed, the source can't be found again by
+        #   looking at them, so a second try would copy the destination's database into itself.
+        if self.installs:
+            self.note_progress('db_refs')
+        for install in self.installs:
+            print('Updating the database settings in {0}'.format(os.path.relpath(install.config_path,
+                                                                                self.site_httpdocs)))
+            install.update_config(user=args.dest_db_user, password=args.dest_db_pass, name=args.dest_db_name,
+                                  host=args.dest_db_host)
+
+        if self.installs:
+            # The site copy went alongside the database copy, so it took the old configuration with it
+            config_paths = [os.path.relpath(install.config_path, self.site_httpdocs) for install in self.installs]
+            work_dir = tempfile.mkdtemp(prefix='migrate_o_matic.')
+            try:
+                transfer.incremental.send(self.site_httpdocs, config_paths, self.dest_httpdocs, self.remote,
+                                          transfer.compression.get_codec('none'), work_dir,
+                                          password=self.ssh_password, meter=self.meter, verbose=args.verbose)
+            except ChildProcessError:
+                print('Could not send the new {0}.  Abort!'.format(', '.join(config_paths)))
+                exit(1)
+            finally:
+                shutil.rmtree(work_dir)
+        if not self.installs or set(self.possible_db_refs) - {install.config_path for install in self.installs}:
+            self.step_placeholder('update database refs')
+
+        # Clear magento cache.  The ones we can read didn't have theirs copied.
+        if len(self.magento_roots) != 0 and not self.magento_installs:
+            self.step_placeholder('clear the magento cache')
+        if args.db_slim == cms.slim.REGENERABLE and any(isinstance(install, cms.magento.Instance)
+                                                        for install in self.installs):
+            self.step_placeholder('reindex magento, its indexes were left behind')
+
+        # Make sure you didn't break anything
+        self.step_placeholder('test the original site')
+
+    def copy_site(self):
+        args = self.args
+        site_httpdocs = self.site_httpdocs
+        dest_httpdocs = self.dest_httpdocs
+
+        print('OK, I am going to try to migrate the site now...')
+        streams = transfer.files.stream_count(args.streams)
+        # The skipped directories themselves still go, so they're there, empty, for the site to fill again
+        tar_excludes = ''.join(' ' + shlex.quote('--exclude=./{0}/*'.format(path)) for path in self.skip_dirs)
+        rsync_excludes = ''.join(shlex.quote('--exclude=/{0}/*'.format(path)) + ' ' for path in self.skip_dirs)
+        if args.incremental:
+            print('Sending only what has changed, as incremental was defined.')
+            file_codec = self.pick_codec('xz', 'tar cf - -C {0} .'.format(site_httpdocs))
+        elif args.freshen:
+            print('Performing rsync, as freshen was defined.')
+            if args.verbose:
+                rsync_verbose = '--verbose '
+            else:
+                rsync_verbose = ''
+            tar_proc = 'rsync -rtlD --delete -e {3} {4}{5}{0}/ {1}:{2}/'.format(site_httpdocs, self.ssh_target,
+                                                                                dest_httpdocs, shlex.quote(self.ssh),
+                                                                                rsync_verbose, rsync_excludes)
+        else:
+            file_codec = self.pick_codec('xz', 'tar cf - -C {0} .'.format(site_httpdocs))
+            # tar sends what's in pruned directories too, which the scan never counted, so it's no total then
+            total_bytes = None if self.site_scan.pruned else self.site_scan.total_bytes
+            tar_proc = transfer.shell.Stream('tar cf - -C {0}{1} .'.format(site_httpdocs, tar_excludes),
+                                             self.remote.format(file_codec.pipe_in('tar xpf - -C {0}'.format(
+                                                 dest_httpdocs))), compress=file_codec.compress, pipeline='files',
+                                             total_bytes=total_bytes)
+            # The destination directory has crap, clear it out.
+            if args.verbose:
+                print('Clearing crap')
+            crap_proc = self.remote.format('rm -rf {0}/*'.format(dest_httpdocs))
+            transfer.shell.run(crap_proc, password=self.ssh_password)
+
+        if args.incremental:
+            manifest_prefix = os.path.join(args.state_dir, '{0}-{1}'.format(args.site, args.destination))
+            if args.dedup_store:
+                dedup_store = transfer.dedup.Store(args.dedup_store, self.remote, password=self.ssh_password,
+                                                   link=args.dedup_link, verbose=args.verbose)
+            else:
+                dedup_store = None
+            exitcode = transfer.incremental.copy_incremental(site_httpdocs, dest_httpdocs, self.remote,
+                                                             manifest_prefix, codec=file_codec,
+                                                             password=self.ssh_password, store=dedup_store,
+                                                             skip=self.skip_dirs, meter=self.meter,
+                                                             verbose=args.verbose)
+        elif streams > 1 and not args.freshen:
+            print('Copying in {0} streams...'.format(streams))
+            plan = transfer.files.plan_shards(self.site_scan, streams, skip=self.skip_dirs)
+            exitcode = transfer.files.copy_parallel(plan, dest_httpdocs, self.remote, codec=file_codec,
+                                                    password=self.ssh_password, meter=self.meter,
+                                                    verbose=args.verbose)
+        else:
+            if args.verbose:
+                print(tar_proc)
+            exitcode = transfer.shell.run(tar_proc, password=self.ssh_password, meter=self.meter)
 
-                # Now that I've done all of that hard work to add the domain name, I have to remove it
-                for d in diffs:
-                    d['host'] = d['host'].replace(args.site, '').rstrip('.')
+        if exitcode != 0:
+            print('Site copy failed.  Abort!')
+            exit(1)
 
-                destination_plesk.add_dns_records(dest_site_id, diffs)
+    def finish(self):
+        args = self.args
 
-    else:
-        print('We do not host DNS.  Disabling DNS on the destination site')
-        destination_plesk.set_dns(customer_id, 'disable')
-
-
-else:
-    step_placeholder('make the new customer in plesk - use bash as shell')
-    step_placeholder('copy the SSL certificates')
-    step_placeholder('update new DNS if on plesk')
-
-
-# Copy any special hosting settings/php settings
-step_placeholder('verify the PHP and hosting settings')
-
-# Make sure there aren't protected directories
-if not args.no_plesk:
-    protected_dirs = source_plesk.get_protected_dirs(source_site_id)
-    if len(protected_dirs) > 0:
-        print('There are protected directories.  Please create them on the destination.')
-else:
-    step_placeholder('verify any protected directories')
-
-
-# Look for the existence of a vhost.conf file
-if os.path.isfile('{0}/{1}/conf/vhost.conf'.format(DOCUMENT_ROOT, args.site)):
-    see_conf = query_yes_no('I see custom vhost settings.  Would you like to see them?', default='no')
-    if see_conf:
-        with open('{0}/{1}/conf/vhost.conf'.format(DOCUMENT_ROOT, args.site), 'r') as conf_file:
-            for line in conf_file:
-                print(line, end='')
-
-if not args.no_db:
-
-    # Make database (through plesk, to get ref)
-    step_placeholder('create the database mysql://{0}/{1}?user={2}&password={3} '.format(args.dest_db_host,
-                                                                                        args.dest_db_name,
-                                                                                        args.dest_db_user,
-                                                                                        args.dest_db_pass))
-
-    # Transfer the Database
-    print('OK, I am going to try to migrate the database now...')
-
-    db_proc = """mysqldump -u{0} -p{1} -h{2} {3} | sed "s/TIME_ZONE='+00:00'/TIME_ZONE='+06:00'/" | pv | xz -c -4 | ssh {4}@{5} "xz -d -c | mysql -u{6} -p{7} -h{8} {9}" """.format(
-        args.source_db_user, shlex.quote(args.source_db_pass), args.source_db_host, args.source_db_name,
-        args.dest_sftp_user, args.destination, args.dest_db_user, shlex.quote(args.dest_db_pass), args.dest_db_host,
-        args.dest_db_name)
-    if args.verbose:
-        print(db_proc)
-    try:
-        # This is the "wrong" way to do it, but I can't get the nested Popen's to work
-        if args.dest_sftp_pass is None:
-            exitcode = subprocess.call(db_proc, shell=True)
-        else:
-            child = pexpect.spawnu('/bin/bash', ['-c', db_proc], timeout=None)
-            child.expect(['password: '])
-            child.sendline(args.dest_sftp_pass)
-            child.logfile = sys.stdout
-            child.expect(pexpect.EOF)
-            child.close()
-
-            exitcode = child.exitstatus
-    except KeyboardInterrupt:
-        exit(130)
-
-    if exitcode != 0:
-        print('DB copy failed.  Abort!')
-        exit(1)
-
-    # Update the DB refs in local.xmls or wp-config.php
-
-    if (len(possible_db_refs) == 1) and (len(wp_roots) == 1):
-        print('Updating wordpress configuration')
-        wp_install.update_config(user=args.dest_db_user, password=args.dest_db_pass, name=args.dest_db_name,
-                                 host=args.dest_db_host)
-    else:
-        step_placeholder('update database refs')
+        # Test the site in the new location
+        self.step_placeholder('test the site in the new location')
 
-    # Clear magento cache
-    if len(magento_roots) != 0:
-        step_placeholder('clear the magento cache')
+        # Update DNS/Switch Nameserver
+        self.step_placeholder('update the real DNS')
 
-    # Make sure you didn't break anything
-    step_placeholder('test the original site')
+        # Transfer cron jobs
+        if not args.no_db and (len(self.magento_roots) != 0):
+            self.step_placeholder('transfer any cron jobs')
 
-# Transfer the site
+        # Switch shell back to /chroot
+        if not args.no_plesk:
+            print('Switching shell back to chroot... ', end='')
+            shell_result = self.run_async(
+                self.destination_plesk.set_webspace({'shell': '/usr/local/psa/bin/chrootsh'}, self.dest_site_id))
 
-print('OK, I am going to try to migrate the site now...')
-if args.freshen:
-    print('Performing rsync, as freshen was defined.')
-    if args.verbose:
-        rsync_verbose = '--verbose '
-    else:
-        rsync_verbose = ''
-    tar_proc = 'rsync -rtlD --delete {3}{0}/ {1}@{2}:{4}/'.format(site_httpdocs, args.dest_sftp_user, args.destination,
-                                                                  rsync_verbose, dest_httpdocs)
-else:
-    tar_proc = 'tar cf - -C {0} . | pv -s {1} | xz -c |  ssh {2}@{3} "tar xJf - -C {4}"'.format(site_httpdocs,
-                                                                                                get_folder_size(
-                                                                                                    site_httpdocs),
-                                                                                                args.dest_sftp_user,
-                                                                                                args.destination,
-                                                                                                dest_httpdocs)
-    # The destination directory has crap, clear it out.
-    if args.verbose:
-        print('Clearing crap')
-    crap_proc = 'ssh {0}@{1} "rm -rf {2}/*"'.format(args.dest_sftp_user, args.destination, dest_httpdocs)
-    if args.dest_sftp_pass is None:
-        exitcode = subprocess.call(crap_proc, shell=True)
-    else:
-        child = pexpect.spawnu('/bin/bash', ['-c', crap_proc], timeout=None)
-        child.expect(['password: '])
-        child.sendline(args.dest_sftp_pass)
-        child.logfile = sys.stdout
-        child.expect(pexpect.EOF)
-        child.close()
-if args.verbose:
-    print(tar_proc)
-try:
-    # This is the "wrong" way to do it, but I can't get the nested Popen's to work
-    if args.dest_sftp_pass is None:
-        exitcode = subprocess.call(tar_proc, shell=True)
-    else:
-        child = pexpect.spawnu('/bin/bash', ['-c', tar_proc], timeout=None)
-        child.expect(['password: '])
-        child.sendline(args.dest_sftp_pass)
-        child.logfile = sys.stdout
-        child.expect(pexpect.EOF)
-        child.close()
-
-        exitcode = child.exitstatus
-except KeyboardInterrupt:
-    exit(130)
-
-if exitcode != 0:
-    print('Site copy failed.  Abort!')
-    exit(1)
-
-# Test the site in the new location
-step_placeholder('test the site in the new location')
-
-# Update DNS/Switch Nameserver
-step_placeholder('update the real DNS')
-
-# Transfer cron jobs
-if not args.no_db and (len(magento_roots) != 0):
-    step_placeholder('transfer any cron jobs')
-
-# Switch shell back to /chroot
-if not args.no_plesk:
-    print('Switching shell back to chroot... ', end='')
-    shell_result = destination_plesk.set_webspace({'shell': '/usr/local/psa/bin/chrootsh'}, dest_site_id)
-
-    if shell_result[0] == 'ok':
-        print('OK')
-    else:
-        print('')
-        print('Failed to switch the shell back.  Take a look.')
-        print('{0}: {1}'.format(shell_result[0], shell_result[1]))
-        exit(1)
-else:
-    step_placeholder('switch that shell back')
-
-exit(0)
+            if shell_result[0] == 'ok':
+                print('OK')
+            else:
+                print('')
+                print('Failed to switch the shell back.  Take a look.')
+                print('{0}: {1}'.format(shell_result[0], shell_result[1]))
+                exit(1)
+        else:
+            self.step_placeholder('switch that shell back')
+
+    def write_metrics(self):
+        summary = self.meter.write_summary(self.metrics_summary)
+        self.meter.close()
+        for pipeline in summary['pipelines']:
+            print('{0}: {1} streams, {2:.1f} MB read, {3:.1f} MB sent in {4:.0f}s, {5:.1f} MB/s'.format(
+                pipeline['pipeline'], pipeline['streams'], pipeline['read'] / 1e6, pipeline['sent'] / 1e6,
+                pipeline['seconds'], pipeline['read_mb_per_second']))
+        if self.args.verbose:
+            print('Metrics are in {0}'.format(self.metrics_summary))
+
+    def write_profile(self, phases):
+        """Ranks the slowest calls to other systems, and writes them out, with the phases, as a Chrome trace"""
+        tracer = telemetry.tracing.default_tracer
+        for phase in phases:
+            if phase.started is not None:
+                tracer.add(phase.name, phase.started, phase.finished or time.monotonic(), category='phase',
+                           thread='phase ' + phase.name, exitcode=phase.exitcode)
+        print(tracer.report())
+        tracer.export_chrome(self.trace_path)
+        print('Trace written to {0}, open it in chrome://tracing or https://ui.perfetto.dev'.format(self.trace_path))
+
+    def phases(self):
+        """
+        The migration's steps, and which ones each has to wait for.  The database and the files go to different places,
+        so their copies go on side by side, and alongside the Plesk set up once the site exists to copy into.
+
+        :return: A list of batch.phases.Phase
+        """
+        args = self.args
+
+        # The copies go through the customer's account on the destination, which has to exist first.  Only the native
+        #   engine straight to the database doesn't need it.
+        if args.db_engine == 'native' and args.db_direct:
+            database_requires = ['find_database']
+        else:
+            database_requires = ['find_database', 'connect']
+
+        return [
+            batch.phases.Phase('check_site', self.check_site),
+            batch.phases.Phase('scan_site', self.scan_site, ['check_site']),
+            batch.phases.Phase('find_database', self.find_database, ['scan_site']),
+            batch.phases.Phase('ask_sftp_password', self.ask_sftp_password, ['find_database']),
+            batch.phases.Phase('create_site', self.create_site, ['ask_sftp_password']),
+            batch.phases.Phase('connect', self.connect, ['create_site']),
+            batch.phases.Phase('copy_database', self.copy_database, database_requires),
+            batch.phases.Phase('copy_site', self.copy_site, ['scan_site', 'connect']),
+            batch.phases.Phase('configure_plesk', self.configure_plesk, ['create_site']),
+            batch.phases.Phase('review', self.review, ['configure_plesk']),
+            # The new database settings can only go in once the database is there, and have to be sent after the files
+            batch.phases.Phase('update_db_refs', self.update_database_refs, ['copy_database', 'copy_site']),
+            batch.phases.Phase('finish', self.finish, ['update_db_refs', 'review']),
+        ]
+
+    def run(self):
+        """
+        Does the whole migration, each step as soon as the ones it needs are done.
+
+        :return: The exit status
+        """
+        phases = self.phases()
+        try:
+            exitcode = batch.phases.run_phases(phases, workers=1 if self.args.serial else None,
+                                               verbose=self.args.verbose)
+        except KeyboardInterrupt:
+            # The phases' threads never see it, so whatever they have running has to be stopped for them
+            transfer.shell.kill_all()
+            print('')
+            print(batch.phases.report(phases))
+            return 130
+        finally:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+            if self.ssh_master is not None:
+                self.ssh_master.close()
+            self.resolver.save()
+            self.write_metrics()
+            if self.args.profile:
+                self.write_profile(phases)
+
+        print(batch.phases.report(phases))
+        if exitcode != 0:
+            return exitcode
+
+        if self.todo:
+            print('Still to do by hand:')
+            for action in self.todo:
+                print('  {0}'.format(action))
+        return 0
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    exit(Migration(args).run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import asyncio
+import functools
+
+import plesk.apiclient
+
+
+class AsyncClient(plesk.apiclient.Client):
+    """
+    An asyncio flavour of Client.  The methods are the same, but they're coroutines, so calls that don't depend on each
+    other (say, one to the source and one to the destination) can be in flight at the same time.
+
+    The requests themselves still go over the pooled http.client connections, each on a thread from the executor.
+    """
+
+    def __init__(self, host, port=8443, protocol='https', ssl_unverified=False, verbose=False, pool=None,
+                 inventory=None, tracer=None, index=None, executor=None):
+        """
+        :param executor: The concurrent.futures executor to run requests on, defaults to the event loop's own
+        """
+        super().__init__(host, port=port, protocol=protocol, ssl_unverified=ssl_unverified, verbose=verbose,
+                         pool=pool, inventory=inventory, tracer=tracer, index=index)
+        self.executor = executor
+
+    def __run(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    async def _send_async(self, operations):
+        return await self.__run(self._send, operations)
+
+    def batch(self):
+        """
+        Starts a batch of operations that will go out in a single packet.  Same as Client.batch(), except execute()
+        is a coroutine.
+
+        :return: An AsyncBatch bound to this client
+        """
+        return AsyncBatch(self)
+
+    async def lookup_plesk_info(self, fresh=False):
+        return await self.__run(super().lookup_plesk_info, fresh)
+
+    async def get_hosting_info(self, site_name):
+        return (await self._send_async([self._get_hosting_info_op(site_name)]))[0]
+
+    async def get_protected_dirs(self, site_id):
+        return (await self._send_async([self._get_protected_dirs_op(site_id)]))[0]
+
+    async def get_dns_records(self, site_id, get_id=False):
+        return (await self._send_async([self._get_dns_records_op(site_id, get_id)]))[0]
+
+    async def get_dns_template(self, fresh=False):
+        return (await self._send_async([self._get_dns_template_op(fresh)]))[0]
+
+    async def get_ssl_certs(self, site_name):
+        return (await self._send_async([self._get_ssl_certs_op(site_name)]))[0]
+
+    async def get_customer_id(self, login_id, fresh=False):
+        return (await self._send_async([self._get_customer_id_op(login_id, fresh)]))[0]
+
+    async def get_site_id(self, name, fresh=False):
+        return (await self._send_async([self._get_site_id_op(name, fresh)]))[0]
+
+    async def list_objects(self, kind):
+        return (await self._send_async([self._list_objects_op(kind)]))[0]
+
+    async def set_dns(self, site, status):
+        return (await self._send_async([self._set_dns_op(site, status)]))[0]
+
+    async def set_webspace(self, hosting_info, site_id):
+        return (await self._send_async([self._set_webspace_op(hosting_info, site_id)]))[0]
+
+    async def add_webspace(self, gen_setup, hosting_type, hosting_info, hosting_ip, hosting_plan):
+        return (await self._send_async([self._add_webspace_op(gen_setup, hosting_type, hosting_info, hosting_ip,
+                                                              hosting_plan)]))[0]
+
+    async def add_customer(self, customer_name):
+        return (await self._send_async([self._add_customer_op(customer_name)]))[0]
+
+    async def add_dns_records(self, site_id, records):
+        return (await self._send_async([self._add_dns_records_op(site_id, records)]))[0]
+
+    async def del_dns_record(self, record_id):
+        return (await self._send_async([self._del_dns_record_op(record_id)]))[0]
+
+
+class AsyncBatch(plesk.apiclient.Batch):
+    """A Batch for an AsyncClient, where execute() is a coroutine"""
+
+    async def execute(self):
+        """
+        Sends everything queued so far in a single packet, and empties the queue.
+
+        :return: A list with the result of each operation, in the order they were queued
+        """
+        if not self.operations:
+            return []
+
+        operations = self.operations
+        self.operations = []
+        return await self.client._send_async(operations)
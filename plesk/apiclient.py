@@ -1,20 +1,46 @@
-import base64
-import http.client
-import json
+import codecs
+import collections
 import random
 import re
 import string
 import xml.etree.ElementTree as ET
 
-import Crypto
-import Crypto.Cipher.AES
-import pymysql
+from plesk.inventory import default_inventory
+from plesk.pool import default_pool
+from telemetry.tracing import default_tracer
+
+# One operation for a packet: the request element to send, and a function to make the matching response usable.  An
+# operation that can have lots of results (say, every record in a zone) can give each instead, a function to make one
+# <result> usable.  It's handed every result as soon as it has come in, and the operation's answer is the list of what
+# it returned (leaving out Nones), or False if Plesk said any of them was an error.  parse isn't used then.
+Operation = collections.namedtuple('Operation', ['element', 'parse', 'each'])
+Operation.__new__.__defaults__ = (None,)
+
+# How much of a response to take off the socket at a time
+READ_BYTES = 64 * 1024
+
+# For list_objects(): the entity to ask for each kind the index keeps, and which gen_info fields go in which column
+LISTED_KINDS = {'customers': ('customer', {'login': 'login', 'pname': 'pname'}),
+                'webspaces': ('webspace', {'name': 'name', 'owner-id': 'owner_id'}),
+                'sites': ('site', {'name': 'name', 'webspace-id': 'webspace_id'})}
+
+
+def _answered(value):
+    """:return: An Operation that's already been answered, say out of the index, so it needn't go to Plesk at all"""
+    return Operation(None, lambda res_elm: value)
+
+
+def customer_login(customer_name):
+    """:return: The login add_customer() gives a new customer"""
+    # Make a friendly customer login - strip out non-alphanum, limit to 20 characters, add _cp
+    return re.sub(r'[\W_]+', '', customer_name).lower()[:20] + '_cp'
 
 
 class Client:
     """A class to interact with Plesk Installations"""
 
-    def __init__(self, host, port=8443, protocol='https', ssl_unverified=False, verbose=False):
+    def __init__(self, host, port=8443, protocol='https', ssl_unverified=False, verbose=False, pool=None,
+                 inventory=None, tracer=None, index=None):
         self.host = host
         self.port = port
         self.protocol = protocol
@@ -24,6 +50,17 @@ class Client:
         self.login = None
         self.password = None
         self.internal_ip = None
+        if pool is None:
+            pool = default_pool
+        self.pool = pool
+        if inventory is None:
+            inventory = default_inventory
+        self.inventory = inventory
+        if tracer is None:
+            tracer = default_tracer
+        self.tracer = tracer
+        # A plesk.index.Index to answer lookups from, if we have one
+        self.index = index
 
     def set_credentials(self, login, password):
         self.login = login
@@ -32,77 +69,40 @@ class Client:
     def set_secret_key(self, secret_key):
         self.secret_key = secret_key
 
-    def lookup_plesk_info(self):
+    def lookup_plesk_info(self, fresh=False):
         """
         This function uses the SQL database made my Alex's PHP inventory app for retrieving plesk info
 
-        Depends on connectivity to the database, and the presence of the config.json file used for PHP's site inventory
+        Depends on connectivity to the database, and the presence of the config.json file used for PHP's site inventory.
+        Answers come out of the inventory's cache when they can.
+        :param fresh: If true, skip the cache and ask the database
         :return: Boolean with success
         """
-        # We try to pull the configuration from the database
-
-        # Open JSON config
-        with open('config.json') as json_config_file:
-            config = json.load(json_config_file)
-
-        connection = pymysql.connect(host=config['production']['database']['params']['host'],
-                                     user=config['production']['database']['params']['username'],
-                                     db=config['production']['database']['params']['dbname'],
-                                     password=config['production']['database']['params']['password'])
-
-        # Connect to the database, and pull the row corresponding to the host
-        if self.verbose:
-            print((config['production']['database']['params']['host'],
-                   config['production']['database']['params']['username'],
-                   config['production']['database']['params']['dbname'],
-                   config['production']['database']['params']['password']))
-        try:
-            with connection.cursor() as cursor:
-                sql = "select hostname, username, password, internal_ip from plesks where hostname = %s"
-                result_num = cursor.execute(sql, self.host)
-                if result_num != 1:
-                    print('Could not find that host in the database.')
-                    return False
-                result_tuple = cursor.fetchone()
-        finally:
-            connection.close()
-
-        result = {}
-        for k, v in zip(('hostname', 'username', 'password', 'internal_ip'), result_tuple):
-            result[k] = v
-
-        if self.verbose:
-            print(result)
-
-        # Got me a shiny result, but the password is still encrypted
-
-        ciphertext_dec = base64.b64decode(result['password'])
-
-        # The initialization vector should be the first 16 bytes of the encrypted data, that's how PHP stores it
-        iv = ciphertext_dec[0:16]
-
-        # I use CFB in both PHP and python.  It's not dependent on the phrase being a multiple of 16 bytes
-        decrypto = Crypto.Cipher.AES.new(config['production']['enc_key'], Crypto.Cipher.AES.MODE_CFB, iv)
-
-        # The rest of the string is the encrypted data
-        ciphertext = ciphertext_dec[16:]
-        real_password = decrypto.decrypt(ciphertext).decode('utf-8')
-
-        result['password'] = real_password
+        with self.tracer.span('plesk lookup_plesk_info', category='inventory', host=self.host) as span:
+            result = self.inventory.lookup([self.host], fresh=fresh).get(self.host)
+
+            if result is None:
+                span.status = 'not found'
+                print('Could not find that host in the database.')
+                return False
+
+            if self.verbose:
+                print(result)
+
+            if all((result['username'], result['password'], result['internal_ip'])):
+                self.login = result['username']
+                self.password = result['password']
+                self.internal_ip = result['internal_ip']
+                return True
+            else:
+                span.status = 'incomplete'
+                return False
 
+    def __query(self, request, reader, idempotent=False):
+        headers = {"Content-type": "text/xml"}
+        # Indenting only makes the response bigger, unless somebody's going to read it
         if self.verbose:
-            print(result)
-
-        if all((result['username'], result['password'], result['internal_ip'])):
-            self.login = result['username']
-            self.password = result['password']
-            self.internal_ip = result['internal_ip']
-            return True
-        else:
-            return False
-
-    def __query(self, request):
-        headers = {"Content-type": "text/xml", "HTTP_PRETTY_PRINT": "TRUE"}
+            headers["HTTP_PRETTY_PRINT"] = "TRUE"
 
         if self.secret_key:
             headers["KEY"] = self.secret_key
@@ -110,33 +110,80 @@ class Client:
             headers["HTTP_AUTH_LOGIN"] = self.login
             headers["HTTP_AUTH_PASSWD"] = self.password
 
-        if 'https' == self.protocol:
-            if self.ssl_unverified:
-                conn = http.client.HTTPSConnection(self.host, self.port,
-                                                   context=ssl._create_unverified_context())
-            else:
-                conn = http.client.HTTPSConnection(self.host, self.port)
-        else:
-            conn = http.client.HTTPConnection(self.host, self.port)
+        return self.pool.request(self.protocol, self.host, self.port, "POST", "/enterprise/control/agent.php", request,
+                                 headers, ssl_unverified=self.ssl_unverified, reader=reader, idempotent=idempotent)
+
+    def _send(self, operations):
+        """
+        Wraps any number of operations into a single packet, sends it, and hands each operation its own part of the
+        response to make usable.  Plesk answers the operations in the order they were asked.
+
+        :param operations: A list of Operations, as made by the _*_op methods
+        :return: A list with the result of each operation, in the same order
+        """
+
+        # Anything already answered from the index stays home
+        asked = [operation for operation in operations if operation.element is not None]
+        answers = iter(self.__send_packet(asked) if asked else [])
+        return [next(answers, False) if operation.element is not None else operation.parse(None)
+                for operation in operations]
+
+    def __send_packet(self, operations):
+        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
+        for operation in operations:
+            packet_elm.append(operation.element)
+
+        # Named for what's in the packet, e.g. 'plesk site.get+dns.del_rec*3'
+        kinds = collections.OrderedDict()
+        for operation in operations:
+            kind = '{0}.{1}'.format(operation.element.tag, operation.element[0].tag)
+            kinds[kind] = kinds.get(kind, 0) + 1
+        span_name = 'plesk ' + '+'.join(kind if count == 1 else '{0}*{1}'.format(kind, count)
+                                        for kind, count in kinds.items())
+        with self.tracer.span(span_name, category='plesk', host=self.host, operations=len(operations)) as span:
+            request = ET.tostring(packet_elm, 'utf-8')
+            span.set(request_bytes=len(request))
+
+            if self.verbose:
+                print(request)
+
+            # Parsed as it comes off the socket, so a huge response never has to be in memory all at once.  A packet
+            # that only gets things can safely go again if the connection drops, one that adds or changes can't.
+            read_only = all(operation.element[0].tag.startswith('get') for operation in operations)
+            response = self.__query(request, lambda http_response: _Response(operations, self.verbose).read(
+                http_response), idempotent=read_only)
+            span.set(response_bytes=response.bytes)
+
+            # If Plesk didn't like the packet as a whole, there's one system error instead of an answer per operation
+            if response.system_error:
+                span.status = 'system error'
+                return [False] * len(operations)
+
+            if response.errors:
+                span.status = '{0} errors'.format(response.errors)
+
+        return response.results
+
+    def batch(self):
+        """
+        Starts a batch of operations that will go out in a single packet.  Queue operations by calling the usual
+        method names on the batch, then call execute() to get the results.
 
-        conn.request("POST", "/enterprise/control/agent.php", request, headers)
-        response = conn.getresponse()
-        data = response.read()
-        return data.decode("utf-8")
+        :return: A Batch bound to this client
+        """
+        return Batch(self)
 
-    def __get_info(self, req_type, req_info, req_filter=None):
+    def _get_info_op(self, req_type, req_info, req_filter=None):
         """
         Takes the reqType, reqInfo, and reqFilter, and builds an XML request (because who likes to make XML?)
-        Passes said XML to __query to get the XML result, then makes it usable.
 
         :param req_type: The type of request, can be customer, webspace (subscription), or site (domain)
         :param req_info: The type of information we're looking for.  Probably gen_info or hosting
         :param req_filter: A list of lists, with the first item being the key, and the second, value
-        :return: An XML element object rooted at the response section.  Returns False if entity not found
+        :return: An Operation whose result is an XML element rooted at the data section, or False if entity not found
         """
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, req_type)
+        req_type_elm = ET.Element(req_type)
         get_elm = ET.SubElement(req_type_elm, 'get')
         req_filter_elm = ET.SubElement(get_elm, 'filter')
         if req_filter:
@@ -146,34 +193,50 @@ class Client:
         dataset_elm = ET.SubElement(get_elm, 'dataset')
         ET.SubElement(dataset_elm, req_info)
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
+        def parse(res_et):
+            if res_et.find('.//status').text == 'error':
+                return False
+            else:
+                return res_et.find('.//data')
 
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
+        return Operation(req_type_elm, parse)
 
-        if self.verbose:
-            print(response)
+    def _get_hosting_info_op(self, site_name):
+        get_info_op = self._get_info_op('site', 'hosting', [['name', site_name]])
 
-        res_et = ET.fromstring(response)
+        def parse(res_et):
+            response = get_info_op.parse(res_et)
 
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            return res_et.find('.//data')
+            property_dict = {}
+
+            if response:
+                properties = response.find('./hosting/vrt_hst').findall('property')
+                for property in properties:
+                    property_dict[property.find('name').text] = property.find('value').text
+
+                return property_dict
+            else:
+                return False
+
+        return Operation(get_info_op.element, parse)
 
     def get_hosting_info(self, site_name):
-        response = self.__get_info('site', 'hosting', [['name', site_name]])
+        return self._send([self._get_hosting_info_op(site_name)])[0]
 
-        property_dict = {}
+    def _get_protected_dirs_op(self, site_id):
+        req_type_elm = ET.Element('protected-dir')
+        get_elm = ET.SubElement(req_type_elm, 'get')
+        req_filter_elm = ET.SubElement(get_elm, 'filter')
+        req_filter_key_elm = ET.SubElement(req_filter_elm, 'site-id')
+        req_filter_key_elm.text = site_id
 
-        if response:
-            properties = response.find('./hosting/vrt_hst').findall('property')
-            for property in properties:
-                property_dict[property.find('name').text] = property.find('value').text
+        def each(result_elm):
+            if result_elm.find('data') is not None:
+                res_name = result_elm.find('.//name').text
+                if res_name != 'plesk-stat':
+                    return res_name
 
-            return property_dict
-        else:
-            return False
+        return Operation(req_type_elm, None, each)
 
     def get_protected_dirs(self, site_id):
         """
@@ -183,35 +246,28 @@ class Client:
         :param site_id: A filter to specify what object we're looking for
         :return: An XML element object rooted at the response section.  Returns False if entity not found
         """
+        return self._send([self._get_protected_dirs_op(site_id)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'protected-dir')
-        get_elm = ET.SubElement(req_type_elm, 'get')
+    def _get_dns_records_op(self, site_id, get_id=False):
+        req_type_elm = ET.Element('dns')
+        get_elm = ET.SubElement(req_type_elm, 'get_rec')
         req_filter_elm = ET.SubElement(get_elm, 'filter')
         req_filter_key_elm = ET.SubElement(req_filter_elm, 'site-id')
         req_filter_key_elm.text = site_id
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
-
-        res_et = ET.fromstring(response)
+        def each(result_elm):
+            dns_record = {}
+            if get_id:
+                # Let's capture the record ID
+                dns_record['id'] = result_elm.find('id').text
 
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            protected_dirs = []
-            if res_et.find('.//data'):
-                for result_elm in res_et.findall('.//result'):
-                    res_name = result_elm.find('.//name').text
-                    if res_name != 'plesk-stat':
-                        protected_dirs.append(res_name)
+            # The "data" element is a member of result
+            data_elm = result_elm.find('data')
+            for datalet in data_elm:
+                dns_record[datalet.tag] = datalet.text
+            return dns_record
 
-            return protected_dirs
+        return Operation(req_type_elm, None, each)
 
     def get_dns_records(self, site_id, get_id=False):
         """
@@ -222,128 +278,104 @@ class Client:
         :param get_id: If true, also add the record ID to each dict
         :return: A list of dicts, where each dict has a 'type', 'host', 'value', and optionally an 'opt'.
         """
+        return self._send([self._get_dns_records_op(site_id, get_id)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'dns')
-        get_elm = ET.SubElement(req_type_elm, 'get_rec')
-        req_filter_elm = ET.SubElement(get_elm, 'filter')
-        req_filter_key_elm = ET.SubElement(req_filter_elm, 'site-id')
-        req_filter_key_elm.text = site_id
-
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
+    def _get_dns_template_op(self, fresh=False):
+        if self.index is not None and not fresh:
+            template = self.index.dns_template(self.host)
+            if template is not None:
+                return _answered(template)
 
-        res_et = ET.fromstring(response)
-
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            dns_records = []
-            for result_elm in res_et.findall('.//result'):
-                dns_record = {}
-                if get_id:
-                    # Let's capture the record ID
-                    dns_record['id'] = result_elm.find('id').text
+        req_type_elm = ET.Element('dns')
+        get_elm = ET.SubElement(req_type_elm, 'get_rec')
+        ET.SubElement(get_elm, 'filter')
+        ET.SubElement(get_elm, 'template')
 
-                # The "data" element is a member of result
-                data_elm = result_elm.find('data')
-                for datalet in data_elm:
-                    dns_record[datalet.tag] = datalet.text
-                dns_records.append(dns_record)
+        def each(result_elm):
+            # The "data" element is a member of result
+            data_elm = result_elm.find('data')
+            dns_record = {}
+            for datalet in data_elm:
+                dns_record[datalet.tag] = datalet.text
+            return dns_record
 
-            return dns_records
+        return Operation(req_type_elm, None, each)
 
-    def get_dns_template(self):
+    def get_dns_template(self, fresh=False):
         """
         Gets the DNS template for this domain
 
+        :param fresh: If true, ask Plesk even if the index has it
         :return: A set of dicts, where each dict has a 'type', 'host', 'value', and optionally an 'opt'.
         """
+        return self._send([self._get_dns_template_op(fresh)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'dns')
-        get_elm = ET.SubElement(req_type_elm, 'get_rec')
+    def _list_objects_op(self, kind):
+        entity, fields = LISTED_KINDS[kind]
+        req_type_elm = ET.Element(entity)
+        get_elm = ET.SubElement(req_type_elm, 'get')
+        # No filter means all of them
         ET.SubElement(get_elm, 'filter')
-        ET.SubElement(get_elm, 'template')
-
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
-
-        res_et = ET.fromstring(response)
+        dataset_elm = ET.SubElement(get_elm, 'dataset')
+        ET.SubElement(dataset_elm, 'gen_info')
 
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            dns_records = []
-            for result_elm in res_et.findall('.//result'):
-                # The "data" element is a member of result
-                data_elm = result_elm.find('data')
-                dns_record = {}
-                for datalet in data_elm:
-                    dns_record[datalet.tag] = datalet.text
-                dns_records.append(dns_record)
+        def each(result_elm):
+            gen_info_elm = result_elm.find('data/gen_info')
+            if gen_info_elm is None:
+                return None
+            return result_elm.find('id').text, {column: gen_info_elm.findtext(field)
+                                                for field, column in fields.items()}
 
-            return dns_records
+        return Operation(req_type_elm, None, each)
 
-    def get_ssl_certs(self, site_name):
+    def list_objects(self, kind):
         """
-        Takes the site name and builds an XML request (because who likes to make XML?)
-        Passes said XML to __query to get the XML result, then makes it usable.
+        Gets every object of a kind on the server, for plesk.index to keep.
 
-        :param site_name: A filter to specify what object we're looking for
-        :return: A list of names of SSL certs.  Returns False if entity not found
+        :param kind: 'customers', 'webspaces' or 'sites'
+        :return: A list of (id, dict of the index's columns for it), or False if Plesk wouldn't say
         """
+        return self._send([self._list_objects_op(kind)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'certificate')
+    def _get_ssl_certs_op(self, site_name):
+        req_type_elm = ET.Element('certificate')
         get_elm = ET.SubElement(req_type_elm, 'get-pool')
         req_filter_elm = ET.SubElement(get_elm, 'filter')
         req_filter_key_elm = ET.SubElement(req_filter_elm, 'domain-name')
         req_filter_key_elm.text = site_name
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
-
-        res_et = ET.fromstring(response)
+        def parse(res_et):
+            if res_et.find('.//status').text == 'error':
+                return False
+            else:
+                ssl_certs = []
+                certificates_elm = res_et.find('.//certificates')
+                if len(certificates_elm) > 1:
+                    for result_elm in res_et.findall('.//certificate'):
+                        res_name = result_elm.find('.//name').text
+                        ssl_certs.append(res_name)
 
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            ssl_certs = []
-            certificates_elm = res_et.find('.//certificates')
-            if len(certificates_elm) > 1:
-                for result_elm in res_et.findall('.//certificate'):
-                    res_name = result_elm.find('.//name').text
-                    ssl_certs.append(res_name)
+                return ssl_certs
 
-            return ssl_certs
+        return Operation(req_type_elm, parse)
 
-    def get_customer_id(self, login_id):
+    def get_ssl_certs(self, site_name):
         """
-        Takes the reqType, reqInfo, and reqFilter, and builds an XML request (because who likes to make XML?)
+        Takes the site name and builds an XML request (because who likes to make XML?)
         Passes said XML to __query to get the XML result, then makes it usable.
 
-        :param login_id: The username for the control panel user
-        :return: A list with the customer id and the customer pretty name.  Returns False if entity not found
+        :param site_name: A filter to specify what object we're looking for
+        :return: A list of names of SSL certs.  Returns False if entity not found
         """
+        return self._send([self._get_ssl_certs_op(site_name)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'customer')
+    def _get_customer_id_op(self, login_id, fresh=False):
+        if self.index is not None and not fresh:
+            customer = self.index.customer(self.host, login_id)
+            if customer is not None:
+                return _answered(customer)
+
+        req_type_elm = ET.Element('customer')
         get_elm = ET.SubElement(req_type_elm, 'get')
         req_filter_elm = ET.SubElement(get_elm, 'filter')
         req_filter_key_elm = ET.SubElement(req_filter_elm, 'login')
@@ -351,35 +383,37 @@ class Client:
         dataset_elm = ET.SubElement(get_elm, 'dataset')
         ET.SubElement(dataset_elm, 'gen_info')
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
-
-        res_et = ET.fromstring(response)
+        def parse(res_et):
+            if res_et.find('.//status').text == 'error':
+                return False
+            else:
+                returnee = []
+                returnee.append(res_et.find('.//id').text)
+                returnee.append(res_et.find('.//pname').text)
+                if self.index is not None:
+                    self.index.add(self.host, 'customers', returnee[0], login=login_id, pname=returnee[1])
+                return returnee
 
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            returnee = []
-            returnee.append(res_et.find('.//id').text)
-            returnee.append(res_et.find('.//pname').text)
-            return returnee
+        return Operation(req_type_elm, parse)
 
-    def get_site_id(self, name):
+    def get_customer_id(self, login_id, fresh=False):
         """
         Takes the reqType, reqInfo, and reqFilter, and builds an XML request (because who likes to make XML?)
         Passes said XML to __query to get the XML result, then makes it usable.
 
-        :param name: The name of the site
-        :return: A the site ID.  Returns False if entity not found
+        :param login_id: The username for the control panel user
+        :param fresh: If true, ask Plesk even if the index knows
+        :return: A list with the customer id and the customer pretty name.  Returns False if entity not found
         """
+        return self._send([self._get_customer_id_op(login_id, fresh)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'site')
+    def _get_site_id_op(self, name, fresh=False):
+        if self.index is not None and not fresh:
+            site_id = self.index.site_id(self.host, name)
+            if site_id is not None:
+                return _answered(site_id)
+
+        req_type_elm = ET.Element('site')
         get_elm = ET.SubElement(req_type_elm, 'get')
         req_filter_elm = ET.SubElement(get_elm, 'filter')
         req_filter_key_elm = ET.SubElement(req_filter_elm, 'name')
@@ -387,32 +421,39 @@ class Client:
         dataset_elm = ET.SubElement(get_elm, 'dataset')
         ET.SubElement(dataset_elm, 'gen_info')
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
+        def parse(res_et):
+            if res_et.find('.//status').text == 'error':
+                return False
+            else:
+                site_id = res_et.find('.//id').text
+                if self.index is not None:
+                    self.index.add(self.host, 'sites', site_id, name=name,
+                                   webspace_id=res_et.findtext('.//gen_info/webspace-id'))
+                return site_id
 
-        if self.verbose:
-            print(response)
+        return Operation(req_type_elm, parse)
 
-        res_et = ET.fromstring(response)
+    def get_site_id(self, name, fresh=False):
+        """
+        Takes the reqType, reqInfo, and reqFilter, and builds an XML request (because who likes to make XML?)
+        Passes said XML to __query to get the XML result, then makes it usable.
 
-        if res_et.find('.//status').text == 'error':
-            return False
-        else:
-            return res_et.find('.//id').text
+        :param name: The name of the site
+        :param fresh: If true, ask Plesk even if the index knows
+        :return: A the site ID.  Returns False if entity not found
+        """
+        return self._send([self._get_site_id_op(name, fresh)])[0]
 
-    def __set_info(self, set_entity, set_type, set_info, set_filter=None):
+    def _set_info_op(self, set_entity, set_type, set_info, set_filter=None):
         """
-        Submits a query to the Plesk API to set some information, such as create customer
+        Builds an operation to set some information, such as create customer
         :param set_entity: What type of entity we're modifying - webspace, customer, etc.
         :param set_type: What type of information we're giving plesk - gen_info, hosting, etc.
         :param set_info: A dict containing key/value pairs of hosting/gen_info information
         :param set_filter: A dict with two members, 'key' and 'value' describing what we're modifying
-        :return: Boolean with success
+        :return: An Operation whose result is a boolean with success
         """
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        set_entity_elm = ET.SubElement(packet_elm, set_entity)
+        set_entity_elm = ET.Element(set_entity)
         set_elm = ET.SubElement(set_entity_elm, 'set')
         set_filter_elm = ET.SubElement(set_elm, 'filter')
         if set_filter:
@@ -424,63 +465,44 @@ class Client:
             infolet_elm = ET.SubElement(setTypeElm, infolet[0])
             infolet_elm.text = infolet[1]
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
+        def parse(res_elm):
+            res_info_elm = res_elm.find('.//result/status')
 
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
+            if res_info_elm.text == 'ok':
+                return True
+            else:
+                return False
 
-        res_elm = ET.fromstring(response)
-        res_info_elm = res_elm.find('result')
+        return Operation(set_entity_elm, parse)
 
-        if res_info_elm.text == 'ok':
-            return True
-        else:
-            return False
-
-    def set_dns(self, site, status):
-        """
-        Submits a query to the Plesk API to set some information, such as create customer
-        :param site: Site ID of the site to modify
-        :param status: Desired status, either 'enable' or 'disable'
-        :return: Boolean with success
-        """
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        set_entity_elm = ET.SubElement(packet_elm, 'dns')
+    def _set_dns_op(self, site, status):
+        set_entity_elm = ET.Element('dns')
         set_elm = ET.SubElement(set_entity_elm, status)
         set_filter_elm = ET.SubElement(set_elm, 'filter')
         req_filter = ET.SubElement(set_filter_elm, 'site-id')
         req_filter.text = site
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
+        def parse(res_elm):
+            res_info_elm = res_elm.find('.//status')
 
-        res_elm = ET.fromstring(response)
-        res_info_elm = res_elm.find('.//status')
+            if res_info_elm.text == 'ok':
+                return True
+            else:
+                return False
 
-        if res_info_elm.text == 'ok':
-            return True
-        else:
-            return False
+        return Operation(set_entity_elm, parse)
 
-    def set_webspace(self, hosting_info, site_id):
+    def set_dns(self, site, status):
         """
-        Creates an entity in plesk of type add_entity, and pre-populates it with information.
-
-        :param hosting_info: A dict containing key/value pairs of hosting information
-        :param site_id: This is the ID for the site to update
-        :return: list with status and Id if success, or status and error if failure
+        Submits a query to the Plesk API to set some information, such as create customer
+        :param site: Site ID of the site to modify
+        :param status: Desired status, either 'enable' or 'disable'
+        :return: Boolean with success
         """
+        return self._send([self._set_dns_op(site, status)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        set_entity_elm = ET.SubElement(packet_elm, 'webspace')
+    def _set_webspace_op(self, hosting_info, site_id):
+        set_entity_elm = ET.Element('webspace')
         set_elm = ET.SubElement(set_entity_elm, 'set')
         filter_elm = ET.SubElement(set_elm, 'filter')
         id_elm = ET.SubElement(filter_elm, 'id')
@@ -495,35 +517,26 @@ class Client:
             hostlet_value_elm = ET.SubElement(property_elm, 'value')
             hostlet_value_elm.text = hostlet[1]
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
+        def parse(res_elm):
+            if res_elm.find('.//status').text == 'ok':
+                return ['ok', res_elm.find('.//id').text]
+            else:
+                return [res_elm.find('.//status').text, res_elm.find('.//errtext').text]
 
-        res_elm = ET.fromstring(response)
+        return Operation(set_entity_elm, parse)
 
-        if res_elm.find('.//status').text == 'ok':
-            return ['ok', res_elm.find('.//id').text]
-        else:
-            return [res_elm.find('.//status').text, res_elm.find('.//errtext').text]
-
-    def add_webspace(self, gen_setup, hosting_type, hosting_info, hosting_ip, hosting_plan):
+    def set_webspace(self, hosting_info, site_id):
         """
         Creates an entity in plesk of type add_entity, and pre-populates it with information.
 
-        :param gen_setup: A dict containing key/value pairs of gen_info information
-        :param hosting_type: If creating a webspace or forward, what kind of entity we're creating
-        :param hosting_info: If creating a webspace or forward, a dict containing key/value pairs of hosting information
-        :param hosting_plan: If creating a webspace, which plan to use
-        :param hosting_ip: If creating a webspace, which IP address to bind to
+        :param hosting_info: A dict containing key/value pairs of hosting information
+        :param site_id: This is the ID for the site to update
         :return: list with status and Id if success, or status and error if failure
         """
+        return self._send([self._set_webspace_op(hosting_info, site_id)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        add_entity_elm = ET.SubElement(packet_elm, 'webspace')
+    def _add_webspace_op(self, gen_setup, hosting_type, hosting_info, hosting_ip, hosting_plan):
+        add_entity_elm = ET.Element('webspace')
         add_elm = ET.SubElement(add_entity_elm, 'add')
         gen_info_elm = ET.SubElement(add_elm, 'gen_setup')
         gen_setup['htype'] = hosting_type
@@ -544,40 +557,36 @@ class Client:
         hosting_plan_elm = ET.SubElement(add_elm, 'plan-name')
         hosting_plan_elm.text = hosting_plan
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
-
-        res_elm = ET.fromstring(response)
+        def parse(res_elm):
+            if res_elm.find('.//status').text == 'ok':
+                return ['ok', res_elm.find('.//id').text]
+            else:
+                return [res_elm.find('.//status').text, res_elm.find('.//errtext').text]
 
-        if res_elm.find('.//status').text == 'ok':
-            return ['ok', res_elm.find('.//id').text]
-        else:
-            return [res_elm.find('.//status').text, res_elm.find('.//errtext').text]
+        return Operation(add_entity_elm, parse)
 
-    def add_customer(self, customer_name):
+    def add_webspace(self, gen_setup, hosting_type, hosting_info, hosting_ip, hosting_plan):
         """
         Creates an entity in plesk of type add_entity, and pre-populates it with information.
 
-        :param customer_name: A pretty version of the customer's name.
-        :return: id of created entity
+        :param gen_setup: A dict containing key/value pairs of gen_info information
+        :param hosting_type: If creating a webspace or forward, what kind of entity we're creating
+        :param hosting_info: If creating a webspace or forward, a dict containing key/value pairs of hosting information
+        :param hosting_plan: If creating a webspace, which plan to use
+        :param hosting_ip: If creating a webspace, which IP address to bind to
+        :return: list with status and Id if success, or status and error if failure
         """
+        return self._send([self._add_webspace_op(gen_setup, hosting_type, hosting_info, hosting_ip, hosting_plan)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        add_entity_elm = ET.SubElement(packet_elm, 'customer')
+    def _add_customer_op(self, customer_name):
+        add_entity_elm = ET.Element('customer')
         add_elm = ET.SubElement(add_entity_elm, 'add')
         gen_info_elm = ET.SubElement(add_elm, 'gen_info')
         pname_elm = ET.SubElement(gen_info_elm, 'pname')
         pname_elm.text = customer_name
         login_elm = ET.SubElement(gen_info_elm, 'login')
 
-        # Make a friendly customer login - strip out non-alphanum, limit to 20 characters, add _cp
-        login_id = re.sub('[\W_]+', '', customer_name).lower()[:20] + '_cp'
-        login_elm.text = login_id
+        login_elm.text = customer_login(customer_name)
 
         passwd_elm = ET.SubElement(gen_info_elm, 'passwd')
         passwd_elm.text = ''.join(random.SystemRandom().choice(string.ascii_uppercase + string.ascii_lowercase +
@@ -586,34 +595,29 @@ class Client:
         email_elm = ET.SubElement(gen_info_elm, 'email')
         email_elm.text = 'hostmaster@firstscribe.com'
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
-
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
-
-        if self.verbose:
-            print(response)
-
-        res_elm = ET.fromstring(response)
+        def parse(res_elm):
+            if res_elm.find('.//status').text == 'ok':
+                return res_elm.find('.//id').text
+            else:
+                return False
 
-        if res_elm.find('.//status').text == 'ok':
-            return res_elm.find('.//id').text
-        else:
-            return False
+        return Operation(add_entity_elm, parse)
 
-    def add_dns_records(self, site_id, records):
+    def add_customer(self, customer_name):
         """
-        Takes the reqType, reqInfo, and reqFilter, and builds an XML request (because who likes to make XML?)
-        Passes said XML to __query to get the XML result, then makes it usable.
+        Creates an entity in plesk of type add_entity, and pre-populates it with information.
 
-        :param site_id: Which site to add records to.
-        :param records: A list of dicts, where the dicts contain a 'type', 'host', 'value', and optionally an 'opt'.  See
-            get_dns_records().
-        :return: A boolean with success
+        :param customer_name: A pretty version of the customer's name.
+        :return: id of created entity
         """
+        return self._send([self._add_customer_op(customer_name)])[0]
 
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        req_type_elm = ET.SubElement(packet_elm, 'dns')
+    def _add_dns_records_op(self, site_id, records):
+        # Nothing to add would be an empty <dns/>, with no action in it to ask Plesk for
+        if not records:
+            return _answered(True)
+
+        req_type_elm = ET.Element('dns')
         for record in records:
             get_elm = ET.SubElement(req_type_elm, 'add_rec')
             # I don't care what the dict says about the source site-id, I'm going to set my own
@@ -625,20 +629,40 @@ class Client:
             if record['opt']:
                 ET.SubElement(get_elm, 'opt').text = record['opt']
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
+        def parse(res_et):
+            # There's an add_rec result for every record, and any of them can fail on its own
+            return all(status_elm.text == 'ok' for status_elm in res_et.iter('status'))
 
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
+        return Operation(req_type_elm, parse)
 
-        if self.verbose:
-            print(response)
+    def add_dns_records(self, site_id, records):
+        """
+        Takes the reqType, reqInfo, and reqFilter, and builds an XML request (because who likes to make XML?)
+        Passes said XML to __query to get the XML result, then makes it usable.
 
-        res_et = ET.fromstring(response)
+        :param site_id: Which site to add records to.
+        :param records: A list of dicts, where the dicts contain a 'type', 'host', 'value', and optionally an 'opt'.  See
+            get_dns_records().
+        :return: True if every record was added
+        """
+        return self._send([self._add_dns_records_op(site_id, records)])[0]
 
-        if res_et.find('.//status').text == 'ok':
-            return True
-        else:
-           return False
+    def _del_dns_record_op(self, record_id):
+        set_entity_elm = ET.Element('dns')
+        set_elm = ET.SubElement(set_entity_elm, 'del_rec')
+        set_filter_elm = ET.SubElement(set_elm, 'filter')
+        req_filter = ET.SubElement(set_filter_elm, 'id')
+        req_filter.text = record_id
+
+        def parse(res_elm):
+            res_info_elm = res_elm.find('.//status')
+
+            if res_info_elm.text == 'ok':
+                return True
+            else:
+                return False
+
+        return Operation(set_entity_elm, parse)
 
     def del_dns_record(self, record_id):
         """
@@ -646,25 +670,136 @@ class Client:
         :param record_id: Id of record to be deleted
         :return: Boolean with success
         """
-        packet_elm = ET.Element('packet', {'version': '1.6.3.5'})
-        set_entity_elm = ET.SubElement(packet_elm, 'dns')
-        set_elm = ET.SubElement(set_entity_elm, 'del_rec')
-        set_filter_elm = ET.SubElement(set_elm, 'filter')
-        req_filter = ET.SubElement(set_filter_elm, 'id')
-        req_filter.text = record_id
+        return self._send([self._del_dns_record_op(record_id)])[0]
 
-        if self.verbose:
-            print(ET.tostring(packet_elm, 'utf-8'))
 
-        response = self.__query(ET.tostring(packet_elm, 'utf-8'))
+class _Response:
+    """
+    Parses a response packet as it comes off the socket.  Each operation gets its part of the response as soon as that
+    has all come in, and then it's thrown away; operations with an each get their results one at a time the same way.
+    So however big the response, only about one result's worth of it is ever kept.
+    """
 
+    def __init__(self, operations, verbose=False):
+        self.operations = operations
+        self.verbose = verbose
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        # The elements from the packet down to wherever the parser is
+        self.path = []
+        self.results = []
+        self.collected = []
+        self.failed = False
+        self.errors = 0
+        self.system_error = False
+        self.bytes = 0
+
+    def read(self, http_response):
+        """
+        Reads the whole response and parses it.
+
+        :param http_response: An http.client.HTTPResponse
+        :return: Itself, with results (the answer for each operation, in order), errors (how many error statuses there
+            were), system_error (whether Plesk turned the whole packet down) and bytes (how big the response was)
+        """
+        while True:
+            chunk = http_response.read(READ_BYTES)
+            if not chunk:
+                break
+            self.bytes += len(chunk)
+            if self.verbose:
+                print(self.decoder.decode(chunk), end='')
+            self.parser.feed(chunk)
+            self.__handle()
+
+        self.parser.close()
+        self.__handle()
         if self.verbose:
-            print(response)
+            print(self.decoder.decode(b'', final=True))
+        return self
+
+    def __operation(self):
+        """:return: The operation whose answer is being parsed, or None if Plesk answered more than we asked"""
+        if len(self.results) < len(self.operations):
+            return self.operations[len(self.results)]
+
+    def __handle(self):
+        for event, element in self.parser.read_events():
+            if event == 'start':
+                self.path.append(element)
+                continue
+
+            self.path.pop()
+            if element.tag == 'status' and element.text == 'error':
+                self.errors += 1
+
+            # packet/<entity>, one per operation (or a system error for the lot)
+            if len(self.path) == 1:
+                if element.tag == 'system':
+                    self.system_error = True
+                else:
+                    self.__finish(element)
+                self.path[0].remove(element)
+
+            # packet/<entity>/<action>/result
+            elif len(self.path) == 3 and element.tag == 'result':
+                operation = self.__operation()
+                if operation is not None and operation.each is not None:
+                    if element.findtext('status') == 'error':
+                        self.failed = True
+                    else:
+                        value = operation.each(element)
+                        if value is not None:
+                            self.collected.append(value)
+                    self.path[-1].remove(element)
+
+    def __finish(self, element):
+        operation = self.__operation()
+        if operation is None:
+            return
+
+        if operation.each is None:
+            self.results.append(operation.parse(element))
+        else:
+            self.results.append(False if self.failed else self.collected)
+        self.collected = []
+        self.failed = False
 
-        res_elm = ET.fromstring(response)
-        res_info_elm = res_elm.find('.//status')
 
-        if res_info_elm.text == 'ok':
-            return True
-        else:
-            return False
+class Batch:
+    """
+    A queue of Client operations that goes out as one packet.  Call the same methods you would on the Client, e.g.
+    batch.get_site_id('example.com'), then execute() to get back a list of results in the order they were queued.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.operations = []
+
+    def __getattr__(self, name):
+        builder = getattr(self.client, '_{0}_op'.format(name), None)
+        if builder is None:
+            raise AttributeError('{0} cannot be batched'.format(name))
+
+        def queue(*args, **kwargs):
+            self.operations.append(builder(*args, **kwargs))
+            # Hand back the position, so the caller can find this operation's result
+            return len(self.operations) - 1
+
+        return queue
+
+    def __len__(self):
+        return len(self.operations)
+
+    def execute(self):
+        """
+        Sends everything queued so far in a single packet, and empties the queue.
+
+        :return: A list with the result of each operation, in the order they were queued
+        """
+        if not self.operations:
+            return []
+
+        operations = self.operations
+        self.operations = []
+        return self.client._send(operations)
@@ -0,0 +1,198 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# What gets synced from each server, in the order it's asked for.  Each has a table of its own.
+KINDS = ['customers', 'webspaces', 'sites', 'dns_template']
+
+SCHEMA = """
+create table if not exists synced (host text, kind text, synced real, primary key (host, kind));
+create table if not exists customers (host text, id text, login text, pname text, primary key (host, id));
+create index if not exists customers_by_login on customers (host, login);
+create table if not exists webspaces (host text, id text, name text, owner_id text, primary key (host, id));
+create index if not exists webspaces_by_name on webspaces (host, name);
+create table if not exists sites (host text, id text, name text, webspace_id text, primary key (host, id));
+create index if not exists sites_by_name on sites (host, name);
+create table if not exists dns_template (host text, id text, record text, primary key (host, id));
+"""
+
+# The columns of each table that come from Plesk, besides host and id
+COLUMNS = {'customers': ['login', 'pname'], 'webspaces': ['name', 'owner_id'], 'sites': ['name', 'webspace_id'],
+           'dns_template': ['record']}
+
+
+class Index:
+    """
+    A local SQLite copy of what a batch keeps asking Plesk servers: their customers, webspaces, sites and DNS
+    template.  sync() pulls everything of each kind from a server in one packet, and after that only changes what
+    changed; Clients given the index answer lookups from it, and add what they look up live to it.  A kind that hasn't
+    been synced from the server within max_age is too old to answer from, so it's as though the index didn't know.
+
+    One file can be shared by any number of migrations at once.
+    """
+
+    def __init__(self, path, max_age=86400, verbose=False):
+        """
+        :param path: The SQLite file
+        :param max_age: How many seconds a synced kind is good for, both to answer lookups from and before sync() asks
+            the server again
+        :param verbose: Explain what is going on
+        """
+        self.path = path
+        self.max_age = max_age
+        self.verbose = verbose
+        self.connection = None
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def __connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Clients call in from the executor's threads, so the connection is shared under the lock
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute('pragma journal_mode=wal')
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    def __one(self, host, kind, sql, params):
+        if not self.current(host, kind):
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        with self.lock:
+            row = self.__connect().execute(sql, params).fetchone()
+            self.stats['hits' if row is not None else 'misses'] += 1
+            return row
+
+    def synced(self, host, kind):
+        """:return: When the kind was last synced from the host, as time.time(), or None if it never was"""
+        with self.lock:
+            row = self.__connect().execute('select synced from synced where host = ? and kind = ?',
+                                           (host, kind)).fetchone()
+        return row[0] if row is not None else None
+
+    def current(self, host, kind):
+        """:return: True if the kind was synced from the host within max_age, so lookups can be answered from it"""
+        synced = self.synced(host, kind)
+        return synced is not None and time.time() - synced <= self.max_age
+
+    def customer(self, host, login):
+        """:return: [id, pname] of the customer with that login, as get_customer_id() gives it, or None"""
+        row = self.__one(host, 'customers', 'select id, pname from customers where host = ? and login = ?',
+                         (host, login))
+        return list(row) if row is not None else None
+
+    def site_id(self, host, name):
+        """:return: The id of the site, as get_site_id() gives it, or None"""
+        row = self.__one(host, 'sites', 'select id from sites where host = ? and name = ?', (host, name))
+        return row[0] if row is not None else None
+
+    def webspace_id(self, host, name):
+        row = self.__one(host, 'webspaces', 'select id from webspaces where host = ? and name = ?', (host, name))
+        return row[0] if row is not None else None
+
+    def dns_template(self, host):
+        """:return: The server's DNS template, as get_dns_template() gives it, or None if it isn't current"""
+        if not self.current(host, 'dns_template'):
+            with self.lock:
+                self.stats['misses'] += 1
+            return None
+
+        with self.lock:
+            self.stats['hits'] += 1
+            rows = self.__connect().execute(
+                'select record from dns_template where host = ? order by cast(id as integer)', (host,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def add(self, host, kind, object_id, **columns):
+        """Records one object looked up live, e.g. add('web3', 'sites', '42', name='example.com', webspace_id='7')"""
+        names = ['host', 'id'] + COLUMNS[kind]
+        with self.lock:
+            connection = self.__connect()
+            with connection:
+                connection.execute('insert or replace into {0} ({1}) values ({2})'.format(
+                    kind, ', '.join(names), ', '.join('?' * len(names))),
+                    [host, object_id] + [columns.get(column) for column in COLUMNS[kind]])
+
+    def replace(self, host, kind, objects):
+        """
+        Brings the index's copy of a kind up to date with everything the server has of it: changes what changed, adds
+        what's new and drops what's gone, leaving the rest alone.
+
+        :param objects: A list of (id, dict of the kind's columns), as list_objects() gives them
+        :return: How many were added, changed and removed
+        """
+        columns = COLUMNS[kind]
+        with self.lock:
+            connection = self.__connect()
+            with connection:
+                objects = dict(objects)
+                existing = {row[0]: list(row[1:]) for row in connection.execute(
+                    'select id, {0} from {1} where host = ?'.format(', '.join(columns), kind), (host,))}
+
+                added = changed = 0
+                for object_id, values in objects.items():
+                    row = [values.get(column) for column in columns]
+                    if existing.get(object_id) == row:
+                        continue
+                    if object_id in existing:
+                        changed += 1
+                    else:
+                        added += 1
+                    connection.execute('insert or replace into {0} (host, id, {1}) values (?, ?, {2})'.format(
+                        kind, ', '.join(columns), ', '.join('?' * len(columns))), [host, object_id] + row)
+
+                removed = [object_id for object_id in existing if object_id not in objects]
+                connection.executemany('delete from {0} where host = ? and id = ?'.format(kind),
+                                       [(host, object_id) for object_id in removed])
+                connection.execute('insert or replace into synced (host, kind, synced) values (?, ?, ?)',
+                                   (host, kind, time.time()))
+
+        return added, changed, len(removed)
+
+    def sync(self, client, fresh=False):
+        """
+        Pulls the kinds that are older than max_age (or everything, if fresh) from a server, all in one packet.
+
+        :param client: A plesk.apiclient.Client for the server, with its credentials set
+        :param fresh: Sync every kind, however recently it was synced
+        :return: True if everything that was asked for came back
+        """
+        now = time.time()
+        wanted = [kind for kind in KINDS if fresh or now - (self.synced(client.host, kind) or 0) > self.max_age]
+        if not wanted:
+            if self.verbose:
+                print('{0}: the index is up to date'.format(client.host))
+            return True
+
+        batch = client.batch()
+        for kind in wanted:
+            if kind == 'dns_template':
+                batch.get_dns_template(fresh=True)
+            else:
+                batch.list_objects(kind)
+        results = batch.execute()
+
+        success = True
+        for kind, result in zip(wanted, results):
+            if result is False:
+                print('{0}: could not get the {1}'.format(client.host, kind.replace('_', ' ')))
+                success = False
+                continue
+            if kind == 'dns_template':
+                result = [(str(position), {'record': json.dumps(record, sort_keys=True)})
+                          for position, record in enumerate(result)]
+            added, changed, removed = self.replace(client.host, kind, result)
+            if self.verbose:
+                print('{0}: {1} {2}, {3} added, {4} changed, {5} removed'.format(
+                    client.host, len(result), kind.replace('_', ' '), added, changed, removed))
+        return success
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
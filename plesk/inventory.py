@@ -0,0 +1,181 @@
+import base64
+import json
+import os
+import threading
+import time
+
+import Crypto
+import Crypto.Cipher.AES
+import pymysql
+
+from telemetry.tracing import default_tracer
+
+
+def _host(hostname):
+    """:return: The hostname the way the cache keeps it, since DNS doesn't care about case or a trailing dot"""
+    return hostname.lower().rstrip('.')
+
+
+class Inventory:
+    """
+    The plesk instances known to Alex's PHP inventory app.  All the hosts asked for at once are fetched in a single
+    query over one reused connection, and the decrypted credentials are kept in memory for a while, and optionally in
+    an encrypted file on disk, so the inventory database doesn't get asked the same thing over and over.
+    """
+
+    def __init__(self, config_path='config.json', ttl=600, cache_path=None, verbose=False):
+        """
+        :param config_path: Where the config.json file used for PHP's site inventory lives
+        :param ttl: How many seconds a looked up host is good for
+        :param cache_path: If given, also keep the cache in this file, encrypted with the inventory's key
+        :param verbose: Explain what is going on
+        """
+        self.config_path = config_path
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.verbose = verbose
+        self.config = None
+        self.connection = None
+        self.cache = None
+        self.lock = threading.Lock()
+
+    def __load_config(self):
+        if self.config is None:
+            with open(self.config_path) as json_config_file:
+                self.config = json.load(json_config_file)['production']
+        return self.config
+
+    def __connect(self):
+        """
+        Hands back the inventory database connection, opening it the first time and reconnecting if it has dropped.
+        """
+        params = self.__load_config()['database']['params']
+
+        if self.connection is None:
+            if self.verbose:
+                print((params['host'], params['username'], params['dbname'], params['password']))
+            self.connection = pymysql.connect(host=params['host'], user=params['username'], db=params['dbname'],
+                                              password=params['password'])
+        else:
+            self.connection.ping(reconnect=True)
+
+        return self.connection
+
+    def __cipher(self, iv):
+        # I use CFB in both PHP and python.  It's not dependent on the phrase being a multiple of 16 bytes
+        return Crypto.Cipher.AES.new(self.__load_config()['enc_key'], Crypto.Cipher.AES.MODE_CFB, iv)
+
+    def __decrypt(self, encoded):
+        ciphertext_dec = base64.b64decode(encoded)
+
+        # The initialization vector should be the first 16 bytes of the encrypted data, that's how PHP stores it
+        iv = ciphertext_dec[0:16]
+
+        # The rest of the string is the encrypted data
+        return self.__cipher(iv).decrypt(ciphertext_dec[16:]).decode('utf-8')
+
+    def __encrypt(self, plaintext):
+        # Same layout as PHP's, so the IV rides along at the front
+        iv = os.urandom(16)
+        return base64.b64encode(iv + self.__cipher(iv).encrypt(plaintext.encode('utf-8')))
+
+    def __load_cache(self):
+        if self.cache is not None:
+            return
+
+        self.cache = {}
+        if self.cache_path and os.path.isfile(self.cache_path):
+            with open(self.cache_path, 'rb') as cache_fh:
+                try:
+                    self.cache = json.loads(self.__decrypt(cache_fh.read()))
+                except ValueError:
+                    # Garbled, or encrypted with some other key.  It's only a cache, start over.
+                    print('Ignoring unreadable inventory cache {0}'.format(self.cache_path))
+
+    def __save_cache(self):
+        if not self.cache_path:
+            return
+
+        # Write it out somewhere only we can read, then swap it in, so nobody sees half a file
+        temp_path = self.cache_path + '.tmp'
+        cache_fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(cache_fd, 'wb') as cache_fh:
+            cache_fh.write(self.__encrypt(json.dumps(self.cache)))
+        os.replace(temp_path, self.cache_path)
+
+    def lookup(self, hostnames, fresh=False):
+        """
+        Finds the plesk login, password and internal IP for each of the hosts.  Anything not cached, or cached for
+        longer than the TTL, is pulled from the inventory database in one query.
+
+        :param hostnames: A list of hostnames of plesk instances
+        :param fresh: If true, ignore the cache and ask the database
+        :return: A dict of hostname to a dict with 'hostname', 'username', 'password', and 'internal_ip'.  Hosts the
+            inventory doesn't know about are left out.
+        """
+        with self.lock:
+            self.__load_cache()
+
+            now = time.time()
+            keys = {_host(hostname) for hostname in hostnames}
+            wanted = [key for key in keys
+                      if fresh or key not in self.cache or now - self.cache[key]['fetched'] > self.ttl]
+
+            if wanted:
+                with default_tracer.span('inventory select plesks', category='inventory', hosts=len(wanted),
+                                         cached=len(keys) - len(wanted)) as span:
+                    with self.__connect().cursor() as cursor:
+                        sql = ("select hostname, username, password, internal_ip from plesks where hostname in ({0})"
+                               .format(', '.join(['%s'] * len(wanted))))
+                        cursor.execute(sql, wanted)
+                        result_tuples = cursor.fetchall()
+                    span.set(rows=len(result_tuples))
+
+                for result_tuple in result_tuples:
+                    result = {}
+                    for k, v in zip(('hostname', 'username', 'password', 'internal_ip'), result_tuple):
+                        result[k] = v
+
+                    if self.verbose:
+                        print(result)
+
+                    # Got me a shiny result, but the password is still encrypted
+                    result['password'] = self.__decrypt(result['password'])
+                    result['fetched'] = now
+                    self.cache[_host(result['hostname'])] = result
+
+                # Hosts that have gone from the inventory take their credentials with them
+                for key in set(wanted) - {_host(result_tuple[0]) for result_tuple in result_tuples}:
+                    self.cache.pop(key, None)
+
+                self.__save_cache()
+
+            found = {}
+            for hostname in hostnames:
+                if _host(hostname) in self.cache:
+                    found[hostname] = dict(self.cache[_host(hostname)])
+                    del found[hostname]['fetched']
+            return found
+
+    def forget(self, hostname=None):
+        """
+        Drops a host, or everything if no host is given, from the cache.
+
+        :param hostname: The host to forget
+        """
+        with self.lock:
+            self.__load_cache()
+            if hostname is None:
+                self.cache = {}
+            else:
+                self.cache.pop(_host(hostname), None)
+            self.__save_cache()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# Shared by every Client unless told otherwise, so the source and destination lookups share a query and a cache
+default_inventory = Inventory()
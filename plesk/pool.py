@@ -0,0 +1,133 @@
+import http.client
+import ssl
+import threading
+import time
+
+# Errors that mean the server hung up on a kept-alive socket, rather than anything being wrong with the request
+STALE_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, http.client.ResponseNotReady,
+                ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+
+
+class ConnectionPool:
+    """A small pool of persistent HTTP(S) connections, kept per protocol, host and port"""
+
+    def __init__(self, max_idle=4, idle_timeout=30):
+        """
+        :param max_idle: How many idle connections to keep around for each protocol/host/port
+        :param idle_timeout: Seconds an idle connection is trusted before we'd rather open a new one
+        """
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'reused': 0, 'handshakes': 0, 'handshake_time': 0.0, 'reconnects': 0}
+
+    def __connect(self, key):
+        protocol, host, port, ssl_unverified = key
+
+        if 'https' == protocol:
+            if ssl_unverified:
+                conn = http.client.HTTPSConnection(host, port, context=ssl._create_unverified_context())
+            else:
+                conn = http.client.HTTPSConnection(host, port)
+        else:
+            conn = http.client.HTTPConnection(host, port)
+
+        # Connect up front, so the TCP + TLS handshake gets timed on its own
+        start = time.monotonic()
+        conn.connect()
+        elapsed = time.monotonic() - start
+
+        with self.lock:
+            self.stats['handshakes'] += 1
+            self.stats['handshake_time'] += elapsed
+
+        return conn
+
+    def __acquire(self, key):
+        """
+        Hands out an idle connection for the key if there is a fresh enough one, otherwise opens a new one.
+
+        :return: A list with the connection and whether or not it was reused
+        """
+        now = time.monotonic()
+        with self.lock:
+            idle = self.idle.get(key, [])
+            while idle:
+                conn, last_used = idle.pop()
+                if now - last_used < self.idle_timeout:
+                    self.stats['reused'] += 1
+                    return [conn, True]
+                conn.close()
+
+        return [self.__connect(key), False]
+
+    def __release(self, key, conn):
+        with self.lock:
+            idle = self.idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    def request(self, protocol, host, port, method, url, body, headers, ssl_unverified=False, reader=None,
+                idempotent=False):
+        """
+        Sends a request over a pooled connection and reads the whole response.  If a reused connection turns out to
+        have been dropped by the server before the request went out, the request is sent once more on a brand new
+        connection.  Once it's out, the server may already have acted on it, so it only goes again if it's idempotent.
+
+        :param reader: If given, called with the http.client.HTTPResponse to read the body its own way (say, parsing
+            it as it comes in), instead of reading it all into memory.  It may be called again if the request has to be
+            sent again, so it shouldn't keep anything between calls.
+        :param idempotent: Whether sending the request twice does no more than sending it once, say a Plesk packet
+            that only gets things
+        :return: The response body, as bytes, or whatever reader returned
+        """
+        key = (protocol, host, port, ssl_unverified)
+
+        with self.lock:
+            self.stats['requests'] += 1
+
+        while True:
+            conn, reused = self.__acquire(key)
+            sending = True
+            try:
+                conn.request(method, url, body, headers)
+                sending = False
+                response = conn.getresponse()
+                if reader is None:
+                    data = response.read()
+                else:
+                    data = reader(response)
+                    # Whatever the reader left behind has to go before the connection can be used again
+                    response.read()
+            except STALE_ERRORS:
+                conn.close()
+                if not reused or not (sending or idempotent):
+                    raise
+                with self.lock:
+                    self.stats['reconnects'] += 1
+                continue
+            except Exception:
+                conn.close()
+                raise
+
+            if response.will_close:
+                conn.close()
+            else:
+                self.__release(key, conn)
+
+            return data
+
+    def close(self):
+        """Closes every idle connection"""
+        with self.lock:
+            for idle in self.idle.values():
+                for conn, last_used in idle:
+                    conn.close()
+            self.idle = {}
+
+
+# Shared by every Client unless told otherwise, so two clients for the same server share their sockets
+default_pool = ConnectionPool()
@@ -0,0 +1,69 @@
+import argparse
+import getpass
+import os
+
+import plesk.apiclient
+import plesk.index
+import plesk.inventory
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="copy plesk servers' customers, subscriptions, sites and DNS template "
+                                                 'into the local index that migrations answer lookups from')
+    parser.add_argument('hosts', help='the plesk servers to sync', nargs='+')
+    parser.add_argument('--index', help='the index file, defaults to ~/.migrate_o_matic/plesk-index.sqlite',
+                        default=os.path.expanduser('~/.migrate_o_matic/plesk-index.sqlite'))
+    parser.add_argument('--max-age', help='only sync what was last synced more than this many seconds ago, defaults '
+                                          'to 86400', type=int, default=86400)
+    parser.add_argument('--fresh', help='sync everything, however recently it was synced', action='store_true')
+    parser.add_argument('--port', help='the plesk API port, defaults to 8443', type=int, default=8443)
+    parser.add_argument('--user', help="the plesk user, if the inventory doesn't know the servers")
+    parser.add_argument('--password', help="the plesk password, if the inventory doesn't know the servers",
+                        nargs='?', const='prompt')
+    parser.add_argument('--inventory-cache', help='keep looked up plesk credentials, encrypted, in this file between '
+                                                  'runs')
+    parser.add_argument('-v', '--verbose', help='explain what is going on', action='store_true')
+    return parser
+
+
+def sync_hosts(hosts, index, port=8443, user=None, password=None, fresh=False, verbose=False):
+    """
+    Syncs each of the hosts into the index, with credentials out of the inventory unless they're given.
+
+    :return: True if every host synced
+    """
+    if user is None:
+        plesk.inventory.default_inventory.lookup(hosts)
+
+    success = True
+    for host in hosts:
+        client = plesk.apiclient.Client(host, port=port, verbose=verbose)
+        if user is not None:
+            client.set_credentials(user, password)
+        elif not client.lookup_plesk_info():
+            print('{0}: I cannot find credentials for it in the inventory'.format(host))
+            success = False
+            continue
+
+        success = index.sync(client, fresh=fresh) and success
+    return success
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    plesk.inventory.default_inventory.cache_path = args.inventory_cache
+    if args.password == 'prompt':
+        args.password = getpass.getpass('Please enter the plesk password: ')
+
+    index = plesk.index.Index(args.index, max_age=args.max_age, verbose=True)
+    try:
+        success = sync_hosts(args.hosts, index, port=args.port, user=args.user, password=args.password,
+                             fresh=args.fresh, verbose=args.verbose)
+    finally:
+        index.close()
+    exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+import time
+
+# The points in a stream bytes are counted at, in the order they pass them
+STAGES = ['read', 'compressed', 'sent', 'written']
+
+
+class PipelineTotals:
+    """What has gone through one kind of stream (say, the database's) so far"""
+
+    def __init__(self, name):
+        self.name = name
+        self.bytes = {stage: 0 for stage in STAGES}
+        self.streams = 0
+        self.running = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self.busy_since = None
+
+    def seconds(self, now=None):
+        """:return: How long streams of this kind have been going, not counting the gaps when none were"""
+        if self.busy_since is None:
+            return self.busy_seconds
+        return self.busy_seconds + (now or time.monotonic()) - self.busy_since
+
+    def rate(self, stage, now=None):
+        seconds = self.seconds(now)
+        return self.bytes[stage] / seconds if seconds else 0.0
+
+    def as_dict(self, now=None):
+        result = {'pipeline': self.name, 'streams': self.streams, 'failed': self.failed,
+                  'seconds': round(self.seconds(now), 3)}
+        result.update(self.bytes)
+        for stage in STAGES:
+            result['{0}_mb_per_second'.format(stage)] = round(self.rate(stage, now) / 1e6, 3)
+        if self.bytes['compressed']:
+            result['compression_ratio'] = round(self.bytes['read'] / self.bytes['compressed'], 3)
+        return result
+
+
+class Meter:
+    """
+    Counts the bytes going through a migration's streams at each stage: read from the source, out of the compressor,
+    handed to ssh, and written at the destination, where we can tell (the native database engine can, a stream going
+    into ssh can't).  Every so often it appends a progress event per pipeline to a JSON lines file, and at the end
+    writes a summary, so runs can be charted and compared across the fleet.
+
+    Everything is thread safe, since streams run side by side.
+    """
+
+    def __init__(self, events_path=None, labels=None, interval=10.0, echo=True):
+        """
+        :param events_path: The JSON lines file to append events to, or None to keep them in memory only
+        :param labels: A dict put in every event and the summary, to say which migration it was (site, hosts, ...)
+        :param interval: How many seconds between progress events
+        :param echo: Print a line of progress along with each progress event, as pv used to
+        """
+        self.events_path = events_path
+        self.labels = labels or {}
+        self.interval = interval
+        self.echo = echo
+        self.pipelines = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.last_progress = time.monotonic()
+        self.events_fh = None
+
+        if events_path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(events_path)), exist_ok=True)
+            self.events_fh = open(events_path, 'a')
+
+    def __pipeline(self, name):
+        if name not in self.pipelines:
+            self.pipelines[name] = PipelineTotals(name)
+        return self.pipelines[name]
+
+    def __event(self, event, fields):
+        record = {'time': round(time.time(), 3), 'event': event}
+        record.update(self.labels)
+        record.update(fields)
+        if self.events_fh is not None:
+            self.events_fh.write(json.dumps(record, sort_keys=True) + '\n')
+            self.events_fh.flush()
+
+    def stream_started(self, pipeline, **fields):
+        """Notes a stream starting, with anything worth knowing about it (which table, which shard, ...)"""
+        with self.lock:
+            now = time.monotonic()
+            totals = self.__pipeline(pipeline)
+            totals.streams += 1
+            totals.running += 1
+            if totals.busy_since is None:
+                totals.busy_since = now
+            fields['pipeline'] = pipeline
+            self.__event('stream_started', fields)
+
+    def stream_finished(self, pipeline, exitcode, **fields):
+        with self.lock:
+            now = time.monotonic()
+            totals = self.__pipeline(pipeline)
+            totals.running -= 1
+            if exitcode != 0:
+                totals.failed += 1
+            if totals.running == 0 and totals.busy_since is not None:
+                totals.busy_seconds += now - totals.busy_since
+                totals.busy_since = None
+            fields.update({'pipeline': pipeline, 'exitcode': exitcode})
+            self.__event('stream_finished', fields)
+
+    def add(self, pipeline, stage, count):
+        """Counts bytes through a stage of a pipeline, and sends out progress if it's been a while"""
+        with self.lock:
+            self.__pipeline(pipeline).bytes[stage] += count
+            now = time.monotonic()
+            if now - self.last_progress >= self.interval:
+                self.last_progress = now
+                self.__progress(now)
+
+    def __progress(self, now):
+        for totals in self.pipelines.values():
+            if totals.busy_since is None:
+                continue
+            self.__event('progress', totals.as_dict(now))
+            if self.echo:
+                print('{0}: {1:.1f} MB read, {2:.1f} MB sent, {3:.1f} MB/s'.format(
+                    totals.name, totals.bytes['read'] / 1e6, totals.bytes['sent'] / 1e6,
+                    totals.rate('read', now) / 1e6))
+
+    def summary(self):
+        """:return: A dict of the totals for every pipeline, with the labels"""
+        with self.lock:
+            now = time.monotonic()
+            result = dict(self.labels)
+            result.update({
+                'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started)),
+                'seconds': round(time.time() - self.started, 3),
+                'pipelines': [totals.as_dict(now) for name, totals in sorted(self.pipelines.items())],
+            })
+            return result
+
+    def write_summary(self, path):
+        """Writes the summary out as JSON, and notes it in the events"""
+        summary = self.summary()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as summary_fh:
+            json.dump(summary, summary_fh, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+        with self.lock:
+            self.__event('summary', {'pipelines': summary['pipelines'], 'seconds': summary['seconds']})
+        return summary
+
+    def close(self):
+        if self.events_fh is not None:
+            self.events_fh.close()
+            self.events_fh = None
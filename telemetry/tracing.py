@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+
+
+class Span:
+    """One timed call, say a Plesk packet or a DNS query, and what's worth knowing about it"""
+
+    def __init__(self, name, category, attributes):
+        self.name = name
+        self.category = category
+        self.attributes = attributes
+        self.status = 'ok'
+        self.thread = threading.get_ident()
+        self.start = time.monotonic()
+        self.end = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def seconds(self):
+        return (self.end if self.end is not None else time.monotonic()) - self.start
+
+
+class Tracer:
+    """
+    Keeps timed spans of the calls a migration makes to other systems (Plesk, the inventory database, DNS), so we can
+    see where the time goes.  They can be ranked slowest first, or written out in Chrome's trace event format for
+    chrome://tracing, Perfetto or speedscope to draw.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.lock = threading.Lock()
+        self.origin = time.monotonic()
+        self.started = time.time()
+
+    def span(self, name, category='call', **attributes):
+        """
+        Times a block, e.g.
+
+            with tracer.span('dns NS', category='dns', query=site) as span:
+                answers = dns.resolver.query(site, 'NS')
+                span.set(answers=len(answers))
+
+        An exception marks the span with its name as the status, and carries on out.
+        """
+        return _Timing(self, Span(name, category, attributes))
+
+    def add(self, name, start, end, category='call', thread=None, **attributes):
+        """
+        Records something timed elsewhere, from time.monotonic() start and end.
+
+        :param thread: Which row it goes in when drawn, defaults to the current thread's
+        """
+        span = Span(name, category, attributes)
+        span.start = start
+        span.end = end
+        if thread is not None:
+            span.thread = thread
+        self.record(span)
+
+    def record(self, span):
+        with self.lock:
+            self.spans.append(span)
+
+    def report(self, limit=15):
+        """:return: A printable ranking of the operations that took longest in all, and the slowest single calls"""
+        with self.lock:
+            spans = [span for span in self.spans if span.category != 'phase']
+
+        if not spans:
+            return 'No calls were traced'
+
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span.name, []).append(span)
+        totals = sorted(by_name.items(), key=lambda item: -sum(span.seconds() for span in item[1]))
+
+        lines = ['{0:<50} {1:>6} {2:>9} {3:>9} {4:>9}'.format('operation', 'calls', 'total', 'mean', 'max')]
+        for name, named in totals[:limit]:
+            seconds = [span.seconds() for span in named]
+            lines.append('{0:<50} {1:>6} {2:>9.3f} {3:>9.3f} {4:>9.3f}'.format(
+                name[:50], len(named), sum(seconds), sum(seconds) / len(seconds), max(seconds)))
+
+        lines.append('')
+        lines.append('Slowest calls:')
+        for span in sorted(spans, key=lambda span: -span.seconds())[:limit]:
+            details = ', '.join('{0}={1}'.format(key, value) for key, value in sorted(span.attributes.items()))
+            lines.append('{0:>9.3f}s {1} [{2}] {3}'.format(span.seconds(), span.name, span.status, details))
+        return '\n'.join(lines)
+
+    def export_chrome(self, path):
+        """Writes the spans out in Chrome's trace event format, one row per thread"""
+        with self.lock:
+            spans = list(self.spans)
+
+        threads = {}
+        events = []
+        for span in spans:
+            tid = threads.setdefault(span.thread, len(threads) + 1)
+            args = dict(span.attributes)
+            args['status'] = span.status
+            events.append({'name': span.name, 'cat': span.category, 'ph': 'X', 'pid': os.getpid(), 'tid': tid,
+                           'ts': round((span.start - self.origin) * 1e6), 'dur': round(span.seconds() * 1e6),
+                           'args': args})
+
+        # Rows we named ourselves (rather than real threads) get their names shown
+        for thread, tid in threads.items():
+            if isinstance(thread, str):
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid,
+                               'args': {'name': thread}})
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w') as trace_fh:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'started': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.started))}},
+                      trace_fh, default=str)
+
+
+class _Timing:
+    def __init__(self, tracer, span):
+        self.tracer = tracer
+        self.span = span
+
+    def __enter__(self):
+        self.span.start = time.monotonic()
+        return self.span
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.span.end = time.monotonic()
+        if exc_type is not None:
+            self.span.status = exc_type.__name__
+        self.tracer.record(self.span)
+        return False
+
+
+# Shared by everything unless told otherwise, so one run's calls all end up in one place
+default_tracer = Tracer()
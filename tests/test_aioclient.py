@@ -0,0 +1,62 @@
+import asyncio
+import io
+import threading
+import time
+
+from plesk.aioclient import AsyncClient
+from telemetry.tracing import Tracer
+
+SITE = ('<packet><site><get><result><status>ok</status><id>42</id><data><gen_info><name>example.com</name>'
+        '</gen_info></data></result></get></site></packet>')
+
+
+class _SlowPool:
+    """Answers every packet with the same site after a pause, noting how many were in flight at once"""
+
+    def __init__(self, pause=0.2):
+        self.pause = pause
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def request(self, protocol, host, port, method, url, body, headers, ssl_unverified=False, reader=None,
+                idempotent=False):
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        time.sleep(self.pause)
+        with self.lock:
+            self.in_flight -= 1
+        return reader(io.BytesIO(SITE.encode()))
+
+
+def _client(pool, tracer=None):
+    client = AsyncClient('plesk.example', pool=pool, tracer=tracer)
+    client.set_credentials('admin', 'secret')
+    return client
+
+
+def test_calls_overlap():
+    pool = _SlowPool()
+
+    async def both():
+        return await asyncio.gather(_client(pool).get_site_id('example.com'),
+                                    _client(pool).get_site_id('example.com'))
+
+    assert asyncio.run(both()) == ['42', '42']
+    assert pool.most_in_flight == 2
+
+
+def test_batch_execute_is_a_coroutine():
+    async def batched():
+        batch = _client(_SlowPool(0)).batch()
+        batch.get_site_id('example.com')
+        return await batch.execute()
+
+    assert asyncio.run(batched()) == ['42']
+
+
+def test_spans_go_to_the_given_tracer():
+    tracer = Tracer()
+    asyncio.run(_client(_SlowPool(0), tracer=tracer).get_site_id('example.com'))
+    assert [span.name for span in tracer.spans] == ['plesk site.get']
@@ -0,0 +1,176 @@
+import io
+import xml.etree.ElementTree as ET
+
+import pytest
+
+import plesk.apiclient
+from plesk.apiclient import Client
+
+
+class _Pool:
+    """Stands in for the connection pool, answering every packet with the same canned response"""
+
+    def __init__(self, response):
+        self.response = response
+        self.packets = []
+        self.idempotent = []
+
+    def request(self, protocol, host, port, method, url, body, headers, ssl_unverified=False, reader=None,
+                idempotent=False):
+        self.packets.append(ET.fromstring(body))
+        self.idempotent.append(idempotent)
+        return reader(io.BytesIO(self.response.encode()))
+
+
+def _client(response):
+    client = Client('plesk.example', pool=_Pool(response))
+    client.set_credentials('admin', 'secret')
+    return client
+
+
+SITE_AND_CUSTOMER = ('<packet>'
+                     '<site><get><result><status>ok</status><id>42</id><data><gen_info><name>example.com</name>'
+                     '<webspace-id>7</webspace-id></gen_info></data></result></get></site>'
+                     '<customer><get><result><status>ok</status><id>3</id><data><gen_info><login>jo</login>'
+                     '<pname>Jo</pname></gen_info></data></result></get></customer>'
+                     '</packet>')
+
+
+def test_batch_goes_out_as_one_packet():
+    client = _client(SITE_AND_CUSTOMER)
+    batch = client.batch()
+    assert batch.get_site_id('example.com') == 0
+    assert batch.get_customer_id('jo') == 1
+    assert len(batch) == 2
+
+    assert batch.execute() == ['42', ['3', 'Jo']]
+    assert len(batch) == 0
+    assert len(client.pool.packets) == 1
+    assert [element.tag for element in client.pool.packets[0]] == ['site', 'customer']
+
+
+def test_empty_batch_sends_nothing():
+    client = _client(SITE_AND_CUSTOMER)
+    assert client.batch().execute() == []
+    assert client.pool.packets == []
+
+
+def test_system_error_fails_every_operation():
+    client = _client('<packet><system><status>error</status><errcode>1001</errcode></system></packet>')
+    batch = client.batch()
+    batch.get_site_id('example.com')
+    batch.get_customer_id('jo')
+    assert batch.execute() == [False, False]
+
+
+def test_error_status_fails_only_its_operation():
+    client = _client('<packet>'
+                     '<site><get><result><status>error</status><errcode>1013</errcode></result></get></site>'
+                     '<customer><get><result><status>ok</status><id>3</id><data><gen_info><pname>Jo</pname>'
+                     '</gen_info></data></result></get></customer>'
+                     '</packet>')
+    batch = client.batch()
+    batch.get_site_id('missing.example')
+    batch.get_customer_id('jo')
+    assert batch.execute() == [False, ['3', 'Jo']]
+
+
+def test_only_packets_that_get_things_may_be_resent():
+    client = _client(SITE_AND_CUSTOMER)
+    client.get_site_id('example.com')
+    client.add_customer('Jo Bloggs')
+    assert client.pool.idempotent == [True, False]
+
+
+def test_unknown_operations_cannot_be_batched():
+    batch = _client(SITE_AND_CUSTOMER).batch()
+    with pytest.raises(AttributeError):
+        batch.reboot_the_server()
+
+
+def _records(*values):
+    results = ''.join('<result><status>ok</status><id>{0}</id><data><type>A</type><host>{1}</host></data></result>'
+                      .format(index, value) for index, value in enumerate(values))
+    return '<dns><get_rec>{0}</get_rec></dns>'.format(results)
+
+
+class _Chunked(io.BytesIO):
+    """A response that never hands over more than a few bytes at a time, whatever it's asked for"""
+
+    def read(self, size=-1):
+        return super().read(5)
+
+
+def test_results_are_parsed_as_they_come_in():
+    client = _client('')
+    seen = []
+
+    def each(result_elm):
+        seen.append(result_elm.findtext('data/host'))
+        return None if result_elm.findtext('data/host') == 'skip.example.com.' else result_elm.findtext('id')
+
+    operations = [client._get_site_id_op('example.com'), plesk.apiclient.Operation(ET.Element('dns'), None, each)]
+    response = plesk.apiclient._Response(operations).read(_Chunked((
+        '<?xml version="1.0" encoding="UTF-8"?><packet>'
+        '<site><get><result><status>ok</status><id>42</id></result></get></site>' +
+        _records('example.com.', 'skip.example.com.', 'ünïcode.example.com.') + '</packet>').encode()))
+
+    assert response.results == ['42', ['0', '2']]
+    assert seen == ['example.com.', 'skip.example.com.', 'ünïcode.example.com.']
+    assert (response.errors, response.system_error) == (0, False)
+
+
+def test_an_error_result_fails_the_whole_operation():
+    client = _client('<packet>' + _records('example.com.').replace('<status>ok', '<status>error', 1) +
+                     _records('example.com.') + '</packet>')
+    batch = client.batch()
+    batch.get_dns_records('42')
+    batch.get_dns_records('43')
+    assert batch.execute() == [False, [{'type': 'A', 'host': 'example.com.'}]]
+
+
+def test_answers_are_thrown_away_once_parsed():
+    held = []
+
+    def each(result_elm):
+        # packet/dns/get_rec, with whatever results it still has hold of
+        held.append(len(response.path[2]))
+        return result_elm.findtext('id')
+
+    response = plesk.apiclient._Response([plesk.apiclient.Operation(ET.Element('dns'), None, each)])
+    response.read(_Chunked(('<packet>' + _records(*['host{0}.'.format(i) for i in range(50)]) +
+                            '</packet>').encode()))
+    assert response.results == [[str(i) for i in range(50)]]
+    assert max(held) <= 2
+
+
+def test_verbose_prints_the_response_as_it_came(capsys):
+    packet = '<packet>\n  <site><get><result><status>ok</status><id>42</id></result></get></site>\n</packet>'
+    client = _client('')
+    response = plesk.apiclient._Response([client._get_site_id_op('example.com')], verbose=True)
+    response.read(_Chunked(packet.encode()))
+    assert response.results == ['42']
+    assert capsys.readouterr().out == packet + '\n'
+    assert response.bytes == len(packet)
+
+
+def test_adding_no_records_sends_nothing():
+    client = _client(SITE_AND_CUSTOMER)
+    assert client.add_dns_records('42', []) is True
+    batch = client.batch()
+    batch.get_site_id('example.com')
+    batch.add_dns_records('42', [])
+    assert batch.execute() == ['42', True]
+    assert [element.tag for element in client.pool.packets[0]] == ['site']
+
+
+def test_one_record_plesk_turns_down_fails_the_lot():
+    added = '<add_rec><result><status>ok</status><id>{0}</id></result></add_rec>'
+    refused = '<add_rec><result><status>error</status><errcode>1007</errcode></result></add_rec>'
+    records = [{'type': 'A', 'host': 'shop', 'value': '192.0.2.9', 'opt': ''}] * 3
+    client = _client('<packet><dns>{0}{1}{2}</dns></packet>'.format(added.format(1), added.format(2), refused))
+    assert client.add_dns_records('42', records) is False
+    assert len(client.pool.packets[0].find('dns')) == 3
+
+    client = _client('<packet><dns>{0}{1}</dns></packet>'.format(added.format(1), added.format(2)))
+    assert client.add_dns_records('42', records[:2]) is True
@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+
+import pytest
+
+import migrate_o_matic
+from batch.scheduler import Job, Limits, argv_for, load_jobs, report, retry_argv, run_jobs
+
+# Stands in for migrate_o_matic.py: sleeps, notes when it ran, and exits with the status its site name asks for
+FAKE_MIGRATION = '''
+import sys, time
+print('start', time.monotonic(), flush=True)
+time.sleep(0.2)
+print('end', time.monotonic())
+sys.exit(int(sys.argv[1].split('-')[-1]))
+'''
+
+
+def test_argv_for():
+    argv = argv_for({'site': 'example.com', 'destination': 'aws-web1', 'dest_sftp_user': 'example', 'verbose': True,
+                     'no_db': False, 'scan_prune': ['cache', 'tmp'], 'db_workers': 4, 'dest_sftp_pass': None})
+    assert argv == ['example.com', 'aws-web1', '--db-workers', '4', '--dest-sftp-user', 'example', '--scan-prune',
+                    'cache', '--scan-prune', 'tmp', '--verbose']
+
+
+def test_load_jobs(tmpdir):
+    path = os.path.join(str(tmpdir), 'batch.json')
+    with open(path, 'w') as batch_fh:
+        json.dump({'defaults': {'source_plesk_host': 'old-plesk', 'dest_db_host': 'db1'},
+                   'sites': [{'site': 'a.example', 'destination': 'web1'},
+                             {'site': 'b.example', 'destination': 'web2', 'no_db': True}]}, batch_fh)
+    jobs = load_jobs(path, migrate_o_matic.build_parser())
+    assert [job.name for job in jobs] == ['a.example', 'b.example']
+    assert jobs[0].hosts == {('source', 'old-plesk'), ('destination', 'web1'), ('db', 'db1')}
+    assert jobs[1].hosts == {('source', 'old-plesk'), ('destination', 'web2')}
+    assert jobs[0].argv[-1] == '--unattended'
+
+
+def test_load_jobs_refuses_bad_arguments(tmpdir):
+    path = os.path.join(str(tmpdir), 'batch.json')
+    with open(path, 'w') as batch_fh:
+        json.dump({'sites': [{'site': 'a.example', 'destination': 'web1', 'db_engine': 'carrier-pigeon'}]}, batch_fh)
+    with pytest.raises(ValueError):
+        load_jobs(path, migrate_o_matic.build_parser())
+
+
+def test_limits():
+    limits = Limits({'destination': 1, 'source': 2})
+    first = Job('a', [], {('source', 'old'), ('destination', 'web1')})
+    second = Job('b', [], {('source', 'old'), ('destination', 'web1')})
+    third = Job('c', [], {('source', 'old'), ('destination', 'web2')})
+    limits.take(first)
+    assert not limits.fits(second)
+    assert limits.fits(third)
+    limits.give_back(first)
+    assert limits.fits(second)
+
+
+def _run(tmpdir, names, limits, workers=4, retries=1):
+    jobs = [Job(name, [name], {('destination', name.split('-')[0])}) for name in names]
+    command = [sys.executable, '-c', FAKE_MIGRATION]
+    return run_jobs(jobs, Limits(limits), workers, command, str(tmpdir), retries=retries, retry_delay=0)
+
+
+def _span(job):
+    with open(job.log_path) as log_fh:
+        times = dict(line.split() for line in log_fh)
+    return float(times['start']), float(times['end'])
+
+
+def test_busy_hosts_hold_their_jobs_back(tmpdir):
+    jobs = _run(tmpdir, ['web1-a-0', 'web1-b-0', 'web2-c-0'], {'destination': 1})
+    assert [job.exitcode for job in jobs] == [0, 0, 0]
+    first, second, third = [_span(job) for job in jobs]
+    assert second[0] >= first[1]
+    assert third[0] < first[1]
+
+
+def test_failed_jobs_are_tried_again(tmpdir):
+    jobs = _run(tmpdir, ['web1-1', 'web2-2'], {'destination': 2}, retries=2)
+    assert [(job.exitcode, job.attempts) for job in jobs] == [(1, 3), (2, 1)]
+    assert report(jobs).endswith('0 of 2 sites migrated, 2 failed')
+
+
+def test_jobs_that_cannot_start_give_their_hosts_back(tmpdir):
+    jobs = [Job(name, [name], {('destination', 'web1')}) for name in ('a', 'b')]
+    run_jobs(jobs, Limits({'destination': 1}), 2, [str(tmpdir.join('no-such-command'))], str(tmpdir), retries=1,
+             retry_delay=0)
+    assert [(job.exitcode, job.attempts) for job in jobs] == [(1, 2), (1, 2)]
+
+
+def test_retry_argv_picks_up_where_it_stopped():
+    argv = ['example.com', 'web1', '--new-customer', 'Example Ltd', '--verbose', '--unattended']
+    assert retry_argv(argv, {}) == argv
+    assert retry_argv(argv, {'reached': ['customer'], 'customer': 'exampleltd_cp'}) == [
+        'example.com', 'web1', '--verbose', '--unattended', '--existing-customer', 'exampleltd_cp']
+    assert retry_argv(argv, {'reached': ['customer', 'site'], 'customer': 'exampleltd_cp'}) == [
+        'example.com', 'web1', '--verbose', '--unattended', '--existing-customer', 'exampleltd_cp', '--freshen']
+    assert retry_argv(argv, {'reached': ['customer', 'site', 'db_refs'], 'customer': 'exampleltd_cp'}) is None
+
+    freshen = ['example.com', 'web1', '--existing-customer', 'jo', '--freshen']
+    assert retry_argv(freshen, {'reached': ['customer', 'site'], 'customer': 'jo'}) == [
+        'example.com', 'web1', '--freshen', '--existing-customer', 'jo']
+
+
+# Notes how far it got, as migrate_o_matic does, and fails the first time
+FAKE_PROGRESS = '''
+import json, sys
+argv = sys.argv[1:]
+path = argv[argv.index('--progress-file') + 1]
+print(' '.join(argv[:argv.index('--progress-file')]))
+if '--freshen' not in argv:
+    with open(path, 'w') as progress_fh:
+        json.dump({'reached': sys.argv[1].split('+'), 'customer': 'jo_cp'}, progress_fh)
+    sys.exit(1)
+'''
+
+
+def test_failed_jobs_are_tried_again_from_where_they_stopped(tmpdir):
+    jobs = [Job(name, [name, '--new-customer', 'Jo'], {('destination', name)})
+            for name in ('customer+site', 'customer+site+db_refs')]
+    # The progress of an earlier batch doesn't count
+    tmpdir.join('customer+site.progress.json').write('{"reached": ["customer", "site", "db_refs"]}')
+    run_jobs(jobs, Limits({}), 2, [sys.executable, '-c', FAKE_PROGRESS], str(tmpdir), retries=1, retry_delay=0)
+    assert [(job.exitcode, job.attempts) for job in jobs] == [(0, 2), (1, 1)]
+    with open(jobs[0].log_path) as log_fh:
+        assert log_fh.read() == 'customer+site --existing-customer jo_cp --freshen\n'
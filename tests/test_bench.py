@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+import bench.fake_plesk
+import bench.sitegen
+import cms.magento
+import plesk.apiclient
+import plesk.pool
+
+
+def _tree(root):
+    found = {}
+    for dir_path, dir_names, file_names in os.walk(root):
+        for file_name in file_names:
+            path = os.path.join(dir_path, file_name)
+            with open(path, 'rb') as file_fh:
+                found[os.path.relpath(path, root)] = file_fh.read()
+    return found
+
+
+@pytest.mark.parametrize('kind', bench.sitegen.KINDS)
+def test_sitegen_makes_the_same_tree_every_time(tmpdir, kind):
+    first = bench.sitegen.generate(str(tmpdir.join('first')), kind, files=200, average_bytes=500)
+    second = bench.sitegen.generate(str(tmpdir.join('second')), kind, files=200, average_bytes=500)
+    assert first == second
+    assert first[0] == 200
+    tree = _tree(str(tmpdir.join('first')))
+    assert tree == _tree(str(tmpdir.join('second')))
+    assert len(tree) == first[0]
+    assert sum(len(data) for data in tree.values()) == first[1]
+
+    # Another seed makes a tree of the same shape, but not the same tree
+    other = bench.sitegen.generate(str(tmpdir.join('other')), kind, files=200, average_bytes=500, seed=2)
+    other_tree = _tree(str(tmpdir.join('other')))
+    assert other_tree != tree
+    assert other[0] == len(other_tree) == first[0]
+    assert other[1] == sum(len(data) for data in other_tree.values())
+
+
+def test_sitegen_makes_installs_the_scanner_knows(tmpdir):
+    bench.sitegen.generate(str(tmpdir.join('wp')), 'wordpress', files=50)
+    bench.sitegen.generate(str(tmpdir.join('mage')), 'magento', files=50)
+    assert tmpdir.join('wp', 'wp-config.php').check(file=True)
+    magento = cms.magento.Instance(str(tmpdir.join('mage')))
+    assert (magento.user, magento.password, magento.name) == ('bench_mage', 'benchpass', 'bench_mage')
+
+
+def test_sitegen_rejects_unknown_kinds(tmpdir):
+    with pytest.raises(ValueError):
+        bench.sitegen.generate(str(tmpdir), 'drupal')
+
+
+@pytest.fixture
+def fake():
+    fake = bench.fake_plesk.FakePlesk(latency=0, per_operation=0, dns_records=8, certificates=3)
+    fake.port = fake.start()
+    yield fake
+    fake.stop()
+
+
+def _client(fake):
+    client = plesk.apiclient.Client('127.0.0.1', port=fake.port, protocol='http', pool=plesk.pool.ConnectionPool())
+    client.set_credentials('admin', 'benchpass')
+    return client
+
+
+def test_fake_plesk_answers_the_client(fake):
+    client = _client(fake)
+    site_id = client.get_site_id('example.com')
+    assert site_id == '42'
+    records = client.get_dns_records(site_id)
+    assert len(records) == 8
+    assert records[0]['type'] == 'A'
+    assert records[7]['host'] == 'host7.example.com.'
+    assert client.get_protected_dirs(site_id) == ['private0']
+    assert client.get_customer_id('example') == ['42', 'Example Customer']
+    assert client.add_customer('Jo Bloggs') == '43'
+    assert (fake.requests, fake.operations) == (5, 5)
+
+
+def test_fake_plesk_counts_a_batch_as_one_request(fake):
+    batch = _client(fake).batch()
+    batch.get_site_id('example.com')
+    batch.get_dns_template()
+    batch.get_customer_id('example')
+    site_id, template, customer = batch.execute()
+    assert site_id == '42'
+    assert template[0]['host'] == '<domain>'
+    assert (fake.requests, fake.operations) == (1, 3)
+
+
+def test_fake_plesk_turns_away_the_unauthorised(fake):
+    response = fake.answer(b'<packet><site><get><filter/></get></site></packet>', authorised=None)
+    assert b'<errcode>1001</errcode>' in response
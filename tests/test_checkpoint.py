@@ -0,0 +1,59 @@
+import json
+import os
+
+from database.checkpoint import Checkpoint
+
+
+def _path(tmpdir):
+    return os.path.join(str(tmpdir), 'state', 'db.checkpoint')
+
+
+def test_a_new_checkpoint_starts_from_nothing(tmpdir):
+    checkpoint = Checkpoint(_path(tmpdir), 'src/db', 'dest/db')
+    assert not checkpoint.resuming
+    assert not checkpoint.is_table_done('wp_posts')
+    assert checkpoint.last_key('wp_posts') is None
+
+
+def test_picks_up_where_the_last_run_stopped(tmpdir):
+    checkpoint = Checkpoint(_path(tmpdir), 'src/db', 'dest/db')
+    checkpoint.schema_done()
+    checkpoint.table_done('wp_options')
+    checkpoint.set_last_key('wp_posts', ['42'])
+
+    again = Checkpoint(_path(tmpdir), 'src/db', 'dest/db')
+    assert again.resuming
+    assert again.is_table_done('wp_options')
+    assert not again.is_table_done('wp_posts')
+    assert again.last_key('wp_posts') == ['42']
+
+
+def test_ignores_checkpoints_of_other_copies(tmpdir):
+    checkpoint = Checkpoint(_path(tmpdir), 'src/db', 'dest/db')
+    checkpoint.schema_done()
+    assert not Checkpoint(_path(tmpdir), 'src/other', 'dest/db').resuming
+    assert not Checkpoint(_path(tmpdir), 'src/db', 'dest/other').resuming
+    assert not Checkpoint(_path(tmpdir), 'src/db', 'dest/db', fresh=True).resuming
+
+
+def test_ignores_a_broken_checkpoint(tmpdir):
+    os.makedirs(os.path.dirname(_path(tmpdir)))
+    with open(_path(tmpdir), 'w') as checkpoint_fh:
+        checkpoint_fh.write('{"source": "src/db", "sche')
+    assert not Checkpoint(_path(tmpdir), 'src/db', 'dest/db').resuming
+
+
+def test_every_step_is_saved_whole(tmpdir):
+    checkpoint = Checkpoint(_path(tmpdir), 'src/db', 'dest/db')
+    checkpoint.table_done('wp_options')
+    with open(_path(tmpdir)) as checkpoint_fh:
+        assert json.load(checkpoint_fh)['tables']['wp_options']['done']
+    assert not os.path.exists(_path(tmpdir) + '.tmp')
+
+
+def test_finish_leaves_nothing_to_pick_up(tmpdir):
+    checkpoint = Checkpoint(_path(tmpdir), 'src/db', 'dest/db')
+    checkpoint.schema_done()
+    checkpoint.finish()
+    assert not os.path.exists(_path(tmpdir))
+    assert not Checkpoint(_path(tmpdir), 'src/db', 'dest/db').resuming
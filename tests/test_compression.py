@@ -0,0 +1,64 @@
+import shutil
+import subprocess
+
+import pytest
+
+import transfer.compression
+from transfer.compression import Codec, choose_codec, get_codec
+
+
+def test_get_codec_takes_a_level():
+    codec = get_codec('zstd:6', threads=2)
+    assert (codec.name, codec.level, codec.threads) == ('zstd', 6, 2)
+    assert codec.compress == 'zstd -c -q -6 -T2'
+    assert str(codec) == 'zstd:6'
+    assert get_codec('xz').level == 6
+
+
+def test_unknown_codecs_are_refused():
+    with pytest.raises(ValueError):
+        get_codec('brotli')
+
+
+def test_none_leaves_pipelines_alone():
+    codec = get_codec('none')
+    assert str(codec) == 'none'
+    assert codec.pipe_out('tar cf - .') == 'tar cf - .'
+    assert codec.pipe_in('tar xf -') == 'tar xf -'
+
+
+def test_single_threaded_codecs_ignore_threads():
+    codec = Codec('lz4', threads=8)
+    assert codec.threads == 1
+    assert codec.pipe_in('tar xf -') == 'lz4 -d -c | tar xf -'
+
+
+@pytest.mark.parametrize('spec', ['lz4', 'zstd:1', 'xz:1'])
+def test_round_trip(spec):
+    codec = get_codec(spec, threads=1)
+    if shutil.which(codec.name) is None:
+        pytest.skip('no {0} here'.format(codec.name))
+    data = b'all work and no play makes jack a dull boy\n' * 1000
+    squeezed = subprocess.run(codec.compress, shell=True, input=data, stdout=subprocess.PIPE, check=True).stdout
+    assert len(squeezed) < len(data)
+    unsqueezed = subprocess.run(codec.decompress, shell=True, input=squeezed, stdout=subprocess.PIPE,
+                                check=True).stdout
+    assert unsqueezed == data
+
+
+@pytest.fixture
+def measured(monkeypatch):
+    # Per thread speed and ratio, fast and loose to slow and tight
+    results = {'none': [float('inf'), 1.0], 'lz4': [500e6, 2.0], 'zstd': [100e6, 3.0], 'xz': [5e6, 5.0]}
+    monkeypatch.setattr(transfer.compression, 'measure_codec', lambda codec, sample: results[codec.name])
+    monkeypatch.setattr(transfer.compression, 'idle_cores', lambda: 4.0)
+
+
+def test_fast_links_get_no_compression(measured):
+    codec = choose_codec('echo sample', 10e9, candidates=['none', 'lz4', 'zstd:3', 'xz:4'])
+    assert codec.name == 'none'
+
+
+def test_slow_links_get_the_best_ratio_the_cores_can_keep_up_with(measured):
+    assert choose_codec('echo sample', 1e6, candidates=['none', 'lz4', 'zstd:3', 'xz:4']).name == 'xz'
+    assert choose_codec('echo sample', 50e6, candidates=['none', 'lz4', 'zstd:3', 'xz:4']).name == 'zstd'
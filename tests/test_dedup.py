@@ -0,0 +1,128 @@
+import os
+
+import pytest
+
+from fs.manifest import Entry, file_digest
+from transfer.dedup import Store
+
+# Runs the "remote" commands right here, in a shell of their own as ssh would
+LOCAL = 'sh -c "{0}"'
+
+
+@pytest.fixture
+def dirs(tmpdir):
+    dirs = {name: os.path.join(str(tmpdir), name) for name in ('store', 'first', 'second', 'work')}
+    for name in 'first', 'second', 'work':
+        os.mkdir(dirs[name])
+    return dirs
+
+
+def _write(root, path, data):
+    full_path = os.path.join(root, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as file_fh:
+        file_fh.write(data)
+    return full_path
+
+
+def _entry(root, path, mode=0o644, mtime=1500000000):
+    full_path = os.path.join(root, path)
+    return path, Entry('f', os.path.getsize(full_path), mtime, mode, file_digest(full_path))
+
+
+def test_wants_only_the_code():
+    store = Store('/store', LOCAL)
+    assert store.wants('wp-includes/version.php')
+    assert store.wants('wp-content/plugins/akismet/akismet.php')
+    assert not store.wants('wp-content/uploads/2020/01/cat.jpg')
+    assert not store.wants('wp-config.php')
+    assert Store('/store', LOCAL, patterns=['*.php']).wants('wp-config.php')
+
+
+def test_key():
+    assert Store('/store', LOCAL).key('abcdef') == 'ab/abcdef'
+
+
+def test_files_added_by_one_site_are_placed_for_the_next(dirs):
+    store = Store(dirs['store'], LOCAL)
+    _write(dirs['first'], 'wp-includes/version.php', b'<?php $wp_version = "6.0";')
+    files = [_entry(dirs['first'], 'wp-includes/version.php')]
+    assert store.place(files, dirs['first'], dirs['work']) == {}
+    store.add(files, dirs['first'], dirs['work'])
+
+    stored = os.path.join(dirs['store'], store.key(files[0][1].digest))
+    assert os.stat(stored).st_mode & 0o777 == 0o444
+
+    placed_files = [('wp-includes/version.php', files[0][1]._replace(mode=0o640))]
+    assert store.place(placed_files, dirs['second'], dirs['work']) == dict(placed_files)
+    placed = os.path.join(dirs['second'], 'wp-includes/version.php')
+    with open(placed, 'rb') as placed_fh:
+        assert placed_fh.read() == b'<?php $wp_version = "6.0";'
+    assert os.stat(placed).st_mode & 0o777 == 0o640
+    assert int(os.stat(placed).st_mtime) == 1500000000
+    assert (store.hits, store.misses) == (1, 1)
+    assert 'a hit rate of 50%' in store.report()
+
+
+def test_damaged_store_copies_are_never_handed_out(dirs):
+    store = Store(dirs['store'], LOCAL)
+    _write(dirs['first'], 'wp-admin/index.php', b'<?php // admin')
+    files = [_entry(dirs['first'], 'wp-admin/index.php')]
+    store.add(files, dirs['first'], dirs['work'])
+
+    stored = os.path.join(dirs['store'], store.key(files[0][1].digest))
+    os.chmod(stored, 0o644)
+    with open(stored, 'wb') as stored_fh:
+        stored_fh.write(b'<?php // tampered')
+    assert store.known({files[0][1].digest}, dirs['work']) == set()
+    assert store.place(files, dirs['second'], dirs['work']) == {}
+
+    # Adding it again puts it right
+    store.add(files, dirs['first'], dirs['work'])
+    assert store.known({files[0][1].digest}, dirs['work']) == {files[0][1].digest}
+
+
+def test_linked_files_share_the_store_copy(dirs):
+    store = Store(dirs['store'], LOCAL, link=True)
+    _write(dirs['first'], 'wp-includes/load.php', b'<?php // load')
+    files = [_entry(dirs['first'], 'wp-includes/load.php', mode=0o444)]
+    store.add(files, dirs['first'], dirs['work'])
+    placed = store.place(files, dirs['second'], dirs['work'])
+    linked = os.stat(os.path.join(dirs['second'], 'wp-includes/load.php'))
+    assert linked.st_nlink == 2
+    # The link has the store copy's time, not the one it was sent with, and the entry says so
+    assert placed == {'wp-includes/load.php': files[0][1]._replace(mtime=int(linked.st_mtime))}
+
+
+def test_files_meant_to_be_writable_are_copied_even_when_linking(dirs):
+    store = Store(dirs['store'], LOCAL, link=True)
+    _write(dirs['first'], 'wp-includes/load.php', b'<?php // load')
+    files = [_entry(dirs['first'], 'wp-includes/load.php')]
+    store.add(files, dirs['first'], dirs['work'])
+    assert store.place(files, dirs['second'], dirs['work']) == dict(files)
+    placed = os.stat(os.path.join(dirs['second'], 'wp-includes/load.php'))
+    assert (placed.st_nlink, placed.st_mode & 0o777) == (1, 0o644)
+
+
+def test_store_copies_cleaned_out_after_asking_are_sent_instead(dirs, monkeypatch):
+    store = Store(dirs['store'], LOCAL)
+    _write(dirs['first'], 'wp-includes/load.php', b'<?php // load')
+    files = [_entry(dirs['first'], 'wp-includes/load.php')]
+    store.add(files, dirs['first'], dirs['work'])
+
+    # Another migration's clean up gets in between known() and the copying
+    known = store.known
+
+    def _known(digests, work_dir):
+        found = known(digests, work_dir)
+        os.remove(os.path.join(dirs['store'], store.key(files[0][1].digest)))
+        return found
+
+    monkeypatch.setattr(store, 'known', _known)
+    assert store.place(files, dirs['second'], dirs['work']) == {}
+    assert not os.path.exists(os.path.join(dirs['second'], 'wp-includes/load.php'))
+    assert (store.hits, store.misses) == (0, 1)
+
+
+def test_an_empty_store_knows_nothing(dirs):
+    assert Store(dirs['store'], LOCAL).known({'0' * 40}, dirs['work']) == set()
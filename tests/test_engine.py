@@ -0,0 +1,85 @@
+import pymysql
+import pytest
+
+from database.engine import Engine, TableStats, quote
+
+
+class _Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        if query in self.connection.refuse:
+            raise pymysql.err.OperationalError(1227, 'Access denied; you need the RELOAD privilege')
+        self.connection.log.append((self.connection.name, query))
+
+
+class _Connection:
+    """Notes every statement run on it, in one log shared with the other connections"""
+
+    def __init__(self, name, log, refuse=()):
+        self.name = name
+        self.log = log
+        self.refuse = refuse
+
+    def cursor(self, cursor_class=None):
+        return _Cursor(self)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = Engine({}, {})
+    log = []
+    names = iter(range(100))
+    monkeypatch.setattr(engine, 'connect_source', lambda: _Connection(next(names), log))
+    return engine, log
+
+
+def test_quote():
+    assert quote('wp_posts') == '`wp_posts`'
+    assert quote('odd`name') == '`odd``name`'
+
+
+def test_after_key_spells_out_the_comparison():
+    engine = Engine({}, {})
+    assert engine.after_key(['id'], ['7']) == 'WHERE (`id` > 7)'
+    assert engine.after_key(['a', 'b'], ['1', "'x'"]) == "WHERE (`a` > 1) OR (`a` = 1 AND `b` > 'x')"
+    assert engine.after_key(['id'], ['7'], 'NOT spam') == 'WHERE ((`id` > 7)) AND (NOT spam)'
+
+
+def test_at_key():
+    assert Engine({}, {}).at_key(['a', 'b'], ['1', '2']) == 'WHERE `a` = 1 AND `b` = 2'
+
+
+def test_table_stats():
+    stats = TableStats('wp_posts')
+    assert stats.rows_per_second() == 0.0
+    stats.rows, stats.bytes, stats.seconds = 100, 2000000, 2.0
+    assert stats.rows_per_second() == 50.0
+    assert str(stats) == 'wp_posts: 100 rows, 2000000 bytes in 2.0s (50 rows/s, 1.00 MB/s)'
+
+
+def test_snapshots_are_all_taken_under_one_lock(engine):
+    engine, log = engine
+    source = _Connection('lock', log)
+    connections = engine.connect_snapshots(source, 3)
+    assert len(connections) == 3
+    assert log[0] == ('lock', 'FLUSH TABLES WITH READ LOCK')
+    assert log[-1] == ('lock', 'UNLOCK TABLES')
+    started = [name for name, query in log if query == 'START TRANSACTION WITH CONSISTENT SNAPSHOT']
+    assert started == [0, 1, 2]
+
+
+def test_snapshots_are_still_taken_without_the_lock(engine, capsys):
+    engine, log = engine
+    source = _Connection('lock', log, refuse=['FLUSH TABLES WITH READ LOCK'])
+    engine.connect_snapshots(source, 2)
+    assert ('lock', 'UNLOCK TABLES') not in log
+    assert [name for name, query in log if query.startswith('START TRANSACTION')] == [0, 1]
+    assert 'Could not lock the source' in capsys.readouterr().out
@@ -0,0 +1,88 @@
+import os
+
+from fs.scanner import scan_site
+from transfer.files import plan_shards, stream_count
+
+
+def _write(root, path, size=0):
+    full_path = os.path.join(str(root), path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as file_fh:
+        file_fh.write(b'x' * size)
+    return full_path
+
+
+def _site(root):
+    for i in range(40):
+        _write(root, 'wp-content/uploads/{0}/{1}.jpg'.format(i % 4, i), 10000 + i)
+    for i in range(10):
+        _write(root, 'wp-includes/{0}.php'.format(i), 500)
+    _write(root, 'index.php', 100)
+    return str(root)
+
+
+def _files(plan):
+    """:return: Every file the plan's shards send, relative to the root, and how many times"""
+    sent = {}
+    for shard in plan.shards:
+        paths = [path for path in shard.loose if os.path.isfile(os.path.join(plan.root, path))]
+        for subtree in shard.subtrees:
+            for dir_path, dir_names, file_names in os.walk(os.path.join(plan.root, subtree)):
+                paths.extend(os.path.relpath(os.path.join(dir_path, name), plan.root) for name in file_names)
+        for path in paths:
+            sent[path] = sent.get(path, 0) + 1
+    return sent
+
+
+def _all_files(root):
+    return {os.path.relpath(os.path.join(dir_path, name), root)
+            for dir_path, dir_names, file_names in os.walk(root) for name in file_names}
+
+
+def test_every_file_goes_exactly_once(tmpdir):
+    root = _site(tmpdir)
+    plan = plan_shards(scan_site(root), 4)
+    sent = _files(plan)
+    assert set(sent) == _all_files(root)
+    assert set(sent.values()) == {1}
+    assert plan.directories[0] == '.'
+
+
+def test_shards_come_out_about_even(tmpdir):
+    root = _site(tmpdir)
+    plan = plan_shards(scan_site(root), 4)
+    assert len(plan.shards) == 4
+    sizes = sorted(shard.bytes for shard in plan.shards)
+    assert sizes[-1] - sizes[0] <= sizes[-1] / 2
+
+
+def test_hardlinks_stay_together(tmpdir):
+    root = _site(tmpdir)
+    os.link(os.path.join(root, 'index.php'), os.path.join(root, 'wp-content/uploads/0/index.php'))
+    plan = plan_shards(scan_site(root), 4)
+    holding = [shard for shard in plan.shards if 'index.php' in shard.loose]
+    assert len(holding) == 1
+    assert 'wp-content/uploads/0/index.php' in holding[0].loose
+    assert set(_files(plan).values()) == {1}
+
+
+def test_pruned_directories_go_whole(tmpdir):
+    root = _site(tmpdir)
+    _write(root, 'wp-content/cache/page.html', 100)
+    plan = plan_shards(scan_site(root, prune=['cache']), 2)
+    assert any('wp-content/cache' in shard.subtrees for shard in plan.shards)
+    assert set(_files(plan)) == _all_files(root)
+
+
+def test_skipped_directories_go_empty(tmpdir):
+    root = _site(tmpdir)
+    _write(root, 'var/cache/mage--0/mage---1', 5000)
+    plan = plan_shards(scan_site(root), 2, skip=['var/cache'])
+    assert 'var/cache' in plan.directories
+    assert not any(path.startswith('var/cache/') for path in _files(plan))
+
+
+def test_stream_count():
+    assert stream_count('3') == 3
+    assert stream_count(0) == 1
+    assert stream_count('auto') >= 1
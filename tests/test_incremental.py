@@ -0,0 +1,33 @@
+import os
+
+import transfer.shell
+from fs.manifest import build, compare
+from transfer.compression import get_codec
+from transfer.incremental import send
+
+
+def test_modes_survive_the_destination_umask(tmpdir):
+    root = os.path.join(str(tmpdir), 'source')
+    dest_dir = os.path.join(str(tmpdir), 'destination')
+    work_dir = os.path.join(str(tmpdir), 'work')
+    for path in root, dest_dir, work_dir:
+        os.mkdir(path)
+    for name, mode in ('public.php', 0o644), ('script.sh', 0o755):
+        with open(os.path.join(root, name), 'w') as file_fh:
+            file_fh.write(name)
+        os.chmod(os.path.join(root, name), mode)
+
+    # The destination's user has a stricter umask than whoever made the files
+    send(root, ['public.php', 'script.sh'], dest_dir, "sh -c 'umask 077 && {0}'", get_codec('none'), work_dir)
+
+    delta = compare(build(root), build(dest_dir))
+    assert delta.send == []
+    assert os.stat(os.path.join(dest_dir, 'script.sh')).st_mode & 0o777 == 0o755
+
+
+def test_extracts_with_the_senders_modes(tmpdir, monkeypatch):
+    # Only root's tar keeps modes by default, and the destination's user isn't root
+    commands = []
+    monkeypatch.setattr(transfer.shell, 'run', lambda command, **kwargs: commands.append(command) or 0)
+    send(str(tmpdir), ['index.php'], '/var/www/httpdocs', 'ssh host "{0}"', get_codec('none'), str(tmpdir))
+    assert 'tar xpf - -C /var/www/httpdocs' in commands[0].sink
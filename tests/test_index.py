@@ -0,0 +1,158 @@
+import io
+import threading
+import time
+import xml.etree.ElementTree as ET
+import xml.sax.saxutils
+
+import pytest
+
+import plesk.index
+from plesk.apiclient import Client
+from plesk.index import Index
+
+
+class _Pool:
+    """Stands in for the connection pool, answering each packet with the next canned response"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.packets = []
+
+    def request(self, protocol, host, port, method, url, body, headers, ssl_unverified=False, reader=None,
+                idempotent=False):
+        self.packets.append(ET.fromstring(body))
+        return reader(io.BytesIO(self.responses.pop(0).encode()))
+
+
+def _result(object_id, **fields):
+    gen_info = ''.join('<{0}>{1}</{0}>'.format(field.replace('_', '-'), value) for field, value in fields.items())
+    return '<result><status>ok</status><id>{0}</id><data><gen_info>{1}</gen_info></data></result>'.format(object_id,
+                                                                                                           gen_info)
+
+
+def _everything(customers, webspaces, sites, template):
+    records = ''.join('<result><status>ok</status><id>{0}</id><data><type>{1}</type><host>{2}</host>'
+                      '<value>{3}</value></data></result>'.format(index, *map(xml.sax.saxutils.escape, record))
+                      for index, record in enumerate(template))
+    customers, webspaces, sites = [''.join(_result(object_id, **fields) for object_id, fields in objects)
+                                   for objects in (customers, webspaces, sites)]
+    return ('<packet><customer><get>{0}</get></customer><webspace><get>{1}</get></webspace><site><get>{2}</get></site>'
+            '<dns><get_rec>{3}</get_rec></dns></packet>'.format(customers, webspaces, sites, records))
+
+
+def _customer(object_id, login, pname):
+    return object_id, {'login': login, 'pname': pname}
+
+
+@pytest.fixture
+def index(tmpdir):
+    index = Index(str(tmpdir.join('index', 'plesk.sqlite')))
+    yield index
+    index.close()
+
+
+def test_replace_changes_only_what_changed(index):
+    assert index.replace('web3', 'customers', [_customer('1', 'jo', 'Jo'), _customer('2', 'al', 'Al')]) == (2, 0, 0)
+    assert index.replace('web3', 'customers', [_customer('1', 'jo', 'Jo Bloggs'), _customer('3', 'sam', 'Sam')]) == \
+        (1, 1, 1)
+    assert index.customer('web3', 'jo') == ['1', 'Jo Bloggs']
+    assert index.customer('web3', 'al') is None
+    # Another server's are its own
+    assert index.customer('web4', 'jo') is None
+    assert index.stats == {'hits': 1, 'misses': 2}
+    assert index.synced('web3', 'customers') is not None
+    assert index.synced('web3', 'sites') is None
+
+
+def test_add_and_look_up(index):
+    index.replace('web3', 'sites', [])
+    index.replace('web3', 'webspaces', [])
+    index.add('web3', 'sites', '42', name='example.com', webspace_id='7')
+    index.add('web3', 'webspaces', '7', name='example.com', owner_id='3')
+    assert index.site_id('web3', 'example.com') == '42'
+    assert index.webspace_id('web3', 'example.com') == '7'
+    index.add('web3', 'sites', '43', name='example.com')
+    assert index.site_id('web3', 'example.org') is None
+
+
+def test_the_index_is_shared_between_threads(index):
+    index.replace('web3', 'sites', [])
+
+    def add(start):
+        for object_id in range(start, start + 50):
+            index.add('web3', 'sites', str(object_id), name='site{0}.example.com'.format(object_id))
+
+    threads = [threading.Thread(target=add, args=(start,)) for start in range(0, 200, 50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert [index.site_id('web3', 'site{0}.example.com'.format(i)) for i in range(200)] == \
+        [str(i) for i in range(200)]
+
+
+def test_sync_pulls_everything_in_one_packet(tmpdir, index):
+    template = [('A', '<domain>.', '<ip>'), ('MX', '<domain>.', 'mail.<domain>.')]
+    pool = _Pool(_everything([('3', {'login': 'jo', 'pname': 'Jo'})],
+                             [('7', {'name': 'example.com', 'owner_id': '3'})],
+                             [('42', {'name': 'example.com', 'webspace_id': '7'})], template))
+    client = Client('web3', pool=pool, index=index)
+    client.set_credentials('admin', 'secret')
+    assert index.sync(client)
+    assert len(pool.packets) == 1
+    assert [element.tag for element in pool.packets[0]] == ['customer', 'webspace', 'site', 'dns']
+
+    # Lookups are answered from the index, without going to Plesk
+    assert client.get_site_id('example.com') == '42'
+    assert client.get_customer_id('jo') == ['3', 'Jo']
+    assert client.get_dns_template() == [{'type': 'A', 'host': '<domain>.', 'value': '<ip>'},
+                                         {'type': 'MX', 'host': '<domain>.', 'value': 'mail.<domain>.'}]
+    assert len(pool.packets) == 1
+
+    # Until max_age is up, there's nothing to sync
+    assert index.sync(client)
+    assert len(pool.packets) == 1
+
+
+def test_lookups_the_index_misses_are_added_to_it(index):
+    index.replace('web3', 'sites', [])
+    pool = _Pool('<packet><site><get>{0}</get></site></packet>'.format(_result('42', name='example.com',
+                                                                               webspace_id='7')))
+    client = Client('web3', pool=pool, index=index)
+    client.set_credentials('admin', 'secret')
+    assert client.get_site_id('example.com') == '42'
+    assert client.get_site_id('example.com') == '42'
+    assert len(pool.packets) == 1
+
+
+def test_a_kind_plesk_would_not_give_is_not_marked_synced(index, capsys):
+    pool = _Pool('<packet>'
+                 '<customer><get><result><status>error</status><errcode>1006</errcode></result></get></customer>'
+                 '<webspace><get></get></webspace><site><get></get></site><dns><get_rec></get_rec></dns></packet>')
+    client = Client('web3', pool=pool, index=index)
+    client.set_credentials('admin', 'secret')
+    assert not index.sync(client)
+    assert 'web3: could not get the customers' in capsys.readouterr().out
+    assert index.synced('web3', 'customers') is None
+    assert index.synced('web3', 'sites') is not None
+    assert index.dns_template('web3') == []
+
+
+def test_a_kind_not_synced_lately_is_not_answered_from(index, monkeypatch):
+    index.replace('web3', 'sites', [('42', {'name': 'example.com', 'webspace_id': '7'})])
+    index.replace('web3', 'dns_template', [('0', {'record': '{"type": "A"}'})])
+    index.add('web3', 'customers', '3', login='jo', pname='Jo')
+    assert index.site_id('web3', 'example.com') == '42'
+    assert index.dns_template('web3') == [{'type': 'A'}]
+    # Never synced, so it isn't known whether jo is still there
+    assert index.customer('web3', 'jo') is None
+
+    later = time.time() + index.max_age + 1
+    monkeypatch.setattr(plesk.index.time, 'time', lambda: later)
+    assert index.site_id('web3', 'example.com') is None
+    assert index.dns_template('web3') is None
+
+    pool = _Pool('<packet><site><get>{0}</get></site></packet>'.format(_result('43', name='example.com')))
+    client = Client('web3', pool=pool, index=index)
+    client.set_credentials('admin', 'secret')
+    assert client.get_site_id('example.com') == '43'
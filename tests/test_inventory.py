@@ -0,0 +1,101 @@
+import base64
+import os
+
+import Crypto.Cipher.AES
+
+from plesk.inventory import Inventory
+
+KEY = b'0123456789abcdef'
+
+
+def _encrypt(plaintext):
+    iv = os.urandom(16)
+    return base64.b64encode(iv + Crypto.Cipher.AES.new(KEY, Crypto.Cipher.AES.MODE_CFB, iv).encrypt(
+        plaintext.encode('utf-8'))).decode()
+
+
+class _Connection:
+    """Stands in for the inventory database, with one plesk in it"""
+
+    def __init__(self):
+        self.queries = []
+
+    def ping(self, reconnect=False):
+        pass
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def execute(self, sql, params):
+        self.queries.append(params)
+        # MySQL compares case-insensitively, as the real table would
+        self.rows = [('web3.example.com', 'admin', _encrypt('secret'), '10.0.0.3')
+                     for hostname in params if hostname.lower() == 'web3.example.com']
+
+    def fetchall(self):
+        return self.rows
+
+
+def _inventory(tmpdir=None):
+    inventory = Inventory(cache_path=os.path.join(tmpdir, 'cache') if tmpdir else None)
+    inventory.config = {'database': {'params': {}}, 'enc_key': KEY}
+    inventory.connection = _Connection()
+    return inventory
+
+
+def test_looks_up_and_decrypts():
+    inventory = _inventory()
+    found = inventory.lookup(['web3.example.com', 'nowhere.example.com'])
+    assert found == {'web3.example.com': {'hostname': 'web3.example.com', 'username': 'admin', 'password': 'secret',
+                                          'internal_ip': '10.0.0.3'}}
+
+
+def test_asks_once_while_cached():
+    inventory = _inventory()
+    inventory.lookup(['web3.example.com'])
+    inventory.lookup(['web3.example.com'])
+    assert len(inventory.connection.queries) == 1
+
+    inventory.lookup(['web3.example.com'], fresh=True)
+    assert len(inventory.connection.queries) == 2
+
+
+def test_case_and_trailing_dot_do_not_matter():
+    inventory = _inventory()
+    found = inventory.lookup(['WEB3.example.com.'])
+    assert found['WEB3.example.com.']['password'] == 'secret'
+    assert inventory.lookup(['web3.example.com'])['web3.example.com']['internal_ip'] == '10.0.0.3'
+    assert len(inventory.connection.queries) == 1
+
+
+def test_cache_file_survives_a_new_inventory(tmpdir):
+    _inventory(str(tmpdir)).lookup(['web3.example.com'])
+    inventory = _inventory(str(tmpdir))
+    assert inventory.lookup(['web3.example.com'])['web3.example.com']['password'] == 'secret'
+    assert inventory.connection.queries == []
+
+
+def test_forget():
+    inventory = _inventory()
+    inventory.lookup(['web3.example.com'])
+    inventory.forget('Web3.example.com')
+    inventory.lookup(['web3.example.com'])
+    assert len(inventory.connection.queries) == 2
+
+
+def test_hosts_gone_from_the_inventory_are_dropped(tmpdir):
+    inventory = _inventory(str(tmpdir))
+    inventory.lookup(['web3.example.com'])
+    inventory.connection.fetchall = lambda: []
+    assert inventory.lookup(['web3.example.com'], fresh=True) == {}
+    assert inventory.cache == {}
+    # Nor is it in the cache file any more
+    again = _inventory(str(tmpdir))
+    again.lookup(['web3.example.com'])
+    assert len(again.connection.queries) == 1
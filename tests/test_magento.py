@@ -0,0 +1,155 @@
+import os
+
+import pytest
+
+import cms.magento
+import cms.slim
+import cms.wordpress
+
+LOCAL_XML = '''<?xml version="1.0"?>
+<config>
+    <global>
+        <resources>
+            <db>
+                <table_prefix><![CDATA[mage_]]></table_prefix>
+            </db>
+            <!-- The store's database -->
+            <default_setup>
+                <connection>
+                    <host><![CDATA[db1.example.com]]></host>
+                    <username>store</username>
+                    <password><![CDATA[s3cret&more]]></password>
+                    <dbname>store_live</dbname>
+                    <initStatements><![CDATA[SET NAMES utf8]]></initStatements>
+                </connection>
+            </default_setup>
+        </resources>
+    </global>
+</config>
+'''
+
+ENV_PHP = '''<?php
+return [
+    'backend' => ['frontName' => 'admin_1x2y'],
+    'db' => [
+        'table_prefix' => 'm2_',
+        'connection' => [
+            'default' => [
+                'host' => 'db1.example.com',
+                'dbname' => 'store_live',
+                'username' => 'store',
+                'password' => 'it\\'s s3cret',
+                'model' => 'mysql4',
+                'active' => '1'
+            ],
+            'indexer' => [
+                'host' => 'db2.example.com',
+                'dbname' => 'store_indexer',
+                'username' => 'indexer',
+                'password' => 'other'
+            ]
+        ]
+    ],
+];
+'''
+
+
+def _install(tmpdir, config_file, contents):
+    tmpdir.join(config_file).write(contents, ensure=True)
+    return cms.magento.Instance(str(tmpdir))
+
+
+def _settings(install):
+    return install.host, install.user, install.password, install.name
+
+
+def test_reads_local_xml(tmpdir):
+    store = _install(tmpdir, 'app/etc/local.xml', LOCAL_XML)
+    assert store.version == 1
+    assert _settings(store) == ('db1.example.com', 'store', 's3cret&more', 'store_live')
+    assert store.table_prefix == 'mage_'
+
+
+def test_rewrites_local_xml(tmpdir):
+    store = _install(tmpdir, 'app/etc/local.xml', LOCAL_XML)
+    store.update_config(user='new<user>', password='n3w]pass', host='localhost')
+    assert _settings(store) == ('localhost', 'new<user>', 'n3w]pass', 'store_live')
+
+    config = tmpdir.join('app', 'etc', 'local.xml').read()
+    assert '<host><![CDATA[localhost]]></host>' in config
+    assert '<username>new&lt;user&gt;</username>' in config
+    assert '<password><![CDATA[n3w]pass]]></password>' in config
+    assert '<dbname>store_live</dbname>' in config
+    # Everything else stays as it was
+    assert '<!-- The store\'s database -->' in config
+    assert '<initStatements><![CDATA[SET NAMES utf8]]></initStatements>' in config
+    assert len(config.splitlines()) == len(LOCAL_XML.splitlines())
+
+    assert _settings(cms.magento.Instance(str(tmpdir))) == ('localhost', 'new<user>', 'n3w]pass', 'store_live')
+
+
+def test_reads_env_php(tmpdir):
+    store = _install(tmpdir, 'app/etc/env.php', ENV_PHP)
+    assert store.version == 2
+    assert _settings(store) == ('db1.example.com', 'store', "it's s3cret", 'store_live')
+    assert store.table_prefix == 'm2_'
+
+
+def test_rewrites_env_php(tmpdir):
+    store = _install(tmpdir, 'app/etc/env.php', ENV_PHP)
+    store.update_config(user='store_new', password='back\\slash\'d', name='store_copy')
+
+    reread = cms.magento.Instance(str(tmpdir))
+    assert _settings(reread) == ('db1.example.com', 'store_new', 'back\\slash\'d', 'store_copy')
+    config = tmpdir.join('app', 'etc', 'env.php').read()
+    # Only the default connection changes
+    assert "'dbname' => 'store_indexer'" in config
+    assert "'password' => 'other'" in config
+    assert "'frontName' => 'admin_1x2y'" in config
+
+
+def test_env_php_comes_first(tmpdir):
+    tmpdir.join('app', 'etc', 'local.xml').write(LOCAL_XML, ensure=True)
+    store = _install(tmpdir, 'app/etc/env.php', ENV_PHP)
+    assert store.config_path == str(tmpdir.join('app', 'etc', 'env.php'))
+
+
+def test_unreadable_configs(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        cms.magento.Instance(str(tmpdir))
+    assert cms.magento.config_path(str(tmpdir)) is None
+    with pytest.raises(ValueError):
+        _install(tmpdir.mkdir('broken'), 'app/etc/local.xml', '<config><global>')
+    with pytest.raises(ValueError):
+        _install(tmpdir.mkdir('empty'), 'app/etc/local.xml', '<config><global><resources/></global></config>')
+
+
+def test_skip_dirs(tmpdir):
+    store = _install(tmpdir, 'app/etc/local.xml', LOCAL_XML)
+    tmpdir.join('var', 'cache').ensure(dir=True)
+    tmpdir.join('media', 'catalog', 'product', 'cache').ensure(dir=True)
+    tmpdir.join('var', 'log').ensure(dir=True)
+    tmpdir.join('elsewhere').ensure(dir=True)
+    os.symlink(str(tmpdir.join('elsewhere')), str(tmpdir.join('var', 'session')))
+    assert store.skip_dirs() == [str(tmpdir.join('var', 'cache')), str(tmpdir.join('media', 'catalog', 'product',
+                                                                                     'cache'))]
+
+
+def test_classify(tmpdir):
+    store = _install(tmpdir, 'app/etc/env.php', ENV_PHP)
+    assert store.classify('m2_cache') == (cms.slim.DISPOSABLE, [])
+    assert store.classify('m2_catalog_product_index_eav_replica') == (cms.slim.DISPOSABLE, [])
+    assert store.classify('m2_catalog_category_product_index_store1') == (cms.slim.REGENERABLE, [])
+    assert store.classify('m2_sales_order') == (cms.slim.ESSENTIAL, [])
+    assert store.classify('cache') == (cms.slim.ESSENTIAL, [])
+
+
+def test_rewrites_wp_config(tmpdir):
+    tmpdir.join('wp-config.php').write("<?php\ndefine('DB_NAME', 'blog');\ndefine('DB_USER', 'blog');\n"
+                                       "define('DB_PASSWORD', 'secret');\ndefine('DB_HOST', 'localhost');\n"
+                                       "define('WP_DEBUG', false);\n$table_prefix = 'wp_';\n")
+    blog = cms.wordpress.Instance(str(tmpdir))
+    blog.update_config(user='blog_new', password='n3w', host='db2.example.com')
+    reread = cms.wordpress.Instance(str(tmpdir))
+    assert (reread.name, reread.user, reread.password, reread.host) == ('blog', 'blog_new', 'n3w', 'db2.example.com')
+    assert "define('WP_DEBUG', false);" in tmpdir.join('wp-config.php').read()
@@ -0,0 +1,114 @@
+import os
+
+from fs.manifest import Entry, Manifest, build, compare, load, parse
+
+
+def _write(root, path, data=b''):
+    full_path = os.path.join(str(root), path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as file_fh:
+        file_fh.write(data)
+    return full_path
+
+
+def _file(size=10, mtime=1000, mode=0o644, digest=None):
+    return Entry('f', size, mtime, mode, digest)
+
+
+def _directory(mtime=1000, mode=0o755):
+    return Entry('d', 0, mtime, mode, None)
+
+
+def test_build_lists_everything(tmpdir):
+    root = str(tmpdir)
+    _write(root, 'index.php', b'<?php')
+    _write(root, 'wp-content/uploads/a.jpg', b'jpeg')
+    os.symlink('index.php', os.path.join(root, 'link.php'))
+    os.chmod(os.path.join(root, 'index.php'), 0o600)
+    manifest = build(root)
+    assert sorted(manifest.entries) == ['.', 'index.php', 'link.php', 'wp-content', 'wp-content/uploads',
+                                        'wp-content/uploads/a.jpg']
+    assert manifest.entries['index.php'][:2] == ('f', 5)
+    assert manifest.entries['index.php'].mode == 0o600
+    assert manifest.entries['link.php'].kind == 'l'
+    assert manifest.entries['wp-content'].kind == 'd'
+    assert manifest.total_bytes() == 5 + 4 + len('index.php')
+
+
+def test_build_lists_skipped_directories_but_not_their_contents(tmpdir):
+    root = str(tmpdir)
+    _write(root, 'var/cache/mage--0/mage---1', b'cache')
+    manifest = build(root, skip=['var/cache'])
+    assert 'var/cache' in manifest.entries
+    assert 'var/cache/mage--0' not in manifest.entries
+
+
+def test_build_carries_digests_over_for_unchanged_files(tmpdir):
+    root = str(tmpdir)
+    _write(root, 'same.php', b'same')
+    _write(root, 'changed.php', b'old')
+    previous = build(root)
+    previous.entries['same.php'] = previous.entries['same.php']._replace(digest='abc')
+    previous.entries['changed.php'] = previous.entries['changed.php']._replace(digest='def')
+    _write(root, 'changed.php', b'newer')
+    manifest = build(root, previous)
+    assert manifest.entries['same.php'].digest == 'abc'
+    assert manifest.entries['changed.php'].digest is None
+
+
+def test_save_and_load(tmpdir):
+    path = os.path.join(str(tmpdir), 'state', 'site.manifest')
+    manifest = Manifest({'.': _directory(), 'odd name.php': _file(digest='abc'), 'dir': _directory(mode=0o700)})
+    manifest.save(path)
+    assert load(path).entries == manifest.entries
+    assert load(path + '.missing') is None
+
+
+def test_parse_reads_find_listings():
+    listing = b'd 4096 1000.5 755 - \0f 10 1001.25 644 - index.php\0l 9 1002.0 777 - link.php\0'
+    manifest = parse(listing)
+    assert manifest.entries == {'.': _directory(), 'index.php': _file(mtime=1001),
+                                'link.php': Entry('l', 9, 1002, 0o777, None)}
+
+
+def test_compare_sends_what_changed():
+    source = Manifest({'.': _directory(), 'same': _file(), 'new': _file(), 'bigger': _file(size=20),
+                       'chmodded': _file(mode=0o600), 'touched': _file(mtime=2000),
+                       'hashed-same': _file(mtime=2000, digest='a'), 'hashed-different': _file(mtime=2000, digest='b')})
+    destination = Manifest({'.': _directory(), 'same': _file(), 'bigger': _file(), 'chmodded': _file(),
+                            'touched': _file(), 'hashed-same': _file(digest='a'), 'hashed-different': _file(digest='a')})
+    delta = compare(source, destination)
+    assert delta.send == ['bigger', 'chmodded', 'hashed-different', 'new']
+    assert delta.unsure == ['touched']
+    assert delta.remove == []
+    assert delta.directories == []
+
+
+def test_compare_removes_only_the_top_of_what_went():
+    source = Manifest({'.': _directory(), 'kept': _directory()})
+    destination = Manifest({'.': _directory(), 'kept': _directory(), 'gone': _directory(), 'gone/a': _file(),
+                            'gone/b': _directory(), 'gone/b/c': _file(), 'kept/stale': _file()})
+    assert compare(source, destination).remove == ['gone', 'kept/stale']
+
+
+def test_compare_replaces_entries_that_changed_kind():
+    source = Manifest({'.': _directory(), 'thing': _file()})
+    destination = Manifest({'.': _directory(), 'thing': _directory()})
+    delta = compare(source, destination)
+    assert delta.remove == ['thing']
+    assert delta.send == ['thing']
+
+
+def test_directories_to_fix():
+    source = Manifest({'.': _directory(), 'a': _directory(mode=0o700), 'b': _directory(), 'b/c': _directory(),
+                       'b/c/new': _file()})
+    destination = Manifest({'.': _directory(), 'a': _directory(), 'b': _directory(), 'b/c': _directory()})
+    delta = compare(source, destination)
+    assert delta.directories == ['a']
+    assert delta.directories_to_fix(source) == ['a', 'b/c']
+
+
+def test_forget_drops_everything_under_a_path():
+    manifest = Manifest({'.': _directory(), 'a': _directory(), 'a/b': _file(), 'ab': _file()})
+    manifest.forget(['a'])
+    assert sorted(manifest.entries) == ['.', 'ab']
@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+from telemetry.metrics import Meter
+
+
+def _events(path):
+    with open(path) as events_fh:
+        return [json.loads(line) for line in events_fh]
+
+
+def test_counts_bytes_by_pipeline_and_stage():
+    meter = Meter(echo=False)
+    meter.stream_started('database', table='wp_posts')
+    meter.add('database', 'read', 1000)
+    meter.add('database', 'compressed', 250)
+    meter.add('database', 'sent', 250)
+    meter.stream_finished('database', 0, table='wp_posts')
+    summary = meter.summary()['pipelines'][0]
+    assert (summary['pipeline'], summary['streams'], summary['failed']) == ('database', 1, 0)
+    assert (summary['read'], summary['compressed'], summary['sent'], summary['written']) == (1000, 250, 250, 0)
+    assert summary['compression_ratio'] == 4.0
+
+
+def test_busy_time_leaves_out_the_gaps():
+    meter = Meter(echo=False)
+    meter.stream_started('files')
+    totals = meter.pipelines['files']
+    time.sleep(0.05)
+    meter.stream_finished('files', 1)
+    busy = totals.seconds()
+    time.sleep(0.05)
+    assert totals.seconds() == busy
+    assert 0.05 <= busy < 0.1
+    assert totals.failed == 1
+
+
+def test_events_and_summary_go_to_files(tmpdir):
+    events_path = os.path.join(str(tmpdir), 'metrics', 'run.jsonl')
+    summary_path = os.path.join(str(tmpdir), 'metrics', 'run.summary.json')
+    meter = Meter(events_path, labels={'site': 'example.com'}, interval=0, echo=False)
+    meter.stream_started('files', shard=1)
+    meter.add('files', 'read', 10)
+    meter.stream_finished('files', 0, shard=1)
+    meter.write_summary(summary_path)
+    meter.close()
+
+    events = _events(events_path)
+    assert [event['event'] for event in events] == ['stream_started', 'progress', 'stream_finished', 'summary']
+    assert all(event['site'] == 'example.com' for event in events)
+    assert events[0]['shard'] == 1
+    assert events[1]['read'] == 10
+    with open(summary_path) as summary_fh:
+        summary = json.load(summary_fh)
+    assert summary['site'] == 'example.com'
+    assert summary['pipelines'][0]['read'] == 10
+
+
+def test_progress_is_echoed(capsys):
+    meter = Meter(interval=0)
+    meter.stream_started('files')
+    meter.add('files', 'read', 2000000)
+    assert capsys.readouterr().out.startswith('files: 2.0 MB read, 0.0 MB sent')
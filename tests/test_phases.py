@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from batch.phases import Phase, check, critical_path, report, run_phases
+
+
+def _sleeper(seconds, log=None, name=None):
+    def run():
+        if log is not None:
+            log.append(name)
+        time.sleep(seconds)
+    return run
+
+
+def test_check_refuses_missing_and_circular_requirements():
+    check([Phase('a', None), Phase('b', None, ['a'])])
+    with pytest.raises(ValueError):
+        check([Phase('a', None, ['nowhere'])])
+    with pytest.raises(ValueError):
+        check([Phase('a', None, ['c']), Phase('b', None, ['a']), Phase('c', None, ['b'])])
+    with pytest.raises(ValueError):
+        check([Phase('a', None), Phase('a', None)])
+
+
+def test_independent_phases_overlap():
+    phases = [Phase('start', _sleeper(0)), Phase('database', _sleeper(0.2), ['start']),
+              Phase('files', _sleeper(0.2), ['start']), Phase('finish', _sleeper(0), ['database', 'files'])]
+    assert run_phases(phases) == 0
+    database, files = phases[1], phases[2]
+    assert files.started < database.finished
+    assert phases[3].started >= max(database.finished, files.finished)
+
+
+def test_workers_limit_how_many_run_at_once():
+    running = [0, 0]
+    lock = threading.Lock()
+
+    def run():
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    assert run_phases([Phase(str(i), run) for i in range(4)], workers=1) == 0
+    assert running[1] == 1
+
+
+def test_a_failure_stops_new_phases_but_not_running_ones():
+    log = []
+
+    def fail():
+        exit(3)
+
+    phases = [Phase('slow', _sleeper(0.2, log, 'slow')), Phase('fails', fail),
+              Phase('after', _sleeper(0, log, 'after'), ['fails'])]
+    assert run_phases(phases) == 3
+    assert phases[0].exitcode == 0
+    assert phases[2].started is None
+    assert log == ['slow']
+
+
+def test_exceptions_fail_the_phase():
+    def broken():
+        raise RuntimeError('oops')
+
+    phases = [Phase('broken', broken)]
+    assert run_phases(phases) == 1
+
+
+def test_critical_path_and_report():
+    phases = [Phase('start', _sleeper(0)), Phase('database', _sleeper(0.2), ['start']),
+              Phase('files', _sleeper(0.05), ['start']), Phase('finish', _sleeper(0), ['database', 'files']),
+              Phase('never', _sleeper(0), ['finish'])]
+    run_phases(phases[:4])
+    assert [phase.name for phase in critical_path(phases)] == ['start', 'database', 'finish']
+    lines = report(phases).split('\n')
+    assert lines[-2] == 'Critical path (*): start -> database -> finish'
+    assert any(line.startswith('never') and line.endswith('skipped') for line in lines)
+    assert report([Phase('a', None)]) == 'Nothing ran'
@@ -0,0 +1,93 @@
+import os
+
+import pytest
+
+import database.pipe
+import transfer.shell
+from database.checkpoint import Checkpoint
+from database.scheduler import TableInfo
+from transfer.compression import get_codec
+
+TABLES = [TableInfo('wp_posts', 'BASE TABLE', 3000, 30), TableInfo('wp_options', 'BASE TABLE', 2000, 20),
+          TableInfo('wp_comments', 'BASE TABLE', 1000, 10), TableInfo('wp_cache', 'BASE TABLE', 500, 5),
+          TableInfo('recent_posts', 'VIEW', None, None)]
+
+
+class _Streams(list):
+    """Every stream run, and the exit codes to give the ones whose dump has a word in it"""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = {}
+
+
+@pytest.fixture
+def streams(monkeypatch):
+    streams = _Streams()
+
+    def run(stream, password=None, mirror=True, meter=None):
+        streams.append(stream)
+        for word, exitcode in streams.failing.items():
+            if word in stream.source:
+                return exitcode
+        return 0
+
+    monkeypatch.setattr(transfer.shell, 'run', run)
+    return streams
+
+
+def _copy(**kwargs):
+    return database.pipe.copy_tables('mysqldump -uu -pp', 'mysql -uu -pp db', 'db', TABLES, 'ssh host "{0}"',
+                                     get_codec('none'), 2, **kwargs)
+
+
+def _dumped(streams):
+    return [stream.source.split(' db', 1)[1].rstrip(')').split() for stream in streams]
+
+
+def test_rows_go_in_one_snapshot(streams):
+    assert _copy() == 0
+    assert len(streams) == 3
+    assert '--no-data --skip-triggers' in streams[0].source
+    assert '--single-transaction' in streams[1].source
+    assert _dumped(streams)[1] == ['wp_posts', 'wp_options', 'wp_comments', 'wp_cache']
+    assert '--triggers' in streams[2].source
+
+
+def test_per_table_dumps_each_table_on_its_own(streams):
+    assert _copy(per_table=True) == 0
+    data = streams[1:-1]
+    assert sorted(_dumped(data)) == [['wp_cache'], ['wp_comments'], ['wp_options'], ['wp_posts']]
+    assert all('--single-transaction' in stream.source for stream in data)
+
+
+def test_filtered_tables_get_their_own_dump(streams):
+    assert _copy(row_filters={'wp_cache': None, 'wp_options': "option_name NOT LIKE '_transient_%'"}) == 0
+    dumped = _dumped(streams[1:-1])
+    assert ['wp_posts', 'wp_comments'] in dumped
+    filtered = [stream for stream in streams if 'wp_options' in stream.source and '--where' in stream.source]
+    assert len(filtered) == 1
+    assert not any('wp_cache' in words for words in dumped)
+
+
+def test_a_failed_dump_stops_the_copy(streams):
+    streams.failing['wp_posts'] = 3
+    assert _copy() == 3
+    assert not any('--triggers' in stream.source for stream in streams)
+
+
+def test_checkpoints_skip_finished_tables_and_empty_the_rest(streams, tmpdir):
+    path = os.path.join(str(tmpdir), 'checkpoint.json')
+    checkpoint = Checkpoint(path, 'source/db', 'dest/db')
+    streams.failing['wp_comments'] = 1
+    assert _copy(checkpoint=checkpoint, per_table=True) == 1
+
+    del streams[:]
+    streams.failing.clear()
+    checkpoint = Checkpoint(path, 'source/db', 'dest/db')
+    assert checkpoint.resuming
+    assert _copy(checkpoint=checkpoint) == 0
+    assert '--no-data --skip-triggers' not in streams[0].source
+    assert _dumped(streams)[0][-2:] == ['wp_comments', 'wp_cache']
+    assert 'TRUNCATE TABLE `wp_comments`;' in streams[0].source
+    assert not os.path.exists(path)
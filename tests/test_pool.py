@@ -0,0 +1,90 @@
+import http.client
+import http.server
+import threading
+import time
+
+import pytest
+
+from plesk.pool import ConnectionPool
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append(body)
+        if self.server.drop_next:
+            # Took the request, then hung up without answering
+            self.server.drop_next -= 1
+            self.close_connection = True
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    server.received = []
+    server.drop_next = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _post(pool, server, body, **kwargs):
+    return pool.request('http', '127.0.0.1', server.server_address[1], 'POST', '/', body, {}, **kwargs)
+
+
+def test_reuses_connections(server):
+    pool = ConnectionPool()
+    assert _post(pool, server, b'one') == b'one'
+    assert _post(pool, server, b'two') == b'two'
+    assert pool.stats['handshakes'] == 1
+    assert pool.stats['reused'] == 1
+    pool.close()
+
+
+def test_does_not_resend_after_the_server_has_the_request(server):
+    pool = ConnectionPool()
+    _post(pool, server, b'warm up')
+    server.drop_next = 1
+    with pytest.raises(http.client.RemoteDisconnected):
+        _post(pool, server, b'add_customer')
+    assert server.received.count(b'add_customer') == 1
+    pool.close()
+
+
+def test_resends_idempotent_requests(server):
+    pool = ConnectionPool()
+    _post(pool, server, b'warm up')
+    server.drop_next = 1
+    assert _post(pool, server, b'get', idempotent=True) == b'get'
+    assert server.received.count(b'get') == 2
+    assert pool.stats['reconnects'] == 1
+    pool.close()
+
+
+class _DeadConnection:
+    def request(self, *args):
+        raise BrokenPipeError()
+
+    def close(self):
+        pass
+
+
+def test_resends_anything_that_never_went_out(server):
+    pool = ConnectionPool()
+    key = ('http', '127.0.0.1', server.server_address[1], False)
+    pool.idle[key] = [(_DeadConnection(), time.monotonic())]
+    assert _post(pool, server, b'add_customer') == b'add_customer'
+    assert server.received == [b'add_customer']
+    pool.close()
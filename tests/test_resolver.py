@@ -0,0 +1,173 @@
+import socket
+import threading
+import time
+
+import dns.exception
+import dns.message
+import dns.rrset
+import pytest
+
+import zone.resolver
+from zone.resolver import Resolver, served_by
+
+
+@pytest.fixture
+def nameserver():
+    """A nameserver on a port of its own, that says every name's A record is 192.0.2.7"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    questions = []
+
+    def serve():
+        while True:
+            try:
+                data, peer = sock.recvfrom(4096)
+            except OSError:
+                return
+            query = dns.message.from_wire(data)
+            questions.append(query.question[0].name.to_text())
+            response = dns.message.make_response(query)
+            response.answer.append(dns.rrset.from_text(query.question[0].name, 60, 'IN', 'A', '192.0.2.7'))
+            sock.sendto(response.to_wire(), peer)
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield sock.getsockname()[1], questions
+    sock.close()
+
+
+def test_nameservers_on_their_own_ports(nameserver):
+    port, questions = nameserver
+    resolver = Resolver(nameservers=['127.0.0.1:{0}'.format(port)], timeout=2)
+    assert resolver.lookup('Example.com.') == ['192.0.2.7']
+    assert questions == ['example.com.']
+
+
+def test_nameserver_names_are_looked_up(monkeypatch):
+    looked_up = []
+
+    def getaddrinfo(host, port, type=0):
+        looked_up.append(host)
+        if host == 'ns.example.net':
+            return [(socket.AF_INET, type, 17, '', ('192.0.2.53', port)),
+                    (socket.AF_INET6, type, 17, '', ('2001:db8::53', port, 0, 0)),
+                    (socket.AF_INET, type, 17, '', ('192.0.2.53', port))]
+        return [(socket.AF_INET, type, 17, '', (host, port))]
+
+    monkeypatch.setattr(zone.resolver.socket, 'getaddrinfo', getaddrinfo)
+    resolver = Resolver(nameservers=['ns.example.net', '192.0.2.1:5353', '[2001:db8::1]:5300'])
+    assert looked_up == ['ns.example.net', '192.0.2.1', '2001:db8::1']
+    servers = [(server.address, server.port) if hasattr(server, 'port') else (server, 53)
+               for server in resolver.resolver.nameservers]
+    assert servers == [('192.0.2.53', 53), ('2001:db8::53', 53), ('192.0.2.1', 5353), ('2001:db8::1', 5300)]
+
+
+def test_nameservers_that_cannot_be_used(monkeypatch):
+    def getaddrinfo(host, port, type=0):
+        raise socket.gaierror(-2, 'Name or service not known')
+
+    monkeypatch.setattr(zone.resolver.socket, 'getaddrinfo', getaddrinfo)
+    with pytest.raises(ValueError, match='ns.example.invalid'):
+        Resolver(nameservers=['ns.example.invalid'])
+    with pytest.raises(ValueError, match='bad port'):
+        Resolver(nameservers=['192.0.2.1:dns'])
+
+
+def _asking(resolver, monkeypatch, answers, delay=0):
+    """Has the resolver answer from answers, a dict of (name, type) to (records, ttl), counting what it asks"""
+    asked = []
+
+    def ask(name, rdtype):
+        asked.append((name, rdtype))
+        time.sleep(delay)
+        if (name, rdtype) not in answers:
+            raise dns.exception.Timeout()
+        values, ttl = answers[(name, rdtype)]
+        return list(values), time.time() + ttl
+
+    monkeypatch.setattr(resolver, '_Resolver__ask', ask)
+    return asked
+
+
+def test_answers_are_kept_for_their_ttl(monkeypatch):
+    resolver = Resolver(nameservers=['127.0.0.1'])
+    answers = {('example.com', 'NS'): (['ns1.example.com.'], 60)}
+    asked = _asking(resolver, monkeypatch, answers)
+    assert resolver.lookup('EXAMPLE.com.', 'ns') == ['ns1.example.com.']
+    assert resolver.lookup('example.com', 'NS') == ['ns1.example.com.']
+    assert asked == [('example.com', 'NS')]
+
+    answers[('example.com', 'NS')] = (['ns2.example.com.'], -1)
+    resolver.cache[('example.com', 'NS')] = (['ns1.example.com.'], time.time() - 1)
+    assert resolver.lookup('example.com', 'NS') == ['ns2.example.com.']
+    assert len(asked) == 2
+    assert resolver.stats == {'queries': 3, 'hits': 1, 'lookups': 2, 'failures': 0}
+
+
+def test_the_same_question_is_only_asked_once_at_a_time(monkeypatch):
+    resolver = Resolver(nameservers=['127.0.0.1'], workers=8)
+    asked = _asking(resolver, monkeypatch, {('example.com', 'A'): (['192.0.2.1'], 60),
+                                            ('example.org', 'A'): (['192.0.2.2'], 60)}, delay=0.1)
+    answers, failures = resolver.lookup_many(['example.com', 'example.org', 'example.net'])
+    assert answers == {'example.com': ['192.0.2.1'], 'example.org': ['192.0.2.2']}
+    assert list(failures) == ['example.net']
+
+    asked.clear()
+    resolver.cache.clear()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resolver.lookup('example.com'))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [['192.0.2.1']] * 5
+    assert asked == [('example.com', 'A')]
+
+
+def test_cache_file_is_shared_between_runs(tmpdir, monkeypatch):
+    cache_path = str(tmpdir.join('dns', 'cache.json'))
+    first = Resolver(nameservers=['127.0.0.1'], cache_path=cache_path)
+    _asking(first, monkeypatch, {('example.com', 'NS'): (['ns1.example.com.'], 60)})
+    first.lookup('example.com', 'NS')
+    first.preload('gone.example.com', 'A', ['192.0.2.1'], -1)
+
+    second = Resolver(nameservers=['127.0.0.1'], cache_path=cache_path)
+    second.preload('example.org', 'NS', ['ns1.example.org.'], 60)
+    first.save()
+    second.save()
+
+    third = Resolver(nameservers=['127.0.0.1'], cache_path=cache_path)
+    asked = _asking(third, monkeypatch, {})
+    assert third.lookup('example.com', 'NS') == ['ns1.example.com.']
+    assert third.lookup('example.org', 'NS') == ['ns1.example.org.']
+    assert ('gone.example.com', 'A') not in third.cache
+    assert asked == []
+
+
+def test_an_unreadable_cache_is_started_over(tmpdir, capsys):
+    cache_path = tmpdir.join('cache.json')
+    cache_path.write('{not json')
+    resolver = Resolver(nameservers=['127.0.0.1'], cache_path=str(cache_path))
+    resolver.preload('example.com', 'A', ['192.0.2.1'], 60)
+    assert 'Ignoring unreadable DNS cache' in capsys.readouterr().out
+    resolver.save()
+    assert Resolver(nameservers=['127.0.0.1'], cache_path=str(cache_path)).lookup('example.com') == ['192.0.2.1']
+
+
+def test_zone_files_preload_the_cache(tmpdir, monkeypatch):
+    zone_file = tmpdir.join('sites.zone')
+    zone_file.write('$ORIGIN .\n$TTL 3600\n'
+                    'example.com. IN NS ns1.firstscribe.com.\n'
+                    'example.com. IN NS ns2.firstscribe.com.\n'
+                    'example.org. IN NS ns1.example.org.\n')
+    resolver = Resolver(nameservers=['127.0.0.1'])
+    asked = _asking(resolver, monkeypatch, {})
+    assert resolver.load_zone_file(str(zone_file)) == 2
+    assert sorted(resolver.lookup('example.com', 'NS')) == ['ns1.firstscribe.com.', 'ns2.firstscribe.com.']
+    assert asked == []
+
+
+def test_served_by():
+    assert served_by(['NS1.Firstscribe.com.', 'ns2.other.net.'], 'firstscribe.com')
+    assert served_by(['firstscribe.com.'], 'firstscribe.com.')
+    assert not served_by(['ns1.notfirstscribe.com.'], 'firstscribe.com')
+    assert not served_by([], 'firstscribe.com')
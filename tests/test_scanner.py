@@ -0,0 +1,103 @@
+import os
+
+import fs.scanner
+from fs.scanner import scan_site
+
+DATABASE_REFS = '(wp-config.php|etc/local.xml|etc/env.php|includes?/(config.xml|connect.php))$'
+
+
+def _write(root, path, size=0):
+    full_path = os.path.join(str(root), path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as file_fh:
+        file_fh.write(b'x' * size)
+    return full_path
+
+
+def _site(root):
+    _write(root, 'wp-config.php', 100)
+    _write(root, 'index.php', 50)
+    _write(root, 'wp-content/uploads/a.jpg', 1000)
+    _write(root, 'shop/app/etc/local.xml', 200)
+    _write(root, 'shop/app/etc/local.xml.template', 200)
+    _write(root, 'shop/var/cache/mage--0/mage---1', 5000)
+    return str(root)
+
+
+def test_finds_installs_and_database_refs(tmpdir):
+    root = _site(tmpdir)
+    scan = scan_site(root, DATABASE_REFS)
+    assert scan.wp_roots == [root]
+    assert scan.magento_roots == [os.path.join(root, 'shop')]
+    assert scan.db_refs == [os.path.join(root, 'shop/app/etc/local.xml'), os.path.join(root, 'wp-config.php')]
+
+
+def test_counts_files_and_bytes(tmpdir):
+    root = _site(tmpdir)
+    scan = scan_site(root)
+    assert scan.file_count == 6
+    # The directories' own entries count too, so it's at least what's in the files
+    assert scan.total_bytes >= 100 + 50 + 1000 + 200 + 200 + 5000
+    assert scan.top_level['shop']['files'] == 3
+    assert scan.top_level['.']['files'] == 2
+    assert sum(scan.dir_bytes.values()) + os.lstat(root).st_size == scan.total_bytes
+
+
+def test_notes_hardlinks_and_skips_symlinked_directories(tmpdir):
+    root = _site(tmpdir)
+    os.link(os.path.join(root, 'index.php'), os.path.join(root, 'index2.php'))
+    os.symlink(os.path.join(root, 'shop'), os.path.join(root, 'shop-link'))
+    scan = scan_site(root)
+    assert scan.hardlinks == [os.path.join(root, 'index.php'), os.path.join(root, 'index2.php')]
+    assert not any('shop-link' in path for path in scan.dir_bytes)
+
+
+def test_prunes_by_name_and_by_path(tmpdir):
+    root = _site(tmpdir)
+    _write(root, 'wp-content/cache/page.html', 3000)
+    scan = scan_site(root, prune=['*/wp-content/cache', 'var'])
+    assert scan.pruned == [os.path.join(root, 'shop/var'), os.path.join(root, 'wp-content/cache')]
+    assert scan.file_count == 5
+    assert not any('cache' in path for path in scan.dir_bytes)
+    # What's in the pruned directories isn't counted
+    assert scan_site(root).total_bytes - scan.total_bytes >= 5000 + 3000
+
+
+def test_threads_find_what_one_thread_does(tmpdir):
+    root = _site(tmpdir)
+    for i in range(50):
+        _write(root, 'wp-content/uploads/{0}/{1}.jpg'.format(i % 7, i), i)
+    one = scan_site(root, DATABASE_REFS)
+    many = scan_site(root, DATABASE_REFS, workers=4, queue_size=2)
+    for field in ('wp_roots', 'magento_roots', 'db_refs', 'total_bytes', 'file_count', 'dir_count', 'dir_bytes'):
+        assert getattr(many, field) == getattr(one, field)
+
+
+class _VanishedEntry:
+    """A directory that was listed but is gone by the time we look at it"""
+
+    def __init__(self, entry):
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_dir(self):
+        return True
+
+    def is_symlink(self):
+        return False
+
+    def stat(self, follow_symlinks=True):
+        raise FileNotFoundError(self.path)
+
+
+def test_skips_directories_that_vanish(tmpdir, monkeypatch):
+    root = _site(tmpdir)
+    scandir = os.scandir
+
+    def vanishing_scandir(path):
+        return [_VanishedEntry(entry) if entry.name == 'wp-content' else entry for entry in scandir(path)]
+
+    monkeypatch.setattr(fs.scanner.os, 'scandir', vanishing_scandir)
+    scan = scan_site(root)
+    assert os.path.join(root, 'wp-content') not in scan.dir_bytes
+    assert scan.file_count == 5
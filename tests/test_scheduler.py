@@ -0,0 +1,85 @@
+import threading
+import time
+
+import pytest
+
+from database.scheduler import Progress, TableInfo, run_largest_first, table_sizes
+
+
+class _Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+class _Connection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self):
+        return _Cursor(self.rows)
+
+
+def test_table_sizes_puts_the_biggest_first_and_views_last():
+    tables = table_sizes(_Connection([('small', 'BASE TABLE', 10, 1), ('view', 'VIEW', None, None),
+                                      ('big', 'BASE TABLE', 1000, 100), ('empty', 'BASE TABLE', None, None)]))
+    assert [table.name for table in tables] == ['big', 'small', 'empty', 'view']
+    assert tables[2].bytes == 0
+    assert tables[-1].is_view()
+
+
+def test_runs_the_biggest_tables_first():
+    tables = [TableInfo(name, 'BASE TABLE', size, 0) for name, size in [('a', 1), ('b', 300), ('c', 20)]]
+    started = []
+    results = run_largest_first(tables, 1, lambda table: started.append(table.name) or table.bytes)
+    assert started == ['b', 'c', 'a']
+    assert results == {'a': 1, 'b': 300, 'c': 20}
+
+
+def test_runs_tables_at_once():
+    tables = [TableInfo(str(i), 'BASE TABLE', i, 0) for i in range(6)]
+    lock = threading.Lock()
+    running = [0, 0]
+
+    def job(table):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    run_largest_first(tables, 3, job)
+    assert running[1] == 3
+
+
+def test_stops_starting_tables_after_a_failure():
+    tables = [TableInfo(name, 'BASE TABLE', size, 0) for name, size in [('a', 3), ('b', 2), ('c', 1)]]
+    started = []
+
+    def job(table):
+        started.append(table.name)
+        if table.name == 'a':
+            raise ChildProcessError(2)
+
+    with pytest.raises(ChildProcessError):
+        run_largest_first(tables, 1, job)
+    assert started == ['a']
+
+
+def test_progress():
+    tables = [TableInfo('a', 'BASE TABLE', 300, 0), TableInfo('b', 'BASE TABLE', 100, 0)]
+    progress = Progress(tables)
+    assert progress.table_done(tables[0]).startswith('1 of 2 tables done, 75% by size')
+    assert progress.table_done(tables[1]) == '2 of 2 tables done, 100% by size, about 0s to go'
@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+import transfer.shell
+from telemetry.metrics import Meter
+from transfer.shell import Stream, kill_all, run
+
+
+def _run_in_background(command, **kwargs):
+    exitcodes = []
+    thread = threading.Thread(target=lambda: exitcodes.append(run(command, mirror=False, **kwargs)))
+    thread.start()
+    return thread, exitcodes
+
+
+def _wait_for_children(count):
+    deadline = time.monotonic() + 5
+    while len(transfer.shell._running) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_run():
+    assert run('true', mirror=False) == 0
+    assert run('exit 3', mirror=False) == 3
+    assert transfer.shell._running == set()
+
+
+def test_kill_all_stops_pipelines_on_other_threads():
+    start = time.monotonic()
+    thread, exitcodes = _run_in_background('sleep 30')
+    _wait_for_children(1)
+    kill_all()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert exitcodes[0] != 0
+    assert time.monotonic() - start < 5
+
+
+def test_kill_all_stops_pipelines_answering_password_prompts():
+    thread, exitcodes = _run_in_background("printf 'password: ' && read answer && sleep 30 | cat", password='secret')
+    _wait_for_children(1)
+    kill_all()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def _stream(tmpdir, sink_prefix=''):
+    out = os.path.join(str(tmpdir), 'out')
+    stream = Stream('head -c 100000 /dev/zero', '{0}gzip -d -c > {1}'.format(sink_prefix, out), compress='gzip -c',
+                    pipeline='files', shard=0)
+    return stream, out
+
+
+def test_streams_are_metered_at_each_stage(tmpdir):
+    meter = Meter(echo=False)
+    stream, out = _stream(tmpdir)
+    assert run(stream, mirror=False, meter=meter) == 0
+    assert os.path.getsize(out) == 100000
+    totals = meter.pipelines['files'].bytes
+    assert totals['read'] == 100000
+    assert 0 < totals['compressed'] == totals['sent'] < 100000
+    # Nothing here can see the destination write it
+    assert totals['written'] == 0
+
+
+def test_streams_are_metered_when_ssh_wants_a_password(tmpdir):
+    meter = Meter(echo=False)
+    # Asks on its terminal, as ssh would, then takes the data
+    stream, out = _stream(tmpdir, "printf 'password: ' > /dev/tty && read answer < /dev/tty && ")
+    assert run(stream, password='secret', mirror=False, meter=meter) == 0
+    assert os.path.getsize(out) == 100000
+    assert meter.pipelines['files'].bytes['read'] == 100000
+    assert transfer.shell._running == set()
+
+
+def test_metered_streams_fail_with_their_sink(tmpdir):
+    meter = Meter(echo=False)
+    stream = Stream('head -c 100000 /dev/zero', 'exit 5', pipeline='files')
+    assert run(stream, mirror=False, meter=meter) == 5
+    assert meter.pipelines['files'].failed == 1
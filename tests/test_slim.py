@@ -0,0 +1,158 @@
+import pytest
+
+import cms.magento
+import cms.slim
+import cms.wordpress
+from cms.slim import DISPOSABLE, ESSENTIAL, REGENERABLE
+from database.scheduler import TableInfo
+
+
+class _Cursor:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, query, args=None):
+        self.connection.queries.append(query)
+
+    def fetchone(self):
+        return self.connection.counts
+
+
+class _Connection:
+    """Says every filtered table has counts[0] rows, counts[1] of which the filter leaves out"""
+
+    def __init__(self, counts=(100, 25)):
+        self.counts = counts
+        self.queries = []
+
+    def cursor(self, cursor_class=None):
+        return _Cursor(self)
+
+
+class _Install:
+    def __init__(self, table_prefix):
+        self.table_prefix = table_prefix
+
+
+def _wordpress(tmpdir, prefix='wp_'):
+    tmpdir.join('wp-config.php').write("<?php\ndefine('DB_NAME', 'blog');\ndefine('DB_USER', 'blog');\n"
+                                       "define('DB_PASSWORD', 'secret');\ndefine('DB_HOST', 'localhost');\n"
+                                       "$table_prefix = '{0}';\n".format(prefix))
+    return cms.wordpress.Instance(str(tmpdir))
+
+
+def _magento(tmpdir, prefix=''):
+    tmpdir.join('app', 'etc', 'local.xml').write(
+        '<config><global><resources><db><table_prefix><![CDATA[{0}]]></table_prefix></db><default_setup><connection>'
+        '<host>localhost</host><username>store</username><password>secret</password><dbname>store</dbname>'
+        '</connection></default_setup></resources></global></config>'.format(prefix), ensure=True)
+    return cms.magento.Instance(str(tmpdir))
+
+
+def _tables(*names):
+    return [TableInfo(name, 'BASE TABLE', 1000, 10) for name in names]
+
+
+def test_plan_by_level():
+    tables = _tables('wp_wfhits', 'wp_yoast_indexable', 'wp_options', 'wp_posts') + \
+        [TableInfo('wp_view', 'VIEW', 0, 0)]
+    kinds = {'wp_wfhits': (DISPOSABLE, []), 'wp_yoast_indexable': (REGENERABLE, []),
+             'wp_options': (ESSENTIAL, [(DISPOSABLE, 'expired'), (REGENERABLE, 'transient')])}
+
+    def classify(name):
+        return kinds.get(name, (ESSENTIAL, []))
+
+    connection = _Connection()
+    row_filters, savings = cms.slim.plan(connection, tables, DISPOSABLE, classify)
+    assert row_filters == {'wp_wfhits': None, 'wp_options': 'NOT COALESCE((expired), FALSE)'}
+    assert savings == [cms.slim.Saving('wp_wfhits', DISPOSABLE, 'schema only', 10, 1000),
+                       cms.slim.Saving('wp_options', DISPOSABLE, 'filtered', 25, 250)]
+    assert connection.queries == ['SELECT COUNT(*), COALESCE(SUM((expired)), 0) FROM `wp_options`']
+
+    row_filters, savings = cms.slim.plan(_Connection(), tables, REGENERABLE, classify)
+    assert row_filters == {'wp_wfhits': None, 'wp_yoast_indexable': None,
+                           'wp_options': 'NOT COALESCE((expired) OR (transient), FALSE)'}
+    assert savings[-1].kind == REGENERABLE
+
+
+def test_plan_leaves_tables_nothing_would_be_saved_on():
+    row_filters, savings = cms.slim.plan(_Connection((100, 0)), _tables('wp_options'), DISPOSABLE,
+                                         lambda name: (ESSENTIAL, [(DISPOSABLE, 'expired')]))
+    assert (row_filters, savings) == ({}, [])
+
+
+def test_report():
+    assert cms.slim.report([]) == 'Nothing in the database can be left behind'
+    lines = cms.slim.report([cms.slim.Saving('wp_wfhits', DISPOSABLE, 'schema only', 10, 1000000),
+                             cms.slim.Saving('wp_options', DISPOSABLE, 'filtered', 25, 3000000)]).split('\n')
+    assert lines[1].split() == ['wp_options', DISPOSABLE, 'filtered', '25', '3.0']
+    assert lines[-1] == 'Leaving behind about 4.0 MB'
+
+
+def test_by_install_gives_each_table_to_the_longest_prefix():
+    store, blog, other_blog = _Install(''), _Install('wp_'), _Install('wp_2')
+    tables = _tables('wp_options', 'wp_2options', 'catalog_product_index_price_idx', 'log_url', 'wp_x')
+    owned = cms.slim.by_install([store, blog, other_blog], tables)
+    assert [(install, [table.name for table in install_tables]) for install, install_tables in owned] == [
+        (store, ['catalog_product_index_price_idx', 'log_url']), (blog, ['wp_options', 'wp_x']),
+        (other_blog, ['wp_2options'])]
+
+    # The first of two with the same prefix has them
+    first, second = _Install('wp_'), _Install('wp_')
+    owned = cms.slim.by_install([first, second], tables)
+    assert [len(install_tables) for install, install_tables in owned] == [3, 0]
+
+
+def test_wordpress_classify(tmpdir):
+    blog = _wordpress(tmpdir)
+    assert blog.classify('wp_wfhits') == (DISPOSABLE, [])
+    assert blog.classify('wp_3_redirection_logs') == (DISPOSABLE, [])
+    assert blog.classify('wp_yoast_indexable') == (REGENERABLE, [])
+    assert blog.classify('wp_posts') == (ESSENTIAL, [])
+    assert blog.classify('other_wfhits') == (ESSENTIAL, [])
+
+    kind, row_kinds = blog.classify('wp_options')
+    assert kind == ESSENTIAL
+    assert [row_kind for row_kind, condition in row_kinds] == [DISPOSABLE, REGENERABLE]
+    assert 'FROM `wp_options` AS expiry' in row_kinds[0][1]
+    assert 'SUBSTRING(`wp_options`.option_name, 12)' in row_kinds[0][1]
+    assert blog.classify('wp_actionscheduler_actions')[1] == [(DISPOSABLE,
+                                                               "status IN ('complete', 'failed', 'canceled')")]
+
+
+def test_magento_classify(tmpdir):
+    store = _magento(tmpdir, 'mage_')
+    assert store.classify('mage_core_cache') == (DISPOSABLE, [])
+    assert store.classify('mage_log_url') == (DISPOSABLE, [])
+    assert store.classify('mage_catalog_product_index_price_idx') == (DISPOSABLE, [])
+    assert store.classify('mage_catalog_product_index_price') == (REGENERABLE, [])
+    assert store.classify('mage_catalogsearch_fulltext') == (REGENERABLE, [])
+    assert store.classify('mage_sales_flat_order') == (ESSENTIAL, [])
+    assert store.classify('core_cache') == (ESSENTIAL, [])
+
+
+def test_magento_with_no_prefix_leaves_other_tables_alone(tmpdir):
+    store = _magento(tmpdir.mkdir('store'))
+    assert store.classify('catalogrule_product_price_tmp') == (DISPOSABLE, [])
+    assert store.classify('cache') == (DISPOSABLE, [])
+    # Scratch tables of something that isn't Magento
+    assert store.classify('wp_wc_admin_notes_tmp') == (ESSENTIAL, [])
+    assert store.classify('stats_daily_idx') == (ESSENTIAL, [])
+
+    blog = _wordpress(tmpdir.mkdir('blog'))
+    tables = _tables('cache', 'wp_wfhits', 'wp_wc_product_meta_lookup_tmp', 'wp_posts')
+    for install, install_tables in cms.slim.by_install([store, blog], tables):
+        row_filters, savings = install.slim(_Connection(), install_tables)
+        assert set(row_filters) == ({'cache'} if install is store else {'wp_wfhits'})
+
+
+@pytest.mark.parametrize('level', cms.slim.LEVELS)
+def test_each_level_leaves_out_more(tmpdir, level):
+    row_filters, savings = _wordpress(tmpdir).slim(_Connection(), _tables('wp_wfhits', 'wp_yoast_indexable'), level)
+    assert len(row_filters) == cms.slim.LEVELS.index(level)
@@ -0,0 +1,21 @@
+from transfer.ssh import MAX_SESSIONS, Master
+
+
+def test_share_leaves_what_fits_alone():
+    assert Master('user@host').share(4, 4) == [4, 4]
+    assert Master('user@host').share(MAX_SESSIONS - 1, 0) == [MAX_SESSIONS - 1, 0]
+
+
+def test_share_keeps_everything_under_max_sessions():
+    master = Master('user@host')
+    assert master.share(8, 8) == [4, 4]
+    assert master.share(12, 6) == [6, 3]
+    assert sum(master.share(16, 1)) < MAX_SESSIONS
+    assert master.share(40, 1)[1] == 1
+
+
+def test_options_go_through_the_master():
+    master = Master('user@host')
+    master.control_path = '/tmp/mom-ssh.x/master'
+    assert master.remote() == ('ssh -o ControlPath=/tmp/mom-ssh.x/master -o ControlMaster=no -o BatchMode=yes '
+                               'user@host "{0}"')
@@ -0,0 +1,61 @@
+import json
+import os
+import time
+
+import pytest
+
+from telemetry.tracing import Tracer
+
+
+def test_spans_time_their_block():
+    tracer = Tracer()
+    with tracer.span('dns NS', category='dns', query='example.com') as span:
+        time.sleep(0.02)
+        span.set(answers=2)
+    assert len(tracer.spans) == 1
+    assert tracer.spans[0].status == 'ok'
+    assert tracer.spans[0].attributes == {'query': 'example.com', 'answers': 2}
+    assert tracer.spans[0].seconds() >= 0.02
+
+
+def test_exceptions_mark_the_span_and_carry_on():
+    tracer = Tracer()
+    with pytest.raises(TimeoutError):
+        with tracer.span('plesk site.get'):
+            raise TimeoutError()
+    assert tracer.spans[0].status == 'TimeoutError'
+
+
+def test_report_ranks_the_slowest():
+    tracer = Tracer()
+    now = time.monotonic()
+    tracer.add('plesk site.get', now, now + 0.5)
+    tracer.add('plesk site.get', now, now + 0.25)
+    tracer.add('dns NS', now, now + 0.1, category='dns', query='example.com')
+    tracer.add('copy_site', now, now + 60, category='phase')
+    lines = tracer.report().split('\n')
+    assert lines[1].split() == ['plesk', 'site.get', '2', '0.750', '0.375', '0.500']
+    assert lines[2].startswith('dns NS')
+    assert not any('copy_site' in line for line in lines)
+    assert lines[-1] == '    0.100s dns NS [ok] query=example.com'
+    assert Tracer().report() == 'No calls were traced'
+
+
+def test_export_chrome(tmpdir):
+    tracer = Tracer()
+    now = time.monotonic()
+    with tracer.span('plesk site.get'):
+        pass
+    tracer.add('copy_site', now, now + 1, category='phase', thread='phase copy_site', exitcode=0)
+    path = os.path.join(str(tmpdir), 'trace', 'run.json')
+    tracer.export_chrome(path)
+    with open(path) as trace_fh:
+        trace = json.load(trace_fh)
+    spans = [event for event in trace['traceEvents'] if event['ph'] == 'X']
+    names = [event for event in trace['traceEvents'] if event['ph'] == 'M']
+    assert [event['name'] for event in spans] == ['plesk site.get', 'copy_site']
+    assert spans[1]['dur'] == 1000000
+    assert spans[1]['args'] == {'exitcode': 0, 'status': 'ok'}
+    assert spans[0]['tid'] != spans[1]['tid']
+    assert names == [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': spans[1]['tid'],
+                      'args': {'name': 'phase copy_site'}}]
@@ -0,0 +1,83 @@
+from zone.diff import custom_records, diff_zones, expand_template, record_key, relative_host
+
+TEMPLATE = [{'type': 'A', 'host': '<domain>.', 'value': '<ip>', 'opt': ''},
+            {'type': 'CNAME', 'host': 'www.<domain>.', 'value': '<domain>.', 'opt': ''},
+            {'type': 'MX', 'host': '<domain>.', 'value': 'mail.<domain>.', 'opt': '10'},
+            {'type': 'TXT', 'host': '<domain>.', 'value': 'v=spf1 +a +mx -all', 'opt': ''}]
+
+
+def _record(record_type, host, value, opt='', record_id=None):
+    record = {'type': record_type, 'host': host, 'value': value, 'opt': opt}
+    if record_id is not None:
+        record['id'] = record_id
+    return record
+
+
+def test_record_key_ignores_what_dns_does():
+    assert record_key(_record('cname', 'WWW.Example.com.', 'Example.COM.')) == \
+        record_key(_record('CNAME', 'www.example.com', 'example.com', None))
+    assert record_key(_record('AAAA', 'example.com', '2001:DB8::1')) == \
+        record_key(_record('AAAA', 'example.com.', '2001:db8::1'))
+    # A TXT record's value is what it is
+    assert record_key(_record('TXT', 'example.com', 'Hello')) != record_key(_record('TXT', 'example.com', 'hello'))
+    assert record_key(_record('MX', 'example.com', 'mail.example.com', '10')) != \
+        record_key(_record('MX', 'example.com', 'mail.example.com', '20'))
+
+
+def test_expand_template():
+    expanded = expand_template(TEMPLATE, 'example.com', '192.0.2.1')
+    assert expanded[0] == _record('A', 'example.com.', '192.0.2.1')
+    assert expanded[1] == _record('CNAME', 'www.example.com.', 'example.com.')
+    assert TEMPLATE[0]['host'] == '<domain>.'
+
+
+def test_relative_host():
+    assert relative_host('example.com.', 'example.com') == ''
+    assert relative_host('Mail.Example.com.', 'example.com') == 'Mail'
+    assert relative_host('a.b.example.com', 'example.com') == 'a.b'
+    assert relative_host('other.net.', 'example.com') == 'other.net'
+    assert relative_host('notexample.com', 'example.com') == 'notexample.com'
+
+
+def test_custom_records_leave_out_the_template():
+    template = expand_template(TEMPLATE, 'example.com', '192.0.2.1')
+    records = [_record('A', 'Example.com', '192.0.2.1'), _record('A', 'shop.example.com.', '192.0.2.9'),
+               _record('CNAME', 'www.example.com.', 'example.com')]
+    assert custom_records(records, template) == [records[1]]
+
+
+def test_diff_adds_what_is_missing_and_keeps_the_rest():
+    template = expand_template(TEMPLATE, 'example.com', '192.0.2.1')
+    records = template + [_record('A', 'shop.example.com.', '192.0.2.9'),
+                          _record('A', 'blog.example.com.', '192.0.2.8')]
+    zone = ([dict(record, id=str(index)) for index, record in enumerate(expand_template(TEMPLATE, 'example.com',
+                                                                                         '198.51.100.1'))] +
+            [_record('A', 'SHOP.example.com', '192.0.2.9', record_id='9')])
+    diff = diff_zones(records, template, zone, 'example.com')
+    assert diff.custom == records[-2:]
+    assert diff.add == [_record('A', 'blog', '192.0.2.8')]
+    assert diff.delete == []
+    assert diff.keep == zone
+
+
+def test_custom_mx_and_spf_replace_the_destinations():
+    template = expand_template(TEMPLATE, 'example.com', '192.0.2.1')
+    records = [record for record in template if record['type'] not in ('MX', 'TXT')] + [
+        _record('MX', 'example.com.', 'aspmx.l.google.com.', '1'),
+        _record('MX', 'example.com.', 'alt1.aspmx.l.google.com.', '5'),
+        _record('TXT', 'example.com.', '"v=spf1 include:_spf.google.com ~all"')]
+    zone = [dict(record, id=str(index)) for index, record in enumerate(template)] + [
+        _record('MX', 'example.com.', 'ASPMX.l.google.com', '1', record_id='7'),
+        _record('MX', 'lists.example.com.', 'mail.example.com.', '10', record_id='8')]
+    diff = diff_zones(records, template, zone, 'example.com')
+    # The template's MX and SPF go, the MX already there and the one for another host stay
+    assert diff.delete == ['2', '3']
+    assert [record['id'] for record in diff.keep] == ['0', '1', '7', '8']
+    assert diff.add == [_record('MX', '', 'alt1.aspmx.l.google.com.', '5'),
+                        _record('TXT', '', '"v=spf1 include:_spf.google.com ~all"')]
+
+
+def test_duplicates_in_the_source_are_added_once():
+    records = [_record('A', 'shop.example.com.', '192.0.2.9'), _record('A', 'Shop.example.com', '192.0.2.9')]
+    diff = diff_zones(records, [], [], 'example.com')
+    assert diff.add == [_record('A', 'shop', '192.0.2.9')]
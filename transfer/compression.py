@@ -0,0 +1,185 @@
+import os
+import subprocess
+import time
+
+import transfer.shell
+
+# name -> (compress command, decompress command, default level, whether it can use more than one thread)
+CODECS = {
+    'none': (None, None, None, False),
+    'lz4': ('lz4 -c -{level}', 'lz4 -d -c', 1, False),
+    'zstd': ('zstd -c -q -{level} -T{threads}', 'zstd -d -c -q', 3, True),
+    'xz': ('xz -c -{level} -T{threads}', 'xz -d -c', 6, True),
+}
+
+# What auto tries, from cheapest to squeeziest
+AUTO_CANDIDATES = ['none', 'lz4', 'zstd:1', 'zstd:3', 'zstd:9', 'xz:4']
+
+# How much of the stream auto compresses to size things up
+SAMPLE_BYTES = 16 * 1024 * 1024
+
+
+class Codec:
+    """A way to squeeze a stream before it goes over ssh, and unsqueeze it on the other side"""
+
+    def __init__(self, name, level=None, threads=0):
+        """
+        :param name: One of CODECS
+        :param level: The compression level, defaults to the codec's usual
+        :param threads: How many threads the compressor may use, 0 for one per core.  Ignored by single threaded codecs.
+        """
+        if name not in CODECS:
+            raise ValueError("unknown codec: '{0}'".format(name))
+
+        compress, decompress, default_level, threaded = CODECS[name]
+        if level is None:
+            level = default_level
+
+        self.name = name
+        self.level = level
+        self.threads = threads if threaded else 1
+        self.compress = compress.format(level=level, threads=threads) if compress else None
+        self.decompress = decompress
+
+    def __str__(self):
+        if self.level is None:
+            return self.name
+        return '{0}:{1}'.format(self.name, self.level)
+
+    def pipe_out(self, command):
+        """
+        :param command: A pipeline producing the raw stream
+        :return: The pipeline with compression tacked on the end
+        """
+        if self.compress is None:
+            return command
+        return '{0} | {1}'.format(command, self.compress)
+
+    def pipe_in(self, command):
+        """
+        :param command: A pipeline consuming the raw stream
+        :return: The pipeline with decompression stuck on the front
+        """
+        if self.decompress is None:
+            return command
+        return '{0} | {1}'.format(self.decompress, command)
+
+
+def get_codec(spec, threads=0):
+    """
+    :param spec: A codec name, optionally with a level, e.g. 'zstd' or 'zstd:6'
+    :param threads: How many threads the compressor may use, 0 for one per core
+    :return: A Codec
+    """
+    name, _, level = spec.partition(':')
+    return Codec(name, int(level) if level else None, threads)
+
+
+def idle_cores(interval=0.5):
+    """
+    Measures how many cores' worth of CPU are sitting idle, from /proc/stat.  Falls back to every core where there's no
+    /proc/stat to read.
+
+    :param interval: How long to watch for, in seconds
+    :return: The number of idle cores, as a float
+    """
+
+    def read_cpu():
+        with open('/proc/stat') as stat_fh:
+            fields = [int(field) for field in stat_fh.readline().split()[1:]]
+        # idle + iowait count as headroom
+        return sum(fields), fields[3] + fields[4]
+
+    try:
+        total_before, idle_before = read_cpu()
+        time.sleep(interval)
+        total_after, idle_after = read_cpu()
+    except (OSError, IndexError, ValueError):
+        return float(os.cpu_count() or 1)
+
+    if total_after == total_before:
+        return float(os.cpu_count() or 1)
+    return (os.cpu_count() or 1) * (idle_after - idle_before) / (total_after - total_before)
+
+
+def measure_link(remote, password=None, sample_bytes=SAMPLE_BYTES):
+    """
+    Pushes incompressible bytes to the destination and throws them away there, to see how fast the link is.
+
+    :param remote: A format string wrapping a command to be run on the destination, e.g. 'ssh user@host "{0}"'
+    :param password: The password to give ssh, or None if keys will do
+    :param sample_bytes: How much to send
+    :return: The throughput in bytes per second, or None if it didn't work
+    """
+    command = 'head -c {0} /dev/urandom | {1}'.format(sample_bytes, remote.format('cat > /dev/null'))
+
+    start = time.monotonic()
+    exitcode = transfer.shell.run(command, password=password, mirror=False)
+    elapsed = time.monotonic() - start
+
+    if exitcode != 0 or elapsed <= 0:
+        return None
+    return sample_bytes / elapsed
+
+
+def measure_codec(codec, sample):
+    """
+    Compresses a sample on one thread, to see how fast and how well the codec does on this data.
+
+    :param codec: A Codec
+    :param sample: The bytes to compress
+    :return: A list with bytes per second per thread, and the compression ratio
+    """
+    if codec.compress is None:
+        return [float('inf'), 1.0]
+
+    single = Codec(codec.name, codec.level, 1)
+    start = time.monotonic()
+    compressed = subprocess.run(single.compress, shell=True, input=sample, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL).stdout
+    elapsed = max(time.monotonic() - start, 1e-6)
+
+    return [len(sample) / elapsed, len(sample) / max(len(compressed), 1)]
+
+
+def choose_codec(sample_command, link_speed, threads=0, candidates=None, verbose=False):
+    """
+    Picks the codec that should move data fastest, given how fast the link is and how much CPU we can spare.  Each
+    candidate can push at most (its speed per thread * the threads it may use, or the idle cores) raw bytes a second,
+    and at most (link speed * its ratio), and the slower of the two wins.
+
+    :param sample_command: A pipeline producing a representative sample of the stream, e.g. the first bit of the tar
+    :param link_speed: The link throughput in bytes per second, from measure_link
+    :param threads: How many threads compressors may use, 0 for one per core
+    :param candidates: Codec specs to choose between, defaults to AUTO_CANDIDATES
+    :param verbose: Explain what you are doing
+    :return: A Codec
+    """
+    if candidates is None:
+        candidates = AUTO_CANDIDATES
+
+    sample = subprocess.run('{0} | head -c {1}'.format(sample_command, SAMPLE_BYTES), shell=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+    headroom = max(idle_cores(), 1.0)
+    if threads:
+        headroom = min(headroom, threads)
+
+    best = None
+    best_speed = 0
+    for spec in candidates:
+        codec = get_codec(spec, threads)
+        if codec.compress is not None and not sample:
+            continue
+
+        cpu_speed, ratio = measure_codec(codec, sample)
+        speed = min(cpu_speed * min(codec.threads or headroom, headroom), link_speed * ratio)
+
+        if verbose:
+            print('{0}: {1:.1f} MB/s per thread, ratio {2:.2f}, about {3:.1f} MB/s'.format(
+                codec, cpu_speed / 1e6 if cpu_speed != float('inf') else float('inf'), ratio, speed / 1e6))
+
+        if best is None or speed > best_speed:
+            best = codec
+            best_speed = speed
+
+    return best
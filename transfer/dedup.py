@@ -0,0 +1,175 @@
+import fnmatch
+import os
+import shlex
+
+import transfer.files
+import transfer.incremental
+
+# What's worth keeping in the store: the code every WordPress site carries, rather than its uploads
+STORE_PATTERNS = ['*/wp-admin/*', '*/wp-includes/*', '*/wp-content/plugins/*', '*/wp-content/themes/*',
+                  '*/wp-content/languages/*', '*/wp-content/mu-plugins/*']
+
+# The mode of every copy in the store, which is all a file linked out of it can have
+STORE_MODE = 0o444
+
+
+class Store:
+    """
+    A content addressed store of files on a destination server, each kept under its SHA-1 (ab/abcdef...), shared by
+    every site copied there.  Files the store already has are put in place from it on the destination instead of being
+    sent again.
+    """
+
+    def __init__(self, path, remote, password=None, link=False, patterns=None, verbose=False):
+        """
+        :param path: Where the store lives on the destination.  Every account we ssh in as has to be able to write to it.
+        :param remote: A format string wrapping a command to be run on the destination, e.g. 'ssh user@host "{0}"'
+        :param password: The password to give ssh, or None if keys will do
+        :param link: Hardlink files out of the store, rather than copying them.  Linked files share their mode and
+            times with the store, and changing one in place changes it for every site, so it's off by default.  Only
+            files that are meant to have the store's mode (0444) are linked, so no site is left with read only files it
+            expects to write to.  The rest, and any the link can't be made for (another filesystem, or someone else's
+            file), are copied.
+        :param patterns: fnmatch patterns against each file's path from the root ('./wp-admin/index.php') saying what
+            goes in the store, defaults to STORE_PATTERNS
+        :param verbose: Explain what you are doing
+        """
+        self.path = path
+        self.remote = remote
+        self.password = password
+        self.link = link
+        self.patterns = patterns if patterns is not None else STORE_PATTERNS
+        self.verbose = verbose
+        self.hits = 0
+        self.hit_bytes = 0
+        self.misses = 0
+        self.miss_bytes = 0
+
+    def wants(self, path):
+        """:return: Whether a file, by its path from the root, belongs in the store"""
+        return any(fnmatch.fnmatchcase('./' + path, pattern) for pattern in self.patterns)
+
+    def key(self, digest):
+        return '{0}/{1}'.format(digest[:2], digest)
+
+    def __run_script(self, lines, work_dir, name, stdout=None):
+        script = os.path.join(work_dir, name)
+        with open(script, 'w') as script_fh:
+            script_fh.write('\n'.join(lines) + '\n')
+        transfer.incremental.run_remote('bash -s', self.remote, password=self.password, stdin=script, stdout=stdout,
+                                        verbose=self.verbose)
+
+    def known(self, digests, work_dir):
+        """
+        Asks the store which of the digests it has.  The store's copies are hashed again, so a damaged (or tampered
+        with) one is never handed out.
+
+        :return: The set of digests the store has
+        """
+        key_list = os.path.join(work_dir, 'keys')
+        sums = os.path.join(work_dir, 'store_sums')
+        transfer.files.write_list([self.key(digest) for digest in digests], key_list)
+        transfer.incremental.run_remote('cd {0} 2>/dev/null && xargs -0 -r sha1sum -z -- 2>/dev/null; true'.format(
+            shlex.quote(self.path)), self.remote, password=self.password, stdin=key_list, stdout=sums,
+            verbose=self.verbose)
+
+        found = set()
+        with open(sums, 'rb') as sums_fh:
+            for record in sums_fh.read().split(b'\0'):
+                digest = record[:40].decode()
+                if record and os.path.basename(os.fsdecode(record[42:])) == digest:
+                    found.add(digest)
+        return found
+
+    def place(self, files, dest_dir, work_dir):
+        """
+        Puts the files the store already has in place on the destination, with their modes and times.  One the store
+        lost in the meantime (say, to another migration cleaning it out) is left to be sent after all.
+
+        :param files: A list of (path, fs.manifest.Entry) for files headed for the destination, with digests
+        :param dest_dir: Where the site goes on the destination
+        :return: A dict of the paths that were put in place, and so needn't be sent, to their entries as they are now
+            on the destination.  A linked file has the store copy's mode and time.
+        """
+        wanted = [(path, entry) for path, entry in files if entry.digest is not None and self.wants(path)]
+        if not wanted:
+            return {}
+
+        found = self.known(set(entry.digest for path, entry in wanted), work_dir)
+        hits = []
+        parents = set()
+        lines = []
+        for path, entry in wanted:
+            if entry.digest not in found:
+                self.misses += 1
+                self.miss_bytes += entry.size
+                continue
+
+            hits.append((path, entry))
+            parents.add(os.path.dirname(os.path.join(dest_dir, path)))
+
+            source = shlex.quote(os.path.join(self.path, self.key(entry.digest)))
+            target = shlex.quote(os.path.join(dest_dir, path))
+            copy = 'cp -f -- {0} {1} && chmod {2:o} {1} && touch -m -d @{3} {1}'.format(source, target, entry.mode,
+                                                                                    entry.mtime)
+            if self.link and entry.mode == STORE_MODE:
+                copy = 'ln -f -- {0} {1} 2>/dev/null || {{ {2}; }}'.format(source, target, copy)
+            # Say what the file ended up as, or '-' if the store copy has gone since we asked
+            lines.append("{{ {0}; }} && stat -c '%a %Y' -- {1} || {{ [ -e {2} ] && exit 1; echo -; }}".format(
+                copy, target, source))
+
+        if not lines:
+            return {}
+
+        lines.insert(0, 'mkdir -p -- {0} || exit 1'.format(' '.join(shlex.quote(p) for p in sorted(parents))))
+        results = os.path.join(work_dir, 'placed')
+        self.__run_script(lines, work_dir, 'place', stdout=results)
+        with open(results) as results_fh:
+            outcomes = results_fh.read().split('\n')
+
+        placed = {}
+        for (path, entry), outcome in zip(hits, outcomes):
+            if outcome.strip() in ('', '-'):
+                self.misses += 1
+                self.miss_bytes += entry.size
+                continue
+            mode, mtime = outcome.split()
+            self.hits += 1
+            self.hit_bytes += entry.size
+            placed[path] = entry._replace(mode=int(mode, 8), mtime=int(mtime))
+        return placed
+
+    def add(self, files, dest_dir, work_dir):
+        """
+        Files just sent to the destination that belong in the store, and aren't in it yet, go in.  Store copies are
+        read only, and anything that can't be added is left out quietly, since the store is only ever a shortcut.
+
+        :param files: A list of (path, fs.manifest.Entry) for files now on the destination, with digests
+        :param dest_dir: Where the site is on the destination
+        """
+        keys = {}
+        for path, entry in files:
+            if entry.digest is not None and self.wants(path):
+                keys.setdefault(self.key(entry.digest), path)
+        if not keys:
+            return
+
+        lines = ['mkdir -p -- {0} 2>/dev/null'.format(
+            ' '.join(shlex.quote(os.path.join(self.path, key[:2])) for key in sorted(set(k[:2] for k in keys))))]
+        for key, path in sorted(keys.items()):
+            stored = shlex.quote(os.path.join(self.path, key))
+            # $$ so two copies adding the same file at once don't trip over each other
+            temp = shlex.quote(os.path.join(self.path, key + '.tmp')) + '$$'
+            target = shlex.quote(os.path.join(dest_dir, path))
+            # A store copy that doesn't match (not that it should happen) gets replaced
+            lines.append('cmp -s -- {1} {0} || {{ cp -- {1} {2} && chmod {3:o} {2} && mv -f -- {2} {0}; }} 2>/dev/null'
+                         .format(stored, target, temp, STORE_MODE))
+        lines.append('true')
+        self.__run_script(lines, work_dir, 'add')
+
+    def report(self):
+        """:return: A line saying how well the store did"""
+        files = self.hits + self.misses
+        total_bytes = self.hit_bytes + self.miss_bytes
+        return 'Dedup store: {0} of {1} files ({2} of {3} bytes) came from the store, a hit rate of {4:.0f}%'.format(
+            self.hits, files, self.hit_bytes, total_bytes, 100.0 * self.hits / files if files else 0)
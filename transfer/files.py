@@ -0,0 +1,202 @@
+import heapq
+import os
+import shlex
+import tempfile
+
+import transfer.compression
+import transfer.shell
+
+
+class Shard:
+    """A slice of a site to be copied by one stream"""
+
+    def __init__(self, index):
+        self.index = index
+        # Paths, relative to the root, to be archived on their own
+        self.loose = []
+        # Paths, relative to the root, to be archived along with everything under them
+        self.subtrees = []
+        self.bytes = 0
+
+
+class ShardPlan:
+    """How a site is split between streams, and which directories need their metadata put right afterwards"""
+
+    def __init__(self, root, shards, directories):
+        self.root = root
+        self.shards = shards
+        # Directories that more than one stream writes into, parents first, relative to the root
+        self.directories = directories
+
+
+def stream_count(streams):
+    """
+    :param streams: A number of streams, or 'auto'
+    :return: The number of streams to use.  'auto' means one per two cores, since each stream keeps a compressor and
+        ssh busy.
+    """
+    if streams == 'auto':
+        return max(1, (os.cpu_count() or 1) // 2)
+    return max(1, int(streams))
+
+
+def plan_shards(scan, count, granularity=4, skip=None):
+    """
+    Splits a scanned site into shards of about the same size.  Big directories are broken up into their own files
+    (in chunks) plus their subdirectories, and anything small enough is kept whole, until every piece is smaller than
+    a shard / granularity.  The pieces are then dealt out largest first, each to the lightest shard.
+
+    Files with other hardlinks all go in one piece, so they stay linked.  Pruned directories are kept whole, but as the
+    scan didn't size them, they count as nothing.  Skipped directories go empty.
+
+    :param scan: A SiteScan of the site, from fs.scanner.scan_site
+    :param count: How many shards to make
+    :param granularity: How many pieces a shard should be made up of, at least
+    :param skip: Directories, relative to the scan's root, whose contents are left out
+    :return: A ShardPlan
+    """
+    root = scan.root
+
+    # Add each directory's bytes into its parents' to get the size of every subtree
+    subtree_bytes = dict(scan.dir_bytes)
+    children = {}
+    for path in sorted(scan.dir_bytes, key=lambda p: p.count(os.sep), reverse=True):
+        if path == root:
+            continue
+        parent = os.path.dirname(path)
+        subtree_bytes[parent] = subtree_bytes.get(parent, 0) + subtree_bytes[path]
+        children.setdefault(parent, []).append(path)
+    for path in scan.pruned:
+        children.setdefault(os.path.dirname(path), []).append(path)
+
+    # A directory holding a hardlink has to be broken up, or the hardlink would end up in two pieces, and one holding a
+    # skipped directory, or it would go whole
+    skip = {os.path.join(root, path) for path in skip or []}
+    hardlinks = {path for path in scan.hardlinks if not any(path.startswith(skipped + os.sep) for skipped in skip)}
+    must_split = {root}
+    for path in hardlinks | skip:
+        parent = os.path.dirname(path)
+        while parent not in must_split and parent.startswith(root):
+            must_split.add(parent)
+            parent = os.path.dirname(parent)
+
+    piece_limit = max(1, subtree_bytes.get(root, 0) // (count * granularity))
+    pieces = []
+    directories = []
+
+    pending = [root]
+    while pending:
+        path = pending.pop()
+        relative = os.path.relpath(path, root)
+        if path in skip:
+            directories.append(relative)
+            continue
+
+        # Pruned (or unreadable) directories and anything small enough go whole, the rest gets broken up
+        if path not in scan.dir_bytes or (path not in must_split and subtree_bytes[path] <= piece_limit):
+            pieces.append((subtree_bytes.get(path, 0), 'subtree', [relative]))
+            continue
+
+        directories.append(relative)
+        pending.extend(children.get(path, []))
+
+        # This directory's own files, in chunks no bigger than a piece
+        chunk = []
+        chunk_bytes = 0
+        for entry in sorted(os.scandir(path), key=lambda e: e.name):
+            if entry.is_dir(follow_symlinks=False) or entry.path in hardlinks:
+                continue
+            chunk.append(os.path.relpath(entry.path, root))
+            chunk_bytes += entry.stat(follow_symlinks=False).st_size
+            if chunk_bytes >= piece_limit:
+                pieces.append((chunk_bytes, 'loose', chunk))
+                chunk = []
+                chunk_bytes = 0
+        if chunk:
+            pieces.append((chunk_bytes, 'loose', chunk))
+
+    if hardlinks:
+        hardlink_bytes = sum(os.lstat(path).st_size for path in hardlinks)
+        pieces.append((hardlink_bytes, 'loose', [os.path.relpath(path, root) for path in sorted(hardlinks)]))
+
+    shards = [Shard(index) for index in range(count)]
+    lightest = [(0, index) for index in range(count)]
+    for piece_bytes, kind, paths in sorted(pieces, key=lambda piece: piece[0], reverse=True):
+        shard_bytes, index = heapq.heappop(lightest)
+        shard = shards[index]
+        if kind == 'loose':
+            shard.loose.extend(paths)
+        else:
+            shard.subtrees.extend(paths)
+        shard.bytes += piece_bytes
+        heapq.heappush(lightest, (shard.bytes, index))
+
+    # Parents first, so the final pass reads naturally; tar sets directory metadata at the very end regardless
+    directories.sort(key=lambda p: (p != '.', p.count(os.sep), p))
+
+    return ShardPlan(root, [shard for shard in shards if shard.loose or shard.subtrees], directories)
+
+
+def write_list(paths, list_path):
+    """Writes a null separated file list for tar's --null -T"""
+    with open(list_path, 'wb') as list_fh:
+        for path in paths:
+            list_fh.write(os.fsencode(path) + b'\0')
+
+
+def copy_parallel(plan, dest_dir, remote, codec=None, password=None, meter=None, verbose=False):
+    """
+    Copies the shards of a site all at once, one tar | compress | ssh stream each, extracting on the destination as they
+    arrive.  As several streams write into the same directories, a last (small) stream puts those directories'
+    modes and times back the way a single tar would have left them.
+
+    :param plan: A ShardPlan from plan_shards
+    :param dest_dir: Where the site goes on the destination
+    :param remote: A format string wrapping a command to be run on the destination, e.g. 'ssh user@host "{0}"'
+    :param codec: The transfer.compression.Codec to squeeze the streams with, defaults to xz
+    :param password: The password to give ssh, or None if keys will do
+    :param meter: A telemetry.metrics.Meter to count the streams' bytes with, if any
+    :param verbose: Explain what you are doing
+    :return: 0 if every stream succeeded, otherwise the first failing exit status
+    """
+    if codec is None:
+        codec = transfer.compression.get_codec('xz')
+
+    list_dir = tempfile.mkdtemp(prefix='migrate_o_matic.')
+    try:
+        commands = []
+        for shard in plan.shards:
+            loose_list = os.path.join(list_dir, '{0}.loose'.format(shard.index))
+            subtree_list = os.path.join(list_dir, '{0}.subtrees'.format(shard.index))
+            write_list(shard.loose, loose_list)
+            write_list(shard.subtrees, subtree_list)
+
+            commands.append(transfer.shell.Stream(
+                'tar cf - -C {0} --null --no-recursion -T {1} --recursion -T {2}'.format(
+                    shlex.quote(plan.root), loose_list, subtree_list),
+                remote.format(codec.pipe_in('tar xpf - -C {0}'.format(dest_dir))), compress=codec.compress,
+                pipeline='files', shard=shard.index))
+
+        if verbose:
+            for shard, command in zip(plan.shards, commands):
+                print('Stream {0}: {1} bytes, {2} files, {3} subtrees'.format(shard.index, shard.bytes,
+                                                                              len(shard.loose), len(shard.subtrees)))
+                print(command)
+
+        for exitcode in transfer.shell.run_all(commands, password=password, meter=meter):
+            if exitcode != 0:
+                return exitcode
+
+        directory_list = os.path.join(list_dir, 'directories')
+        write_list(plan.directories, directory_list)
+        command = 'tar cf - -C {0} --null --no-recursion -T {1} | {2}'.format(
+            shlex.quote(plan.root), directory_list, remote.format('tar xpf - -C {0}'.format(dest_dir)))
+
+        if verbose:
+            print(command)
+
+        return transfer.shell.run(command, password=password, mirror=verbose)
+    finally:
+        for name in os.listdir(list_dir):
+            os.remove(os.path.join(list_dir, name))
+        os.rmdir(list_dir)
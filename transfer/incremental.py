@@ -0,0 +1,205 @@
+import os
+import shlex
+import tempfile
+
+import fs.manifest
+import transfer.compression
+import transfer.files
+import transfer.shell
+
+# About how much each tar stream carries before the destination's manifest is checkpointed
+BATCH_BYTES = 256 * 1024 * 1024
+
+
+def run_remote(command, remote, password=None, stdin=None, stdout=None, verbose=False):
+    """
+    Runs a command on the destination, feeding it and keeping what it says in local files, since run can't hand back
+    output when it has to answer ssh's password prompt.
+
+    :raises ChildProcessError: With the exit status, if it fails
+    """
+    command = remote.format(command)
+    if stdin is not None:
+        command = '{0} < {1}'.format(command, stdin)
+    if stdout is not None:
+        command = '{0} > {1}'.format(command, stdout)
+    if verbose:
+        print(command)
+
+    exitcode = transfer.shell.run(command, password=password, mirror=verbose and stdout is None)
+    if exitcode != 0:
+        raise ChildProcessError(exitcode)
+
+
+def list_remote(dest_dir, remote, work_dir, password=None, verbose=False):
+    """
+    :return: A Manifest of everything in dest_dir on the destination, without digests
+    """
+    listing = os.path.join(work_dir, 'listing')
+    run_remote("mkdir -p {0} && cd {0} && find . -printf '{1}'".format(dest_dir, fs.manifest.LISTING_FORMAT), remote,
+               password=password, stdout=listing, verbose=verbose)
+    with open(listing, 'rb') as listing_fh:
+        return fs.manifest.parse(listing_fh.read())
+
+
+def hash_remote(dest_dir, paths, remote, work_dir, password=None, verbose=False):
+    """
+    :return: A dict of path to the SHA-1 of that file on the destination
+    """
+    path_list = os.path.join(work_dir, 'unsure')
+    sums = os.path.join(work_dir, 'sums')
+    transfer.files.write_list(paths, path_list)
+    run_remote('cd {0} && xargs -0 -r sha1sum -z --'.format(dest_dir), remote, password=password, stdin=path_list,
+               stdout=sums, verbose=verbose)
+
+    digests = {}
+    with open(sums, 'rb') as sums_fh:
+        for record in sums_fh.read().split(b'\0'):
+            if record:
+                digests[os.fsdecode(record[42:])] = record[:40].decode()
+    return digests
+
+
+def send(root, paths, dest_dir, remote, codec, work_dir, password=None, meter=None, verbose=False):
+    """Sends just the given paths, without recursing into directories, in one tar stream"""
+    path_list = os.path.join(work_dir, 'send')
+    transfer.files.write_list(paths, path_list)
+    command = transfer.shell.Stream(
+        'tar cf - -C {0} --null --no-recursion -T {1}'.format(shlex.quote(root), path_list),
+        remote.format(codec.pipe_in('tar xpf - -C {0}'.format(dest_dir))), compress=codec.compress, pipeline='files',
+        paths=len(paths))
+    if verbose:
+        print(command)
+
+    exitcode = transfer.shell.run(command, password=password, mirror=verbose, meter=meter)
+    if exitcode != 0:
+        raise ChildProcessError(exitcode)
+
+
+def copy_incremental(root, dest_dir, remote, state_prefix, codec=None, password=None, batch_bytes=BATCH_BYTES,
+                     store=None, skip=None, meter=None, verbose=False):
+    """
+    Makes the destination match the source, sending only what's missing or changed.  A manifest of the source is kept
+    between runs, so files that haven't changed never need hashing again, and a manifest of the destination is
+    checkpointed after every batch, so if the copy dies it picks up where it stopped next time.  Once the copy
+    finishes the destination's manifest is thrown away, and the next run lists the destination afresh.
+
+    Files that match in size, mode and time are taken to be the same, like rsync's quick check.  Where only the times
+    differ, both ends hash the file to decide.  Anything on the destination that isn't in the source is removed.
+
+    With a dedup store, files the store wants are hashed before they're sent, and the ones it already has are put in
+    place on the destination from the store instead.  Those that do get sent are added to it afterwards.
+
+    :param root: The directory to copy, probably a site's httpdocs
+    :param dest_dir: Where it goes on the destination
+    :param remote: A format string wrapping a command to be run on the destination, e.g. 'ssh user@host "{0}"'
+    :param state_prefix: Where to keep the manifests, a path to which '.source' and '.destination' are added
+    :param codec: The transfer.compression.Codec to squeeze the streams with, defaults to xz
+    :param password: The password to give ssh, or None if keys will do
+    :param batch_bytes: About how much to send between checkpoints
+    :param store: A transfer.dedup.Store on the destination, or None not to use one
+    :param skip: Directories, relative to the root, whose contents are left out (and removed from the destination)
+    :param meter: A telemetry.metrics.Meter to count the streams' bytes with, if any
+    :param verbose: Explain what you are doing
+    :return: 0 if everything went, otherwise the first failing exit status
+    """
+    if codec is None:
+        codec = transfer.compression.get_codec('xz')
+
+    source_path = state_prefix + '.source'
+    destination_path = state_prefix + '.destination'
+
+    work_dir = tempfile.mkdtemp(prefix='migrate_o_matic.')
+    try:
+        source = fs.manifest.build(root, fs.manifest.load(source_path), skip=skip)
+        destination = fs.manifest.load(destination_path)
+        if destination is None:
+            destination = list_remote(dest_dir, remote, work_dir, password=password, verbose=verbose)
+        else:
+            print('Picking up an unfinished copy from {0}'.format(destination_path))
+
+        delta = fs.manifest.compare(source, destination)
+
+        if delta.unsure:
+            if verbose:
+                print('Hashing {0} files that have changed time but not size'.format(len(delta.unsure)))
+            for path in delta.unsure:
+                source.entries[path] = source.entries[path]._replace(
+                    digest=fs.manifest.file_digest(os.path.join(root, path)))
+            digests = hash_remote(dest_dir, delta.unsure, remote, work_dir, password=password, verbose=verbose)
+            for path in delta.unsure:
+                if digests.get(path) == source.entries[path].digest:
+                    destination.entries[path] = destination.entries[path]._replace(digest=digests[path])
+                else:
+                    delta.send.append(path)
+            delta.send.sort()
+
+        if store is not None:
+            for path in delta.send:
+                entry = source.entries[path]
+                if entry.kind == 'f' and entry.digest is None and store.wants(path):
+                    source.entries[path] = entry._replace(digest=fs.manifest.file_digest(os.path.join(root, path)))
+        source.save(source_path)
+
+        send_bytes = sum(source.entries[path].size for path in delta.send)
+        print('{0} of {1} entries to send ({2} of {3} bytes), {4} to remove'.format(
+            len(delta.send), len(source), send_bytes, source.total_bytes(), len(delta.remove)))
+
+        if delta.remove:
+            path_list = os.path.join(work_dir, 'remove')
+            transfer.files.write_list(delta.remove, path_list)
+            run_remote('cd {0} && xargs -0 -r rm -rf --'.format(dest_dir), remote, password=password,
+                       stdin=path_list, verbose=verbose)
+            destination.forget(delta.remove)
+            destination.save(destination_path)
+
+        if store is not None:
+            placed = store.place([(path, source.entries[path]) for path in delta.send
+                                  if source.entries[path].kind == 'f'], dest_dir, work_dir)
+            if placed:
+                # As they really are there, so a linked file isn't taken to have the mode and time it was sent with
+                destination.entries.update(placed)
+                destination.save(destination_path)
+                delta.placed = sorted(placed)
+                delta.send = [path for path in delta.send if path not in placed]
+                send_bytes = sum(source.entries[path].size for path in delta.send)
+
+        sent_bytes = 0
+        batch = []
+        batch_size = 0
+        for index, path in enumerate(delta.send):
+            batch.append(path)
+            batch_size += source.entries[path].size
+            if batch_size < batch_bytes and index < len(delta.send) - 1:
+                continue
+
+            send(root, batch, dest_dir, remote, codec, work_dir, password=password, meter=meter, verbose=verbose)
+            for sent in batch:
+                destination.entries[sent] = source.entries[sent]
+            destination.save(destination_path)
+
+            sent_bytes += batch_size
+            print('Sent {0} of {1} bytes'.format(sent_bytes, send_bytes))
+            batch = []
+            batch_size = 0
+
+        if store is not None:
+            store.add([(path, source.entries[path]) for path in delta.send if source.entries[path].kind == 'f'],
+                      dest_dir, work_dir)
+            print(store.report())
+
+        # Sending files into directories changes their times, so they go last
+        directories = delta.directories_to_fix(source)
+        if directories:
+            send(root, directories, dest_dir, remote, codec, work_dir, password=password, meter=meter,
+                 verbose=verbose)
+
+        if os.path.exists(destination_path):
+            os.remove(destination_path)
+        return 0
+    except ChildProcessError as e:
+        return e.args[0]
+    finally:
+        for name in os.listdir(work_dir):
+            os.remove(os.path.join(work_dir, name))
+        os.rmdir(work_dir)
@@ -0,0 +1,315 @@
+import os
+import shlex
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import pexpect
+
+# How much the pumps between a Stream's parts move at a time
+CHUNK_BYTES = 1024 * 1024
+
+# Every process run() and run_metered() have going, so kill_all() can stop them from another thread
+_running = set()
+_running_lock = threading.Lock()
+
+
+def _started(child):
+    with _running_lock:
+        _running.add(child)
+    return child
+
+
+def _finished(child):
+    with _running_lock:
+        _running.discard(child)
+
+
+def kill_all():
+    """
+    Kills every pipeline run() still has going, for when we're interrupted.  Pipelines run on other threads never see
+    the KeyboardInterrupt, and ones answering a password prompt are on a terminal of their own, so nothing else would
+    stop them.  Each of those is a session of its own, so the whole pipeline goes at once.  The rest share our terminal,
+    so a ^C reaches every part of them anyway, and killing their shells covers an interrupt meant for us alone.
+    """
+    with _running_lock:
+        children = list(_running)
+        _running.clear()
+    for child in children:
+        try:
+            if isinstance(child, subprocess.Popen):
+                child.kill()
+            else:
+                os.killpg(child.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+
+class Stream:
+    """
+    A pipeline that sends data to the destination, kept in its three parts: what makes the data here, what squeezes it,
+    and the ssh that takes it away.  Run with a telemetry.metrics.Meter, the data goes through us between the parts so
+    the bytes at each stage can be counted.  Otherwise it's run as one pipeline like any other.
+    """
+
+    def __init__(self, source, sink, compress=None, pipeline='stream', **fields):
+        """
+        :param source: A pipeline producing the raw stream
+        :param sink: A pipeline taking the (compressed) stream, usually ssh to the destination
+        :param compress: The compressor, e.g. a Codec's compress, or None to send it as it is
+        :param pipeline: Which totals the stream counts towards, e.g. 'files' or 'database'
+        :param fields: Anything else worth knowing about the stream in the events, e.g. table='wp_posts'
+        """
+        self.source = source
+        self.sink = sink
+        self.compress = compress
+        self.pipeline = pipeline
+        self.fields = fields
+
+    def __str__(self):
+        return ' | '.join(part for part in (self.source, self.compress, self.sink) if part)
+
+
+def run_metered(stream, meter, mirror=True, password=None):
+    """
+    Runs a Stream's parts as separate processes, pumping the data between them ourselves and counting it: read out of
+    the source, out of the compressor, and taken by ssh.  What the destination end does with it is out of our sight, so
+    nothing counts as written.
+
+    ssh asks for a password on a terminal, so with one to give, the sink runs on a terminal from pexpect and takes its
+    data from a fifo instead.
+
+    :param stream: The Stream
+    :param meter: The telemetry.metrics.Meter to count into
+    :param mirror: Whether to show the pipeline's output as it goes
+    :param password: The password to give ssh, or None if keys will do
+    :return: The exit status of the sink, or if it was happy, of the first part that wasn't
+    """
+    output = None if mirror else subprocess.DEVNULL
+    meter.stream_started(stream.pipeline, **stream.fields)
+
+    processes = [_started(subprocess.Popen(stream.source, shell=True, stdout=subprocess.PIPE, stderr=output))]
+    if stream.compress:
+        processes.append(_started(subprocess.Popen(stream.compress, shell=True, stdin=subprocess.PIPE,
+                                                   stdout=subprocess.PIPE)))
+
+    fifo_dir = None
+    if password is None:
+        sink = _started(subprocess.Popen(stream.sink, shell=True, stdin=subprocess.PIPE, stdout=output, stderr=output))
+        sink_stdin = sink.stdin
+    else:
+        fifo_dir = tempfile.mkdtemp(prefix='migrate_o_matic.')
+        fifo = os.path.join(fifo_dir, 'stream')
+        os.mkfifo(fifo, 0o600)
+        sink = _started(pexpect.spawnu('/bin/bash', ['-c', '{{ {0}; }} < {1}'.format(stream.sink, shlex.quote(fifo))],
+                                       timeout=None))
+        # Waits for bash to open the other end, which it does before anything else
+        sink_stdin = open(fifo, 'wb')
+
+    def pump(reader, writer, taken, given):
+        """Moves data from one part to the next, counting it as taken from the one and given to the other"""
+        try:
+            while True:
+                chunk = reader.read1(CHUNK_BYTES)
+                if not chunk:
+                    break
+                meter.add(stream.pipeline, taken, len(chunk))
+                writer.write(chunk)
+                if given is not None:
+                    meter.add(stream.pipeline, given, len(chunk))
+        except BrokenPipeError:
+            # Whatever is downstream died, and its exit status will say why
+            pass
+        finally:
+            reader.close()
+            try:
+                writer.close()
+            except BrokenPipeError:
+                pass
+
+    if stream.compress:
+        pumps = [(processes[0].stdout, processes[1].stdin, 'read', None),
+                 (processes[1].stdout, sink_stdin, 'compressed', 'sent')]
+    else:
+        pumps = [(processes[0].stdout, sink_stdin, 'read', 'sent')]
+    threads = [threading.Thread(target=pump, args=pump_args) for pump_args in pumps]
+    for thread in threads:
+        thread.start()
+
+    try:
+        if password is None:
+            sink_exitcode = sink.wait()
+            _finished(sink)
+        else:
+            sink_exitcode = _answer(sink, password, mirror)
+    finally:
+        for thread in threads:
+            thread.join()
+        if fifo_dir is not None:
+            os.remove(fifo)
+            os.rmdir(fifo_dir)
+
+    exitcodes = [process.wait() for process in processes] + [sink_exitcode]
+    for process in processes:
+        _finished(process)
+    exitcode = exitcodes[-1] or next((code for code in exitcodes if code), 0)
+    meter.stream_finished(stream.pipeline, exitcode, **stream.fields)
+    return exitcode
+
+
+def _answer(child, password, mirror):
+    """
+    Gives a pexpect child the password when it asks for it, and waits for it to finish.
+
+    :return: Its exit status
+    """
+    try:
+        # It may be gone before it asks, killed, or failing to connect at all
+        if child.expect(['password: ', pexpect.EOF]) == 0:
+            child.sendline(password)
+            if mirror:
+                child.logfile = sys.stdout
+            child.expect(pexpect.EOF)
+        child.close()
+    finally:
+        _finished(child)
+    return child.exitstatus
+
+
+def run(command, password=None, mirror=True, meter=None):
+    """
+    Runs a shell pipeline, answering ssh's password prompt if we were given a password.
+
+    This is the "wrong" way to do it, but I can't get the nested Popen's to work.
+
+    :param command: The pipeline, as one string for bash, or a Stream
+    :param password: The password to give ssh, or None if keys will do
+    :param mirror: Whether to show the pipeline's output as it goes
+    :param meter: A telemetry.metrics.Meter to count a Stream's bytes with.  Only Streams can be counted.
+    :return: The exit status of the pipeline
+    """
+    if isinstance(command, Stream):
+        if meter is not None:
+            return run_metered(command, meter, mirror=mirror, password=password)
+        command = str(command)
+
+    if password is None:
+        output = None if mirror else subprocess.DEVNULL
+        child = _started(subprocess.Popen(command, shell=True, stdout=output, stderr=output))
+        try:
+            return child.wait()
+        finally:
+            _finished(child)
+
+    return _answer(_started(pexpect.spawnu('/bin/bash', ['-c', command], timeout=None)), password, mirror)
+
+
+def run_all(commands, password=None, mirror=False, meter=None):
+    """
+    Runs several shell pipelines at once, each on its own thread.
+
+    :param commands: A list of pipelines, each one string for bash or a Stream
+    :param password: The password to give ssh, or None if keys will do
+    :param mirror: Whether to show the pipelines' output as they go.  It gets jumbled, so it's off by default.
+    :param meter: A telemetry.metrics.Meter to count the Streams' bytes with, if any
+    :return: A list with each pipeline's exit status, in the same order
+    """
+    exitcodes = [None] * len(commands)
+
+    def runner(index):
+        try:
+            exitcodes[index] = run(commands[index], password=password, mirror=mirror, meter=meter)
+        except Exception as e:
+            print('Stream {0} failed: {1}'.format(index, e))
+            exitcodes[index] = -1
+
+    threads = [threading.Thread(target=runner, args=(index,)) for index in range(len(commands))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return exitcodes
+
+
+class Tunnel:
+    """An ssh port forward from a local port, through a host we can ssh to, to somewhere only it can reach"""
+
+    def __init__(self, ssh_target, remote_host, remote_port=3306, password=None, master=None):
+        """
+        :param ssh_target: Who to ssh as, user@host
+        :param remote_host: Where the forward ends up, as seen from ssh_target
+        :param remote_port: The port it ends up on
+        :param password: The password to give ssh, or None if keys will do
+        :param master: A transfer.ssh.Master to ssh_target to add the forward to, rather than making a connection of its
+            own
+        """
+        self.ssh_target = ssh_target
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.password = password
+        self.master = master
+        self.local_port = None
+        self.child = None
+
+    def open(self, timeout=30):
+        """
+        Starts the forward and waits for it to take connections.
+
+        :return: The local port to connect to
+        """
+        # Let the kernel find us a free port
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.local_port = probe.getsockname()[1]
+
+        forward = '127.0.0.1:{0}:{1}:{2}'.format(self.local_port, self.remote_host, self.remote_port)
+        command = ['ssh', '-N', '-o', 'ExitOnForwardFailure=yes', '-L', forward, self.ssh_target]
+
+        if self.master is not None:
+            if self.master.control('forward', '-L', forward) != 0:
+                raise OSError('the ssh master to {0} would not forward to {1}:{2}'.format(
+                    self.ssh_target, self.remote_host, self.remote_port))
+            # Nothing of our own to run, just the forward to cancel later
+            self.child = forward
+        elif self.password is None:
+            self.child = subprocess.Popen(command)
+        else:
+            self.child = pexpect.spawnu(command[0], command[1:], timeout=None)
+            self.child.expect(['password: '])
+            self.child.sendline(self.password)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', self.local_port), timeout=1).close()
+                return self.local_port
+            except OSError:
+                time.sleep(0.2)
+
+        self.close()
+        raise OSError('ssh tunnel to {0}:{1} through {2} never came up'.format(self.remote_host, self.remote_port,
+                                                                             self.ssh_target))
+
+    def close(self):
+        if self.child is None:
+            return
+        if self.master is not None:
+            self.master.control('cancel', '-L', self.child)
+        elif isinstance(self.child, subprocess.Popen):
+            self.child.terminate()
+            self.child.wait()
+        else:
+            self.child.close(force=True)
+        self.child = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
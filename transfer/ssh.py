@@ -0,0 +1,136 @@
+import os
+import shlex
+import subprocess
+import tempfile
+import time
+
+import pexpect
+
+# How many sessions sshd allows on one connection, unless someone changed its MaxSessions
+MAX_SESSIONS = 10
+
+
+class Master:
+    """
+    One authenticated ssh connection to a host, kept open for the whole run, that every other ssh to it goes through
+    (OpenSSH's ControlMaster).  The key exchange and any password happen once, here, and each command or stream after
+    that is just another session on the same connection, which several can share at once.
+
+    The server caps sessions per connection (MaxSessions, 10 unless someone changed it).  Past that, ssh would quietly
+    make its own connection and ask for the password again, so commands through the master are in BatchMode and fail
+    instead of hanging on a prompt nobody will answer.  share() keeps whatever runs at once under the cap.
+    """
+
+    def __init__(self, target, password=None, verbose=False):
+        """
+        :param target: Who to ssh as, user@host
+        :param password: The password to give ssh, or None if keys will do
+        :param verbose: Explain what you are doing
+        """
+        self.target = target
+        self.password = password
+        self.verbose = verbose
+        self.control_dir = None
+        self.control_path = None
+        self.child = None
+
+    def options(self):
+        """:return: The ssh options that send a connection through the master, as a string for the shell"""
+        return '-o ControlPath={0} -o ControlMaster=no -o BatchMode=yes'.format(shlex.quote(self.control_path))
+
+    def ssh(self):
+        """:return: An ssh command going through the master, e.g. for rsync's -e"""
+        return 'ssh {0}'.format(self.options())
+
+    def remote(self):
+        """:return: A format string wrapping a command to be run on the host through the master"""
+        return '{0} {1} "{{0}}"'.format(self.ssh(), self.target)
+
+    def share(self, *wanted):
+        """
+        Divides the master's sessions between things that each want several at once (say, the file streams and the
+        database workers), so together they stay under MaxSessions.  One is kept back for the odd command on the side.
+
+        :param wanted: How many sessions each wants
+        :return: A list of how many each may have, in proportion to what they wanted, and at least one
+        """
+        available = MAX_SESSIONS - 1
+        total = sum(wanted)
+        if total <= available:
+            return list(wanted)
+        return [max(1, want * available // total) if want else 0 for want in wanted]
+
+    def control(self, command, *args):
+        """
+        Asks the master to do something (check, forward, cancel, exit).
+
+        :return: The exit status
+        """
+        argv = ['ssh', '-o', 'ControlPath={0}'.format(self.control_path), '-O', command] + list(args) + [self.target]
+        return subprocess.call(argv, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def open(self, timeout=30):
+        """
+        Connects, and waits until the master is taking sessions.
+
+        :raises OSError: If it never does
+        """
+        # Unix sockets have a short path limit, so the socket goes somewhere short rather than under the state dir
+        self.control_dir = tempfile.mkdtemp(prefix='mom-ssh.')
+        self.control_path = os.path.join(self.control_dir, 'master')
+
+        command = ['ssh', '-N', '-o', 'ControlMaster=yes', '-o', 'ControlPath={0}'.format(self.control_path),
+                   '-o', 'ServerAliveInterval=30', self.target]
+        if self.verbose:
+            print(' '.join(shlex.quote(arg) for arg in command))
+
+        if self.password is None:
+            self.child = subprocess.Popen(command, stdin=subprocess.DEVNULL)
+        else:
+            self.child = pexpect.spawnu(command[0], command[1:], timeout=None)
+            self.child.expect(['password: '])
+            self.child.sendline(self.password)
+
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.control('check') == 0:
+                return
+            if not self.alive():
+                break
+            time.sleep(0.2)
+
+        self.close()
+        raise OSError('could not set up an ssh master connection to {0}'.format(self.target))
+
+    def alive(self):
+        if self.child is None:
+            return False
+        if isinstance(self.child, subprocess.Popen):
+            return self.child.poll() is None
+        return self.child.isalive()
+
+    def close(self):
+        if self.child is None:
+            return
+        # Ask nicely first, so sessions still going get to finish writing
+        self.control('exit')
+        if isinstance(self.child, subprocess.Popen):
+            try:
+                self.child.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.child.terminate()
+                self.child.wait()
+        else:
+            self.child.close(force=True)
+        self.child = None
+
+        if os.path.exists(self.control_path):
+            os.remove(self.control_path)
+        os.rmdir(self.control_dir)
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,123 @@
+import collections
+
+# Record types whose value is a host name, so case and a trailing dot don't matter
+NAME_VALUED_TYPES = {'CNAME', 'MX', 'NS', 'PTR', 'SRV'}
+
+# What importing a source zone into the destination's comes to:
+# custom: the source's records that didn't come from the template, which are what we offer to import
+# add: the custom records the destination doesn't already have, with their hosts made relative for add_dns_records
+# delete: the ids of destination records that the custom ones replace, for del_dns_record
+# keep: the destination records that stay as they are
+ZoneDiff = collections.namedtuple('ZoneDiff', ['custom', 'add', 'delete', 'keep'])
+
+
+def record_key(record):
+    """
+    :param record: A record dict, as get_dns_records() makes them
+    :return: A hashable key that's the same for any two records DNS would treat the same, whatever the case, trailing
+        dots or empty opts
+    """
+    record_type = (record.get('type') or '').upper()
+    value = (record.get('value') or '').strip()
+    if record_type in NAME_VALUED_TYPES:
+        value = value.lower().rstrip('.')
+    elif record_type == 'AAAA':
+        value = value.lower()
+    return record_type, _name(record.get('host')), value, (record.get('opt') or '').strip()
+
+
+def _name(host):
+    return (host or '').strip().lower().rstrip('.')
+
+
+def _slot(record):
+    """
+    :return: What a record would be replaced by a custom one of, (kind, host), or None if records like it sit side by
+        side with custom ones.  Any custom MX takes the place of the template's MX at that host, and a custom SPF the
+        template's SPF.
+    """
+    record_type = (record.get('type') or '').upper()
+    if record_type == 'MX':
+        return 'MX', _name(record.get('host'))
+    if record_type == 'SPF' or (record_type == 'TXT' and
+                                (record.get('value') or '').strip().strip('"').lower().startswith('v=spf1')):
+        return 'SPF', _name(record.get('host'))
+    return None
+
+
+def expand_template(template, domain, ip):
+    """
+    :param template: The server's DNS template, as get_dns_template() gives it
+    :param domain: The site it's for
+    :param ip: What <ip> stands for
+    :return: New record dicts, with <domain> and <ip> filled in
+    """
+    expanded = []
+    for entry in template:
+        record = dict(entry)
+        record['host'] = (record.get('host') or '').replace('<domain>', domain).replace('<ip>', ip)
+        record['value'] = (record.get('value') or '').replace('<domain>', domain).replace('<ip>', ip)
+        expanded.append(record)
+    return expanded
+
+
+def relative_host(host, domain):
+    """:return: host, with the domain taken off the end, as add_dns_records() wants it ('' for the domain itself)"""
+    host = (host or '').rstrip('.')
+    if _name(host) == _name(domain):
+        return ''
+    if _name(host).endswith('.' + _name(domain)):
+        return host[:-len(_name(domain)) - 1]
+    return host
+
+
+def custom_records(records, template):
+    """
+    :param records: The source zone
+    :param template: The source server's template, expanded for the site
+    :return: The records that didn't come from the template, in the order they're in the zone
+    """
+    template_keys = {record_key(record) for record in template}
+    return [record for record in records if record_key(record) not in template_keys]
+
+
+def diff_zones(records, template, zone, domain):
+    """
+    Works out how to bring the site's custom DNS records over: add what the destination is missing, and delete the
+    destination's records the custom ones take the place of (its MX when there are custom MX, its SPF when there's a
+    custom SPF), leaving everything else alone.  Records are matched by record_key(), so it's all one pass over each
+    zone however big they are.
+
+    :param records: The source zone, from get_dns_records()
+    :param template: The source server's template, expanded for the site
+    :param zone: The destination zone, from get_dns_records(get_id=True)
+    :param domain: The site
+    :return: A ZoneDiff
+    """
+    custom = custom_records(records, template)
+    source_keys = {record_key(record) for record in records}
+    replaced = {_slot(record) for record in custom} - {None}
+
+    delete = []
+    keep = []
+    zone_keys = set()
+    for record in zone:
+        key = record_key(record)
+        if key not in source_keys and _slot(record) in replaced:
+            delete.append(record['id'])
+        else:
+            keep.append(record)
+            zone_keys.add(key)
+
+    add = []
+    for record in custom:
+        key = record_key(record)
+        if key in zone_keys:
+            continue
+        # Once is enough, should the source have it twice
+        zone_keys.add(key)
+        record = dict(record)
+        record['host'] = relative_host(record['host'], domain)
+        add.append(record)
+
+    return ZoneDiff(custom, add, delete, keep)
@@ -0,0 +1,253 @@
+import concurrent.futures
+import json
+import os
+import socket
+import threading
+import time
+
+import dns.exception
+import dns.rdatatype
+import dns.resolver
+import dns.zone
+
+from telemetry.tracing import default_tracer
+
+
+class Resolver:
+    """
+    Looks up DNS records for lots of names at once, on a pool of threads, and keeps the answers for as long as their
+    TTL says they're good.  Asking for the same thing twice while the first lookup is still going waits for that one
+    rather than sending another.  The answers can be kept in a file between runs, so a batch of migrations can look up
+    every site once up front and each migration finds its answer there, and can be preloaded from a zone file or asked
+    of a stand-in nameserver, for planning without going out to the internet.
+    """
+
+    def __init__(self, nameservers=None, workers=32, timeout=5.0, negative_ttl=300, cache_path=None, verbose=False):
+        """
+        :param nameservers: A list of nameservers to ask, as 'host', 'host:port' or '[IPv6 address]:port', instead of
+            the system's
+        :param workers: How many lookups to have going at once in lookup_many()
+        :param timeout: How many seconds to give each lookup
+        :param negative_ttl: How many seconds to remember that a name or record doesn't exist
+        :param cache_path: If given, also keep the answers in this file between runs
+        :param verbose: Explain what is going on
+        :raises ValueError: If a nameserver's name can't be looked up
+        """
+        self.resolver = dns.resolver.Resolver(configure=not nameservers)
+        if nameservers:
+            self.__use_nameservers(nameservers)
+        self.resolver.lifetime = timeout
+        self.workers = workers
+        self.negative_ttl = negative_ttl
+        self.cache_path = cache_path
+        self.verbose = verbose
+        self.cache = None
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stats = {'queries': 0, 'hits': 0, 'lookups': 0, 'failures': 0}
+
+    def __use_nameservers(self, nameservers):
+        """
+        Points the resolver at the nameservers given, each on its own port.  dnspython only takes IP addresses, so any
+        given by name are looked up here, and every address the name has is asked.
+        """
+        addresses = []
+        for nameserver in nameservers:
+            host, port = _address(nameserver)
+            for address in _addresses(host):
+                if port is None:
+                    addresses.append(address)
+                elif hasattr(dns, 'nameserver'):
+                    addresses.append(dns.nameserver.Do53Nameserver(address, port))
+                else:
+                    # Before dnspython 2.4 the ports went to one side
+                    addresses.append(address)
+                    self.resolver.nameserver_ports[address] = port
+        self.resolver.nameservers = addresses
+
+    def __read_cache(self):
+        """:return: What's in the cache file, as a dict of (name, type) to (answer, expires)"""
+        cache = {}
+        if self.cache_path and os.path.isfile(self.cache_path):
+            with open(self.cache_path) as cache_fh:
+                try:
+                    for name, rdtype, values, expires in json.load(cache_fh):
+                        cache[(name, rdtype)] = (values, expires)
+                except ValueError:
+                    # It's only a cache, start over
+                    print('Ignoring unreadable DNS cache {0}'.format(self.cache_path))
+        return cache
+
+    def __load_cache(self):
+        if self.cache is None:
+            self.cache = self.__read_cache()
+
+    def save(self):
+        """Writes whatever hasn't expired out to the cache file, if there is one"""
+        if not self.cache_path:
+            return
+
+        with self.lock:
+            self.__load_cache()
+            # Other migrations may have added to it since we read it, so keep theirs too
+            cache = self.__read_cache()
+            for key, cached in self.cache.items():
+                if key not in cache or cache[key][1] < cached[1]:
+                    cache[key] = cached
+            now = time.time()
+            entries = [[name, rdtype, values, expires] for (name, rdtype), (values, expires) in cache.items()
+                       if expires > now]
+
+        # Swap it in whole, since other migrations may be reading it
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        temp_path = '{0}.{1}.tmp'.format(self.cache_path, os.getpid())
+        with open(temp_path, 'w') as cache_fh:
+            json.dump(entries, cache_fh)
+        os.replace(temp_path, self.cache_path)
+
+    def preload(self, name, rdtype, values, ttl):
+        """Puts an answer in the cache as though it had been looked up"""
+        with self.lock:
+            self.__load_cache()
+            self.cache[(_name(name), rdtype.upper())] = (list(values), time.time() + ttl)
+
+    def load_zone_file(self, path, origin=None, ttl=None):
+        """
+        Preloads every record in a zone file.  It can be a real zone, or, with $ORIGIN . and no SOA, the records of any
+        number of domains, say the NS records of every site on a server.
+
+        :param path: The zone file
+        :param origin: The zone's name, if the file doesn't say with $ORIGIN
+        :param ttl: How many seconds to keep the records for, defaults to the TTLs in the file
+        :return: How many names and types were loaded
+        """
+        zone = dns.zone.from_file(path, origin=origin, relativize=False, check_origin=False)
+        loaded = 0
+        for name, node in zone.nodes.items():
+            for rdataset in node.rdatasets:
+                self.preload(name.to_text(), dns.rdatatype.to_text(rdataset.rdtype),
+                             [rdata.to_text() for rdata in rdataset], rdataset.ttl if ttl is None else ttl)
+                loaded += 1
+        if self.verbose:
+            print('Loaded {0} DNS answers from {1}'.format(loaded, path))
+        return loaded
+
+    def lookup(self, name, rdtype='A'):
+        """
+        :return: The answer, as a list of the records' text (say, 'ns1.firstscribe.com.' for NS), or an empty list if
+            the name or record doesn't exist
+        :raises dns.exception.DNSException: If no nameserver would answer
+        """
+        key = (_name(name), rdtype.upper())
+        with self.lock:
+            self.__load_cache()
+            self.stats['queries'] += 1
+            cached = self.cache.get(key)
+            if cached is not None and cached[1] > time.time():
+                self.stats['hits'] += 1
+                return list(cached[0])
+
+            pending = self.pending.get(key)
+            asking = pending is None
+            if asking:
+                pending = self.pending[key] = concurrent.futures.Future()
+                self.stats['lookups'] += 1
+            else:
+                self.stats['hits'] += 1
+
+        # Somebody else is already asking, so their answer will do
+        if not asking:
+            return list(pending.result())
+
+        try:
+            values, expires = self.__ask(*key)
+        except Exception as e:
+            with self.lock:
+                self.stats['failures'] += 1
+                del self.pending[key]
+            pending.set_exception(e)
+            raise
+
+        with self.lock:
+            self.cache[key] = (values, expires)
+            del self.pending[key]
+        pending.set_result(values)
+        return list(values)
+
+    def __ask(self, name, rdtype):
+        """:return: A list with the answer's records and when it expires"""
+        with default_tracer.span('dns {0}'.format(rdtype), category='dns', query=name) as span:
+            try:
+                if hasattr(self.resolver, 'resolve'):
+                    answers = self.resolver.resolve(name, rdtype)
+                else:
+                    answers = self.resolver.query(name, rdtype)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer) as e:
+                span.set(answers=0, error=e.__class__.__name__)
+                return [], time.time() + self.negative_ttl
+
+            span.set(answers=len(answers), ttl=answers.rrset.ttl)
+            return [rdata.to_text() for rdata in answers], answers.expiration
+
+    def lookup_many(self, names, rdtype='A'):
+        """
+        Looks up the same kind of record for lots of names at once.
+
+        :return: A dict of name to its answer, as lookup() gives it, and a dict of name to the exception for the names
+            no nameserver would answer for
+        """
+        answers = {}
+        failures = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.workers)) as executor:
+            futures = {executor.submit(self.lookup, name, rdtype): name for name in set(names)}
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    answers[futures[future]] = future.result()
+                except dns.exception.DNSException as e:
+                    failures[futures[future]] = e
+        return answers, failures
+
+
+def _address(nameserver):
+    """
+    :return: The host and port (or None) of a nameserver given as 'host', 'host:port' or '[IPv6 address]:port'
+    :raises ValueError: If the port isn't a number
+    """
+    if nameserver.startswith('['):
+        host, _, port = nameserver[1:].partition(']')
+        port = port[1:] if port.startswith(':') else None
+    elif nameserver.count(':') == 1:
+        host, port = nameserver.split(':')
+    else:
+        # More than one colon is an IPv6 address, which needs brackets to have a port
+        host, port = nameserver, None
+    try:
+        return host, int(port) if port else None
+    except ValueError:
+        raise ValueError("bad port in nameserver '{0}'".format(nameserver))
+
+
+def _addresses(host):
+    """
+    :return: The IP addresses of a host, which may already be one, in the order the system gives them
+    :raises ValueError: If it can't be looked up
+    """
+    try:
+        infos = socket.getaddrinfo(host, 53, type=socket.SOCK_DGRAM)
+    except OSError as e:
+        raise ValueError("cannot look up nameserver '{0}': {1}".format(host, e))
+    addresses = []
+    for info in infos:
+        if info[4][0] not in addresses:
+            addresses.append(info[4][0])
+    return addresses
+
+
+def _name(name):
+    return name.strip().lower().rstrip('.')
+
+
+def served_by(nameservers, domain):
+    """:return: True if any of the nameservers (NS answers from lookup()) are under the domain"""
+    domain = _name(domain)
+    return any(_name(nameserver) == domain or _name(nameserver).endswith('.' + domain) for nameserver in nameservers)